@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from pydantic_settings import BaseSettings
 
@@ -12,9 +13,49 @@ class Settings(BaseSettings):
     anthropic_api_key: str = ""
     claude_model: str = "claude-sonnet-4-5-20250929"
     fernet_key: str = ""
+    web_concurrency: int = 1  # API worker processes; uvicorn reads the same WEB_CONCURRENCY
     cors_origins: list[str] = ["http://localhost:3000"]
     upload_dir: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "uploads")
     max_upload_size_mb: int = 100
+    duckdb_pool_max_connections: int = 32
+    duckdb_pool_idle_timeout_seconds: int = 900
+    duckdb_memory_budget_mb: int = 4096  # for the whole container, split between API workers
+    duckdb_idle_memory_limit_mb: int = 64
+    duckdb_temp_directory: str = os.path.join(tempfile.gettempdir(), "datapilot-duckdb")
+    duckdb_query_memory_limit_mb: int = 2048
+    duckdb_query_threads: int = 4
+    duckdb_preview_memory_limit_mb: int = 256
+    duckdb_preview_threads: int = 1
+    duckdb_ingestion_memory_limit_mb: int = 1024
+    duckdb_ingestion_threads: int = 2
+    query_cache_max_mb: int = 256
+    query_cache_ttl_seconds: int = 300
+    query_max_workers: int = 8
+    query_max_concurrency_per_tenant: int = 4
+    query_max_queue: int = 256
+    query_tenant_weights: dict[str, float] = {}
+    query_history_enabled: bool = True
+    query_history_max_pending: int = 10000
+    query_history_flush_seconds: float = 2.0
+    query_slow_threshold_ms: int = 1000
+    query_slow_profile: bool = False
+    ingestion_backend: str = "local"
+    ingestion_max_workers: int = 2
+    ingestion_recover_on_startup: bool = True
+    ingestion_wait_timeout_seconds: float = 600.0
+    ingestion_claim_ttl_seconds: int = 120
+    rollup_max_workers: int = 1
+    ai_max_concurrency: int = 16
+    ai_max_concurrency_per_tenant: int = 4
+    ai_max_queue: int = 64
+    ai_queue_timeout_seconds: float = 30.0
+    ai_answer_cache_max_entries: int = 500
+    ai_answer_cache_ttl_seconds: int = 86400
+    ai_answer_cache_similarity_threshold: float | None = 0.9
+    tracing_enabled: bool = True
+    tracing_server_timing: bool = True
+    tracing_exporter: str = "none"  # "none", "console" or "file"
+    tracing_file: str = os.path.join(tempfile.gettempdir(), "datapilot-traces.jsonl")
 
     class Config:
         env_file = ".env"
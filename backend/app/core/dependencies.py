@@ -10,6 +10,7 @@ from sqlalchemy.orm import Session
 from app.core.security import decode_token
 from app.database import SessionLocal
 from app.models.user import User
+from app.services.tracing import tracer
 
 bearer_scheme = HTTPBearer()
 
@@ -23,6 +24,7 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+@tracer.span("auth")
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
     db: Session = Depends(get_db),
@@ -9,3 +9,15 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 class Base(DeclarativeBase):
     pass
+
+
+def pool_stats() -> dict:
+    """Return SQLAlchemy connection pool counters for monitoring."""
+    pool = engine.pool
+    stats = {}
+    # SQLite's test pools do not implement every counter
+    for key, name in (("size", "size"), ("checked_in", "checkedin"), ("checked_out", "checkedout"), ("overflow", "overflow")):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[key] = method()
+    return stats
@@ -1,13 +1,41 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import settings
+from app.database import pool_stats
 from app.routers import ai, auth, dashboards, data_sources, queries, semantic_layers, workspaces
+from app.services.ai_limiter import ai_limiter
+from app.services.ai_service import get_ai_service
+from app.services.answer_cache import answer_cache
+from app.services.connection_pool import connection_pool
+from app.services.duckdb_resources import duckdb_resources
+from app.services.ingestion_queue import ingestion_queue
+from app.services.metrics import CONTENT_TYPE, MetricsMiddleware, metrics
+from app.services.query_history import query_history
+from app.services.query_registry import query_registry
+from app.services.query_scheduler import query_scheduler
+from app.services.result_cache import query_result_cache
+from app.services.result_formats import ARROW_METADATA_HEADERS
+from app.services.rollup_service import rollup_metrics
+from app.services.tracing import TracingMiddleware
+from app.services.widget_cache import widget_result_cache
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.ingestion_recover_on_startup:
+        # Uploads left pending or processing by the previous process would never finish
+        ingestion_queue.recover()
+    yield
+
 
 app = FastAPI(
     title="DataPilot API",
     version="0.1.0",
     description="Business Intelligence platform with conversational AI",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -16,7 +44,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Otherwise cross-origin clients cannot read the metadata of Arrow results and streams
+    expose_headers=["Server-Timing", *ARROW_METADATA_HEADERS],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+metrics.register_stats("sqlalchemy_pool", pool_stats)
+metrics.register_stats("duckdb", duckdb_resources.stats)
+metrics.register_stats("connection_pool", connection_pool.stats)
+metrics.register_stats("query_cache", query_result_cache.stats)
+metrics.register_stats("widget_cache", widget_result_cache.stats)
+metrics.register_stats("answer_cache", answer_cache.stats)
+metrics.register_stats("rollups", rollup_metrics.stats)
+metrics.register_stats("query_scheduler", query_scheduler.stats)
+metrics.register_stats("query_registry", query_registry.stats)
+metrics.register_stats("query_history", query_history.stats)
+metrics.register_stats("ingestion", lambda: ingestion_queue.backend.stats())
+metrics.register_stats("ai_limiter", ai_limiter.stats)
+metrics.register_stats("ai", lambda: get_ai_service().stats())
 
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(data_sources.router, prefix="/api/v1/data-sources", tags=["data-sources"])
@@ -30,3 +76,8 @@ app.include_router(ai.router, prefix="/api/v1/ai", tags=["ai"])
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,35 @@
+"""add data source ingestion status
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "005"
+down_revision: Union[str, None] = "004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing data sources were ingested synchronously, so they are ready
+    op.add_column(
+        "data_sources",
+        sa.Column("status", sa.String(20), nullable=False, server_default="ready"),
+    )
+    op.add_column(
+        "data_sources",
+        sa.Column("progress", sa.Integer(), nullable=False, server_default="100"),
+    )
+    op.add_column("data_sources", sa.Column("error_message", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("data_sources", "error_message")
+    op.drop_column("data_sources", "progress")
+    op.drop_column("data_sources", "status")
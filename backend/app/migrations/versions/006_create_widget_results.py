@@ -0,0 +1,67 @@
+"""create widget_results and widget_result_dependencies tables
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision: str = "006"
+down_revision: Union[str, None] = "005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "widget_results",
+        sa.Column(
+            "widget_id",
+            postgresql.UUID(as_uuid=True),
+            sa.ForeignKey("widgets.id", name="fk_widget_results_widget_id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("tenant_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("query_hash", sa.String(64), nullable=False),
+        sa.Column("data_version", sa.String(32), nullable=False),
+        sa.Column("result_json", postgresql.JSON(astext_type=sa.Text()), nullable=False),
+        sa.Column(
+            "computed_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            nullable=False,
+        ),
+    )
+    op.create_index("ix_widget_results_tenant_id", "widget_results", ["tenant_id"])
+
+    op.create_table(
+        "widget_result_dependencies",
+        sa.Column(
+            "widget_id",
+            postgresql.UUID(as_uuid=True),
+            sa.ForeignKey(
+                "widget_results.widget_id",
+                name="fk_widget_result_dependencies_widget_id",
+                ondelete="CASCADE",
+            ),
+            primary_key=True,
+        ),
+        sa.Column("data_source_id", postgresql.UUID(as_uuid=True), primary_key=True),
+    )
+    op.create_index(
+        "ix_widget_result_dependencies_data_source_id",
+        "widget_result_dependencies",
+        ["data_source_id"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_widget_result_dependencies_data_source_id", "widget_result_dependencies")
+    op.drop_table("widget_result_dependencies")
+    op.drop_index("ix_widget_results_tenant_id", "widget_results")
+    op.drop_table("widget_results")
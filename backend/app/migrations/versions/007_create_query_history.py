@@ -0,0 +1,57 @@
+"""create query_history table
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision: str = "007"
+down_revision: Union[str, None] = "006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "query_history",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("tenant_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("workspace_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("source", sa.String(20), nullable=False),
+        sa.Column("query_hash", sa.String(64), nullable=False),
+        sa.Column("sql_text", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("cache_status", sa.String(10), nullable=False),
+        sa.Column("row_count", sa.Integer(), nullable=True),
+        sa.Column("result_bytes", sa.BigInteger(), nullable=True),
+        sa.Column("setup_ms", sa.Float(), nullable=False),
+        sa.Column("queue_ms", sa.Float(), nullable=False),
+        sa.Column("execute_ms", sa.Float(), nullable=False),
+        sa.Column("serialize_ms", sa.Float(), nullable=False),
+        sa.Column("total_ms", sa.Float(), nullable=False),
+        sa.Column("profile_json", postgresql.JSON(astext_type=sa.Text()), nullable=True),
+        sa.Column(
+            "executed_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            nullable=False,
+        ),
+    )
+    op.create_index(
+        "ix_query_history_tenant_id_executed_at", "query_history", ["tenant_id", "executed_at"]
+    )
+    op.create_index(
+        "ix_query_history_tenant_id_query_hash", "query_history", ["tenant_id", "query_hash"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_query_history_tenant_id_query_hash", "query_history")
+    op.drop_index("ix_query_history_tenant_id_executed_at", "query_history")
+    op.drop_table("query_history")
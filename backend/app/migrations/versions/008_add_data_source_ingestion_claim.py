@@ -0,0 +1,30 @@
+"""add data source ingestion claim
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "008"
+down_revision: Union[str, None] = "007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The API worker converting a data source, and when it last showed it was alive
+    op.add_column("data_sources", sa.Column("ingestion_owner", sa.String(64), nullable=True))
+    op.add_column(
+        "data_sources",
+        sa.Column("ingestion_heartbeat_at", sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("data_sources", "ingestion_heartbeat_at")
+    op.drop_column("data_sources", "ingestion_owner")
@@ -1,7 +1,19 @@
 from app.models.user import User
 from app.models.workspace import Workspace
 from app.models.data_source import DataSource
-from app.models.dashboard import Dashboard, Widget, SemanticLayer
+from app.models.dashboard import Dashboard, Widget, WidgetResult, WidgetResultDependency, SemanticLayer
 from app.models.saved_query import SavedQuery
+from app.models.query_history import QueryHistory
 
-__all__ = ["User", "Workspace", "DataSource", "Dashboard", "Widget", "SemanticLayer", "SavedQuery"]
+__all__ = [
+    "User",
+    "Workspace",
+    "DataSource",
+    "Dashboard",
+    "Widget",
+    "WidgetResult",
+    "WidgetResultDependency",
+    "SemanticLayer",
+    "SavedQuery",
+    "QueryHistory",
+]
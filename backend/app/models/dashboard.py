@@ -46,6 +46,39 @@ class Widget(Base):
     updated_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), onupdate=func.now())
 
     dashboard: Mapped["Dashboard"] = relationship("Dashboard", back_populates="widgets")
+    result: Mapped["WidgetResult | None"] = relationship(
+        "WidgetResult", cascade="all, delete-orphan"
+    )
+
+
+class WidgetResult(Base):
+    """Last computed result of a widget's query, reused until it goes stale."""
+    __tablename__ = "widget_results"
+
+    widget_id: Mapped[uuid.UUID] = mapped_column(
+        Uuid, ForeignKey("widgets.id", name="fk_widget_results_widget_id", ondelete="CASCADE"), primary_key=True
+    )
+    tenant_id: Mapped[uuid.UUID] = mapped_column(Uuid, nullable=False, index=True)
+    query_hash: Mapped[str] = mapped_column(String(64), nullable=False)  # SQL, limit and layer version
+    data_version: Mapped[str] = mapped_column(String(32), nullable=False)  # parquet files read
+    result_json: Mapped[dict] = mapped_column(JSON, nullable=False)
+    computed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+    dependencies: Mapped[list["WidgetResultDependency"]] = relationship(
+        "WidgetResultDependency", cascade="all, delete-orphan"
+    )
+
+
+class WidgetResultDependency(Base):
+    """A data source read by a cached widget result."""
+    __tablename__ = "widget_result_dependencies"
+
+    widget_id: Mapped[uuid.UUID] = mapped_column(
+        Uuid,
+        ForeignKey("widget_results.widget_id", name="fk_widget_result_dependencies_widget_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    data_source_id: Mapped[uuid.UUID] = mapped_column(Uuid, primary_key=True, index=True)
 
 
 class SemanticLayer(Base):
@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
 
-from sqlalchemy import String, DateTime, Text, Uuid, func, JSON
+from sqlalchemy import String, DateTime, Integer, Text, Uuid, func, JSON
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.database import Base
@@ -16,4 +16,10 @@ class DataSource(Base):
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     connection_config_encrypted: Mapped[str | None] = mapped_column(Text, default=None)
     schema_cache: Mapped[dict | None] = mapped_column(JSON, default=None)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="ready", server_default="ready")  # pending, processing, ready, failed
+    progress: Mapped[int] = mapped_column(Integer, nullable=False, default=100, server_default="100")
+    error_message: Mapped[str | None] = mapped_column(Text, default=None)
+    # Worker running the ingestion job, and its last heartbeat (see ingestion_queue)
+    ingestion_owner: Mapped[str | None] = mapped_column(String(64), default=None)
+    ingestion_heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), default=None)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
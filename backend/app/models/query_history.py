@@ -0,0 +1,35 @@
+import uuid
+from datetime import datetime
+
+from sqlalchemy import JSON, BigInteger, DateTime, Float, Index, Integer, String, Text, Uuid, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database import Base
+
+
+class QueryHistory(Base):
+    """One query execution: where it came from, what each stage cost and what it returned."""
+    __tablename__ = "query_history"
+    __table_args__ = (
+        Index("ix_query_history_tenant_id_executed_at", "tenant_id", "executed_at"),
+        Index("ix_query_history_tenant_id_query_hash", "tenant_id", "query_hash"),
+    )
+
+    id: Mapped[uuid.UUID] = mapped_column(Uuid, primary_key=True, default=uuid.uuid4)
+    tenant_id: Mapped[uuid.UUID] = mapped_column(Uuid, nullable=False)
+    # No foreign key: history is kept when a workspace is deleted
+    workspace_id: Mapped[uuid.UUID | None] = mapped_column(Uuid, nullable=True)
+    source: Mapped[str] = mapped_column(String(20), nullable=False)  # query, ai or dashboard
+    query_hash: Mapped[str] = mapped_column(String(64), nullable=False)  # parse tree, formatting ignored
+    sql_text: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False)  # ok, error, timeout, cancelled, rejected
+    cache_status: Mapped[str] = mapped_column(String(10), nullable=False)  # hit or miss
+    row_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    result_bytes: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    setup_ms: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    queue_ms: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    execute_ms: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    serialize_ms: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    total_ms: Mapped[float] = mapped_column(Float, nullable=False)
+    profile_json: Mapped[dict | None] = mapped_column(JSON, nullable=True)  # slow queries only
+    executed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
@@ -1,35 +1,95 @@
 """AI router -- text-to-SQL endpoint using Claude API."""
 
+import asyncio
+import json
 import logging
+import time
+import uuid
+from typing import AsyncIterator
 
 import anthropic
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.core.dependencies import get_current_user, get_db
 from app.models.dashboard import SemanticLayer
 from app.models.user import User
 from app.schemas.ai import AIQueryRequest, AIQueryResponse
-from app.services.ai_service import AIService
+from app.services.ai_limiter import AIOverloadedError
+from app.services.ai_service import AIService, get_ai_service
+from app.services.answer_cache import answer_cache
+from app.services.catalog_service import semantic_layer_version
+from app.services.connection_pool import connection_pool
+from app.services.query_registry import QueryCancelledError, query_registry
+from app.services.query_scheduler import QueryOverloadedError
 from app.services.query_service import SemanticQueryBuilder
+from app.services.result_formats import table_to_columnar
+from app.services.tracing import TracedRoute, tracer
 
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 logger = logging.getLogger(__name__)
 
+AI_RESULT_LIMIT = 1000
+# Small first batches so the first rows reach the client quickly
+AI_STREAM_BATCH_SIZE = 100
 
-@router.post("/query", response_model=AIQueryResponse)
-async def ai_query(
-    data: AIQueryRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-):
-    tenant_id = current_user.tenant_id
 
-    # 1. Retrieve semantic layer (tenant-isolated)
+def _ai_http_error(error: Exception) -> HTTPException:
+    """Map an AIService failure to the HTTP error returned to the client."""
+    if isinstance(error, AIOverloadedError):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service is busy. Please retry later.",
+            headers={"Retry-After": "5"},
+        )
+    if isinstance(error, anthropic.RateLimitError):
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="AI service rate limited. Please retry later.",
+        )
+    if isinstance(error, ValueError):
+        return HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"AI generation error: {str(error)}",
+        )
+    logger.error("AI generation failed: %s", error)
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail=f"AI service error: {str(error)}",
+    )
+
+
+def _query_overloaded_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Query engine is busy. Please retry later.",
+        headers={"Retry-After": "2"},
+    )
+
+
+def _query_cancelled_error(error: QueryCancelledError) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(error))
+
+
+def _ensure_ai_configured(ai_service: AIService) -> None:
+    try:
+        ai_service._ensure_client()
+    except RuntimeError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service not configured",
+        )
+
+
+@tracer.span("semantic_layer")
+def _get_definitions(db: Session, workspace_id: uuid.UUID, tenant_id: uuid.UUID) -> dict:
+    """Return the workspace's semantic layer definitions (tenant-isolated)."""
     semantic_layer = (
         db.query(SemanticLayer)
         .filter(
-            SemanticLayer.workspace_id == data.workspace_id,
+            SemanticLayer.workspace_id == workspace_id,
             SemanticLayer.tenant_id == tenant_id,
         )
         .first()
@@ -45,83 +105,138 @@ async def ai_query(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Semantic layer has no definitions configured",
         )
+    return semantic_layer.definitions_json
 
-    definitions = semantic_layer.definitions_json
 
-    # 2. Check AI service availability
-    ai_service = AIService()
-    try:
-        ai_service._ensure_client()
-    except RuntimeError:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="AI service not configured",
-        )
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
 
-    # 3. Generate SQL via Claude
+
+async def _generate_sql(
+    ai_service: AIService,
+    question: str,
+    definitions: dict,
+    tenant_id: uuid.UUID,
+) -> dict:
+    """Ask Claude for SQL, mapping service failures to HTTP errors."""
+    _ensure_ai_configured(ai_service)
     try:
-        ai_result = await ai_service.generate_sql(
-            question=data.question,
+        return await ai_service.generate_sql(
+            question=question,
             semantic_context=definitions,
-        )
-    except anthropic.RateLimitError:
-        raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail="AI service rate limited. Please retry later.",
-        )
-    except ValueError as e:
-        raise HTTPException(
-            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            detail=f"AI generation error: {str(e)}",
+            tenant_id=tenant_id,
         )
     except Exception as e:
-        logger.error("AI generation failed: %s", e)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"AI service error: {str(e)}",
+        raise _ai_http_error(e)
+
+
+@router.post("/query", response_model=AIQueryResponse)
+async def ai_query(
+    data: AIQueryRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    ai_service: AIService = Depends(get_ai_service),
+):
+    tenant_id = current_user.tenant_id
+
+    # 1. Retrieve semantic layer (tenant-isolated)
+    definitions = _get_definitions(db, data.workspace_id, tenant_id)
+
+    # 2. Reuse the SQL of an identical or near-identical question, if any
+    cache_scope = answer_cache.scope_key(
+        tenant_id, data.workspace_id, semantic_layer_version(definitions)
+    )
+    cached = answer_cache.lookup(cache_scope, data.question)
+    if cached is None:
+        _ensure_ai_configured(ai_service)
+
+    # 3. Set up the DuckDB context before any SQL: a missing or not-ready data
+    # source is no SQL error, so it must not cost a Claude retry or drop a cached answer.
+    # DuckDB calls block, so they run in the threadpool.
+    builder = SemanticQueryBuilder(pool=connection_pool, source="ai")
+    try:
+        await run_in_threadpool(
+            builder.setup_context,
+            definitions_json=definitions,
+            tenant_id=tenant_id,
+            db=db,
+            workspace_id=data.workspace_id,
         )
+    except ValueError as e:
+        builder.close()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except RuntimeError as e:
+        builder.close()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    cache_status = "miss"
+    if cached is not None:
+        answer, cache_status = cached
+        ai_result = {
+            "sql": answer.sql,
+            "explanation": answer.explanation,
+            "suggested_chart": answer.suggested_chart,
+        }
+    else:
+        try:
+            ai_result = await _generate_sql(ai_service, data.question, definitions, tenant_id)
+        except BaseException:
+            builder.close()
+            raise
 
     generated_sql = ai_result["sql"]
     explanation = ai_result["explanation"]
     suggested_chart = ai_result.get("suggested_chart")
 
-    # 4. Execute SQL via SemanticQueryBuilder
-    builder = SemanticQueryBuilder()
+    # 4. Validate (bind only), then execute. Both attempts run under one run id,
+    # cancelled if the client disconnects.
+    run_id = query_registry.new_run_id()
+    watcher = asyncio.create_task(query_registry.cancel_on_disconnect(request, tenant_id, run_id))
     try:
-        builder.setup_context(
-            definitions_json=definitions,
-            tenant_id=tenant_id,
-            db=db,
+        await run_in_threadpool(builder.validate, generated_sql)
+        results = await run_in_threadpool(
+            builder.execute_query, sql_text=generated_sql, limit=AI_RESULT_LIMIT, run_id=run_id
         )
-        results = builder.execute_query(sql_text=generated_sql, limit=1000)
     except (ValueError, TimeoutError) as first_error:
-        # Retry once with error context
+        # Retry once with error context, on the same DuckDB context
         logger.warning(
             "First SQL attempt failed, retrying. SQL: %s, Error: %s",
             generated_sql,
             first_error,
         )
-        builder.close()
-        builder = SemanticQueryBuilder()
+        if cached is not None:
+            # The cached SQL no longer works for this layer: forget it
+            answer_cache.discard(cache_scope, cached[0].question)
+            cache_status = "miss"
         try:
+            # A cache hit skipped this check on the first attempt
+            _ensure_ai_configured(ai_service)
             ai_retry = await ai_service.generate_sql_with_retry(
                 question=data.question,
                 semantic_context=definitions,
                 error_message=str(first_error),
                 previous_sql=generated_sql,
+                tenant_id=tenant_id,
             )
             generated_sql = ai_retry["sql"]
             explanation = ai_retry["explanation"]
             suggested_chart = ai_retry.get("suggested_chart")
 
-            builder.setup_context(
-                definitions_json=definitions,
-                tenant_id=tenant_id,
-                db=db,
+            await run_in_threadpool(builder.validate, generated_sql)
+            results = await run_in_threadpool(
+                builder.execute_query, sql_text=generated_sql, limit=AI_RESULT_LIMIT, run_id=run_id
             )
-            results = builder.execute_query(
-                sql_text=generated_sql, limit=1000
+        except AIOverloadedError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="AI service is busy. Please retry later.",
+                headers={"Retry-After": "5"},
             )
+        except QueryOverloadedError:
+            raise _query_overloaded_error()
+        except QueryCancelledError as retry_error:
+            raise _query_cancelled_error(retry_error)
         except ValueError as retry_error:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -132,6 +247,8 @@ async def ai_query(
                 status_code=status.HTTP_408_REQUEST_TIMEOUT,
                 detail=str(retry_error),
             )
+        except HTTPException:
+            raise
         except Exception as retry_error:
             logger.error("Retry also failed: %s", retry_error)
             raise HTTPException(
@@ -140,6 +257,12 @@ async def ai_query(
             )
         finally:
             builder.close()
+    except QueryOverloadedError:
+        builder.close()
+        raise _query_overloaded_error()
+    except QueryCancelledError as e:
+        builder.close()
+        raise _query_cancelled_error(e)
     except RuntimeError as e:
         builder.close()
         raise HTTPException(
@@ -148,6 +271,8 @@ async def ai_query(
         )
     else:
         builder.close()
+    finally:
+        watcher.cancel()
 
     # 5. Fallback chart suggestion via heuristic
     if not suggested_chart:
@@ -156,6 +281,11 @@ async def ai_query(
             row_count=results["row_count"],
         )
 
+    if cache_status == "miss":
+        answer_cache.store(
+            cache_scope, data.question, generated_sql, explanation, suggested_chart
+        )
+
     return AIQueryResponse(
         sql=generated_sql,
         explanation=explanation,
@@ -166,4 +296,173 @@ async def ai_query(
             "execution_time_ms": results["execution_time_ms"],
         },
         suggested_chart=suggested_chart,
+        cache_status=cache_status,
+    )
+
+
+@router.post("/query/stream", response_class=StreamingResponse)
+async def ai_query_stream(
+    data: AIQueryRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    ai_service: AIService = Depends(get_ai_service),
+):
+    """Server-Sent Events variant of /query, emitting each stage as soon as it is done.
+
+    Events, in order: `sql_delta` (SQL text as Claude writes it), `sql`,
+    `explanation`, `validation`, `rows` (one per batch, the first arriving before
+    the query finishes), `stats`, `chart`, then `done`. A failed validation or
+    start of execution emits `retry` and the corrected SQL is streamed again.
+    Failures after the response has started are reported as an `error` event.
+    If the client goes away, the stream is closed and its query cancelled.
+    """
+    tenant_id = current_user.tenant_id
+    definitions = _get_definitions(db, data.workspace_id, tenant_id)
+
+    cache_scope = answer_cache.scope_key(
+        tenant_id, data.workspace_id, semantic_layer_version(definitions)
     )
+    cached = answer_cache.lookup(cache_scope, data.question)
+    if cached is None:
+        _ensure_ai_configured(ai_service)
+
+    # The context needs the request's db session, so it is built before streaming starts
+    builder = SemanticQueryBuilder(pool=connection_pool, source="ai")
+    try:
+        await run_in_threadpool(
+            builder.setup_context,
+            definitions_json=definitions,
+            tenant_id=tenant_id,
+            db=db,
+            workspace_id=data.workspace_id,
+        )
+    except ValueError as e:
+        builder.close()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except RuntimeError as e:
+        builder.close()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    run_id = query_registry.new_run_id()
+
+    async def events() -> AsyncIterator[str]:
+        cache_status = "miss"
+        answer: dict = {}
+        error: Exception | None = None
+        try:
+            # 1. SQL: from the answer cache, or streamed from Claude (at most one retry)
+            for attempt in range(2):
+                if attempt == 0 and cached is not None:
+                    entry, cache_status = cached
+                    answer = {
+                        "sql": entry.sql,
+                        "explanation": entry.explanation,
+                        "suggested_chart": entry.suggested_chart,
+                    }
+                else:
+                    try:
+                        # A cache hit skipped this check before the stream started
+                        _ensure_ai_configured(ai_service)
+                    except HTTPException as e:
+                        yield _sse("error", {"status_code": e.status_code, "detail": e.detail})
+                        return
+                    try:
+                        async for event in ai_service.stream_sql(
+                            question=data.question,
+                            semantic_context=definitions,
+                            tenant_id=tenant_id,
+                            error_message=str(error) if error else None,
+                            previous_sql=answer.get("sql"),
+                        ):
+                            if event["type"] == "sql_delta":
+                                yield _sse("sql_delta", {"text": event["text"]})
+                            else:
+                                answer = event
+                    except Exception as e:
+                        http_error = _ai_http_error(e)
+                        yield _sse("error", {
+                            "status_code": http_error.status_code,
+                            "detail": http_error.detail,
+                        })
+                        return
+                yield _sse("sql", {"sql": answer["sql"], "cache_status": cache_status})
+                yield _sse("explanation", {"explanation": answer["explanation"]})
+
+                # 2. Bind-only validation, then start execution and fetch the first batch
+                error = None
+                try:
+                    await run_in_threadpool(builder.validate, answer["sql"])
+                except ValueError as e:
+                    error = e
+                    yield _sse("validation", {"valid": False, "error": str(e)})
+                else:
+                    yield _sse("validation", {"valid": True})
+                    try:
+                        start = time.monotonic()
+                        result = await run_in_threadpool(
+                            builder.execute_stream,
+                            answer["sql"],
+                            limit=AI_RESULT_LIMIT,
+                            batch_size=AI_STREAM_BATCH_SIZE,
+                            run_id=run_id,
+                        )
+                        first_batch = await run_in_threadpool(next, result["batches"], None)
+                    except (ValueError, TimeoutError) as e:
+                        error = e
+                if error is None:
+                    break
+
+                logger.warning("Streamed SQL attempt failed. SQL: %s, Error: %s", answer["sql"], error)
+                if cache_status != "miss":
+                    # The cached SQL no longer works for this layer: forget it
+                    answer_cache.discard(cache_scope, cached[0].question)
+                    cache_status = "miss"
+                if attempt == 1:
+                    yield _sse("error", {
+                        "status_code": status.HTTP_400_BAD_REQUEST,
+                        "detail": f"SQL generation failed after retry: {str(error)}",
+                    })
+                    return
+                yield _sse("retry", {"error": str(error)})
+
+            # 3. Rows, batch by batch
+            names = [col["name"] for col in result["columns"]]
+            row_count = 0
+            batch = first_batch
+            while batch is not None:
+                rows = [dict(zip(names, values)) for values in zip(*table_to_columnar(batch))]
+                row_count += len(rows)
+                yield _sse("rows", {"columns": result["columns"], "rows": rows})
+                batch = await run_in_threadpool(next, result["batches"], None)
+
+            yield _sse("stats", {
+                "row_count": row_count,
+                "execution_time_ms": round((time.monotonic() - start) * 1000, 2),
+            })
+
+            # 4. Chart suggestion
+            suggested_chart = answer.get("suggested_chart") or ai_service.suggest_chart_type(
+                columns=result["columns"], row_count=row_count
+            )
+            yield _sse("chart", {"suggested_chart": suggested_chart})
+
+            if cache_status == "miss":
+                answer_cache.store(
+                    cache_scope, data.question, answer["sql"], answer["explanation"], suggested_chart
+                )
+            yield _sse("done", {"cache_status": cache_status})
+        except ValueError as e:
+            yield _sse("error", {"status_code": status.HTTP_400_BAD_REQUEST, "detail": str(e)})
+        except QueryOverloadedError:
+            http_error = _query_overloaded_error()
+            yield _sse("error", {"status_code": http_error.status_code, "detail": http_error.detail})
+        except QueryCancelledError as e:
+            http_error = _query_cancelled_error(e)
+            yield _sse("error", {"status_code": http_error.status_code, "detail": http_error.detail})
+        finally:
+            # Closed early (the client disconnected): stop the query where it is,
+            # including one still waiting for a slot or starting on a worker
+            query_registry.cancel(tenant_id, run_id)
+            builder.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -17,8 +17,9 @@ from app.services.auth_service import (
     refresh_access_token,
     register_user,
 )
+from app.services.tracing import TracedRoute
 
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 
 
 @router.post("/register", response_model=UserResponse, status_code=201)
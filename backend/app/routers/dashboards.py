@@ -9,6 +9,7 @@ from app.core.dependencies import get_current_user, get_db
 from app.models.user import User
 from app.schemas.dashboard import (
     DashboardCreate,
+    DashboardRenderResponse,
     DashboardResponse,
     DashboardUpdate,
     DashboardWithWidgets,
@@ -17,8 +18,9 @@ from app.schemas.dashboard import (
     WidgetUpdate,
 )
 from app.services.dashboard_service import DashboardService
+from app.services.tracing import TracedRoute
 
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 
 
 # --- Dashboard CRUD ---
@@ -92,6 +94,21 @@ def delete_dashboard(
     service.delete(dashboard_id)
 
 
+@router.post("/{dashboard_id}/render", response_model=DashboardRenderResponse)
+def render_dashboard(
+    dashboard_id: uuid.UUID,
+    refresh: bool = Query(default=False, description="Recompute every widget, ignoring cached results"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Return every widget's results in one request.
+
+    Cached results are served while fresh; stale widgets run concurrently on one DuckDB context.
+    """
+    service = DashboardService(db, current_user.tenant_id)
+    return service.render(dashboard_id, refresh=refresh)
+
+
 # --- Widget CRUD ---
 
 
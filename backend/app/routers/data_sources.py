@@ -1,18 +1,48 @@
 """Data sources router — CSV upload and management endpoints."""
 
+import asyncio
+import json
 import uuid
+from typing import Literal
 
-from fastapi import APIRouter, Depends, File, Form, Query, UploadFile, status
+from fastapi import APIRouter, Depends, File, Form, Header, Query, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.core.dependencies import get_current_user, get_db
 from app.models.data_source import DataSource
 from app.models.user import User
-from app.schemas.data_source import DataSourceListResponse, DataSourcePreviewResponse, DataSourceResponse
+from app.schemas.data_source import (
+    DataSourceListResponse,
+    DataSourcePreviewResponse,
+    DataSourceResponse,
+    IngestionJobResponse,
+)
 from app.services.base_service import BaseTenantService
-from app.services.csv_service import delete_csv_files, get_csv_preview, upload_csv
+from app.services.cache_invalidation import invalidate_data_source
+from app.services.csv_service import (
+    create_pending_csv_source,
+    delete_csv_files,
+    get_csv_preview,
+)
+from app.services.ingestion_queue import TERMINAL_STATUSES, ingestion_queue
+from app.services.result_formats import ARROW_STREAM_MEDIA_TYPE, build_response, resolve_format
+from app.services.tracing import TracedRoute
 
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
+
+STATUS_STREAM_TIMEOUT_SECONDS = 1.0
+
+
+def _job_response(data_source: DataSource) -> IngestionJobResponse:
+    return IngestionJobResponse(
+        job_id=data_source.id,
+        data_source_id=data_source.id,
+        status=data_source.status,
+        progress=data_source.progress,
+        error_message=data_source.error_message,
+    )
 
 
 @router.post("/upload", response_model=DataSourceResponse, status_code=status.HTTP_201_CREATED)
@@ -22,8 +52,29 @@ def upload_csv_file(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    """Upload a CSV file and create a data source."""
-    return upload_csv(file, name, current_user.tenant_id, db)
+    """Upload a CSV file and create a data source once it is converted.
+
+    Runs on the ingestion workers like /upload/async, but waits for the job.
+    """
+    data_source = create_pending_csv_source(file, name, current_user.tenant_id, db)
+    return ingestion_queue.ingest(data_source, db)
+
+
+@router.post("/upload/async", response_model=IngestionJobResponse, status_code=status.HTTP_202_ACCEPTED)
+def upload_csv_file_async(
+    file: UploadFile = File(...),
+    name: str = Form(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Upload a CSV file and convert it in the background.
+
+    Returns immediately with a job id; poll /{id}/status or follow /{id}/status/stream.
+    """
+    data_source = create_pending_csv_source(file, name, current_user.tenant_id, db)
+    response = _job_response(data_source)
+    ingestion_queue.enqueue(data_source)
+    return response
 
 
 @router.get("/", response_model=list[DataSourceListResponse])
@@ -50,23 +101,87 @@ def list_data_sources(
             name=ds.name,
             row_count=row_count,
             column_count=column_count,
+            status=ds.status,
             created_at=ds.created_at,
         ))
     return result
 
 
-@router.get("/{data_source_id}/preview", response_model=DataSourcePreviewResponse)
+@router.get(
+    "/{data_source_id}/preview",
+    response_model=DataSourcePreviewResponse,
+    responses={200: {"content": {ARROW_STREAM_MEDIA_TYPE: {}}}},
+)
 def preview_data_source(
     data_source_id: uuid.UUID,
     page: int = Query(default=1, ge=1, description="Page number (1-based)"),
     page_size: int = Query(default=50, ge=1, le=1000, description="Rows per page (max 1000)"),
+    format: Literal["json", "columnar", "arrow"] | None = Query(
+        default=None, description="Response format (json, columnar or arrow)"
+    ),
+    cursor: str | None = Query(
+        default=None, description="Opaque next_cursor/prev_cursor token from a previous page (overrides page)"
+    ),
+    accept: str | None = Header(default=None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
     """Return a paginated preview of the CSV data source."""
     service = BaseTenantService(DataSource, db, current_user.tenant_id)
     data_source = service.get_by_id(data_source_id)
-    return get_csv_preview(data_source, page, page_size)
+    result_format = resolve_format(format, accept)
+    return build_response(
+        result_format, get_csv_preview(data_source, page, page_size, result_format, cursor)
+    )
+
+
+@router.get("/{data_source_id}/status", response_model=IngestionJobResponse)
+def get_ingestion_status(
+    data_source_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Return the ingestion status and progress of a data source."""
+    service = BaseTenantService(DataSource, db, current_user.tenant_id)
+    return _job_response(service.get_by_id(data_source_id))
+
+
+@router.get("/{data_source_id}/status/stream", response_class=StreamingResponse)
+def stream_ingestion_status(
+    data_source_id: uuid.UUID,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Server-Sent Events: one `status` event per change until the job is ready or failed."""
+    service = BaseTenantService(DataSource, db, current_user.tenant_id)
+    service.get_by_id(data_source_id)
+
+    def read_status() -> dict | None:
+        # The request session is closed once streaming starts; read through short-lived ones
+        with ingestion_queue.session_factory() as poll_db:
+            current_ds = poll_db.get(DataSource, data_source_id)
+            return None if current_ds is None else _job_response(current_ds).model_dump(mode="json")
+
+    async def events():
+        # Waits on the event loop between updates instead of holding a threadpool thread
+        with ingestion_queue.changes() as changed:
+            last = None
+            while True:
+                changed.clear()
+                current = await run_in_threadpool(read_status)
+                if current is None:
+                    return
+                if current != last:
+                    yield f"event: status\ndata: {json.dumps(current)}\n\n"
+                    last = current
+                if current["status"] in TERMINAL_STATUSES:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), STATUS_STREAM_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    pass  # re-read: jobs run by other processes do not notify this one
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 
 @router.get("/{data_source_id}", response_model=DataSourceResponse)
@@ -91,3 +206,4 @@ def delete_data_source(
     data_source = service.get_by_id(data_source_id)
     delete_csv_files(data_source)
     service.delete(data_source_id)
+    invalidate_data_source(current_user.tenant_id, data_source_id, db)
@@ -1,8 +1,14 @@
-"""Queries router — SQL execution and saved query CRUD."""
+"""Queries router — SQL execution, cancellation, query history and saved query CRUD."""
 
+import asyncio
+import time
 import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Literal
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.core.dependencies import get_current_user, get_db
@@ -12,30 +18,45 @@ from app.models.user import User
 from app.schemas.query import (
     QueryExecuteRequest,
     QueryExecuteResponse,
+    QueryStatsResponse,
+    QueryStreamRequest,
     SavedQueryCreate,
     SavedQueryResponse,
     SavedQueryUpdate,
+    SlowQueryResponse,
 )
 from app.services.base_service import BaseTenantService
+from app.services.catalog_service import view_catalog
+from app.services.connection_pool import connection_pool
+from app.services.metrics import observe_query
+from app.services.query_history import QueryExecution, estimate_json_bytes, query_history
+from app.services.query_registry import QueryCancelledError, query_registry
+from app.services.query_scheduler import QueryOverloadedError
 from app.services.query_service import SemanticQueryBuilder
+from app.services.result_cache import query_result_cache
+from app.services.result_formats import (
+    ARROW_STREAM_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    build_response,
+    encode_table,
+    resolve_format,
+    stream_arrow,
+    stream_ndjson,
+)
+from app.services.sql_parser import parse_query
+from app.services.tracing import TracedRoute, tracer
+from app.services.widget_cache import widget_result_cache
 
-router = APIRouter()
-
+router = APIRouter(route_class=TracedRoute)
 
-@router.post("/execute", response_model=QueryExecuteResponse)
-def execute_query(
-    data: QueryExecuteRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-):
-    """Execute a SQL query against the workspace's semantic layer."""
-    tenant_id = current_user.tenant_id
 
-    # Find the semantic layer for this workspace
+@tracer.span("semantic_layer")
+def _get_semantic_layer(db: Session, workspace_id: uuid.UUID, tenant_id: uuid.UUID) -> SemanticLayer:
+    """Find the workspace's semantic layer (tenant-isolated), with definitions configured."""
     semantic_layer = (
         db.query(SemanticLayer)
         .filter(
-            SemanticLayer.workspace_id == data.workspace_id,
+            SemanticLayer.workspace_id == workspace_id,
             SemanticLayer.tenant_id == tenant_id,
         )
         .first()
@@ -51,19 +72,89 @@ def execute_query(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Semantic layer has no definitions configured",
         )
+    return semantic_layer
 
-    builder = SemanticQueryBuilder()
+
+@router.post(
+    "/execute",
+    response_model=QueryExecuteResponse,
+    responses={200: {"content": {ARROW_STREAM_MEDIA_TYPE: {}}}},
+)
+async def execute_query(
+    data: QueryExecuteRequest,
+    request: Request,
+    accept: str | None = Header(default=None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Execute a SQL query against the workspace's semantic layer.
+
+    Returns row-oriented JSON by default; `format` (or an Arrow Accept header)
+    selects columnar JSON or an Arrow IPC stream instead. The query runs under
+    `run_id` (client-supplied or generated) and is cancelled if the client
+    disconnects before it finishes.
+    """
+    run_id = data.run_id or query_registry.new_run_id()
+    watcher = asyncio.create_task(
+        query_registry.cancel_on_disconnect(request, current_user.tenant_id, run_id)
+    )
+    try:
+        return await run_in_threadpool(_execute_query, data, run_id, accept, db, current_user)
+    finally:
+        watcher.cancel()
+
+
+def _execute_query(
+    data: QueryExecuteRequest,
+    run_id: str,
+    accept: str | None,
+    db: Session,
+    current_user: User,
+):
+    start = time.monotonic()
+    tenant_id = current_user.tenant_id
+    result_format = resolve_format(data.format, accept)
+
+    semantic_layer = _get_semantic_layer(db, data.workspace_id, tenant_id)
+
+    builder = SemanticQueryBuilder(pool=connection_pool)
     try:
+        # Results depend only on the SQL, the limit, and the parquet files read
+        catalog = view_catalog.resolve(semantic_layer.definitions_json, tenant_id, db)
+        cache_key = query_result_cache.make_key(
+            tenant_id, data.sql_text, data.limit, catalog.data_version, result_format
+        )
+        cached = query_result_cache.get(cache_key)
+        if cached is not None:
+            _record_cache_hit(data, tenant_id, cached, start)
+            return build_response(result_format, {**cached, "cache_status": "hit", "run_id": run_id})
+
         builder.setup_context(
             definitions_json=semantic_layer.definitions_json,
             tenant_id=tenant_id,
             db=db,
+            workspace_id=data.workspace_id,
         )
-        result = builder.execute_query(
-            sql_text=data.sql_text,
-            limit=data.limit,
-        )
-        return result
+        if result_format == "json":
+            result = builder.execute_query(
+                sql_text=data.sql_text,
+                limit=data.limit,
+                run_id=run_id,
+            )
+        else:
+            arrow_result = builder.execute_arrow(
+                sql_text=data.sql_text,
+                limit=data.limit,
+                run_id=run_id,
+            )
+            result = {
+                "columns": arrow_result["columns"],
+                **encode_table(result_format, arrow_result["table"]),
+                "row_count": arrow_result["row_count"],
+                "execution_time_ms": arrow_result["execution_time_ms"],
+            }
+        query_result_cache.put(cache_key, result, catalog.data_source_ids)
+        return build_response(result_format, {**result, "cache_status": "miss", "run_id": run_id})
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -74,6 +165,17 @@ def execute_query(
             status_code=status.HTTP_408_REQUEST_TIMEOUT,
             detail=str(e),
         )
+    except QueryCancelledError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e),
+        )
+    except QueryOverloadedError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Query engine is busy. Please retry later.",
+            headers={"Retry-After": "2"},
+        )
     except RuntimeError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -83,6 +185,152 @@ def execute_query(
         builder.close()
 
 
+def _record_cache_hit(data: QueryExecuteRequest, tenant_id: uuid.UUID, cached: dict, start: float) -> None:
+    """Report a result served from the cache to the query history."""
+    parsed = parse_query(data.sql_text)
+    if "body" in cached:
+        result_bytes = len(cached["body"])
+    elif "rows" in cached:
+        result_bytes = estimate_json_bytes(cached["rows"])
+    else:
+        result_bytes = None
+    execution = QueryExecution(
+        tenant_id=str(tenant_id),
+        workspace_id=str(data.workspace_id),
+        source="query",
+        query_hash=parsed.fingerprint,
+        sql_text=parsed.sql,
+        cache_status="hit",
+        row_count=cached["row_count"],
+        result_bytes=result_bytes,
+        setup_ms=(time.monotonic() - start) * 1000,
+    )
+    query_history.record(execution)
+    observe_query(execution)
+
+
+@router.post(
+    "/execute/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}, ARROW_STREAM_MEDIA_TYPE: {}}}},
+)
+def execute_query_stream(
+    data: QueryStreamRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Execute a SQL query and stream the result as NDJSON or Arrow IPC chunks.
+
+    Rows are read from DuckDB one record batch at a time while the response is
+    being sent, so neither time-to-first-byte nor memory grow with result size.
+    """
+    tenant_id = current_user.tenant_id
+    semantic_layer = _get_semantic_layer(db, data.workspace_id, tenant_id)
+
+    builder = SemanticQueryBuilder(pool=connection_pool)
+    try:
+        builder.setup_context(
+            definitions_json=semantic_layer.definitions_json,
+            tenant_id=tenant_id,
+            db=db,
+            workspace_id=data.workspace_id,
+        )
+        stream = builder.execute_stream(sql_text=data.sql_text, limit=data.limit, run_id=data.run_id)
+    except ValueError as e:
+        builder.close()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        )
+    except TimeoutError as e:
+        builder.close()
+        raise HTTPException(
+            status_code=status.HTTP_408_REQUEST_TIMEOUT,
+            detail=str(e),
+        )
+    except QueryCancelledError as e:
+        builder.close()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e),
+        )
+    except QueryOverloadedError:
+        builder.close()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Query engine is busy. Please retry later.",
+            headers={"Retry-After": "2"},
+        )
+    except RuntimeError as e:
+        builder.close()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e),
+        )
+
+    # The builder stays checked out until the last chunk has been sent; closing
+    # it early (client gone) interrupts the query
+    headers = {"X-Run-Id": stream["run_id"]}
+    if data.format == "arrow":
+        body = stream_arrow(stream["schema"], stream["batches"], on_close=builder.close)
+        return StreamingResponse(body, media_type=ARROW_STREAM_MEDIA_TYPE, headers=headers)
+    body = stream_ndjson(stream["columns"], stream["batches"], on_close=builder.close)
+    return StreamingResponse(body, media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+
+@router.delete("/{run_id}", status_code=status.HTTP_204_NO_CONTENT)
+def cancel_query(
+    run_id: str,
+    current_user: User = Depends(get_current_user),
+):
+    """Cancel one of the tenant's running queries.
+
+    The request running it returns `409`; a stream ends early.
+    Runs are only known to the API worker executing them, so an unknown run id
+    answers `409` rather than `404`: with several workers the run may be alive
+    on another one, and a retry can reach it.
+    """
+    if not query_registry.cancel(current_user.tenant_id, run_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="No query with this run id is running on this API worker",
+        )
+
+
+# --- Query history ---
+
+
+@router.get("/history/top", response_model=list[QueryStatsResponse])
+def top_queries(
+    order: Literal["slowest", "frequent"] = Query("slowest", description="Rank by mean time or by executions"),
+    limit: int = Query(10, ge=1, le=100),
+    workspace_id: uuid.UUID | None = Query(None, description="Filter by workspace ID"),
+    since_hours: int | None = Query(None, ge=1, description="Only executions of the last N hours"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """The tenant's queries (grouped by normalized SQL) that are slowest or run most often."""
+    query_history.flush()
+    since = None
+    if since_hours is not None:
+        since = datetime.now(timezone.utc) - timedelta(hours=since_hours)
+    return query_history.top_queries(
+        db, current_user.tenant_id, order, limit, workspace_id=workspace_id, since=since
+    )
+
+
+@router.get("/history/slow", response_model=list[SlowQueryResponse])
+def slow_queries(
+    limit: int = Query(20, ge=1, le=100),
+    workspace_id: uuid.UUID | None = Query(None, description="Filter by workspace ID"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """The tenant's latest slow-query log entries, with DuckDB's execution profile."""
+    query_history.flush()
+    return query_history.slow_queries(db, current_user.tenant_id, limit, workspace_id=workspace_id)
+
+
 # --- Saved queries CRUD ---
 
 
@@ -148,7 +396,11 @@ def update_saved_query(
         update_data["sql_text"] = data.sql_text
     if data.chart_type is not None:
         update_data["chart_type"] = data.chart_type
-    return service.update(query_id, **update_data)
+    saved_query = service.update(query_id, **update_data)
+    if data.sql_text is not None:
+        # Widgets showing this query now run different SQL
+        widget_result_cache.invalidate_saved_query(db, current_user.tenant_id, query_id)
+    return saved_query
 
 
 @router.delete("/saved/{query_id}", status_code=status.HTTP_204_NO_CONTENT)
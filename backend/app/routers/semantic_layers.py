@@ -15,8 +15,11 @@ from app.schemas.semantic_layer import (
     SemanticLayerUpdate,
 )
 from app.services.base_service import BaseTenantService
+from app.services.cache_invalidation import invalidate_workspace
+from app.services.rollup_service import refresh_rollups
+from app.services.tracing import TracedRoute
 
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 
 
 @router.post("/", response_model=SemanticLayerResponse, status_code=status.HTTP_201_CREATED)
@@ -27,11 +30,14 @@ def create_semantic_layer(
 ):
     """Create a new semantic layer for a workspace."""
     service = BaseTenantService(SemanticLayer, db, current_user.tenant_id)
-    return service.create(
+    layer = service.create(
         workspace_id=data.workspace_id,
         name=data.name,
         definitions_json=data.definitions_json,
     )
+    if layer.definitions_json:
+        refresh_rollups(layer.definitions_json, layer.tenant_id, db)
+    return layer
 
 
 @router.get("/", response_model=list[SemanticLayerListResponse])
@@ -81,7 +87,12 @@ def update_semantic_layer(
         update_data["name"] = data.name
     if data.definitions_json is not None:
         update_data["definitions_json"] = data.definitions_json
-    return service.update(semantic_layer_id, **update_data)
+    layer = service.update(semantic_layer_id, **update_data)
+    # Query state derived from the previous definitions is now stale
+    invalidate_workspace(layer.tenant_id, layer.workspace_id)
+    if data.definitions_json is not None:
+        refresh_rollups(layer.definitions_json, layer.tenant_id, db)
+    return layer
 
 
 @router.delete("/{semantic_layer_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -92,4 +103,6 @@ def delete_semantic_layer(
 ):
     """Delete a semantic layer."""
     service = BaseTenantService(SemanticLayer, db, current_user.tenant_id)
+    workspace_id = service.get_by_id(semantic_layer_id).workspace_id
     service.delete(semantic_layer_id)
+    invalidate_workspace(current_user.tenant_id, workspace_id)
@@ -43,3 +43,6 @@ class AIQueryResponse(BaseModel):
     explanation: str
     results: AIQueryResults
     suggested_chart: str | None = None
+    cache_status: str = Field(
+        default="miss", description="hit/similar when the SQL came from the answer cache"
+    )
@@ -2,10 +2,12 @@
 
 import uuid
 from datetime import datetime
-from typing import Any
+from typing import Any, Literal
 
 from pydantic import BaseModel, ConfigDict, Field
 
+from app.schemas.query import ColumnInfo
+
 
 # --- Widget schemas ---
 
@@ -88,3 +90,29 @@ class DashboardResponse(BaseModel):
 class DashboardWithWidgets(DashboardResponse):
     """Response schema for a dashboard with its widgets."""
     widgets: list[WidgetResponse] = []
+
+
+# --- Render schemas ---
+
+
+class WidgetRenderResult(BaseModel):
+    """Result of one widget's query in a dashboard render."""
+    widget_id: uuid.UUID
+    status: Literal["ok", "error", "skipped"]
+    columns: list[ColumnInfo] = []
+    rows: list[dict[str, Any]] = []
+    row_count: int = 0
+    execution_time_ms: float = 0.0
+    error: str | None = None
+    cache_status: Literal["hit", "miss"] | None = Field(
+        default=None, description="Widget result cache outcome (none for skipped widgets)"
+    )
+    computed_at: datetime | None = Field(default=None, description="When the cached result was computed")
+
+
+class DashboardRenderResponse(BaseModel):
+    """Response schema for rendering every widget of a dashboard in one request."""
+    dashboard_id: uuid.UUID
+    widgets: list[WidgetRenderResult]
+    setup_time_ms: float = Field(description="Time to load widgets and set up the query context")
+    total_time_ms: float
@@ -23,6 +23,9 @@ class DataSourceResponse(BaseModel):
     type: str
     name: str
     schema_cache: SchemaInfo | None = None
+    status: str = "ready"
+    progress: int = 100
+    error_message: str | None = None
     created_at: datetime
 
     model_config = {"from_attributes": True}
@@ -34,6 +37,7 @@ class DataSourceListResponse(BaseModel):
     name: str
     row_count: int | None = None
     column_count: int | None = None
+    status: str = "ready"
     created_at: datetime
 
     model_config = {"from_attributes": True}
@@ -46,3 +50,14 @@ class DataSourcePreviewResponse(BaseModel):
     page: int
     page_size: int
     total_pages: int
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
+
+
+class IngestionJobResponse(BaseModel):
+    """Status of a background CSV ingestion. The job id is the data source id."""
+    job_id: uuid.UUID
+    data_source_id: uuid.UUID
+    status: str
+    progress: int
+    error_message: str | None = None
@@ -2,7 +2,7 @@
 
 import uuid
 from datetime import datetime
-from typing import Any
+from typing import Any, Literal
 
 from pydantic import BaseModel, ConfigDict, Field
 
@@ -12,6 +12,32 @@ class QueryExecuteRequest(BaseModel):
     sql_text: str = Field(..., min_length=1, description="SQL query to execute")
     workspace_id: uuid.UUID = Field(..., description="Workspace containing the semantic layer")
     limit: int = Field(default=10000, ge=1, le=50000, description="Max rows to return")
+    format: Literal["json", "columnar", "arrow"] | None = Field(
+        default=None,
+        description="Response format; defaults to the Accept header, then row-oriented json",
+    )
+    run_id: str | None = Field(
+        default=None,
+        min_length=1,
+        max_length=64,
+        pattern=r"^[A-Za-z0-9_.:-]+$",
+        description="Client-chosen id to cancel the query with (DELETE /queries/{run_id})",
+    )
+
+
+class QueryStreamRequest(BaseModel):
+    """Request schema for streaming a SQL query result."""
+    sql_text: str = Field(..., min_length=1, description="SQL query to execute")
+    workspace_id: uuid.UUID = Field(..., description="Workspace containing the semantic layer")
+    limit: int = Field(default=10000, ge=1, le=1000000, description="Max rows to stream")
+    format: Literal["ndjson", "arrow"] = Field(default="ndjson", description="Stream encoding")
+    run_id: str | None = Field(
+        default=None,
+        min_length=1,
+        max_length=64,
+        pattern=r"^[A-Za-z0-9_.:-]+$",
+        description="Client-chosen id to cancel the query with (DELETE /queries/{run_id})",
+    )
 
 
 class ColumnInfo(BaseModel):
@@ -25,6 +51,43 @@ class QueryExecuteResponse(BaseModel):
     rows: list[dict[str, Any]]
     row_count: int
     execution_time_ms: float
+    cache_status: str = Field(default="miss", description="Result cache outcome: hit or miss")
+    run_id: str | None = Field(default=None, description="Id the query ran under")
+
+
+class QueryStatsResponse(BaseModel):
+    """Aggregated executions of one normalized query."""
+    query_hash: str
+    sql_text: str
+    executions: int
+    avg_ms: float
+    max_ms: float
+    total_ms: float
+    avg_rows: float | None
+    avg_bytes: int | None
+    cache_hits: int
+    last_executed_at: datetime
+
+
+class SlowQueryResponse(BaseModel):
+    """One execution from the slow-query log."""
+    id: uuid.UUID
+    workspace_id: uuid.UUID | None
+    source: str
+    query_hash: str
+    sql_text: str
+    status: str
+    row_count: int | None
+    result_bytes: int | None
+    setup_ms: float
+    queue_ms: float
+    execute_ms: float
+    serialize_ms: float
+    total_ms: float
+    profile_json: dict[str, Any] | None
+    executed_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
 
 
 class SavedQueryCreate(BaseModel):
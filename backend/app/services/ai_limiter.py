@@ -0,0 +1,144 @@
+"""AI concurrency limiter — bounds in-flight LLM calls globally and per tenant.
+
+Each LLM round-trip holds a slot for seconds. Without a bound, a burst from one
+tenant can exhaust the Anthropic rate limit for everyone. Callers wait in a FIFO
+queue for a slot; when the queue is full (or the wait times out) the call is
+rejected immediately so the API can shed load instead of piling up requests.
+"""
+
+import asyncio
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from app.config import settings
+
+
+class AIOverloadedError(Exception):
+    """Raised when no LLM slot can be obtained (queue full or wait timed out)."""
+
+
+class AIConcurrencyLimiter:
+    """Fair async limiter with a global cap, a per-tenant cap and a bounded wait queue.
+
+    Waiters are served in arrival order, skipping those whose tenant is already at
+    its cap, so one busy tenant never blocks the others.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_per_tenant: int,
+        max_queue: int,
+        queue_timeout_seconds: float,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_per_tenant = max_per_tenant
+        self.max_queue = max_queue
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self._in_flight = 0
+        self._per_tenant: dict[str, int] = {}
+        self._waiters: "deque[tuple[str, asyncio.Future]]" = deque()
+        self._acquired = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._peak_waiting = 0
+        self._total_wait_ms = 0.0
+
+    @asynccontextmanager
+    async def slot(self, tenant_id: str | uuid.UUID | None) -> AsyncIterator[None]:
+        """Hold one LLM slot for the duration of the block.
+
+        Raises:
+            AIOverloadedError: If the wait queue is full or the wait times out.
+        """
+        tenant = str(tenant_id) if tenant_id is not None else ""
+        await self._acquire(tenant)
+        try:
+            yield
+        finally:
+            self._release(tenant)
+
+    def stats(self) -> dict:
+        """Return limiter counters for monitoring."""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_per_tenant": self.max_per_tenant,
+            "in_flight": self._in_flight,
+            "waiting": len(self._waiters),
+            "peak_waiting": self._peak_waiting,
+            "acquired": self._acquired,
+            "rejected": self._rejected,
+            "timeouts": self._timeouts,
+            "avg_wait_ms": round(self._total_wait_ms / self._acquired, 2) if self._acquired else 0.0,
+        }
+
+    async def _acquire(self, tenant: str) -> None:
+        if self._can_run(tenant):
+            self._grant(tenant, waited_ms=0.0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._rejected += 1
+            raise AIOverloadedError("AI service is at capacity")
+
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        waiter = (tenant, future)
+        self._waiters.append(waiter)
+        self._peak_waiting = max(self._peak_waiting, len(self._waiters))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Granted just as we gave up: hand the slot back
+                self._release(tenant)
+            else:
+                future.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._timeouts += 1
+                raise AIOverloadedError("Timed out waiting for an AI slot") from e
+            raise
+        self._total_wait_ms += (time.monotonic() - start) * 1000
+
+    def _can_run(self, tenant: str) -> bool:
+        return (
+            self._in_flight < self.max_concurrency
+            and self._per_tenant.get(tenant, 0) < self.max_per_tenant
+        )
+
+    def _grant(self, tenant: str, waited_ms: float) -> None:
+        self._in_flight += 1
+        self._per_tenant[tenant] = self._per_tenant.get(tenant, 0) + 1
+        self._acquired += 1
+        self._total_wait_ms += waited_ms
+
+    def _release(self, tenant: str) -> None:
+        self._in_flight -= 1
+        remaining = self._per_tenant[tenant] - 1
+        if remaining:
+            self._per_tenant[tenant] = remaining
+        else:
+            del self._per_tenant[tenant]
+        self._wake()
+
+    def _wake(self) -> None:
+        """Grant freed slots to the oldest waiters that are allowed to run."""
+        for waiter in list(self._waiters):
+            if self._in_flight >= self.max_concurrency:
+                break
+            tenant, future = waiter
+            if self._can_run(tenant):
+                self._waiters.remove(waiter)
+                self._grant(tenant, waited_ms=0.0)
+                future.set_result(None)
+
+
+ai_limiter = AIConcurrencyLimiter(
+    max_concurrency=settings.ai_max_concurrency,
+    max_per_tenant=settings.ai_max_concurrency_per_tenant,
+    max_queue=settings.ai_max_queue,
+    queue_timeout_seconds=settings.ai_queue_timeout_seconds,
+)
@@ -3,10 +3,19 @@
 import json
 import logging
 import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator
 
 import anthropic
 
 from app.config import settings
+from app.services.ai_limiter import AIConcurrencyLimiter, ai_limiter
+from app.services.catalog_service import semantic_layer_version
+from app.services.metrics import ai_request_duration
+from app.services.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -35,17 +44,95 @@ Regles pour suggested_chart :
 - "table" : plusieurs colonnes sans pattern clair, ou listes detaillees
 """
 
+# Marks the end of a prompt prefix Anthropic may cache (system prompt, schema context)
+CACHE_CONTROL = {"type": "ephemeral"}
+
+SCHEMA_PROMPT_CACHE_SIZE = 256
+
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def _partial_json_string(text: str, start: int) -> str:
+    """Decode a JSON string value starting at `start`, stopping at its end or at the end of text.
+
+    An escape sequence cut off by the end of text is left out until more text arrives.
+    """
+    chars: list[str] = []
+    i = start
+    while i < len(text):
+        ch = text[i]
+        if ch == '"':
+            break
+        if ch != "\\":
+            chars.append(ch)
+            i += 1
+            continue
+        if i + 1 >= len(text):
+            break
+        escape = text[i + 1]
+        if escape == "u":
+            if i + 6 > len(text):
+                break
+            chars.append(chr(int(text[i + 2:i + 6], 16)))
+            i += 6
+        else:
+            chars.append(_JSON_ESCAPES.get(escape, escape))
+            i += 2
+    return "".join(chars)
 
-class AIService:
-    """Text-to-SQL service using Claude API."""
 
-    def __init__(self) -> None:
+class JsonStringFieldStream:
+    """Extracts one string field of a JSON object while the object is still being streamed.
+
+    feed() takes the next chunk of raw model output and returns the newly decoded
+    part of the field's value (empty until the field starts).
+    """
+
+    def __init__(self, field: str) -> None:
+        self._pattern = re.compile(rf'"{re.escape(field)}"\s*:\s*"')
+        self._buffer = ""
+        self._start: int | None = None
+        self._emitted = 0
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        if self._start is None:
+            match = self._pattern.search(self._buffer)
+            if match is None:
+                return ""
+            self._start = match.end()
+        value = _partial_json_string(self._buffer, self._start)
+        delta = value[self._emitted:]
+        self._emitted = len(value)
+        return delta
+
+
+class AIService:
+    """Text-to-SQL service using Claude API.
+
+    Holds one AsyncAnthropic client (and its HTTP connection pool); use the shared
+    instance from get_ai_service() rather than constructing one per request.
+    """
+
+    def __init__(self, limiter: AIConcurrencyLimiter = ai_limiter) -> None:
+        self.limiter = limiter
+        self._schema_prompts: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._usage = {
+            "calls": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_read_input_tokens": 0,
+            "cache_creation_input_tokens": 0,
+            "schema_prompt_hits": 0,
+            "schema_prompt_misses": 0,
+        }
         if not settings.anthropic_api_key:
-            self._client: anthropic.Anthropic | None = None
+            self._client: anthropic.AsyncAnthropic | None = None
         else:
-            self._client = anthropic.Anthropic(api_key=settings.anthropic_api_key)
+            self._client = anthropic.AsyncAnthropic(api_key=settings.anthropic_api_key)
 
-    def _ensure_client(self) -> anthropic.Anthropic:
+    def _ensure_client(self) -> anthropic.AsyncAnthropic:
         """Return the Anthropic client, raising if not configured."""
         if self._client is None:
             raise RuntimeError(
@@ -58,6 +145,7 @@ class AIService:
         question: str,
         semantic_context: dict,
         dialect: str = "duckdb",
+        tenant_id: str | uuid.UUID | None = None,
     ) -> dict:
         """Send the question + schema context to Claude and get SQL back.
 
@@ -65,6 +153,7 @@ class AIService:
             question: Natural language question from the user.
             semantic_context: The definitions_json from the semantic layer.
             dialect: SQL dialect (default: duckdb).
+            tenant_id: Tenant the call is counted against by the concurrency limiter.
 
         Returns:
             Dict with keys: sql, explanation, suggested_chart.
@@ -72,25 +161,13 @@ class AIService:
         Raises:
             RuntimeError: If API key is missing.
             ValueError: If Claude returns unparseable JSON.
+            AIOverloadedError: If no concurrency slot is available.
             anthropic.RateLimitError: If Anthropic rate-limits us.
         """
-        client = self._ensure_client()
-        schema_prompt = self.build_schema_prompt(semantic_context)
-
-        user_message = (
-            f"Schema de la base de donnees :\n{schema_prompt}\n\n"
-            f"Dialecte SQL : {dialect}\n\n"
-            f"Question de l'utilisateur : {question}"
+        question_text = f"Question de l'utilisateur : {question}"
+        raw_text = await self._complete(
+            self._schema_context(semantic_context, dialect), question_text, tenant_id
         )
-
-        response = client.messages.create(
-            model=settings.claude_model,
-            max_tokens=1024,
-            system=SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": user_message}],
-        )
-
-        raw_text = response.content[0].text.strip()
         return self._parse_response(raw_text)
 
     async def generate_sql_with_retry(
@@ -100,6 +177,7 @@ class AIService:
         error_message: str,
         previous_sql: str,
         dialect: str = "duckdb",
+        tenant_id: str | uuid.UUID | None = None,
     ) -> dict:
         """Retry SQL generation with the error context from the first attempt.
 
@@ -109,16 +187,54 @@ class AIService:
             error_message: Error from executing the first SQL attempt.
             previous_sql: The SQL that failed.
             dialect: SQL dialect (default: duckdb).
+            tenant_id: Tenant the call is counted against by the concurrency limiter.
 
         Returns:
             Dict with keys: sql, explanation, suggested_chart.
         """
-        client = self._ensure_client()
-        schema_prompt = self.build_schema_prompt(semantic_context)
+        question_text = self._question_text(question, error_message, previous_sql)
+        raw_text = await self._complete(
+            self._schema_context(semantic_context, dialect), question_text, tenant_id
+        )
+        return self._parse_response(raw_text)
 
-        user_message = (
-            f"Schema de la base de donnees :\n{schema_prompt}\n\n"
-            f"Dialecte SQL : {dialect}\n\n"
+    async def stream_sql(
+        self,
+        question: str,
+        semantic_context: dict,
+        dialect: str = "duckdb",
+        tenant_id: str | uuid.UUID | None = None,
+        error_message: str | None = None,
+        previous_sql: str | None = None,
+    ) -> AsyncIterator[dict]:
+        """Stream SQL generation: yields the SQL as it is written, then the parsed answer.
+
+        Yields {"type": "sql_delta", "text": ...} for each new piece of the "sql"
+        field, then one {"type": "result", "sql", "explanation", "suggested_chart"}.
+        Pass error_message and previous_sql to stream a retry instead.
+
+        Raises:
+            Same as generate_sql().
+        """
+        question_text = (
+            self._question_text(question, error_message, previous_sql)
+            if error_message is not None
+            else f"Question de l'utilisateur : {question}"
+        )
+        sql_field = JsonStringFieldStream("sql")
+        chunks: list[str] = []
+        async for text in self._complete_stream(
+            self._schema_context(semantic_context, dialect), question_text, tenant_id
+        ):
+            chunks.append(text)
+            delta = sql_field.feed(text)
+            if delta:
+                yield {"type": "sql_delta", "text": delta}
+        yield {"type": "result", **self._parse_response("".join(chunks).strip())}
+
+    @staticmethod
+    def _question_text(question: str, error_message: str, previous_sql: str | None) -> str:
+        return (
             f"Question de l'utilisateur : {question}\n\n"
             f"ATTENTION : Ma premiere tentative de SQL a echoue.\n"
             f"SQL precedent : {previous_sql}\n"
@@ -126,15 +242,130 @@ class AIService:
             f"Corrige le SQL en tenant compte de l'erreur."
         )
 
-        response = client.messages.create(
-            model=settings.claude_model,
-            max_tokens=1024,
-            system=SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": user_message}],
+    async def _complete(
+        self,
+        schema_context: str,
+        question_text: str,
+        tenant_id: str | uuid.UUID | None,
+    ) -> str:
+        """Run one Claude call inside a concurrency slot and return the response text.
+
+        The system prompt and the schema context are sent as cacheable blocks, so
+        repeated questions on the same workspace only pay full price for the question.
+        """
+        client = self._ensure_client()
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            with tracer.span("llm", model=settings.claude_model) as span:
+                async with self.limiter.slot(tenant_id):
+                    response = await client.beta.prompt_caching.messages.create(
+                        model=settings.claude_model,
+                        max_tokens=1024,
+                        system=[{"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}],
+                        messages=[{
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": schema_context, "cache_control": CACHE_CONTROL},
+                                {"type": "text", "text": question_text},
+                            ],
+                        }],
+                    )
+                if span is not None:
+                    span.set_attribute("llm.input_tokens", getattr(response.usage, "input_tokens", None) or 0)
+                    span.set_attribute("llm.output_tokens", getattr(response.usage, "output_tokens", None) or 0)
+            outcome = "ok"
+        finally:
+            ai_request_duration.observe(time.perf_counter() - start, mode="complete", outcome=outcome)
+        self._record_usage(response.usage)
+        return response.content[0].text.strip()
+
+    async def _complete_stream(
+        self,
+        schema_context: str,
+        question_text: str,
+        tenant_id: str | uuid.UUID | None,
+    ) -> AsyncIterator[str]:
+        """Like _complete(), but yields the response text as Claude produces it."""
+        client = self._ensure_client()
+        start = time.perf_counter()
+        traced_start = time.monotonic()
+        outcome = "error"
+        try:
+            async with self.limiter.slot(tenant_id):
+                async with client.beta.prompt_caching.messages.stream(
+                    model=settings.claude_model,
+                    max_tokens=1024,
+                    system=[{"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}],
+                    messages=[{
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": schema_context, "cache_control": CACHE_CONTROL},
+                            {"type": "text", "text": question_text},
+                        ],
+                    }],
+                ) as stream:
+                    async for text in stream.text_stream:
+                        yield text
+                    message = await stream.get_final_message()
+            outcome = "ok"
+        finally:
+            ai_request_duration.observe(time.perf_counter() - start, mode="stream", outcome=outcome)
+            # Recorded after the fact: a span entered in a generator would straddle its yields
+            tracer.record_span("llm.stream", traced_start, time.monotonic(), model=settings.claude_model)
+        self._record_usage(message.usage)
+
+    def _record_usage(self, usage: object) -> None:
+        counts = {
+            name: getattr(usage, name, None) or 0
+            for name in (
+                "input_tokens",
+                "output_tokens",
+                "cache_read_input_tokens",
+                "cache_creation_input_tokens",
+            )
+        }
+        logger.info(
+            "Claude usage: input=%d output=%d cache_read=%d cache_write=%d",
+            counts["input_tokens"],
+            counts["output_tokens"],
+            counts["cache_read_input_tokens"],
+            counts["cache_creation_input_tokens"],
+        )
+        with self._lock:
+            self._usage["calls"] += 1
+            for name, value in counts.items():
+                self._usage[name] += value
+
+    def stats(self) -> dict:
+        """Return token usage and schema prompt cache counters for monitoring."""
+        with self._lock:
+            return {**self._usage, "schema_prompts_cached": len(self._schema_prompts)}
+
+    def _schema_context(self, definitions_json: dict, dialect: str) -> str:
+        """The cacheable part of the user message: schema description and dialect."""
+        return (
+            f"Schema de la base de donnees :\n{self.schema_prompt_for(definitions_json)}\n\n"
+            f"Dialecte SQL : {dialect}"
         )
 
-        raw_text = response.content[0].text.strip()
-        return self._parse_response(raw_text)
+    def schema_prompt_for(self, definitions_json: dict) -> str:
+        """Return build_schema_prompt's output, memoized per semantic layer version."""
+        version = semantic_layer_version(definitions_json)
+        with self._lock:
+            prompt = self._schema_prompts.get(version)
+            if prompt is not None:
+                self._schema_prompts.move_to_end(version)
+                self._usage["schema_prompt_hits"] += 1
+                return prompt
+            self._usage["schema_prompt_misses"] += 1
+
+        prompt = self.build_schema_prompt(definitions_json)
+        with self._lock:
+            self._schema_prompts[version] = prompt
+            while len(self._schema_prompts) > SCHEMA_PROMPT_CACHE_SIZE:
+                self._schema_prompts.popitem(last=False)
+        return prompt
 
     def build_schema_prompt(self, definitions_json: dict) -> str:
         """Build a text description of the schema from the semantic layer definitions.
@@ -283,3 +514,14 @@ class AIService:
             "explanation": explanation,
             "suggested_chart": suggested_chart,
         }
+
+
+_shared_service: AIService | None = None
+
+
+def get_ai_service() -> AIService:
+    """FastAPI dependency returning the process-wide AIService (created on first use)."""
+    global _shared_service
+    if _shared_service is None:
+        _shared_service = AIService()
+    return _shared_service
@@ -0,0 +1,232 @@
+"""Answer cache — reuses validated SQL for questions already asked in a workspace.
+
+Entries map a normalized question to the SQL, explanation and chart that were
+generated for it and executed successfully. They are scoped by tenant, workspace
+and semantic layer version, so editing the layer makes every old answer
+unreachable (and invalidate() frees them).
+
+A second, local tier catches near-duplicate phrasings ("CA par mois" vs "le CA
+par mois ?") with TF-IDF weighted character n-gram vectors and cosine
+similarity, ignoring filler words. Questions that mention different numbers
+never match, so "top 10 clients" is not answered with the SQL of "top 5 clients".
+"""
+
+import math
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+
+from app.config import settings
+
+# (tenant_id, workspace_id, semantic layer version)
+ScopeKey = tuple[str, str, str]
+
+NGRAM_SIZE = 3
+
+# Filler words that change phrasing but not meaning, ignored by the similarity tier
+STOPWORDS = frozenset({
+    "le", "la", "les", "l", "un", "une", "des", "de", "du", "d", "au", "aux",
+    "quel", "quelle", "quels", "quelles", "est", "sont", "ce", "c", "qu", "que",
+    "moi", "donne", "montre", "affiche", "peux", "tu", "svp", "stp",
+    "the", "a", "an", "of", "what", "is", "are", "show", "me", "give", "please",
+})
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, strip accents and punctuation, and collapse whitespace."""
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^a-z0-9]+", " ", text)
+    return text.strip()
+
+
+def _char_ngrams(text: str) -> Counter:
+    padded = " " + " ".join(w for w in text.split() if w not in STOPWORDS) + " "
+    return Counter(padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1))
+
+
+def _numbers(text: str) -> frozenset[str]:
+    return frozenset(re.findall(r"\d+", text))
+
+
+@dataclass
+class CachedAnswer:
+    """A generated answer that executed successfully."""
+    question: str
+    sql: str
+    explanation: str
+    suggested_chart: str | None
+    ngrams: Counter
+    numbers: frozenset[str]
+    expires_at: float
+
+
+class _Scope:
+    """Answers of one (tenant, workspace, layer version), with n-gram document frequencies."""
+
+    def __init__(self) -> None:
+        self.answers: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self.doc_freq: Counter = Counter()
+
+    def add(self, question: str, answer: CachedAnswer) -> None:
+        self.remove(question)
+        self.answers[question] = answer
+        self.doc_freq.update(answer.ngrams.keys())
+
+    def remove(self, question: str) -> None:
+        answer = self.answers.pop(question, None)
+        if answer is not None:
+            self.doc_freq.subtract(answer.ngrams.keys())
+            self.doc_freq += Counter()  # drop zero counts
+
+    def _weights(self, ngrams: Counter) -> dict[str, float]:
+        total = len(self.answers)
+        return {
+            gram: count * (math.log((1 + total) / (1 + self.doc_freq[gram])) + 1)
+            for gram, count in ngrams.items()
+        }
+
+    def most_similar(self, ngrams: Counter, numbers: frozenset[str]) -> tuple[str, float] | None:
+        query = self._weights(ngrams)
+        query_norm = math.sqrt(sum(w * w for w in query.values()))
+        best: tuple[str, float] | None = None
+        for question, answer in self.answers.items():
+            if answer.numbers != numbers:
+                continue
+            candidate = self._weights(answer.ngrams)
+            norm = math.sqrt(sum(w * w for w in candidate.values()))
+            if not norm or not query_norm:
+                continue
+            dot = sum(w * candidate.get(gram, 0.0) for gram, w in query.items())
+            score = dot / (query_norm * norm)
+            if best is None or score > best[1]:
+                best = (question, score)
+        return best
+
+
+class AnswerCache:
+    """Scoped question -> SQL cache with an exact tier and a similarity tier."""
+
+    def __init__(
+        self,
+        max_entries_per_scope: int,
+        ttl_seconds: float,
+        similarity_threshold: float | None,
+    ) -> None:
+        self.max_entries_per_scope = max_entries_per_scope
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._scopes: dict[ScopeKey, _Scope] = {}
+        self._lock = threading.Lock()
+        self._exact_hits = 0
+        self._similar_hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def scope_key(
+        tenant_id: str | uuid.UUID,
+        workspace_id: str | uuid.UUID,
+        layer_version: str,
+    ) -> ScopeKey:
+        return (str(tenant_id), str(workspace_id), layer_version)
+
+    def lookup(self, scope: ScopeKey, question: str) -> tuple[CachedAnswer, str] | None:
+        """Return (answer, "hit" | "similar") for a question, or None on a miss."""
+        normalized = normalize_question(question)
+        now = time.monotonic()
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is not None:
+                answer = entries.answers.get(normalized)
+                if answer is not None and answer.expires_at > now:
+                    entries.answers.move_to_end(normalized)
+                    self._exact_hits += 1
+                    return answer, "hit"
+
+                if self.similarity_threshold is not None:
+                    match = entries.most_similar(_char_ngrams(normalized), _numbers(normalized))
+                    if match is not None and match[1] >= self.similarity_threshold:
+                        answer = entries.answers[match[0]]
+                        if answer.expires_at > now:
+                            self._similar_hits += 1
+                            return answer, "similar"
+            self._misses += 1
+            return None
+
+    def store(
+        self,
+        scope: ScopeKey,
+        question: str,
+        sql: str,
+        explanation: str,
+        suggested_chart: str | None,
+    ) -> None:
+        """Remember the answer to a question once its SQL has executed successfully."""
+        normalized = normalize_question(question)
+        answer = CachedAnswer(
+            question=normalized,
+            sql=sql,
+            explanation=explanation,
+            suggested_chart=suggested_chart,
+            ngrams=_char_ngrams(normalized),
+            numbers=_numbers(normalized),
+            expires_at=time.monotonic() + self.ttl_seconds,
+        )
+        with self._lock:
+            entries = self._scopes.setdefault(scope, _Scope())
+            entries.add(normalized, answer)
+            while len(entries.answers) > self.max_entries_per_scope:
+                entries.remove(next(iter(entries.answers)))
+
+    def discard(self, scope: ScopeKey, question: str) -> None:
+        """Forget one question's answer (e.g. its SQL stopped working)."""
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is not None:
+                entries.remove(normalize_question(question))
+
+    def invalidate(
+        self,
+        *,
+        tenant_id: object | None = None,
+        workspace_id: object | None = None,
+    ) -> int:
+        """Drop every scope matching all the given filters. Returns the number dropped."""
+        tenant = str(tenant_id) if tenant_id is not None else None
+        workspace = str(workspace_id) if workspace_id is not None else None
+        with self._lock:
+            doomed = [
+                key
+                for key in self._scopes
+                if (tenant is None or key[0] == tenant)
+                and (workspace is None or key[1] == workspace)
+            ]
+            for key in doomed:
+                del self._scopes[key]
+            return len(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scopes.clear()
+
+    def stats(self) -> dict:
+        """Return cache counters for monitoring."""
+        with self._lock:
+            return {
+                "scopes": len(self._scopes),
+                "entries": sum(len(s.answers) for s in self._scopes.values()),
+                "hits": self._exact_hits,
+                "similar_hits": self._similar_hits,
+                "misses": self._misses,
+            }
+
+
+answer_cache = AnswerCache(
+    max_entries_per_scope=settings.ai_answer_cache_max_entries,
+    ttl_seconds=settings.ai_answer_cache_ttl_seconds,
+    similarity_threshold=settings.ai_answer_cache_similarity_threshold,
+)
@@ -0,0 +1,37 @@
+"""Cache invalidation — single entry point for dropping derived query state.
+
+Routers call these hooks after mutating data sources or semantic layers so
+every process-wide cache built on top of them is dropped in one place.
+"""
+
+import uuid
+
+from sqlalchemy.orm import Session
+
+from app.services.answer_cache import answer_cache
+from app.services.catalog_service import view_catalog
+from app.services.connection_pool import connection_pool
+from app.services.result_cache import query_result_cache
+from app.services.widget_cache import widget_result_cache
+
+
+def invalidate_data_source(
+    tenant_id: uuid.UUID,
+    data_source_id: uuid.UUID,
+    db: Session | None = None,
+) -> None:
+    """Drop cached state that reads from a data source (deleted or re-uploaded).
+
+    Persisted widget results are only deleted when a db session is given.
+    """
+    view_catalog.invalidate(tenant_id=tenant_id, data_source_id=data_source_id)
+    connection_pool.invalidate(tenant_id=tenant_id, data_source_id=data_source_id)
+    query_result_cache.invalidate(tenant_id=tenant_id, data_source_id=data_source_id)
+    if db is not None:
+        widget_result_cache.invalidate_data_source(db, tenant_id, data_source_id)
+
+
+def invalidate_workspace(tenant_id: uuid.UUID, workspace_id: uuid.UUID) -> None:
+    """Drop cached state built from a workspace's semantic layer definitions."""
+    connection_pool.invalidate(tenant_id=tenant_id, workspace_id=workspace_id)
+    answer_cache.invalidate(tenant_id=tenant_id, workspace_id=workspace_id)
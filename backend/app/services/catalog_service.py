@@ -0,0 +1,225 @@
+"""View catalog service — resolves semantic layer nodes to parquet-backed views.
+
+Resolving a semantic layer means mapping every table node to its DataSource row
+and parquet file. The result only changes when the layer definitions or the
+referenced data sources change, so it is memoized per (tenant, layer version)
+and all nodes are resolved with a single batched DataSource lookup. A memoized
+catalog is re-checked against the parquet files on every use, so a source
+re-ingested or deleted by another API worker is noticed without invalidation.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+from app.models.data_source import DataSource
+from app.services.tracing import tracer
+
+
+def semantic_layer_version(definitions_json: dict) -> str:
+    """Return a stable fingerprint of a semantic layer's definitions.
+
+    Two layers with identical definitions share a version, so anything keyed on
+    it (pooled DuckDB contexts, caches) is invalidated whenever the model changes.
+    """
+    canonical = json.dumps(definitions_json, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+def view_name_for(source_name: str) -> str:
+    """Sanitize a data source name into a view name: alphanumeric and underscores, max 128 chars."""
+    return re.sub(r"[^a-zA-Z0-9_]", "_", source_name)[:128]
+
+
+@dataclass(frozen=True)
+class CatalogView:
+    """A table node resolved to the parquet file backing its view."""
+    name: str
+    data_source_id: str
+    parquet_path: str
+    fingerprint: str
+
+
+@dataclass(frozen=True)
+class ResolvedCatalog:
+    """All views of one semantic layer version, in node order."""
+    version: str
+    views: tuple[CatalogView, ...]
+
+    @property
+    def data_source_ids(self) -> set[str]:
+        return {view.data_source_id for view in self.views}
+
+    @property
+    def data_version(self) -> str:
+        """Fingerprint of the parquet files behind the views (changes on re-upload)."""
+        return data_version_of(self.views)
+
+
+def data_version_of(views: "tuple[CatalogView, ...] | list[CatalogView]") -> str:
+    """Fingerprint of the parquet files behind some views (changes on re-upload)."""
+    parts = sorted(f"{v.name}:{v.data_source_id}:{v.fingerprint}" for v in views)
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+
+class ViewCatalogCache:
+    """LRU cache of resolved catalogs keyed by (tenant_id, semantic layer version)."""
+
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple[str, str], ResolvedCatalog]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(
+        self,
+        definitions_json: dict,
+        tenant_id: str | uuid.UUID,
+        db: Session,
+    ) -> ResolvedCatalog:
+        """Return the resolved catalog for a semantic layer, resolving it on a miss.
+
+        Raises:
+            ValueError: If a node references a missing data source or parquet file,
+                or if no node could be resolved.
+        """
+        key = (str(tenant_id), semantic_layer_version(definitions_json))
+        with self._lock:
+            catalog = self._entries.get(key)
+            if catalog is not None:
+                self._entries.move_to_end(key)
+        if catalog is not None and _files_unchanged(catalog):
+            return catalog
+
+        with tracer.span("data_sources", nodes=len(definitions_json.get("nodes", []))):
+            catalog = self._resolve_uncached(definitions_json, tenant_id, db, version=key[1])
+
+        with self._lock:
+            self._entries[key] = catalog
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return catalog
+
+    def invalidate(
+        self,
+        *,
+        tenant_id: object | None = None,
+        data_source_id: object | None = None,
+    ) -> int:
+        """Drop every catalog matching all the given filters. Returns the number dropped."""
+        tenant = str(tenant_id) if tenant_id is not None else None
+        source = str(data_source_id) if data_source_id is not None else None
+        with self._lock:
+            doomed = [
+                key
+                for key, catalog in self._entries.items()
+                if (tenant is None or key[0] == tenant)
+                and (source is None or source in catalog.data_source_ids)
+            ]
+            for key in doomed:
+                del self._entries[key]
+            return len(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _resolve_uncached(
+        self,
+        definitions_json: dict,
+        tenant_id: str | uuid.UUID,
+        db: Session,
+        version: str,
+    ) -> ResolvedCatalog:
+        nodes: list[tuple[str, str]] = []
+        for node in definitions_json.get("nodes", []):
+            # Support both flat format (data_source_id) and nested (data.source_id)
+            source_id = node.get("data_source_id") or node.get("data", {}).get("source_id")
+            source_name = node.get("data_source_name") or node.get("data", {}).get("source_name")
+            if source_id and source_name:
+                nodes.append((str(source_id), source_name))
+
+        # One round-trip for every node, with tenant isolation
+        requested_ids = {uuid.UUID(source_id) for source_id, _ in nodes}
+        sources: dict[str, DataSource] = {}
+        if requested_ids:
+            rows = (
+                db.query(DataSource)
+                .filter(
+                    DataSource.id.in_(requested_ids),
+                    DataSource.tenant_id == uuid.UUID(str(tenant_id)),
+                )
+                .all()
+            )
+            sources = {str(ds.id): ds for ds in rows}
+
+        views: list[CatalogView] = []
+        for source_id, source_name in nodes:
+            ds = sources.get(str(uuid.UUID(source_id)))
+            if not ds:
+                raise ValueError(
+                    f"Data source '{source_name}' (id={source_id}) not found for this tenant"
+                )
+
+            if ds.status != "ready":
+                raise ValueError(
+                    f"Data source '{source_name}' is not ready (status: {ds.status})"
+                )
+
+            # Get parquet path from connection config
+            if not ds.connection_config_encrypted:
+                raise ValueError(
+                    f"Data source '{source_name}' has no storage configuration"
+                )
+
+            config = json.loads(ds.connection_config_encrypted)
+            storage_path = config.get("storage_path")
+            if not storage_path:
+                raise ValueError(
+                    f"Data source '{source_name}' has no storage path"
+                )
+
+            parquet_path = Path(storage_path) / "processed.parquet"
+            try:
+                fingerprint = _file_fingerprint(parquet_path)
+            except FileNotFoundError:
+                raise ValueError(
+                    f"Parquet file not found for data source '{source_name}'"
+                )
+
+            views.append(CatalogView(
+                name=view_name_for(source_name),
+                data_source_id=str(ds.id),
+                parquet_path=str(parquet_path),
+                fingerprint=fingerprint,
+            ))
+
+        if not views:
+            raise ValueError("No views could be created from the semantic layer")
+
+        return ResolvedCatalog(version=version, views=tuple(views))
+
+
+def _file_fingerprint(path: Path) -> str:
+    stat = path.stat()
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def _files_unchanged(catalog: ResolvedCatalog) -> bool:
+    """Whether every parquet file behind the catalog is still the one it was resolved with."""
+    try:
+        return all(
+            _file_fingerprint(Path(view.parquet_path)) == view.fingerprint for view in catalog.views
+        )
+    except OSError:
+        return False
+
+
+view_catalog = ViewCatalogCache()
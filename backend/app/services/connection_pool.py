@@ -0,0 +1,247 @@
+"""DuckDB connection pool — warm in-memory databases with semantic layer views registered.
+
+Each pool entry is an in-memory DuckDB database holding the views of one semantic
+layer version for one (tenant, workspace). Requests check out a cursor on the
+database instead of rebuilding every view, and entries are evicted when idle or
+when the pool grows past its size limit (least recently used first).
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable
+
+import duckdb
+
+from app.config import settings
+from app.services.duckdb_resources import duckdb_resources
+
+logger = logging.getLogger(__name__)
+
+# (tenant_id, workspace_id, semantic layer version)
+PoolKey = tuple[str, str, str]
+
+# Factory building a fresh database: returns (connection, view names, data source ids)
+ConnectionFactory = Callable[[], tuple[duckdb.DuckDBPyConnection, list[str], set[str]]]
+
+
+@dataclass
+class _PoolEntry:
+    conn: duckdb.DuckDBPyConnection
+    views: list[str]
+    data_source_ids: set[str]
+    last_used: float = field(default_factory=time.monotonic)
+    leases: int = 0
+    retired: bool = False
+    closed: bool = False
+    # Serializes marking the database in use or idle, and closing it, outside the pool lock
+    state_lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class PooledConnection:
+    """A cursor checked out from a pooled DuckDB database.
+
+    The cursor shares the catalog (and therefore the views) of the pooled
+    database but has its own client context, so concurrent requests on the same
+    workspace do not interfere. Call release() when done.
+    """
+
+    def __init__(self, pool: "DuckDBConnectionPool", key: PoolKey, entry: _PoolEntry) -> None:
+        self._pool = pool
+        self._entry = entry
+        self.key = key
+        self.cursor: duckdb.DuckDBPyConnection = entry.conn.cursor()
+        self.views: list[str] = list(entry.views)
+        self._released = False
+
+    def release(self) -> None:
+        """Close the cursor and hand the database back to the pool."""
+        if self._released:
+            return
+        self._released = True
+        try:
+            self.cursor.close()
+        finally:
+            self._pool._release(self._entry)
+
+
+class DuckDBConnectionPool:
+    """Process-wide LRU pool of warm DuckDB databases keyed by PoolKey."""
+
+    def __init__(self, max_connections: int, idle_timeout_seconds: float) -> None:
+        self.max_connections = max_connections
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self._entries: "OrderedDict[PoolKey, _PoolEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def checkout(self, key: PoolKey, factory: ConnectionFactory) -> PooledConnection:
+        """Return a cursor on the database for `key`, building it with `factory` on a miss.
+
+        The factory runs outside the pool lock; if two requests race to build the
+        same key, the second database is discarded and the first one is shared.
+        """
+        with self._lock:
+            doomed = self._evict_idle_locked()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._hits += 1
+                activated = self._lease_locked(key, entry)
+            else:
+                self._misses += 1
+        self._close(doomed)
+        if entry is not None:
+            return self._checked_out(key, entry, activated)
+
+        conn, views, data_source_ids = factory()
+        new_entry = _PoolEntry(conn=conn, views=views, data_source_ids=set(data_source_ids))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            doomed = []
+            if entry is None:
+                entry = new_entry
+                self._entries[key] = entry
+                doomed = self._evict_lru_locked(keep=key)
+            activated = self._lease_locked(key, entry)
+        if entry is not new_entry:
+            duckdb_resources.close(conn)
+        self._close(doomed)
+        return self._checked_out(key, entry, activated)
+
+    def invalidate(
+        self,
+        *,
+        tenant_id: object | None = None,
+        workspace_id: object | None = None,
+        data_source_id: object | None = None,
+    ) -> int:
+        """Drop every entry matching all the given filters. Returns the number dropped."""
+        tenant = str(tenant_id) if tenant_id is not None else None
+        workspace = str(workspace_id) if workspace_id is not None else None
+        source = str(data_source_id) if data_source_id is not None else None
+
+        with self._lock:
+            keys = [
+                key
+                for key, entry in self._entries.items()
+                if (tenant is None or key[0] == tenant)
+                and (workspace is None or key[1] == workspace)
+                and (source is None or source in entry.data_source_ids)
+            ]
+            doomed = [entry for key in keys if (entry := self._retire_locked(key)) is not None]
+        self._close(doomed)
+        return len(keys)
+
+    def clear(self) -> None:
+        """Drop every pooled database (in-use ones close on release)."""
+        with self._lock:
+            doomed = [entry for key in list(self._entries) if (entry := self._retire_locked(key)) is not None]
+        self._close(doomed)
+
+    def stats(self) -> dict:
+        """Return pool counters for monitoring."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "in_use": sum(1 for e in self._entries.values() if e.leases),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+    def _release(self, entry: _PoolEntry) -> None:
+        with self._lock:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            idle = entry.leases == 0 and not entry.retired
+            doomed = [entry] if entry.leases == 0 and entry.retired else []
+            # With a zero idle timeout this retires the entry itself
+            doomed += self._evict_idle_locked()
+        self._close(doomed)
+        if idle:
+            # Idle databases give their share of the memory budget back
+            self._sync_active(entry)
+
+    # --- internals (call with self._lock held) ---
+    # They only record state: DuckDB calls, which may have to wait for a memory
+    # resize, are made by the callers after releasing the lock.
+
+    def _lease_locked(self, key: PoolKey, entry: _PoolEntry) -> bool:
+        """Take a lease on `entry`. Returns whether it went from idle to in use."""
+        entry.leases += 1
+        entry.last_used = time.monotonic()
+        self._entries.move_to_end(key)
+        return entry.leases == 1
+
+    def _retire_locked(self, key: PoolKey) -> _PoolEntry | None:
+        """Remove `key` from the pool. Returns its entry if it must be closed now."""
+        entry = self._entries.pop(key)
+        entry.retired = True
+        self._evictions += 1
+        return entry if entry.leases == 0 else None
+
+    def _evict_idle_locked(self) -> list[_PoolEntry]:
+        cutoff = time.monotonic() - self.idle_timeout_seconds
+        idle = [
+            key
+            for key, entry in self._entries.items()
+            if entry.leases == 0 and entry.last_used < cutoff
+        ]
+        doomed = []
+        for key in idle:
+            logger.debug("Evicting idle DuckDB context %s", key)
+            entry = self._retire_locked(key)
+            if entry is not None:
+                doomed.append(entry)
+        return doomed
+
+    def _evict_lru_locked(self, keep: PoolKey) -> list[_PoolEntry]:
+        doomed = []
+        # OrderedDict iterates least recently used first
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_connections:
+                break
+            if key == keep:
+                continue
+            logger.debug("Evicting LRU DuckDB context %s", key)
+            entry = self._retire_locked(key)
+            if entry is not None:
+                doomed.append(entry)
+        return doomed
+
+    # --- called without self._lock ---
+
+    def _checked_out(self, key: PoolKey, entry: _PoolEntry, activated: bool) -> PooledConnection:
+        if activated:
+            self._sync_active(entry)
+        return PooledConnection(self, key, entry)
+
+    def _sync_active(self, entry: _PoolEntry) -> None:
+        """Mark the database in use or idle according to its current lease count.
+
+        A checkout and a release racing on the same entry may get here in either
+        order, so the lease count is read again rather than passed in.
+        """
+        with entry.state_lock:
+            if entry.closed:
+                return
+            with self._lock:
+                active = entry.leases > 0
+            duckdb_resources.set_active(entry.conn, active)
+
+    def _close(self, entries: list[_PoolEntry]) -> None:
+        for entry in entries:
+            with entry.state_lock:
+                entry.closed = True
+                duckdb_resources.close(entry.conn)
+
+
+connection_pool = DuckDBConnectionPool(
+    max_connections=settings.duckdb_pool_max_connections,
+    idle_timeout_seconds=settings.duckdb_pool_idle_timeout_seconds,
+)
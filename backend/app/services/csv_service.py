@@ -1,28 +1,27 @@
 """CSV upload service — handles file storage and parquet conversion via DuckDB."""
 
-import datetime
-import decimal
+import base64
+import bisect
+import binascii
 import json
 import os
 import shutil
+import time
 import uuid
 from pathlib import Path
+from typing import Callable
 
 import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
 from fastapi import HTTPException, UploadFile, status
 from sqlalchemy.orm import Session
 
 from app.config import settings
 from app.models.data_source import DataSource
-
-
-def _json_safe(val: object) -> object:
-    """Convert non-JSON-serializable values (date, datetime, Decimal) to strings."""
-    if isinstance(val, (datetime.date, datetime.datetime)):
-        return val.isoformat()
-    if isinstance(val, decimal.Decimal):
-        return float(val)
-    return val
+from app.services.duckdb_resources import duckdb_resources
+from app.services.metrics import ingestion_bytes, ingestion_duration, ingestion_rows
+from app.services.result_formats import encode_table, json_safe
 
 
 def _get_upload_path(tenant_id: uuid.UUID, ds_id: uuid.UUID) -> Path:
@@ -76,93 +75,107 @@ def _save_uploaded_file(file: UploadFile, dest: Path) -> int:
     return size
 
 
-def _convert_to_parquet(csv_path: Path, parquet_path: Path) -> None:
-    """Convert CSV to Parquet using DuckDB."""
-    conn = duckdb.connect()
+def _read_parquet_footer(conn: duckdb.DuckDBPyConnection, parquet_str: str) -> tuple[list[dict], int]:
+    """Return (columns, row_count) of a parquet file from its footer, without scanning data."""
+    columns = [
+        {"name": r[0], "type": r[1]}
+        for r in conn.execute(
+            f"DESCRIBE SELECT * FROM read_parquet('{parquet_str}')"
+        ).fetchall()
+    ]
+    row_count = conn.execute(
+        f"SELECT COALESCE(SUM(num_rows), 0) FROM parquet_file_metadata('{parquet_str}')"
+    ).fetchone()[0]
+    return columns, int(row_count)
+
+
+def _ingest_csv(
+    csv_path: Path,
+    parquet_path: Path,
+    on_progress: Callable[[int], None] | None = None,
+) -> dict:
+    """Convert CSV to Parquet and describe the result, parsing the CSV only once.
+
+    The CSV is scanned a single time by the COPY. Column names and types come from
+    the parquet schema, the row count from the parquet footer, and the sample rows
+    from the first row group, all on the same connection. `on_progress` is called
+    with a percentage once the parquet file has been written.
+    """
+    start = time.perf_counter()
+    conn = duckdb_resources.connect("ingestion")
     try:
         csv_str = str(csv_path).replace("'", "''")
         parquet_str = str(parquet_path).replace("'", "''")
-        conn.execute(
-            f"COPY (SELECT * FROM read_csv_auto('{csv_str}')) TO '{parquet_str}' (FORMAT PARQUET)"
-        )
-    except duckdb.Error as e:
-        raise HTTPException(
-            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            detail=f"Failed to parse CSV: {str(e)}",
-        )
-    finally:
-        conn.close()
-
-
-def _infer_schema(csv_path: Path) -> dict:
-    """Infer column names, types, row count, and sample rows from CSV via DuckDB."""
-    conn = duckdb.connect()
-    try:
-        rel = conn.read_csv(str(csv_path))
-        columns = []
-        for name, dtype in zip(rel.columns, rel.dtypes):
-            columns.append({"name": name, "type": str(dtype)})
-        row_count = rel.count("*").fetchone()[0]
-        sample_rows = rel.limit(100).fetchall()
-        sample = [
-            {col: _json_safe(val) for col, val in zip(rel.columns, row)}
-            for row in sample_rows
-        ]
+        try:
+            conn.execute(
+                f"COPY (SELECT * FROM read_csv_auto('{csv_str}')) TO '{parquet_str}' (FORMAT PARQUET)"
+            )
+        except duckdb.Error as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Failed to parse CSV: {str(e)}",
+            )
+        if on_progress:
+            on_progress(80)
+
+        try:
+            columns, row_count = _read_parquet_footer(conn, parquet_str)
+            sample_rows = conn.execute(
+                f"SELECT * FROM read_parquet('{parquet_str}') LIMIT 100"
+            ).fetchall()
+        except duckdb.Error as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Failed to infer schema: {str(e)}",
+            )
+
+        ingestion_duration.observe(time.perf_counter() - start)
+        ingestion_bytes.inc(csv_path.stat().st_size)
+        ingestion_rows.inc(row_count)
+
+        names = [col["name"] for col in columns]
         return {
             "columns": columns,
             "row_count": row_count,
-            "sample_rows": sample,
+            "sample_rows": [
+                {col: json_safe(val) for col, val in zip(names, row)}
+                for row in sample_rows
+            ],
         }
-    except duckdb.Error as e:
-        raise HTTPException(
-            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            detail=f"Failed to infer schema: {str(e)}",
-        )
     finally:
-        conn.close()
+        duckdb_resources.close(conn)
 
 
-def upload_csv(
+def create_pending_csv_source(
     file: UploadFile,
     name: str,
     tenant_id: uuid.UUID,
     db: Session,
 ) -> DataSource:
-    """Upload a CSV file, convert to parquet, infer schema, and create a DataSource record."""
+    """Save an uploaded CSV and create a 'pending' DataSource for background ingestion.
+
+    Only the disk write happens here; parquet conversion and schema inference are
+    left to ingest_csv_source, run by the ingestion queue.
+    """
     _validate_csv_file(file)
 
     ds_id = uuid.uuid4()
     upload_path = _get_upload_path(tenant_id, ds_id)
-    csv_path = upload_path / "original.csv"
-    parquet_path = upload_path / "processed.parquet"
 
     try:
-        file_size = _save_uploaded_file(file, csv_path)
-        _convert_to_parquet(csv_path, parquet_path)
-        schema_info = _infer_schema(csv_path)
+        file_size = _save_uploaded_file(file, upload_path / "original.csv")
     except HTTPException:
         shutil.rmtree(upload_path, ignore_errors=True)
         raise
-    except Exception:
-        shutil.rmtree(upload_path, ignore_errors=True)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Unexpected error during CSV processing",
-        )
-
-    connection_config = json.dumps({
-        "storage_path": str(upload_path),
-        "original_filename": file.filename,
-        "file_size_bytes": file_size,
-    })
 
     data_source = DataSource(
         id=ds_id,
         tenant_id=tenant_id,
         type="csv",
         name=name,
-        connection_config_encrypted=connection_config,
-        schema_cache=schema_info,
+        connection_config_encrypted=_connection_config(upload_path, file.filename, file_size),
+        status="pending",
+        progress=0,
     )
     db.add(data_source)
     db.commit()
@@ -170,25 +183,113 @@ def upload_csv(
     return data_source
 
 
+def ingest_csv_source(
+    data_source: DataSource,
+    on_progress: Callable[[int], None] | None = None,
+) -> dict:
+    """Convert a pending CSV data source to parquet and return its schema info.
+
+    Raises:
+        HTTPException 422: CSV cannot be parsed or described.
+    """
+    upload_path = Path(json.loads(data_source.connection_config_encrypted)["storage_path"])
+    return _ingest_csv(
+        upload_path / "original.csv",
+        upload_path / "processed.parquet",
+        on_progress=on_progress,
+    )
+
+
+def _connection_config(upload_path: Path, filename: str | None, file_size: int) -> str:
+    return json.dumps({
+        "storage_path": str(upload_path),
+        "original_filename": filename,
+        "file_size_bytes": file_size,
+    })
+
+
+def encode_preview_cursor(data_source_id: uuid.UUID, offset: int) -> str:
+    """Build the opaque token pointing at a row offset of one data source's preview."""
+    payload = json.dumps({"d": str(data_source_id), "o": offset}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_preview_cursor(data_source_id: uuid.UUID, cursor: str) -> int:
+    """Return the row offset encoded in a preview cursor.
+
+    Raises:
+        HTTPException 400: Token is malformed or belongs to another data source.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        offset = int(payload["o"])
+        valid = payload["d"] == str(data_source_id) and offset >= 0
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        valid = False
+    if not valid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid preview cursor",
+        )
+    return offset
+
+
+def _read_parquet_rows(parquet_path: Path, offset: int, limit: int) -> pa.Table:
+    """Read rows [offset, offset + limit) by seeking to the row groups that hold them.
+
+    Per-row-group counts come from the footer, so only the groups overlapping the
+    requested range are decoded and deep pages cost the same as the first one.
+    """
+    with pq.ParquetFile(parquet_path) as parquet_file:
+        metadata = parquet_file.metadata
+        starts = [0]
+        for i in range(metadata.num_row_groups):
+            starts.append(starts[-1] + metadata.row_group(i).num_rows)
+        if offset >= starts[-1]:
+            return parquet_file.schema_arrow.empty_table()
+
+        first = bisect.bisect_right(starts, offset) - 1
+        last = bisect.bisect_left(starts, min(offset + limit, starts[-1])) - 1
+        groups = list(range(first, last + 1))
+        return parquet_file.read_row_groups(groups).slice(offset - starts[first], limit)
+
+
 def get_csv_preview(
     data_source: DataSource,
     page: int,
     page_size: int,
+    result_format: str = "json",
+    cursor: str | None = None,
 ) -> dict:
-    """Return a paginated preview of a CSV data source via DuckDB reading the parquet file.
+    """Return a paginated preview of a CSV data source, read from its parquet file.
+
+    Pages are read by seeking straight to the parquet row groups that contain
+    them rather than with LIMIT/OFFSET, so latency does not grow with depth.
 
     Args:
         data_source: The DataSource ORM instance (must be of type 'csv').
         page: 1-based page number.
         page_size: Number of rows per page (1–1000).
+        result_format: "json" for row dicts, or "columnar"/"arrow" to encode the
+            page's Arrow table (see result_formats).
+        cursor: Opaque token from a previous response's next_cursor/prev_cursor;
+            takes precedence over `page`.
 
     Returns:
-        A dict with keys: columns, rows, total_rows, page, page_size, total_pages.
+        A dict with keys: columns, rows (or data/body), total_rows, page,
+        page_size, total_pages, next_cursor, prev_cursor.
 
     Raises:
+        HTTPException 400: Cursor is invalid.
+        HTTPException 409: Data source is still being ingested (or failed).
         HTTPException 422: Parquet file is missing.
         HTTPException 500: Unexpected DuckDB error.
     """
+    if data_source.status != "ready":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Data source is not ready (status: {data_source.status})",
+        )
     if not data_source.connection_config_encrypted:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -208,54 +309,55 @@ def get_csv_preview(
             detail="Parquet file not found — data source may be corrupted",
         )
 
-    conn = duckdb.connect()
-    try:
-        parquet_str = str(parquet_path).replace("'", "''")
-
-        # Total row count
-        total_rows: int = conn.execute(
-            f"SELECT COUNT(*) FROM read_parquet('{parquet_str}')"
-        ).fetchone()[0]
-
-        total_pages = max(1, -(-total_rows // page_size))  # ceiling division
+    offset = (
+        decode_preview_cursor(data_source.id, cursor)
+        if cursor is not None
+        else (page - 1) * page_size
+    )
 
-        offset = (page - 1) * page_size
-        rel = conn.execute(
-            f"SELECT * FROM read_parquet('{parquet_str}') LIMIT {page_size} OFFSET {offset}"
-        )
-        col_names = [desc[0] for desc in rel.description]
-        raw_rows = rel.fetchall()
-        rows = [
-            {col: _json_safe(val) for col, val in zip(col_names, row)}
-            for row in raw_rows
-        ]
-
-        # Build column schema list from parquet metadata
-        describe_rel = conn.execute(
-            f"DESCRIBE SELECT * FROM read_parquet('{parquet_str}')"
-        )
-        columns = [
-            {"name": r[0], "type": r[1]}
-            for r in describe_rel.fetchall()
-        ]
+    try:
+        # Columns and row count never change after upload: use the copy stored in
+        # schema_cache, falling back to the parquet footer for older records
+        cached = data_source.schema_cache or {}
+        if cached.get("columns") and cached.get("row_count") is not None:
+            columns = [{"name": c["name"], "type": c["type"]} for c in cached["columns"]]
+            total_rows = cached["row_count"]
+        else:
+            with duckdb_resources.connection("preview") as conn:
+                columns, total_rows = _read_parquet_footer(
+                    conn, str(parquet_path).replace("'", "''")
+                )
 
-        return {
-            "columns": columns,
-            "rows": rows,
-            "total_rows": total_rows,
-            "page": page,
-            "page_size": page_size,
-            "total_pages": total_pages,
-        }
-    except HTTPException:
-        raise
-    except duckdb.Error as e:
+        table = _read_parquet_rows(parquet_path, offset, page_size)
+    except (duckdb.Error, pa.ArrowException, OSError) as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to read parquet file: {str(e)}",
         )
-    finally:
-        conn.close()
+
+    if result_format == "json":
+        page_payload: dict = {"rows": [
+            {col: json_safe(val) for col, val in row.items()}
+            for row in table.to_pylist()
+        ]}
+    else:
+        page_payload = encode_table(result_format, table)
+
+    next_offset = offset + page_size
+    return {
+        "columns": columns,
+        **page_payload,
+        "total_rows": total_rows,
+        "page": offset // page_size + 1,
+        "page_size": page_size,
+        "total_pages": max(1, -(-total_rows // page_size)),  # ceiling division
+        "next_cursor": (
+            encode_preview_cursor(data_source.id, next_offset) if next_offset < total_rows else None
+        ),
+        "prev_cursor": (
+            encode_preview_cursor(data_source.id, max(0, offset - page_size)) if offset > 0 else None
+        ),
+    }
 
 
 def delete_csv_files(data_source: DataSource) -> None:
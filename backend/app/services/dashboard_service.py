@@ -1,12 +1,21 @@
-"""Dashboard and Widget service — tenant-scoped CRUD."""
+"""Dashboard and Widget service — tenant-scoped CRUD and batch rendering."""
 
+import time
 import uuid
+from typing import Callable
 
 from fastapi import HTTPException, status
 from sqlalchemy.orm import Session
 
-from app.models.dashboard import Dashboard, Widget
+from app.models.dashboard import Dashboard, SemanticLayer, Widget
+from app.models.saved_query import SavedQuery
 from app.services.base_service import BaseTenantService
+from app.services.catalog_service import view_catalog
+from app.services.connection_pool import connection_pool
+from app.services.query_registry import QueryCancelledError
+from app.services.query_scheduler import QueryOverloadedError
+from app.services.query_service import DEFAULT_LIMIT, MAX_LIMIT, SemanticQueryBuilder
+from app.services.widget_cache import widget_result_cache
 
 
 class DashboardService(BaseTenantService[Dashboard]):
@@ -72,6 +81,8 @@ class DashboardService(BaseTenantService[Dashboard]):
         for key, value in kwargs.items():
             setattr(widget, key, value)
         self.db.commit()
+        if "query_json" in kwargs or "saved_query_id" in kwargs:
+            widget_result_cache.invalidate_widget(self.db, self.tenant_id, widget_id)
         self.db.refresh(widget)
         return widget
 
@@ -98,3 +109,215 @@ class DashboardService(BaseTenantService[Dashboard]):
         self.db.delete(widget)
         self.db.commit()
         return widget
+
+    # --- Rendering ---
+
+    def render(self, dashboard_id: uuid.UUID, refresh: bool = False) -> dict:
+        """Return the results of every widget of a dashboard.
+
+        Fresh results come from the widget result cache. The other widgets share
+        one DuckDB context, set up once from the semantic layer, and run
+        concurrently, each on its own cursor of that database; their results are
+        then cached. A failing widget reports its error without failing the
+        others. `refresh` recomputes every widget.
+
+        Raises:
+            HTTPException: 404 if the dashboard or semantic layer is missing, 422 if
+                the layer has no definitions, 400 if its context cannot be set up.
+        """
+        start = time.monotonic()
+        dashboard = self.get_with_widgets(dashboard_id)
+        widgets = sorted(dashboard.widgets, key=lambda w: (w.created_at is None, w.created_at))
+        queries = self._widget_queries(widgets)
+
+        results: dict[uuid.UUID, dict] = {
+            widget_id: {"widget_id": widget_id, "status": "error" if error else "skipped", "error": error}
+            for widget_id, (sql, _, error) in queries.items()
+            if sql is None
+        }
+        runnable = [(widget_id, sql, limit) for widget_id, (sql, limit, _) in queries.items() if sql]
+        setup_time_ms = 0.0
+
+        if runnable:
+            semantic_layer = self._semantic_layer(dashboard.workspace_id)
+            definitions = semantic_layer.definitions_json
+            try:
+                catalog = view_catalog.resolve(definitions, self.tenant_id, self.db)
+            except ValueError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+            keys = {
+                widget_id: widget_result_cache.key_for(catalog, sql, limit)
+                for widget_id, sql, limit in runnable
+            }
+            cached = {} if refresh else widget_result_cache.get_many(self.db, self.tenant_id, keys)
+            for widget_id, row in cached.items():
+                results[widget_id] = _cached_result(widget_id, row.result_json, row.computed_at)
+            stale = [query for query in runnable if query[0] not in cached]
+
+            if stale:
+                computed, setup_time_ms = self._run_widget_queries(
+                    dashboard.workspace_id, definitions, stale, start
+                )
+                stored = widget_result_cache.put_many(
+                    self.db,
+                    self.tenant_id,
+                    [
+                        (widget_id, keys[widget_id], _result_payload(result))
+                        for widget_id, result in computed.items()
+                        if result["status"] == "ok"
+                    ],
+                )
+                for widget_id, result in computed.items():
+                    row = stored.get(widget_id)
+                    results[widget_id] = {
+                        **result,
+                        "cache_status": "miss",
+                        "computed_at": row.computed_at if row else None,
+                    }
+            else:
+                setup_time_ms = round((time.monotonic() - start) * 1000, 2)
+
+        return {
+            "dashboard_id": dashboard.id,
+            "widgets": [results[widget.id] for widget in widgets],
+            "setup_time_ms": setup_time_ms,
+            "total_time_ms": round((time.monotonic() - start) * 1000, 2),
+        }
+
+    def _run_widget_queries(
+        self,
+        workspace_id: uuid.UUID,
+        definitions: dict,
+        queries: list[tuple[uuid.UUID, str, int]],
+        start: float,
+    ) -> tuple[dict[uuid.UUID, dict], float]:
+        """Run widget queries concurrently on cursors of one context. Returns (results, setup ms).
+
+        Every query is queued on the query scheduler up front, whose per-tenant
+        quota bounds how many run at once; this thread then waits on each.
+        """
+        builder = SemanticQueryBuilder(pool=connection_pool, source="dashboard")
+        try:
+            try:
+                builder.setup_context(
+                    definitions_json=definitions,
+                    tenant_id=self.tenant_id,
+                    db=self.db,
+                    workspace_id=workspace_id,
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            setup_time_ms = round((time.monotonic() - start) * 1000, 2)
+
+            # One cursor per query, so the queries can run concurrently
+            cursors = [builder.cursor() for _ in queries]
+            try:
+                waits = [_submit_widget_query(cursor, query) for cursor, query in zip(cursors, queries)]
+                results = {result["widget_id"]: result for result in (wait() for wait in waits)}
+            finally:
+                for cursor in cursors:
+                    cursor.close()
+        finally:
+            builder.close()
+        return results, setup_time_ms
+
+    def _widget_queries(
+        self, widgets: list[Widget]
+    ) -> dict[uuid.UUID, tuple[str | None, int, str | None]]:
+        """Map each widget to (sql, limit, reason it has no sql)."""
+        saved_ids = {w.saved_query_id for w in widgets if w.saved_query_id}
+        saved_sql: dict[uuid.UUID, str] = {}
+        if saved_ids:
+            saved_sql = {
+                saved.id: saved.sql_text
+                for saved in self.db.query(SavedQuery).filter(
+                    SavedQuery.id.in_(saved_ids),
+                    SavedQuery.tenant_id == self.tenant_id,
+                )
+            }
+
+        queries: dict[uuid.UUID, tuple[str | None, int, str | None]] = {}
+        for widget in widgets:
+            query_json = widget.query_json or {}
+            limit = query_json.get("limit")
+            if not isinstance(limit, int) or not 1 <= limit <= MAX_LIMIT:
+                limit = DEFAULT_LIMIT
+            sql = query_json.get("sql") or query_json.get("sql_text")
+            if isinstance(sql, str) and sql.strip():
+                queries[widget.id] = (sql, limit, None)
+            elif widget.saved_query_id:
+                sql = saved_sql.get(widget.saved_query_id)
+                queries[widget.id] = (sql, limit, None if sql else "Saved query not found")
+            else:
+                queries[widget.id] = (None, limit, None)
+        return queries
+
+    def _semantic_layer(self, workspace_id: uuid.UUID) -> SemanticLayer:
+        semantic_layer = (
+            self.db.query(SemanticLayer)
+            .filter(
+                SemanticLayer.workspace_id == workspace_id,
+                SemanticLayer.tenant_id == self.tenant_id,
+            )
+            .first()
+        )
+        if not semantic_layer:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No semantic layer found for this workspace",
+            )
+        if not semantic_layer.definitions_json:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Semantic layer has no definitions configured",
+            )
+        return semantic_layer
+
+
+def _result_payload(result: dict) -> dict:
+    return {key: result[key] for key in ("columns", "rows", "row_count", "execution_time_ms")}
+
+
+def _cached_result(widget_id: uuid.UUID, payload: dict, computed_at: object) -> dict:
+    return {
+        "widget_id": widget_id,
+        "status": "ok",
+        **payload,
+        "cache_status": "hit",
+        "computed_at": computed_at,
+    }
+
+
+def _submit_widget_query(
+    cursor: SemanticQueryBuilder, query: tuple[uuid.UUID, str, int]
+) -> Callable[[], dict]:
+    """Queue one widget's SQL on its cursor; the returned call waits for its result.
+
+    Failures, when queueing or running, are captured in the result.
+    """
+    widget_id, sql, limit = query
+    start = time.monotonic()
+
+    def _failed(e: Exception) -> dict:
+        return {
+            "widget_id": widget_id,
+            "status": "error",
+            "execution_time_ms": round((time.monotonic() - start) * 1000, 2),
+            "error": str(e),
+        }
+
+    try:
+        pending = cursor.submit_query(sql_text=sql, limit=limit)
+    except (ValueError, QueryOverloadedError) as e:
+        failed = _failed(e)
+        return lambda: failed
+
+    def _wait() -> dict:
+        try:
+            result = pending.result()
+        except (ValueError, TimeoutError, QueryCancelledError) as e:
+            return _failed(e)
+        return {"widget_id": widget_id, "status": "ok", **result}
+
+    return _wait
@@ -0,0 +1,287 @@
+"""DuckDB resource limits — memory, threads and spill directory per connection class.
+
+A default DuckDB database may use every core and most of the machine's RAM, so
+one heavy join could starve every other request or get the container killed.
+Connections are opened through duckdb_resources.connect() with a class:
+
+- "query": semantic layer databases running interactive and dashboard queries
+- "preview": short reads behind the data source preview
+- "ingestion": CSV conversion and rollup materialization
+
+Each class has its own thread count and memory limit, and every database spills
+to its own directory under duckdb_temp_directory. On top of that, a global
+budget is shared between the databases currently in use: when their limits add
+up to more than the budget, each one's limit is scaled down in proportion (so
+large operators spill to disk instead of failing), and restored once load drops.
+Idle pooled databases are held at a small floor.
+
+The budget is enforced per process, so duckdb_memory_budget_mb is divided
+between the web_concurrency API workers sharing the container.
+"""
+
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator
+
+import duckdb
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# No database is ever squeezed below this, whatever the load
+MIN_MEMORY_LIMIT_MB = 64
+
+
+@dataclass(frozen=True)
+class ConnectionProfile:
+    """Resource limits of one connection class."""
+    memory_limit_mb: int
+    threads: int
+
+
+@dataclass
+class _Slot:
+    kind: str
+    profile: ConnectionProfile
+    temp_directory: str
+    active: bool = True
+    # Target limit, decided under the manager's lock
+    memory_limit_mb: int = 0
+    # Limit last SET on the database, under resize_lock
+    applied_mb: int = 0
+    conn: duckdb.DuckDBPyConnection | None = None
+    closed: bool = False
+    resize_lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class DuckDBResourceManager:
+    """Opens DuckDB databases with per-class limits and shares a global memory budget.
+
+    The budget's inputs (total demand of active databases, floors held by idle
+    ones) are kept as running totals, so registering or releasing a database is
+    O(1) while the budget covers everyone. Only when it is or was oversubscribed
+    are the other databases' shares recomputed. New limits are decided under the
+    lock but applied with SET after releasing it, and only to databases whose
+    limit actually changed.
+    """
+
+    def __init__(
+        self,
+        profiles: dict[str, ConnectionProfile],
+        memory_budget_mb: int,
+        idle_memory_limit_mb: int,
+        temp_directory: str,
+    ) -> None:
+        self.profiles = profiles
+        self.memory_budget_mb = memory_budget_mb
+        self.idle_memory_limit_mb = idle_memory_limit_mb
+        self.temp_directory = temp_directory
+        self._slots: dict[duckdb.DuckDBPyConnection, _Slot] = {}
+        self._lock = threading.Lock()
+        self._demand_mb = 0
+        self._idle_mb = 0
+        self._opened = 0
+        self._throttled = 0
+        self._resizes = 0
+
+    def connect(self, kind: str) -> duckdb.DuckDBPyConnection:
+        """Open an in-memory database of connection class `kind`, counted as in use.
+
+        Close it with close() so its share of the budget goes back to the others.
+        """
+        profile = self.profiles[kind]
+        # DuckDB creates the database's own spill directory, but not its parents
+        os.makedirs(self.temp_directory, exist_ok=True)
+        temp_directory = os.path.join(self.temp_directory, f"{kind}-{uuid.uuid4().hex}")
+        slot = _Slot(kind=kind, profile=profile, temp_directory=temp_directory)
+        with self._lock:
+            pressured = self._pressured_locked()
+            self._add_locked(slot)
+            slot.memory_limit_mb = self._share_locked(slot)
+            changed = self._rebalance_locked(pressured)
+        try:
+            # The new database starts at its share, so it never needs a SET here
+            conn = duckdb.connect(config={
+                "memory_limit": f"{slot.memory_limit_mb}MB",
+                "threads": profile.threads,
+                "temp_directory": temp_directory,
+            })
+        except BaseException:
+            with self._lock:
+                pressured = self._pressured_locked()
+                self._remove_locked(slot)
+                changed = self._rebalance_locked(pressured)
+            self._resize(changed)
+            raise
+        slot.conn = conn
+        slot.applied_mb = slot.memory_limit_mb
+        with self._lock:
+            self._slots[conn] = slot
+            self._opened += 1
+            # Its share may have moved while connecting, when it was not yet listed
+            limit = self._share_locked(slot)
+            if limit != slot.memory_limit_mb:
+                slot.memory_limit_mb = limit
+                changed.append(slot)
+        self._resize(changed)
+        return conn
+
+    @contextmanager
+    def connection(self, kind: str) -> Iterator[duckdb.DuckDBPyConnection]:
+        """Open a database of class `kind` for the duration of the block."""
+        conn = self.connect(kind)
+        try:
+            yield conn
+        finally:
+            self.close(conn)
+
+    def set_active(self, conn: duckdb.DuckDBPyConnection, active: bool) -> None:
+        """Mark a long-lived (pooled) database as in use or idle."""
+        with self._lock:
+            slot = self._slots.get(conn)
+            if slot is None or slot.active == active:
+                return
+            pressured = self._pressured_locked()
+            self._remove_locked(slot)
+            slot.active = active
+            self._add_locked(slot)
+            changed = self._rebalance_locked(pressured, slot)
+        self._resize(changed)
+
+    def close(self, conn: duckdb.DuckDBPyConnection) -> None:
+        """Close a database (or a cursor) and release its share of the budget."""
+        changed: list[_Slot] = []
+        with self._lock:
+            slot = self._slots.pop(conn, None)
+            if slot is not None:
+                pressured = self._pressured_locked()
+                self._remove_locked(slot)
+                changed = self._rebalance_locked(pressured)
+        if slot is None:
+            conn.close()
+        else:
+            # Wait out a resize in flight on another thread before closing
+            with slot.resize_lock:
+                slot.closed = True
+                conn.close()
+        self._resize(changed)
+
+    def stats(self) -> dict:
+        """Return budget usage for monitoring."""
+        with self._lock:
+            by_kind: dict[str, int] = {}
+            for slot in self._slots.values():
+                by_kind[slot.kind] = by_kind.get(slot.kind, 0) + 1
+            return {
+                "memory_budget_mb": self.memory_budget_mb,
+                "connections": len(self._slots),
+                "active": sum(1 for s in self._slots.values() if s.active),
+                "allocated_mb": sum(s.memory_limit_mb for s in self._slots.values()),
+                "by_kind": by_kind,
+                "opened": self._opened,
+                "throttled": self._throttled,
+                "resizes": self._resizes,
+            }
+
+    # --- internals (call with self._lock held) ---
+
+    def _idle_floor(self, slot: _Slot) -> int:
+        return min(self.idle_memory_limit_mb, slot.profile.memory_limit_mb)
+
+    def _add_locked(self, slot: _Slot) -> None:
+        if slot.active:
+            self._demand_mb += slot.profile.memory_limit_mb
+        else:
+            self._idle_mb += self._idle_floor(slot)
+
+    def _remove_locked(self, slot: _Slot) -> None:
+        if slot.active:
+            self._demand_mb -= slot.profile.memory_limit_mb
+        else:
+            self._idle_mb -= self._idle_floor(slot)
+
+    def _pressured_locked(self) -> bool:
+        """Whether active databases want more than the budget left after idle floors."""
+        return self._demand_mb > self.memory_budget_mb - self._idle_mb
+
+    def _share_locked(self, slot: _Slot) -> int:
+        """Memory limit for `slot`, which must be counted in the running totals."""
+        if not slot.active:
+            return self._idle_floor(slot)
+        available = self.memory_budget_mb - self._idle_mb
+        if self._demand_mb <= available:
+            return slot.profile.memory_limit_mb
+        share = slot.profile.memory_limit_mb * max(available, 0) // self._demand_mb
+        return max(MIN_MEMORY_LIMIT_MB, min(share, slot.profile.memory_limit_mb))
+
+    def _rebalance_locked(self, was_pressured: bool, touched: _Slot | None = None) -> list[_Slot]:
+        """Retarget the databases whose share moved; return them for _resize().
+
+        With the budget covering everyone before and after, every active database
+        sits at its class limit and only `touched` can have changed.
+        """
+        pressured = self._pressured_locked()
+        if pressured:
+            self._throttled += 1
+        if pressured or was_pressured:
+            candidates = list(self._slots.values())
+        else:
+            candidates = [touched] if touched is not None else []
+        changed = []
+        for slot in candidates:
+            limit = self._share_locked(slot)
+            if limit != slot.memory_limit_mb:
+                slot.memory_limit_mb = limit
+                changed.append(slot)
+        return changed
+
+    # --- called without self._lock ---
+
+    def _resize(self, slots: list[_Slot]) -> None:
+        """SET each database's memory limit to its latest target."""
+        for slot in slots:
+            with slot.resize_lock:
+                # Read the target under resize_lock: whichever thread resizes last
+                # applies the newest value, even if two rebalances race
+                limit = slot.memory_limit_mb
+                if slot.closed or slot.conn is None or limit == slot.applied_mb:
+                    continue
+                try:
+                    # A setting applies to the whole database, not just this client context
+                    cursor = slot.conn.cursor()
+                    try:
+                        cursor.execute(f"SET memory_limit = '{limit}MB'")
+                    finally:
+                        cursor.close()
+                except duckdb.Error as e:
+                    logger.warning("Could not resize DuckDB %s database: %s", slot.kind, e)
+                    continue
+                slot.applied_mb = limit
+            with self._lock:
+                self._resizes += 1
+
+
+duckdb_resources = DuckDBResourceManager(
+    profiles={
+        "query": ConnectionProfile(
+            memory_limit_mb=settings.duckdb_query_memory_limit_mb,
+            threads=settings.duckdb_query_threads,
+        ),
+        "preview": ConnectionProfile(
+            memory_limit_mb=settings.duckdb_preview_memory_limit_mb,
+            threads=settings.duckdb_preview_threads,
+        ),
+        "ingestion": ConnectionProfile(
+            memory_limit_mb=settings.duckdb_ingestion_memory_limit_mb,
+            threads=settings.duckdb_ingestion_threads,
+        ),
+    },
+    memory_budget_mb=settings.duckdb_memory_budget_mb // max(1, settings.web_concurrency),
+    idle_memory_limit_mb=settings.duckdb_idle_memory_limit_mb,
+    temp_directory=settings.duckdb_temp_directory,
+)
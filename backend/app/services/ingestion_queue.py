@@ -0,0 +1,422 @@
+"""Ingestion queue — runs CSV-to-parquet conversion outside the request worker.
+
+The upload endpoints only save the file and create a 'pending' DataSource; the
+conversion is described by an IngestionJob and handed to an IngestionBackend.
+/upload/async returns right away, while /upload waits for its job (ingest())
+so that it keeps answering with the ready data source, but still converts on
+the backend's bounded workers.
+Jobs carry plain identifiers (no ORM objects or closures), so a backend can
+serialize them to an external broker and run the handler in another process.
+Status and progress live on the DataSource row, which is what clients poll.
+Several API workers can share one database: a worker claims a job on its row
+(ingestion_owner, refreshed by a heartbeat) before converting it, so a job
+queued twice, say by recover() in a sibling worker, is converted only once.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Iterator
+
+from fastapi import HTTPException, status
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.data_source import DataSource
+from app.services.csv_service import delete_csv_files, ingest_csv_source
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = frozenset({"ready", "failed"})
+ACTIVE_STATUSES = ("pending", "processing")
+UNEXPECTED_ERROR = "Unexpected error during CSV processing"
+INTERRUPTED_ERROR = "Ingestion was interrupted and the uploaded CSV is no longer available"
+TIMEOUT_ERROR = "CSV ingestion did not finish in time; follow its status at /{id}/status"
+# How often ingest() re-reads the status when no change is seen in this process
+WAIT_POLL_SECONDS = 1.0
+
+
+@dataclass(frozen=True)
+class IngestionJob:
+    """A unit of ingestion work. The job id is the id of the DataSource it fills."""
+    job_id: str
+    tenant_id: str
+
+
+class IngestionBackend(ABC):
+    """Where jobs wait and which workers run them."""
+
+    @abstractmethod
+    def submit(self, job: IngestionJob, handler: Callable[[IngestionJob], None]) -> None:
+        """Schedule `handler(job)` to run on a worker."""
+
+    def stats(self) -> dict:
+        return {}
+
+    def shutdown(self, wait: bool = True) -> None:
+        pass
+
+
+class LocalIngestionBackend(IngestionBackend):
+    """In-process backend: a bounded thread pool (DuckDB releases the GIL while converting)."""
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+
+    def submit(self, job: IngestionJob, handler: Callable[[IngestionJob], None]) -> None:
+        with self._lock:
+            self._queued += 1
+        self._executor.submit(self._run, job, handler)
+
+    def _run(self, job: IngestionJob, handler: Callable[[IngestionJob], None]) -> None:
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            handler(job)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+class InlineIngestionBackend(IngestionBackend):
+    """Runs each job synchronously in the caller's thread (tests and scripts)."""
+
+    def submit(self, job: IngestionJob, handler: Callable[[IngestionJob], None]) -> None:
+        handler(job)
+
+
+class IngestionQueue:
+    """Submits ingestion jobs to a backend and records their progress on the DataSource."""
+
+    def __init__(
+        self,
+        backend: IngestionBackend,
+        session_factory: sessionmaker | Callable[[], Session],
+        wait_timeout_seconds: float = 600.0,
+        claim_ttl_seconds: float = 120.0,
+    ) -> None:
+        self.backend = backend
+        self.session_factory = session_factory
+        self.wait_timeout_seconds = wait_timeout_seconds
+        # A claim whose heartbeat is older than this belongs to a worker that is gone
+        self.claim_ttl_seconds = claim_ttl_seconds
+        self.worker_id = f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._changed = threading.Condition()
+        # Bumped by every update, so waiters can read statuses without holding _changed
+        self._generation = 0
+        self._listeners: set[Callable[[], None]] = set()
+
+    def enqueue(self, data_source: DataSource) -> IngestionJob:
+        """Queue ingestion of a pending data source and return its job."""
+        job = IngestionJob(job_id=str(data_source.id), tenant_id=str(data_source.tenant_id))
+        self.backend.submit(job, self.run_job)
+        return job
+
+    def ingest(self, data_source: DataSource, db: Session) -> DataSource:
+        """Queue ingestion of a pending data source and block until it is ready.
+
+        Raises:
+            HTTPException 422: CSV cannot be parsed (the data source is removed).
+            HTTPException 500: Unexpected conversion error (the data source is removed).
+            HTTPException 504: Job not finished within wait_timeout_seconds (the data
+                source is kept, and its conversion goes on in the background).
+        """
+        if not self.wait(self.enqueue(data_source), self.wait_timeout_seconds):
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail=TIMEOUT_ERROR.format(id=data_source.id),
+            )
+        db.refresh(data_source)
+        if data_source.status == "ready":
+            return data_source
+        message = data_source.error_message or UNEXPECTED_ERROR
+        delete_csv_files(data_source)
+        db.delete(data_source)
+        db.commit()
+        raise HTTPException(
+            status_code=(
+                status.HTTP_500_INTERNAL_SERVER_ERROR
+                if message == UNEXPECTED_ERROR
+                else status.HTTP_422_UNPROCESSABLE_ENTITY
+            ),
+            detail=message,
+        )
+
+    def recover(self) -> dict[str, int]:
+        """Re-queue jobs interrupted by a restart; return how many were requeued and failed.
+
+        Data sources left 'pending' or 'processing' that no live worker holds
+        (unclaimed, or with a stale heartbeat) are queued again when their
+        original.csv is still on disk, and marked 'failed' otherwise, so that
+        clients waiting on them reach a terminal status. An unclaimed job may
+        still be queued in a sibling worker; the claim in run_job keeps it from
+        being converted twice.
+        """
+        db = self.session_factory()
+        try:
+            stuck = (
+                db.query(DataSource)
+                .filter(
+                    DataSource.type == "csv",
+                    DataSource.status.in_(ACTIVE_STATUSES),
+                    or_(
+                        DataSource.ingestion_owner.is_(None),
+                        DataSource.ingestion_heartbeat_at < self._stale_before(),
+                    ),
+                )
+                .all()
+            )
+            requeue = []
+            for data_source in stuck:
+                config = json.loads(data_source.connection_config_encrypted or "{}")
+                storage_path = config.get("storage_path")
+                data_source.ingestion_owner = None
+                data_source.ingestion_heartbeat_at = None
+                if storage_path and (Path(storage_path) / "original.csv").is_file():
+                    data_source.status = "pending"
+                    data_source.progress = 0
+                    requeue.append(data_source)
+                else:
+                    data_source.status = "failed"
+                    data_source.error_message = INTERRUPTED_ERROR
+            db.commit()
+            for data_source in requeue:
+                self.enqueue(data_source)
+        finally:
+            db.close()
+        if stuck:
+            logger.info(
+                "Ingestion recovery: %d job(s) requeued, %d failed",
+                len(requeue), len(stuck) - len(requeue),
+            )
+        return {"requeued": len(requeue), "failed": len(stuck) - len(requeue)}
+
+    def wait(self, job: IngestionJob, timeout: float | None = None) -> bool:
+        """Block until the job's DataSource is ready, failed or gone.
+
+        Returns False when `timeout` seconds pass first, so that a lost job
+        cannot hold the caller forever.
+        """
+        job_id = uuid.UUID(job.job_id)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._changed:
+                seen = self._generation
+            with self.session_factory() as db:
+                current = db.query(DataSource.status).filter(DataSource.id == job_id).scalar()
+            if current is None or current in TERMINAL_STATUSES:
+                return True
+            poll = WAIT_POLL_SECONDS
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                poll = min(poll, remaining)
+            with self._changed:
+                # An update committed after the read has bumped the generation: re-read now
+                if self._generation == seen:
+                    self._changed.wait(poll)
+
+    def run_job(self, job: IngestionJob) -> None:
+        """Convert the job's CSV and move its DataSource to 'ready' or 'failed'.
+
+        Never raises: failures are recorded on the DataSource for clients to read,
+        and a result that cannot be recorded (say, the DataSource was deleted
+        while converting) is logged.
+        """
+        db = self.session_factory()
+        try:
+            self._run_job(db, job)
+        except Exception:
+            logger.exception("Ingestion job %s: could not record its result", job.job_id)
+            db.rollback()
+        finally:
+            db.close()
+
+    def _run_job(self, db: Session, job: IngestionJob) -> None:
+        if not self._claim(db, job):
+            return
+        data_source = (
+            db.query(DataSource)
+            .filter(
+                DataSource.id == uuid.UUID(job.job_id),
+                DataSource.tenant_id == uuid.UUID(job.tenant_id),
+            )
+            .first()
+        )
+        if data_source is None:
+            logger.warning("Ingestion job %s: data source no longer exists", job.job_id)
+            return
+
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat,
+            args=(job, stop_heartbeat),
+            name=f"ingest-heartbeat-{job.job_id[:8]}",
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            self._convert(db, job, data_source)
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+
+    def _convert(self, db: Session, job: IngestionJob, data_source: DataSource) -> None:
+        self._notify()  # the claim moved the job to 'processing'
+        try:
+            schema_info = ingest_csv_source(
+                data_source,
+                on_progress=lambda pct: self._update(db, data_source, progress=pct),
+            )
+        except HTTPException as e:
+            self._fail(db, data_source, str(e.detail))
+            return
+        except Exception:
+            logger.exception("Ingestion job %s failed", job.job_id)
+            self._fail(db, data_source, UNEXPECTED_ERROR)
+            return
+
+        data_source.schema_cache = schema_info
+        self._update(db, data_source, status="ready", progress=100, ingestion_owner=None)
+
+    def _claim(self, db: Session, job: IngestionJob) -> bool:
+        """Atomically take the job for this worker; False if it is done or held by a live worker."""
+        now = datetime.now(timezone.utc)
+        claimed = db.execute(
+            update(DataSource)
+            .where(
+                DataSource.id == uuid.UUID(job.job_id),
+                DataSource.tenant_id == uuid.UUID(job.tenant_id),
+                DataSource.status.in_(ACTIVE_STATUSES),
+                or_(
+                    DataSource.ingestion_owner.is_(None),
+                    DataSource.ingestion_heartbeat_at < self._stale_before(),
+                ),
+            )
+            .values(
+                status="processing",
+                progress=5,
+                ingestion_owner=self.worker_id,
+                ingestion_heartbeat_at=now,
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        if not claimed:
+            logger.info("Ingestion job %s: already done or claimed by another worker", job.job_id)
+        return bool(claimed)
+
+    def _heartbeat(self, job: IngestionJob, stop: threading.Event) -> None:
+        """Refresh this worker's claim on the job until `stop` is set."""
+        while not stop.wait(self.claim_ttl_seconds / 3):
+            try:
+                with self.session_factory() as db:
+                    db.execute(
+                        update(DataSource)
+                        .where(
+                            DataSource.id == uuid.UUID(job.job_id),
+                            DataSource.ingestion_owner == self.worker_id,
+                        )
+                        .values(ingestion_heartbeat_at=datetime.now(timezone.utc))
+                        .execution_options(synchronize_session=False)
+                    )
+                    db.commit()
+            except Exception:
+                logger.exception("Ingestion job %s: could not refresh its heartbeat", job.job_id)
+
+    def _stale_before(self) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(seconds=self.claim_ttl_seconds)
+
+    @contextmanager
+    def changes(self) -> Iterator[asyncio.Event]:
+        """Subscribe the running event loop to job updates in this process.
+
+        The yielded event is set whenever any job reports progress; clear it
+        before reading the status so that no update is missed.
+        """
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def wake() -> None:
+            loop.call_soon_threadsafe(changed.set)
+
+        with self._changed:
+            self._listeners.add(wake)
+        try:
+            yield changed
+        finally:
+            with self._changed:
+                self._listeners.discard(wake)
+
+    def _fail(self, db: Session, data_source: DataSource, message: str) -> None:
+        # Keep the record (and original.csv) so the failure can be inspected; drop partial output
+        storage_path = json.loads(data_source.connection_config_encrypted)["storage_path"]
+        (Path(storage_path) / "processed.parquet").unlink(missing_ok=True)
+        data_source.error_message = message
+        self._update(db, data_source, status="failed", ingestion_owner=None)
+
+    def _update(self, db: Session, data_source: DataSource, **fields: object) -> None:
+        for name, value in fields.items():
+            setattr(data_source, name, value)
+        db.commit()
+        self._notify()
+
+    def _notify(self) -> None:
+        with self._changed:
+            self._generation += 1
+            self._changed.notify_all()
+            listeners = list(self._listeners)
+        for wake in listeners:
+            try:
+                wake()
+            except RuntimeError:
+                pass  # the subscriber's event loop is already closed
+
+
+def _make_backend(name: str) -> IngestionBackend:
+    if name == "local":
+        return LocalIngestionBackend(max_workers=settings.ingestion_max_workers)
+    if name == "inline":
+        return InlineIngestionBackend()
+    raise ValueError(f"Unknown ingestion backend: {name}")
+
+
+ingestion_queue = IngestionQueue(
+    backend=_make_backend(settings.ingestion_backend),
+    session_factory=SessionLocal,
+    wait_timeout_seconds=settings.ingestion_wait_timeout_seconds,
+    claim_ttl_seconds=settings.ingestion_claim_ttl_seconds,
+)
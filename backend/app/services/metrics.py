@@ -0,0 +1,322 @@
+"""Metrics — Prometheus text exposition for the API, DuckDB, ingestion and AI hot paths.
+
+Hot paths record into in-process counters and histograms: request latency per
+router, DuckDB context setup, query stages, rows and bytes returned, ingestion
+volume and Claude call latency. The counters the caches, pools and schedulers
+already keep (their stats() methods) are registered as collectors and read only
+when /metrics is scraped.
+
+No tenant id is ever used as a label, so the endpoint is safe to expose to the
+monitoring network and its cardinality stays bounded.
+"""
+
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ROW_BUCKETS = (1, 10, 100, 1_000, 10_000, 50_000, 100_000, 1_000_000)
+BYTE_BUCKETS = (1024, 10_240, 102_400, 1_048_576, 10_485_760, 104_857_600, 1_073_741_824)
+
+# stats() keys that only ever grow; exported as counters, everything else as gauges
+COUNTER_KEYS = frozenset({
+    "hits", "misses", "similar_hits", "evictions", "invalidations",
+    "submitted", "completed", "rejected", "cancelled", "timeouts", "acquired",
+    "registered", "opened", "throttled", "resizes", "recorded", "written", "dropped", "failed",
+    "profiled",
+    "materialized", "materialize_errors",
+    "calls", "input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens",
+    "schema_prompt_hits", "schema_prompt_misses",
+})
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+@dataclass
+class MetricFamily:
+    """One metric name with its samples, as it appears in the exposition."""
+    name: str
+    type: str
+    help: str
+    samples: list[tuple[str, dict[str, str], float]] = field(default_factory=list)
+
+    def add(self, value: float, suffix: str = "", **labels: str) -> None:
+        self.samples.append((self.name + suffix, labels, value))
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(
+            f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self.samples
+        )
+        return lines
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, "counter", self.help)
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                family.add(value, **dict(zip(self.labelnames, key)))
+        return family
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set."""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        labelnames: tuple[str, ...] = (),
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = labelnames
+        # label values -> (per-bucket counts, sum, count)
+        self._series: dict[tuple[str, ...], tuple[list[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, total, count = self._series.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._series[key] = (counts, total + value, count + 1)
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, "histogram", self.help)
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                family.add(cumulative, "_bucket", **labels, le=_format_value(bound))
+            family.add(count, "_bucket", **labels, le="+Inf")
+            family.add(total, "_sum", **labels)
+            family.add(count, "_count", **labels)
+        return family
+
+
+def stats_families(component: str, stats: dict[str, Any]) -> list[MetricFamily]:
+    """Export a stats() dict as datapilot_<component>_<key> metrics.
+
+    Numbers become gauges (counters for COUNTER_KEYS); a nested dict such as
+    `by_kind` becomes one metric labelled by its keys, so its keys must be a
+    small fixed set, never tenant-supplied names. Components reporting
+    `hits` and `misses` also get a lifetime `hit_ratio` gauge.
+    """
+    families: list[MetricFamily] = []
+    for key, value in stats.items():
+        is_counter = key in COUNTER_KEYS
+        name = f"datapilot_{component}_{key}" + ("_total" if is_counter else "")
+        family = MetricFamily(name, "counter" if is_counter else "gauge", f"{component} {key.replace('_', ' ')}")
+        if isinstance(value, dict):
+            label = key.rsplit("by_", 1)[-1]
+            for item, item_value in sorted(value.items()):
+                if isinstance(item_value, (int, float)):
+                    family.add(item_value, **{label: str(item)})
+        elif isinstance(value, (int, float)):
+            family.add(value)
+        if family.samples:
+            families.append(family)
+    hits, misses = stats.get("hits"), stats.get("misses")
+    if isinstance(hits, (int, float)) and isinstance(misses, (int, float)):
+        ratio = MetricFamily(f"datapilot_{component}_hit_ratio", "gauge", f"{component} hits / lookups since start")
+        ratio.add(round(hits / (hits + misses), 4) if hits + misses else 0.0)
+        families.append(ratio)
+    return families
+
+
+class MetricsRegistry:
+    """The instruments and collectors rendered by /metrics."""
+
+    def __init__(self) -> None:
+        self._instruments: list[Counter | Histogram] = []
+        self._collectors: list[tuple[str, Callable[[], dict[str, Any]]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        counter = Counter(name, help, labelnames)
+        self._instruments.append(counter)
+        return counter
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        labelnames: tuple[str, ...] = (),
+    ) -> Histogram:
+        histogram = Histogram(name, help, buckets, labelnames)
+        self._instruments.append(histogram)
+        return histogram
+
+    def register_stats(self, component: str, stats: Callable[[], dict[str, Any]]) -> None:
+        """Export a component's stats() at every scrape (replacing an earlier registration)."""
+        with self._lock:
+            self._collectors = [(c, fn) for c, fn in self._collectors if c != component]
+            self._collectors.append((component, stats))
+
+    def collect(self) -> Iterable[MetricFamily]:
+        for instrument in self._instruments:
+            yield instrument.collect()
+        with self._lock:
+            collectors = list(self._collectors)
+        for component, stats in collectors:
+            yield from stats_families(component, stats())
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for family in self.collect():
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+http_request_duration = metrics.histogram(
+    "datapilot_http_request_duration_seconds",
+    "HTTP request latency until the last body chunk was sent, per router",
+    labelnames=("router", "method", "status"),
+)
+duckdb_setup_duration = metrics.histogram(
+    "datapilot_duckdb_setup_duration_seconds",
+    "Time to set up a query context (pooled checkout or view registration)",
+    labelnames=("source",),
+)
+query_duration = metrics.histogram(
+    "datapilot_query_duration_seconds",
+    "Query latency from setup to materialized result",
+    labelnames=("source", "status", "cache_status"),
+)
+query_stage_duration = metrics.histogram(
+    "datapilot_query_stage_duration_seconds",
+    "Time executed queries spent waiting for a worker, executing and serializing",
+    labelnames=("stage",),
+)
+query_result_rows = metrics.histogram(
+    "datapilot_query_result_rows",
+    "Rows returned per query",
+    buckets=ROW_BUCKETS,
+    labelnames=("source",),
+)
+query_result_bytes = metrics.histogram(
+    "datapilot_query_result_bytes",
+    "Result size per query",
+    buckets=BYTE_BUCKETS,
+    labelnames=("source",),
+)
+ingestion_duration = metrics.histogram(
+    "datapilot_ingestion_duration_seconds",
+    "CSV to parquet conversion time",
+)
+ingestion_bytes = metrics.counter("datapilot_ingestion_bytes_total", "CSV bytes converted to parquet")
+ingestion_rows = metrics.counter("datapilot_ingestion_rows_total", "Rows converted to parquet")
+ai_request_duration = metrics.histogram(
+    "datapilot_ai_request_duration_seconds",
+    "Claude API call latency, including the wait for a concurrency slot",
+    labelnames=("mode", "outcome"),
+)
+
+
+def observe_query(execution: Any) -> None:
+    """Record a query execution (a query_history.QueryExecution) in the query metrics."""
+    query_duration.observe(
+        execution.total_ms / 1000,
+        source=execution.source,
+        status=execution.status,
+        cache_status=execution.cache_status,
+    )
+    if execution.status != "ok":
+        return
+    if execution.cache_status == "miss":
+        query_stage_duration.observe(execution.queue_ms / 1000, stage="queue")
+        query_stage_duration.observe(execution.execute_ms / 1000, stage="execute")
+        query_stage_duration.observe(execution.serialize_ms / 1000, stage="serialize")
+    if execution.row_count is not None:
+        query_result_rows.observe(execution.row_count, source=execution.source)
+    if execution.result_bytes is not None:
+        query_result_bytes.observe(execution.result_bytes, source=execution.source)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request into http_request_duration.
+
+    The router label is the matched route's tag ("queries", "ai", ...), or its
+    path for untagged routes; requests matching no route share "unmatched". A
+    streamed response is timed until its last chunk has been sent.
+    """
+
+    def __init__(self, app: Callable) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def _send(message: dict) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = scope.get("route")
+            if route is None:
+                router = "unmatched"
+            else:
+                tags = getattr(route, "tags", None)
+                router = str(tags[0]) if tags else getattr(route, "path", "unmatched")
+            http_request_duration.observe(
+                time.perf_counter() - start,
+                router=router,
+                method=scope["method"],
+                status=str(status_code),
+            )
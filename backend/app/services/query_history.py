@@ -0,0 +1,277 @@
+"""Query history — a record of every query execution, and the slow-query log.
+
+SemanticQueryBuilder reports each query it runs (a stream when it ends), and
+the query endpoint each result cache hit, as a QueryExecution: the parse-tree
+hash of the SQL, tenant, workspace, time spent in setup / queue / execute /
+serialize, rows, bytes and cache status. Executions slower than
+query_slow_threshold_ms make up the slow-query log; with query_slow_profile on
+they also carry DuckDB's JSON profile of the run.
+
+Recording only appends to an in-memory buffer. A background thread writes the
+buffer to the query_history table in batches, so queries never wait on the
+database; past max_pending unwritten executions, the oldest are dropped.
+"""
+
+import json
+import logging
+import threading
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Literal
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.query_history import QueryHistory
+
+logger = logging.getLogger(__name__)
+
+# Rows sampled to estimate the JSON size of a row result
+_BYTES_SAMPLE_ROWS = 100
+
+
+def estimate_json_bytes(rows: list[Any]) -> int:
+    """Approximate JSON size of a list of rows, extrapolated from a sample of them."""
+    if not rows:
+        return 2
+    step = max(len(rows) // _BYTES_SAMPLE_ROWS, 1)
+    sample = rows[::step][:_BYTES_SAMPLE_ROWS]
+    sample_bytes = len(json.dumps(sample, default=str))
+    return round(sample_bytes * len(rows) / len(sample))
+
+
+@dataclass
+class QueryExecution:
+    """One execution, as reported by the code that ran (or served) it."""
+    tenant_id: str
+    workspace_id: str | None
+    source: str
+    query_hash: str
+    sql_text: str
+    status: str = "ok"
+    cache_status: str = "miss"
+    row_count: int | None = None
+    result_bytes: int | None = None
+    setup_ms: float = 0.0
+    queue_ms: float = 0.0
+    execute_ms: float = 0.0
+    serialize_ms: float = 0.0
+    profile: dict | None = None
+    executed_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @property
+    def total_ms(self) -> float:
+        return round(self.setup_ms + self.queue_ms + self.execute_ms + self.serialize_ms, 2)
+
+    def to_row(self) -> QueryHistory:
+        return QueryHistory(
+            tenant_id=uuid.UUID(self.tenant_id),
+            workspace_id=uuid.UUID(self.workspace_id) if self.workspace_id else None,
+            source=self.source,
+            query_hash=self.query_hash,
+            sql_text=self.sql_text,
+            status=self.status,
+            cache_status=self.cache_status,
+            row_count=self.row_count,
+            result_bytes=self.result_bytes,
+            setup_ms=round(self.setup_ms, 2),
+            queue_ms=round(self.queue_ms, 2),
+            execute_ms=round(self.execute_ms, 2),
+            serialize_ms=round(self.serialize_ms, 2),
+            total_ms=self.total_ms,
+            profile_json=self.profile,
+            executed_at=self.executed_at,
+        )
+
+
+class QueryHistoryRecorder:
+    """Buffers executions in memory and writes them to query_history in the background."""
+
+    def __init__(
+        self,
+        session_factory: sessionmaker | Callable[[], Session],
+        max_pending: int,
+        flush_interval_seconds: float,
+        slow_threshold_ms: int,
+        enabled: bool = True,
+        profile_slow: bool = False,
+    ) -> None:
+        self.session_factory = session_factory
+        self.max_pending = max_pending
+        self.flush_interval_seconds = flush_interval_seconds
+        self.slow_threshold_ms = slow_threshold_ms
+        self.enabled = enabled
+        self.profile_slow = profile_slow
+        self._pending: deque[QueryExecution] = deque()
+        self._lock = threading.Lock()
+        # Serializes flushes between the background thread and read endpoints
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher: threading.Thread | None = None
+        self._recorded = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._profiled = 0
+
+    @property
+    def profiling(self) -> bool:
+        """Whether query connections should collect DuckDB profiles.
+
+        DuckDB can only write a profile of every query to a file, so this is
+        opt-in (query_slow_profile): the slow-query log works without it.
+        """
+        return self.enabled and self.profile_slow and self.slow_threshold_ms > 0
+
+    def is_slow(self, elapsed_ms: float) -> bool:
+        return self.profiling and elapsed_ms >= self.slow_threshold_ms
+
+    def record(self, execution: QueryExecution) -> None:
+        """Queue an execution to be written."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self._pending.popleft()
+                self._dropped += 1
+            self._pending.append(execution)
+            self._recorded += 1
+            if execution.profile is not None:
+                self._profiled += 1
+            self._start_flusher_locked()
+
+    def flush(self) -> int:
+        """Write every pending execution now. Returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+                self._pending.clear()
+            if not batch:
+                return 0
+            try:
+                with self.session_factory() as db:
+                    db.add_all([execution.to_row() for execution in batch])
+                    db.commit()
+            except Exception:
+                # History is best effort: a failed batch is counted and dropped, not retried
+                with self._lock:
+                    self._failed += len(batch)
+                logger.exception("Could not write %d query history entries", len(batch))
+                return 0
+            with self._lock:
+                self._written += len(batch)
+            return len(batch)
+
+    def clear(self) -> None:
+        """Discard pending executions without writing them."""
+        with self._lock:
+            self._pending.clear()
+
+    def top_queries(
+        self,
+        db: Session,
+        tenant_id: uuid.UUID,
+        order: Literal["slowest", "frequent"],
+        limit: int,
+        workspace_id: uuid.UUID | None = None,
+        since: datetime | None = None,
+    ) -> list[dict]:
+        """Aggregate the tenant's history per query hash, slowest (by mean time) or most run first."""
+        executions = func.count(QueryHistory.id)
+        avg_ms = func.avg(QueryHistory.total_ms)
+        query = db.query(
+            QueryHistory.query_hash,
+            func.max(QueryHistory.sql_text),
+            executions,
+            avg_ms,
+            func.max(QueryHistory.total_ms),
+            func.sum(QueryHistory.total_ms),
+            func.avg(QueryHistory.row_count),
+            func.avg(QueryHistory.result_bytes),
+            func.sum(case((QueryHistory.cache_status == "hit", 1), else_=0)),
+            func.max(QueryHistory.executed_at),
+        ).filter(QueryHistory.tenant_id == tenant_id)
+        if workspace_id is not None:
+            query = query.filter(QueryHistory.workspace_id == workspace_id)
+        if since is not None:
+            query = query.filter(QueryHistory.executed_at >= since)
+        ordering = (avg_ms.desc(), executions.desc()) if order == "slowest" else (executions.desc(), avg_ms.desc())
+        rows = query.group_by(QueryHistory.query_hash).order_by(*ordering).limit(limit).all()
+        return [
+            {
+                "query_hash": query_hash,
+                "sql_text": sql_text,
+                "executions": count,
+                "avg_ms": round(avg, 2),
+                "max_ms": round(max_ms, 2),
+                "total_ms": round(total, 2),
+                "avg_rows": round(avg_rows, 1) if avg_rows is not None else None,
+                "avg_bytes": round(avg_bytes) if avg_bytes is not None else None,
+                "cache_hits": int(hits or 0),
+                "last_executed_at": last_executed_at,
+            }
+            for (
+                query_hash, sql_text, count, avg, max_ms, total, avg_rows, avg_bytes, hits, last_executed_at
+            ) in rows
+        ]
+
+    def slow_queries(
+        self,
+        db: Session,
+        tenant_id: uuid.UUID,
+        limit: int,
+        workspace_id: uuid.UUID | None = None,
+    ) -> list[QueryHistory]:
+        """The tenant's most recent executions over the slow-query threshold."""
+        if self.slow_threshold_ms <= 0:
+            return []
+        query = db.query(QueryHistory).filter(
+            QueryHistory.tenant_id == tenant_id,
+            QueryHistory.total_ms >= self.slow_threshold_ms,
+        )
+        if workspace_id is not None:
+            query = query.filter(QueryHistory.workspace_id == workspace_id)
+        return query.order_by(QueryHistory.executed_at.desc()).limit(limit).all()
+
+    def stats(self) -> dict:
+        """Return recorder counters for monitoring."""
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "recorded": self._recorded,
+                "written": self._written,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "profiled": self._profiled,
+            }
+
+    # --- internals ---
+
+    def _start_flusher_locked(self) -> None:
+        if self.flush_interval_seconds <= 0:
+            return
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._flush_loop, name="query-history", daemon=True)
+            self._flusher.start()
+        elif len(self._pending) >= self.max_pending // 2:
+            self._wake.set()
+
+    def _flush_loop(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval_seconds)
+            self._wake.clear()
+            self.flush()
+
+
+query_history = QueryHistoryRecorder(
+    session_factory=SessionLocal,
+    max_pending=settings.query_history_max_pending,
+    flush_interval_seconds=settings.query_history_flush_seconds,
+    slow_threshold_ms=settings.query_slow_threshold_ms,
+    enabled=settings.query_history_enabled,
+    profile_slow=settings.query_slow_profile,
+)
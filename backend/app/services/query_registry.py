@@ -0,0 +1,122 @@
+"""Query registry — running queries by run id, so they can be cancelled.
+
+A query is registered under its tenant and a run id (chosen by the client or
+generated) for as long as it runs. Cancelling it, from DELETE /queries/{run_id}
+or because the client disconnected, calls the canceller the executor registered:
+a queued query is withdrawn, a running one is interrupted in DuckDB, and the
+request waiting on it returns at once.
+
+The registry lives in one process: with several API workers, a run can only be
+cancelled by a request that reaches the worker running it.
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Protocol
+
+# (tenant_id, run_id)
+RunKey = tuple[str, str]
+
+# How often a running query checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class _Disconnectable(Protocol):
+    def is_disconnected(self) -> Awaitable[bool]: ...
+
+
+class QueryCancelledError(Exception):
+    """Raised to the caller of a query that was cancelled."""
+
+
+@dataclass
+class RunningQuery:
+    run_id: str
+    tenant_id: str
+    sql: str
+    canceller: Callable[[], None]
+    started_at: float = field(default_factory=time.monotonic)
+    cancelled: bool = False
+
+
+class QueryRegistry:
+    """Tenant-scoped table of running queries and their cancellers."""
+
+    def __init__(self) -> None:
+        self._runs: dict[RunKey, RunningQuery] = {}
+        self._lock = threading.Lock()
+        self._registered = 0
+        self._cancelled = 0
+
+    @staticmethod
+    def new_run_id() -> str:
+        return uuid.uuid4().hex
+
+    def register(
+        self,
+        tenant_id: str | uuid.UUID | None,
+        run_id: str,
+        sql: str,
+        canceller: Callable[[], None],
+    ) -> RunningQuery:
+        """Record a running query.
+
+        Raises:
+            ValueError: If the tenant already has a query running under this run id.
+        """
+        key = (str(tenant_id), run_id)
+        with self._lock:
+            if key in self._runs:
+                raise ValueError(f"Query run '{run_id}' is already running")
+            run = RunningQuery(run_id=run_id, tenant_id=key[0], sql=sql, canceller=canceller)
+            self._runs[key] = run
+            self._registered += 1
+            return run
+
+    def unregister(self, run: RunningQuery) -> None:
+        with self._lock:
+            key = (run.tenant_id, run.run_id)
+            if self._runs.get(key) is run:
+                del self._runs[key]
+
+    def cancel(self, tenant_id: str | uuid.UUID | None, run_id: str) -> bool:
+        """Cancel a tenant's running query. Returns False if no such query is running."""
+        with self._lock:
+            run = self._runs.get((str(tenant_id), run_id))
+            if run is None or run.cancelled:
+                return run is not None
+            run.cancelled = True
+            self._cancelled += 1
+        run.canceller()
+        return True
+
+    async def cancel_on_disconnect(
+        self,
+        request: _Disconnectable,
+        tenant_id: str | uuid.UUID | None,
+        run_id: str,
+    ) -> None:
+        """Cancel a run once the client has gone away (retrying until the run has registered).
+
+        Run it as a task next to the request's query and cancel the task once the
+        query has returned.
+        """
+        while True:
+            if await request.is_disconnected() and self.cancel(tenant_id, run_id):
+                return
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+    def stats(self) -> dict:
+        """Return registry counters for monitoring."""
+        with self._lock:
+            return {
+                "running": len(self._runs),
+                "registered": self._registered,
+                "cancelled": self._cancelled,
+            }
+
+
+query_registry = QueryRegistry()
@@ -0,0 +1,220 @@
+"""Query scheduler — admission control and fair sharing of DuckDB execution slots.
+
+Every query run by SemanticQueryBuilder goes through one process-wide pool of
+worker threads. At most max_workers queries run at once, at most max_per_tenant
+of them for any one tenant, and at most max_queue wait; past that, new queries
+are rejected right away (QueryOverloadedError) so the API sheds load instead of
+piling up threads.
+
+When a worker frees up, the next query comes from the tenant that has used the
+least worker time relative to its weight (weighted fair queueing on measured
+run time). A tenant submitting a batch of heavy dashboard queries therefore
+only delays its own queue: others keep being served in proportion to their
+weights.
+
+Streamed queries start on a worker too, which is freed once DuckDB has returned
+their result reader: the request thread then pulls the rows, so a slow client
+does not keep a worker from other queries.
+"""
+
+import concurrent.futures
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from app.config import settings
+
+# Initial guess of a query's run time, refined per tenant as queries complete
+DEFAULT_COST_SECONDS = 0.05
+_COST_SMOOTHING = 0.2
+
+
+class QueryOverloadedError(Exception):
+    """Raised when the query queue is full."""
+
+
+@dataclass
+class _Task:
+    fn: Callable[[], Any]
+    future: concurrent.futures.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    charged: float = 0.0
+
+
+@dataclass
+class _TenantState:
+    weight: float
+    queue: "deque[_Task]" = field(default_factory=deque)
+    running: int = 0
+    # Worker seconds used, divided by weight; the tenant with the least goes next
+    usage: float = 0.0
+    avg_cost: float = DEFAULT_COST_SECONDS
+
+
+class QueryScheduler:
+    """Bounded worker pool with per-tenant quotas and weighted fair queueing."""
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_per_tenant: int,
+        max_queue: int,
+        tenant_weights: dict[str, float] | None = None,
+    ) -> None:
+        self.max_workers = max_workers
+        self.max_per_tenant = max_per_tenant
+        self.max_queue = max_queue
+        self.tenant_weights = tenant_weights or {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="duckdb-query"
+        )
+        self._tenants: dict[str, _TenantState] = {}
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queued = 0
+        self._peak_queued = 0
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._cancelled = 0
+        self._total_queue_ms = 0.0
+        self._max_queue_ms = 0.0
+        self._total_run_ms = 0.0
+
+    def submit(self, tenant_id: str | uuid.UUID | None, fn: Callable[[], Any]) -> concurrent.futures.Future:
+        """Queue `fn` for a tenant and return a future for its result.
+
+        Raises:
+            QueryOverloadedError: If the queue is full.
+        """
+        tenant = str(tenant_id) if tenant_id is not None else ""
+        task = _Task(fn=fn, future=concurrent.futures.Future())
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise QueryOverloadedError("Query engine is at capacity")
+            state = self._tenants.get(tenant)
+            if state is None:
+                state = self._tenants[tenant] = _TenantState(weight=self._weight(tenant))
+            if not state.queue and not state.running:
+                # A tenant coming back from idle does not get credit for the time it was away
+                state.usage = max(state.usage, self._min_usage_locked(exclude=state))
+            state.queue.append(task)
+            self._queued += 1
+            self._submitted += 1
+            self._peak_queued = max(self._peak_queued, self._queued)
+            self._dispatch_locked()
+        return task.future
+
+    def cancel(self, future: concurrent.futures.Future) -> bool:
+        """Withdraw a query that has not started yet. Returns False if it is already running."""
+        with self._lock:
+            for tenant, state in list(self._tenants.items()):
+                for task in state.queue:
+                    if task.future is future:
+                        state.queue.remove(task)
+                        self._queued -= 1
+                        self._cancelled += 1
+                        future.cancel()
+                        self._forget_idle_locked(tenant, state)
+                        return True
+        return False
+
+    def stats(self) -> dict:
+        """Return scheduler counters for monitoring."""
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "max_workers": self.max_workers,
+                "max_per_tenant": self.max_per_tenant,
+                "running": self._running,
+                "queued": self._queued,
+                "peak_queued": self._peak_queued,
+                "active_tenants": len(self._tenants),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "cancelled": self._cancelled,
+                "avg_queue_ms": round(self._total_queue_ms / started, 2) if started else 0.0,
+                "max_queue_ms": round(self._max_queue_ms, 2),
+                "avg_run_ms": round(self._total_run_ms / self._completed, 2) if self._completed else 0.0,
+            }
+
+    def _weight(self, tenant: str) -> float:
+        return max(float(self.tenant_weights.get(tenant, 1.0)), 0.01)
+
+    # --- internals (call with self._lock held) ---
+
+    def _min_usage_locked(self, exclude: _TenantState) -> float:
+        usages = [
+            s.usage for s in self._tenants.values()
+            if s is not exclude and (s.queue or s.running)
+        ]
+        return min(usages, default=0.0)
+
+    def _dispatch_locked(self) -> None:
+        while self._running < self.max_workers:
+            ready = [
+                (state.usage, state.queue[0].enqueued_at, tenant)
+                for tenant, state in self._tenants.items()
+                if state.queue and state.running < self.max_per_tenant
+            ]
+            if not ready:
+                return
+            _, _, tenant = min(ready)
+            state = self._tenants[tenant]
+            task = state.queue.popleft()
+            self._queued -= 1
+            if not task.future.set_running_or_notify_cancel():
+                self._cancelled += 1
+                self._forget_idle_locked(tenant, state)
+                continue
+
+            waited_ms = (time.monotonic() - task.enqueued_at) * 1000
+            self._total_queue_ms += waited_ms
+            self._max_queue_ms = max(self._max_queue_ms, waited_ms)
+            # Charge the expected cost now so a tenant's queued queries do not all start at once
+            task.charged = state.avg_cost / state.weight
+            state.usage += task.charged
+            state.running += 1
+            self._running += 1
+            self._executor.submit(self._run, tenant, state, task)
+
+    def _forget_idle_locked(self, tenant: str, state: _TenantState) -> None:
+        if not state.queue and not state.running:
+            del self._tenants[tenant]
+
+    def _run(self, tenant: str, state: _TenantState, task: _Task) -> None:
+        start = time.monotonic()
+        error: BaseException | None = None
+        result: Any = None
+        try:
+            result = task.fn()
+        except BaseException as e:
+            error = e
+        elapsed = time.monotonic() - start
+        with self._lock:
+            state.running -= 1
+            state.usage += elapsed / state.weight - task.charged
+            state.avg_cost += _COST_SMOOTHING * (elapsed - state.avg_cost)
+            self._running -= 1
+            self._completed += 1
+            self._total_run_ms += elapsed * 1000
+            self._forget_idle_locked(tenant, state)
+            self._dispatch_locked()
+        # Resolve last, so a caller woken by the result sees the slot already freed
+        if error is not None:
+            task.future.set_exception(error)
+        else:
+            task.future.set_result(result)
+
+
+query_scheduler = QueryScheduler(
+    max_workers=settings.query_max_workers,
+    max_per_tenant=settings.query_max_concurrency_per_tenant,
+    max_queue=settings.query_max_queue,
+    tenant_weights=settings.query_tenant_weights,
+)
@@ -1,108 +1,215 @@
 """Query service — SemanticQueryBuilder for DuckDB cross-CSV queries."""
 
-import datetime
-import decimal
+import concurrent.futures
+import contextvars
 import json
-import re
+import os
+import threading
 import time
 import uuid
-from pathlib import Path
-from typing import Any
-
-import concurrent.futures
+from typing import Any, Callable, Iterator, TypeVar
 
 import duckdb
 from sqlalchemy.orm import Session
 
-from app.models.data_source import DataSource
+from app.services.catalog_service import ViewCatalogCache, semantic_layer_version, view_catalog
+from app.services.connection_pool import DuckDBConnectionPool, PooledConnection
+from app.services.duckdb_resources import duckdb_resources
+from app.services.metrics import duckdb_setup_duration, observe_query
+from app.services.query_history import QueryExecution, estimate_json_bytes, query_history
+from app.services.query_registry import QueryCancelledError, RunningQuery, query_registry
+from app.services.query_scheduler import QueryOverloadedError, query_scheduler
+from app.services.result_formats import json_safe
+from app.services.rollup_service import RollupSpec, register_rollups, rewrite_for_rollups, rollup_specs
+from app.services.sql_parser import ParsedQuery, parse_query
+from app.services.tracing import tracer
 
 
-# SQL statements that are NOT allowed (write operations)
-_FORBIDDEN_SQL_PATTERN = re.compile(
-    r"\b(DROP|DELETE|INSERT|UPDATE|CREATE|ALTER|TRUNCATE|GRANT|REVOKE|EXEC|EXECUTE|CALL|MERGE|UPSERT"
-    r"|COPY|SET|ATTACH|DETACH|LOAD|INSTALL)\b",
-    re.IGNORECASE,
-)
+T = TypeVar("T")
 
 # Maximum rows returned
 DEFAULT_LIMIT = 10000
 MAX_LIMIT = 50000
 
-
-def _json_safe(val: object) -> object:
-    """Convert non-JSON-serializable values to strings."""
-    if isinstance(val, (datetime.date, datetime.datetime)):
-        return val.isoformat()
-    if isinstance(val, decimal.Decimal):
-        return float(val)
-    if isinstance(val, bytes):
-        return val.hex()
-    if isinstance(val, uuid.UUID):
-        return str(val)
-    return val
+# Streamed results are never materialized, so they may go well beyond MAX_LIMIT
+MAX_STREAM_LIMIT = 1000000
+STREAM_BATCH_SIZE = 10000
 
 
 def _sanitize_sql(sql_text: str) -> str:
-    """Validate that the SQL is a read-only SELECT query.
+    """Validate that the SQL is a single read-only SELECT query.
 
-    Raises ValueError if the query contains forbidden statements.
+    Raises ValueError if the query is empty, unparseable or not a SELECT.
     """
-    stripped = sql_text.strip().rstrip(";").strip()
-    if not stripped:
-        raise ValueError("SQL query cannot be empty")
-
-    # Reject embedded semicolons (multi-statement injection)
-    if ";" in stripped:
-        raise ValueError("Multiple SQL statements are not allowed")
-
-    # Check for forbidden statements
-    match = _FORBIDDEN_SQL_PATTERN.search(stripped)
-    if match:
-        raise ValueError(
-            f"Forbidden SQL operation: {match.group(0).upper()}. Only SELECT queries are allowed."
-        )
+    return parse_query(sql_text).sql
 
-    # Must start with SELECT, WITH, or EXPLAIN
-    first_word = stripped.split()[0].upper()
-    if first_word not in ("SELECT", "WITH", "EXPLAIN"):
-        raise ValueError(
-            f"Query must start with SELECT, WITH, or EXPLAIN. Got: {first_word}"
-        )
 
-    return stripped
+def _ensure_limit(sql_text: str, limit: int) -> str:
+    """Cap the rows a query can return with an outer LIMIT."""
+    return parse_query(sql_text).with_limit(limit)
+
+
+def _read_profile(path: str) -> dict | None:
+    """Load the JSON profile DuckDB wrote for the last query on a connection."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _record(
+    execution: QueryExecution,
+    submitted: float,
+    started: list[float],
+    finished: bool = False,
+) -> None:
+    """Fill in the time a query waited (and, if it did not finish, ran) and report it."""
+    now = time.monotonic()
+    if started:
+        execution.queue_ms = (started[0] - submitted) * 1000
+        if not finished:
+            execution.execute_ms = (now - started[0]) * 1000
+    else:
+        execution.queue_ms = (now - submitted) * 1000
+    query_history.record(execution)
+    observe_query(execution)
+
+
+class PendingQuery:
+    """A query queued by SemanticQueryBuilder.submit_query(); result() waits for it.
+
+    Waits for a worker slot (per-tenant quota, fair share) count toward the
+    timeout. On timeout or cancellation the query is withdrawn or interrupted
+    and result() raises at once; the builder's close() then hands the
+    connection back when the worker lets go of it.
+    """
 
+    def __init__(
+        self,
+        builder: "SemanticQueryBuilder",
+        future: concurrent.futures.Future,
+        cancelled: concurrent.futures.Future,
+        run: RunningQuery,
+        execution: QueryExecution,
+        submitted: float,
+        started: list[float],
+        timeout_seconds: float,
+        size: Callable[[Any], int],
+        build: Callable[[list[dict], Any, float], dict[str, Any]],
+    ) -> None:
+        self.future = future
+        self.run_id = run.run_id
+        self._builder = builder
+        self._conn = builder._conn
+        self._cancelled = cancelled
+        self._running = run
+        self._execution = execution
+        self._submitted = submitted
+        self._started = started
+        self._timeout_seconds = timeout_seconds
+        self._size = size
+        self._build = build
+
+    def result(self) -> dict[str, Any]:
+        """Wait for the query until its deadline and return its result.
 
-def _ensure_limit(sql_text: str, limit: int) -> str:
-    """Append LIMIT clause if the query doesn't already have one."""
-    upper = sql_text.upper()
-    # Simple check: if LIMIT is already in the query, leave it
-    if re.search(r"\bLIMIT\s+\d+", upper):
-        return sql_text
-    return f"{sql_text} LIMIT {limit}"
+        Raises:
+            ValueError: If execution fails.
+            TimeoutError: If the query exceeds its timeout.
+            QueryCancelledError: If the query was cancelled.
+        """
+        execution, submitted, started = self._execution, self._submitted, self._started
+        remaining = self._submitted + self._timeout_seconds - time.monotonic()
+        try:
+            done, _ = concurrent.futures.wait(
+                [self.future, self._cancelled],
+                timeout=max(remaining, 0),
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+        finally:
+            query_registry.unregister(self._running)
+
+        if self.future in done:
+            try:
+                columns, payload, (start, executed, end), profile = self.future.result()
+            except duckdb.Error as e:
+                execution.status = "error"
+                _record(execution, submitted, started)
+                raise ValueError(f"Query execution error: {str(e)}")
+            execution.execute_ms = (executed - start) * 1000
+            execution.serialize_ms = (end - executed) * 1000
+            execution.row_count = len(payload)
+            execution.result_bytes = self._size(payload)
+            execution.profile = profile
+            _record(execution, submitted, started, finished=True)
+            return self._build(columns, payload, round((end - start) * 1000, 2))
+
+        if not query_scheduler.cancel(self.future):
+            # Already running: interrupt it; close() waits for the worker to let go
+            self._conn.interrupt()  # type: ignore[union-attr]
+            self._builder._in_flight = self.future
+        if self._cancelled.done():
+            execution.status = "cancelled"
+            _record(execution, submitted, started)
+            raise QueryCancelledError(f"Query {self.run_id} was cancelled")
+        execution.status = "timeout"
+        _record(execution, submitted, started)
+        raise TimeoutError(
+            f"Query exceeded timeout of {self._timeout_seconds} seconds"
+        )
 
 
 class SemanticQueryBuilder:
     """Creates DuckDB views from semantic layer definitions and executes SQL queries.
 
-    Each instance manages an in-memory DuckDB connection with views registered
-    from parquet files referenced in the semantic layer.
+    Without a pool, each instance manages its own in-memory DuckDB connection with
+    views registered from the parquet files referenced in the semantic layer.
+    With a pool, setup_context() checks out a cursor on a warm database that
+    already has the views registered for this workspace and layer version.
+
+    Every query run through execute_query() or execute_arrow() is reported to
+    the query history under `source` ("query", "ai" or "dashboard").
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        pool: DuckDBConnectionPool | None = None,
+        catalog: ViewCatalogCache = view_catalog,
+        source: str = "query",
+    ) -> None:
         self._conn: duckdb.DuckDBPyConnection | None = None
+        self._pool = pool
+        self._catalog = catalog
+        self.source = source
+        self._lease: PooledConnection | None = None
+        self._rollups: list[RollupSpec] = []
+        self._tenant_id: str | None = None
+        self._workspace_id: str | None = None
+        # Time setup_context() took, charged to the first query run after it
+        self._setup_ms = 0.0
+        # Where DuckDB writes the JSON profile of this connection's last query
+        self._profile_path: str | None = None
+        # Interrupted query still running on a scheduler worker, and an unfinished stream
+        self._in_flight: concurrent.futures.Future | None = None
+        self._stream_run: RunningQuery | None = None
+        self._stream_execution: tuple[QueryExecution, float, list[float]] | None = None
 
     def setup_context(
         self,
         definitions_json: dict,
         tenant_id: str | uuid.UUID,
         db: Session,
+        workspace_id: str | uuid.UUID | None = None,
     ) -> list[str]:
-        """Create DuckDB views for each table node in the semantic layer.
+        """Create (or reuse) DuckDB views for each table node in the semantic layer.
 
         Args:
             definitions_json: The semantic layer definitions with nodes and edges.
             tenant_id: Current tenant ID for data source lookup.
             db: SQLAlchemy session for looking up DataSource records.
+            workspace_id: Workspace owning the semantic layer. Required to reuse a
+                pooled context; when omitted a private connection is created.
 
         Returns:
             List of view names that were successfully created.
@@ -110,74 +217,146 @@ class SemanticQueryBuilder:
         Raises:
             ValueError: If definitions are invalid or data sources are not found.
         """
-        self._conn = duckdb.connect()
-        views_created: list[str] = []
-
-        nodes = definitions_json.get("nodes", [])
-        if not nodes:
+        if not definitions_json.get("nodes", []):
             raise ValueError("Semantic layer has no table nodes defined")
+        start = time.monotonic()
 
-        for node in nodes:
-            # Support both flat format (data_source_id) and nested (data.source_id)
-            source_id = node.get("data_source_id") or node.get("data", {}).get("source_id")
-            source_name = node.get("data_source_name") or node.get("data", {}).get("source_name")
-
-            if not source_id or not source_name:
-                continue
-
-            # Look up the DataSource record (with tenant isolation)
-            ds = (
-                db.query(DataSource)
-                .filter(
-                    DataSource.id == uuid.UUID(str(source_id)),
-                    DataSource.tenant_id == uuid.UUID(str(tenant_id)),
-                )
-                .first()
-            )
-            if not ds:
-                raise ValueError(
-                    f"Data source '{source_name}' (id={source_id}) not found for this tenant"
-                )
-
-            # Get parquet path from connection config
-            if not ds.connection_config_encrypted:
-                raise ValueError(
-                    f"Data source '{source_name}' has no storage configuration"
-                )
-
-            config = json.loads(ds.connection_config_encrypted)
-            storage_path = config.get("storage_path")
-            if not storage_path:
-                raise ValueError(
-                    f"Data source '{source_name}' has no storage path"
-                )
-
-            parquet_path = Path(storage_path) / "processed.parquet"
-            if not parquet_path.exists():
-                raise ValueError(
-                    f"Parquet file not found for data source '{source_name}'"
-                )
-
-            # Sanitize view name: only alphanumeric and underscores, max 128 chars
-            safe_name = re.sub(r"[^a-zA-Z0-9_]", "_", source_name)[:128]
-            parquet_str = str(parquet_path).replace("'", "''")
-
+        def _factory() -> tuple[duckdb.DuckDBPyConnection, list[str], set[str]]:
+            return self._build_database(definitions_json, tenant_id, db)
+
+        with tracer.span("duckdb.setup", pooled=self._pool is not None and workspace_id is not None):
+            if self._pool is not None and workspace_id is not None:
+                # Keyed on the parquet files too: a source re-ingested by another
+                # worker gets a fresh database instead of views built for the old file
+                catalog = self._catalog.resolve(definitions_json, tenant_id, db)
+                key = (str(tenant_id), str(workspace_id), f"{catalog.version}:{catalog.data_version}")
+                self._lease = self._pool.checkout(key, _factory)
+                self._conn = self._lease.cursor
+                views = self._lease.views
+            else:
+                self._conn, views, _ = _factory()
+
+            self._rollups = self._registered_rollups(definitions_json)
+            self._tenant_id = str(tenant_id)
+            self._workspace_id = str(workspace_id) if workspace_id is not None else None
+            self._enable_profiling()
+        self._setup_ms = (time.monotonic() - start) * 1000
+        duckdb_setup_duration.observe(self._setup_ms / 1000, source=self.source)
+        return views
+
+    def _enable_profiling(self) -> None:
+        """Have DuckDB write a JSON profile of every query on this connection, for the slow-query log.
+
+        Profiling settings belong to the client context, so each cursor gets its own file.
+        """
+        if not query_history.profiling:
+            return
+        profile_dir = os.path.join(duckdb_resources.temp_directory, "profiles")
+        os.makedirs(profile_dir, exist_ok=True)
+        self._profile_path = os.path.join(profile_dir, f"{uuid.uuid4().hex}.json")
+        path = self._profile_path.replace("'", "''")
+        self._conn.execute("PRAGMA enable_profiling = 'json'")  # type: ignore[union-attr]
+        self._conn.execute(f"PRAGMA profiling_output = '{path}'")  # type: ignore[union-attr]
+
+    def _registered_rollups(self, definitions_json: dict) -> list[RollupSpec]:
+        """The layer's rollups whose views exist in this context's database."""
+        specs = rollup_specs(definitions_json)
+        if not specs:
+            return []
+        existing = {
+            name for (name,) in self._conn.execute(  # type: ignore[union-attr]
+                "SELECT view_name FROM duckdb_views() WHERE NOT internal"
+            ).fetchall()
+        }
+        return [spec for spec in specs if spec.view_name in existing]
+
+    def _build_database(
+        self,
+        definitions_json: dict,
+        tenant_id: str | uuid.UUID,
+        db: Session,
+    ) -> tuple[duckdb.DuckDBPyConnection, list[str], set[str]]:
+        """Open an in-memory DuckDB database and register one view per table node.
+
+        Table nodes are resolved through the view catalog cache, so a warm catalog
+        costs no DataSource lookups. Declared rollups that are already materialized
+        are registered as views too; the others are scheduled in the background.
+        Returns the connection, the view names, and the data source ids the views
+        read from.
+        """
+        catalog = self._catalog.resolve(definitions_json, tenant_id, db)
+        conn = duckdb_resources.connect("query")
+        try:
+            with tracer.span("duckdb.views", views=len(catalog.views)):
+                self._create_views(conn, definitions_json, catalog.views)
+        except Exception:
+            duckdb_resources.close(conn)
+            raise
+
+        return conn, [view.name for view in catalog.views], catalog.data_source_ids
+
+    @staticmethod
+    def _create_views(conn: duckdb.DuckDBPyConnection, definitions_json: dict, views: Any) -> None:
+        for view in views:
+            parquet_str = view.parquet_path.replace("'", "''")
             # Quote view name with double quotes to prevent keyword collisions
-            self._conn.execute(
-                f'CREATE VIEW "{safe_name}" AS SELECT * FROM read_parquet(\'{parquet_str}\')'
+            conn.execute(
+                f'CREATE VIEW "{view.name}" AS SELECT * FROM read_parquet(\'{parquet_str}\')'
             )
-            views_created.append(safe_name)
+        register_rollups(conn, definitions_json, views)
+
+    def cursor(self) -> "SemanticQueryBuilder":
+        """Return a builder on a new cursor of this context's database.
+
+        The cursor sees the same views but has its own client context, so queries
+        on several cursors can run concurrently. Close it before closing this builder.
+
+        Raises:
+            RuntimeError: If no context has been set up.
+        """
+        if not self._conn:
+            raise RuntimeError("No query context set up. Call setup_context() first.")
+        child = SemanticQueryBuilder(catalog=self._catalog, source=self.source)
+        child._conn = self._conn.cursor()
+        child._rollups = self._rollups
+        child._tenant_id = self._tenant_id
+        child._workspace_id = self._workspace_id
+        child._enable_profiling()
+        return child
 
-        if not views_created:
-            raise ValueError("No views could be created from the semantic layer")
+    @property
+    def has_context(self) -> bool:
+        """Whether setup_context() succeeded and the views can be queried."""
+        return self._conn is not None
+
+    def validate(self, sql_text: str) -> None:
+        """Bind and plan a sanitized query against the views without running it.
+
+        Catches unknown tables or columns and type errors in milliseconds, before
+        any parquet data is scanned.
+
+        Raises:
+            ValueError: If SQL is forbidden or fails to bind.
+            RuntimeError: If no context has been set up.
+        """
+        if not self._conn:
+            raise RuntimeError("No query context set up. Call setup_context() first.")
 
-        return views_created
+        parsed = parse_query(sql_text)
+        if parsed.explain:
+            return
+        try:
+            with tracer.span("duckdb.validate"):
+                self._conn.execute(f"EXPLAIN {parsed.sql}")
+        except duckdb.Error as e:
+            raise ValueError(f"Query validation error: {str(e)}")
 
     def execute_query(
         self,
         sql_text: str,
         limit: int = DEFAULT_LIMIT,
         timeout_seconds: int = 30,
+        run_id: str | None = None,
     ) -> dict[str, Any]:
         """Execute a sanitized SQL query against the DuckDB views.
 
@@ -185,68 +364,381 @@ class SemanticQueryBuilder:
             sql_text: The SQL query to execute.
             limit: Maximum number of rows to return.
             timeout_seconds: Query timeout in seconds.
+            run_id: Id under which the query can be cancelled while it runs
+                (generated when omitted).
 
         Returns:
             Dict with columns, rows, row_count, and execution_time_ms.
 
         Raises:
-            ValueError: If SQL is invalid or contains forbidden operations.
+            ValueError: If SQL is invalid or contains forbidden operations, or
+                the run id is already in use.
             RuntimeError: If no context has been set up.
             TimeoutError: If query exceeds timeout.
+            QueryCancelledError: If the query was cancelled.
+            QueryOverloadedError: If the query queue is full.
         """
-        if not self._conn:
-            raise RuntimeError("No query context set up. Call setup_context() first.")
+        return self.submit_query(sql_text, limit, timeout_seconds, run_id).result()
 
-        # Sanitize
-        sanitized = _sanitize_sql(sql_text)
+    def submit_query(
+        self,
+        sql_text: str,
+        limit: int = DEFAULT_LIMIT,
+        timeout_seconds: int = 30,
+        run_id: str | None = None,
+    ) -> "PendingQuery":
+        """Queue a query like execute_query() without waiting for it.
 
-        # Enforce limit
-        effective_limit = min(limit, MAX_LIMIT)
-        sanitized = _ensure_limit(sanitized, effective_limit)
+        The returned PendingQuery's result() waits for the query (the timeout
+        runs from submission) and returns what execute_query() would, or raises
+        what it would. Lets a caller queue queries on several cursors before
+        waiting on any of them.
 
-        start = time.monotonic()
+        Raises:
+            ValueError: If SQL is invalid or contains forbidden operations, or
+                the run id is already in use.
+            RuntimeError: If no context has been set up.
+            QueryOverloadedError: If the query queue is full.
+        """
+        def _fetch_rows(result: duckdb.DuckDBPyConnection, columns: list[dict]) -> list[dict]:
+            with tracer.span("duckdb.fetch"):
+                raw_rows = result.fetchall()
+            with tracer.span("json_safe", rows=len(raw_rows)):
+                return [
+                    {col["name"]: json_safe(val) for col, val in zip(columns, row)}
+                    for row in raw_rows
+                ]
+
+        def _build(columns: list[dict], rows: list[dict], elapsed_ms: float) -> dict[str, Any]:
+            return {
+                "columns": columns,
+                "rows": rows,
+                "row_count": len(rows),
+                "execution_time_ms": elapsed_ms,
+            }
 
-        def _run_query() -> tuple[list[dict], list[dict]]:
-            result = self._conn.execute(sanitized)  # type: ignore[union-attr]
-            columns = [
-                {"name": desc[0], "type": str(desc[1])}
-                for desc in result.description
-            ]
-            raw_rows = result.fetchall()
-            rows = [
-                {col["name"]: _json_safe(val) for col, val in zip(columns, row)}
-                for row in raw_rows
-            ]
-            return columns, rows
+        return self._submit(
+            sql_text, limit, timeout_seconds, _fetch_rows, estimate_json_bytes, _build, run_id
+        )
 
-        try:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
-                future = pool.submit(_run_query)
-                columns, rows = future.result(timeout=timeout_seconds)
+    def execute_arrow(
+        self,
+        sql_text: str,
+        limit: int = DEFAULT_LIMIT,
+        timeout_seconds: int = 30,
+        run_id: str | None = None,
+    ) -> dict[str, Any]:
+        """Execute a sanitized SQL query and return the result as an Arrow table.
+
+        Skips the per-row Python conversion of execute_query(); the table comes
+        straight from DuckDB's columnar result.
+
+        Returns:
+            Dict with columns, table (pyarrow.Table), row_count, and execution_time_ms.
 
-            elapsed_ms = round((time.monotonic() - start) * 1000, 2)
+        Raises:
+            Same as execute_query().
+        """
+        def _fetch_arrow(result: duckdb.DuckDBPyConnection, columns: list[dict]) -> Any:
+            with tracer.span("duckdb.fetch"):
+                return result.fetch_arrow_table()
 
+        def _build(columns: list[dict], table: Any, elapsed_ms: float) -> dict[str, Any]:
             return {
                 "columns": columns,
-                "rows": rows,
-                "row_count": len(rows),
+                "table": table,
+                "row_count": table.num_rows,
                 "execution_time_ms": elapsed_ms,
             }
-        except concurrent.futures.TimeoutError:
-            # Cancel the connection to abort the running query
-            if self._conn:
-                self._conn.interrupt()
-            raise TimeoutError(
-                f"Query exceeded timeout of {timeout_seconds} seconds"
-            )
+
+        return self._submit(
+            sql_text, limit, timeout_seconds, _fetch_arrow, lambda table: table.nbytes, _build, run_id
+        ).result()
+
+    def execute_stream(
+        self,
+        sql_text: str,
+        limit: int = DEFAULT_LIMIT,
+        batch_size: int = STREAM_BATCH_SIZE,
+        run_id: str | None = None,
+        timeout_seconds: int = 30,
+    ) -> dict[str, Any]:
+        """Start a sanitized query and return its result as a stream of Arrow record batches.
+
+        The query starts on the query scheduler like any other, and frees its
+        worker as soon as DuckDB has returned the result reader. Rows are then
+        pulled from DuckDB on the caller's thread, one batch at a time as it
+        iterates, so a slow reader does not hold a worker and memory stays
+        proportional to batch_size rather than the result size. The connection
+        must stay open until iteration ends; close() aborts a stream that has
+        not been read to the end. The query is registered under `run_id` until
+        then, so it can be cancelled.
+
+        Returns:
+            Dict with columns, schema (pyarrow.Schema) and batches (iterator of
+            pyarrow.RecordBatch).
+
+        Raises:
+            ValueError: If SQL is invalid, forbidden, or fails to start (also
+                raised from the iterator if DuckDB fails mid-stream), or the
+                run id is already in use.
+            RuntimeError: If no context has been set up.
+            TimeoutError: If the query has not started within the timeout.
+            QueryCancelledError: If the query was cancelled (also raised from
+                the iterator).
+            QueryOverloadedError: If the query queue is full.
+        """
+        if not self._conn:
+            raise RuntimeError("No query context set up. Call setup_context() first.")
+
+        if self._in_flight is not None:
+            concurrent.futures.wait([self._in_flight])
+            self._in_flight = None
+
+        parsed, sanitized = self._prepare(sql_text, min(limit, MAX_STREAM_LIMIT))
+        conn = self._conn
+        execution = QueryExecution(
+            tenant_id=str(self._tenant_id),
+            workspace_id=self._workspace_id,
+            source=self.source,
+            query_hash=parsed.fingerprint,
+            sql_text=parsed.sql,
+            setup_ms=self._setup_ms,
+            row_count=0,
+            result_bytes=0,
+        )
+        self._setup_ms = 0.0
+        submitted = time.monotonic()
+        started: list[float] = []
+        streaming = threading.Event()
+        # Resolved by the registry's canceller while the query waits or starts
+        cancelled: concurrent.futures.Future = concurrent.futures.Future()
+
+        def _cancel() -> None:
+            cancelled.set_result(None)
+            if streaming.is_set():
+                conn.interrupt()
+
+        def _start() -> tuple[list[dict], Any]:
+            started.append(time.monotonic())
+            with tracer.span("duckdb.execute"):
+                result = conn.execute(sanitized)
+            columns = [
+                {"name": desc[0], "type": str(desc[1])}
+                for desc in result.description
+            ]
+            return columns, result.fetch_record_batch(batch_size)
+
+        run = query_registry.register(
+            self._tenant_id, run_id or query_registry.new_run_id(), sanitized, _cancel
+        )
+        try:
+            context = contextvars.copy_context()
+            future = query_scheduler.submit(self._tenant_id, lambda: context.run(_start))
+        except QueryOverloadedError:
+            query_registry.unregister(run)
+            execution.status = "rejected"
+            _record(execution, submitted, started)
+            raise
+        # Waits for a worker slot count toward the timeout, as for PendingQuery
+        done, _ = concurrent.futures.wait(
+            [future, cancelled],
+            timeout=timeout_seconds,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        if future not in done:
+            if not query_scheduler.cancel(future):
+                conn.interrupt()
+                self._in_flight = future
+            query_registry.unregister(run)
+            execution.status = "cancelled" if cancelled.done() else "timeout"
+            _record(execution, submitted, started)
+            if cancelled.done():
+                raise QueryCancelledError(f"Query {run.run_id} was cancelled")
+            raise TimeoutError(f"Query exceeded timeout of {timeout_seconds} seconds")
+        try:
+            columns, reader = future.result()
         except duckdb.Error as e:
+            query_registry.unregister(run)
+            execution.status = "cancelled" if run.cancelled else "error"
+            _record(execution, submitted, started)
+            if run.cancelled:
+                raise QueryCancelledError(f"Query {run.run_id} was cancelled")
             raise ValueError(f"Query execution error: {str(e)}")
+        self._stream_run = run
+        self._stream_execution = (execution, submitted, started)
+        streaming.set()
+
+        def _batches() -> Iterator[Any]:
+            try:
+                for batch in reader:
+                    if run.cancelled:
+                        break
+                    execution.row_count += batch.num_rows  # type: ignore[operator]
+                    execution.result_bytes += batch.nbytes  # type: ignore[operator]
+                    yield batch
+            # The record batch reader reports DuckDB errors (and interrupts) as OSError
+            except (duckdb.Error, OSError) as e:
+                if not run.cancelled:
+                    self._end_stream(interrupt=False, status="error")
+                    raise ValueError(f"Query execution error: {str(e)}")
+            if run.cancelled:
+                self._end_stream(interrupt=False, status="cancelled")
+                raise QueryCancelledError(f"Query {run.run_id} was cancelled")
+            self._end_stream(interrupt=False, status="ok")
+
+        return {
+            "columns": columns,
+            "schema": reader.schema,
+            "batches": _batches(),
+            "run_id": run.run_id,
+        }
+
+    def _end_stream(self, interrupt: bool, status: str = "cancelled") -> None:
+        """Release an open stream's run id and record the execution.
+
+        A stream closed before it was drained (e.g. the client went away) is
+        recorded as cancelled.
+        """
+        run, self._stream_run = self._stream_run, None
+        recorded, self._stream_execution = self._stream_execution, None
+        if run is None:
+            return
+        query_registry.unregister(run)
+        if interrupt and self._conn:
+            self._conn.interrupt()
+        if recorded is not None:
+            execution, submitted, started = recorded
+            execution.status = status
+            _record(execution, submitted, started)
+
+    def _prepare(self, sql_text: str, limit: int) -> tuple[ParsedQuery, str]:
+        """Sanitize a query, rewrite it onto a rollup when one can answer it, and cap its rows.
+
+        Returns the query as parsed (before any rewrite) and the SQL to run.
+        """
+        parsed = parse_query(sql_text)
+        routed = parsed
+        if self._rollups:
+            try:
+                routed, _ = rewrite_for_rollups(self._conn, parsed, self._rollups)  # type: ignore[arg-type]
+            except duckdb.Error:
+                # Invalid SQL: run it as written so execution reports the error
+                pass
+        return parsed, routed.with_limit(limit)
+
+    def _submit(
+        self,
+        sql_text: str,
+        limit: int,
+        timeout_seconds: int,
+        fetch: Callable[[duckdb.DuckDBPyConnection, list[dict]], T],
+        size: Callable[[T], int],
+        build: Callable[[list[dict], T, float], dict[str, Any]],
+        run_id: str | None = None,
+    ) -> "PendingQuery":
+        """Sanitize, cap and queue a query on the query scheduler.
+
+        `fetch` materializes the result on the worker thread, `size` gives its
+        size in bytes for the query history and `build` shapes what result()
+        returns from the columns, the fetched payload and the run time.
+        """
+        if not self._conn:
+            raise RuntimeError("No query context set up. Call setup_context() first.")
+
+        if self._in_flight is not None:
+            # A previous query on this connection was interrupted: let it unwind first
+            concurrent.futures.wait([self._in_flight])
+            self._in_flight = None
+
+        # Sanitize, route to a rollup and enforce limit
+        parsed, sanitized = self._prepare(sql_text, min(limit, MAX_LIMIT))
+        conn = self._conn
+        profile_path = self._profile_path
+        execution = QueryExecution(
+            tenant_id=str(self._tenant_id),
+            workspace_id=self._workspace_id,
+            source=self.source,
+            query_hash=parsed.fingerprint,
+            sql_text=parsed.sql,
+            setup_ms=self._setup_ms,
+        )
+        self._setup_ms = 0.0
+        submitted = time.monotonic()
+        started: list[float] = []
+        # Runs on a scheduler worker in a copy of this context, so its spans join the request's trace
+        context = contextvars.copy_context()
+
+        def _run_query() -> tuple[list[dict], T, tuple[float, float, float], dict | None]:
+            start = time.monotonic()
+            started.append(start)
+            tracer.record_span("duckdb.queue", submitted, start)
+            with tracer.span("duckdb.execute"):
+                result = conn.execute(sanitized)
+            executed = time.monotonic()
+            columns = [
+                {"name": desc[0], "type": str(desc[1])}
+                for desc in result.description
+            ]
+            payload = fetch(result, columns)
+            end = time.monotonic()
+            profile = None
+            if profile_path and query_history.is_slow((end - start) * 1000):
+                profile = _read_profile(profile_path)
+            return columns, payload, (start, executed, end), profile
+
+        # Resolved by the registry's canceller (Future.cancel() would not wake wait())
+        cancelled: concurrent.futures.Future = concurrent.futures.Future()
+        run = query_registry.register(
+            self._tenant_id, run_id or query_registry.new_run_id(), sanitized,
+            lambda: cancelled.set_result(None),
+        )
+        try:
+            future = query_scheduler.submit(self._tenant_id, lambda: context.run(_run_query))
+        except QueryOverloadedError:
+            query_registry.unregister(run)
+            execution.status = "rejected"
+            _record(execution, submitted, started)
+            raise
+        return PendingQuery(
+            self, future, cancelled, run, execution, submitted, started, timeout_seconds, size, build
+        )
 
     def close(self) -> None:
-        """Close the DuckDB connection."""
-        if self._conn:
-            self._conn.close()
-            self._conn = None
+        """Close the DuckDB connection, or hand a pooled one back to the pool.
+
+        Aborts an unfinished stream. If an interrupted query is still unwinding
+        on a worker thread, the connection is released once it returns, without
+        blocking the caller.
+        """
+        self._end_stream(interrupt=True)
+        lease, conn = self._lease, self._conn
+        in_flight = self._in_flight
+        self._lease = None
+        self._conn = None
+        self._in_flight = None
+        self._rollups = []
+        profile_path, self._profile_path = self._profile_path, None
+        if in_flight is not None and not in_flight.done():
+            in_flight.add_done_callback(lambda _: self._release(lease, conn, profile_path))
+        else:
+            self._release(lease, conn, profile_path)
+
+    @staticmethod
+    def _release(
+        lease: PooledConnection | None,
+        conn: duckdb.DuckDBPyConnection | None,
+        profile_path: str | None = None,
+    ) -> None:
+        if lease is not None:
+            lease.release()
+        elif conn is not None:
+            duckdb_resources.close(conn)
+        if profile_path is not None:
+            try:
+                os.remove(profile_path)
+            except FileNotFoundError:
+                pass
 
     def __enter__(self) -> "SemanticQueryBuilder":
         return self
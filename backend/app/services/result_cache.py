@@ -0,0 +1,174 @@
+"""Query result cache — tenant-scoped, size-bounded LRU with TTL.
+
+Parquet files never change after upload, so the result of a read-only query is
+fully determined by its SQL, its row limit, and the files it reads. Entries are
+keyed on exactly that, which makes them safe to serve until their TTL expires
+or a data source they depend on is deleted.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from app.config import settings
+
+# (tenant_id, normalized SQL, limit, data version, result format)
+ResultKey = tuple[str, str, int, str, str]
+
+
+def normalize_sql(sql_text: str) -> str:
+    """Collapse whitespace outside string literals and quoted identifiers.
+
+    Trailing semicolons are dropped so `SELECT 1;` and `SELECT  1` share a key;
+    quoted text is kept verbatim because whitespace there is significant.
+    """
+    out: list[str] = []
+    quote: str | None = None
+    pending_space = False
+    for ch in sql_text.strip().rstrip(";").strip():
+        if quote:
+            out.append(ch)
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            if pending_space:
+                out.append(" ")
+                pending_space = False
+            out.append(ch)
+            quote = ch
+        elif ch.isspace():
+            pending_space = bool(out)
+        else:
+            if pending_space:
+                out.append(" ")
+                pending_space = False
+            out.append(ch)
+    return "".join(out)
+
+
+def _estimate_size(result: dict[str, Any]) -> int:
+    """Cheap approximation of a result's memory footprint in bytes."""
+    if "body" in result:
+        return 256 + len(result["body"])
+    columns = max(1, len(result.get("columns", [])))
+    return 256 + result.get("row_count", 0) * columns * 48
+
+
+@dataclass
+class _CacheEntry:
+    result: dict[str, Any]
+    data_source_ids: frozenset[str]
+    size: int
+    expires_at: float
+
+
+class QueryResultCache:
+    """LRU cache of query results bounded by an approximate byte budget."""
+
+    def __init__(self, max_bytes: int, ttl_seconds: float) -> None:
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[ResultKey, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(
+        tenant_id: str | uuid.UUID,
+        sql_text: str,
+        limit: int,
+        data_version: str,
+        result_format: str = "json",
+    ) -> ResultKey:
+        return (str(tenant_id), normalize_sql(sql_text), limit, data_version, result_format)
+
+    def get(self, key: ResultKey) -> dict[str, Any] | None:
+        """Return the cached result for `key`, or None on a miss or expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._drop_locked(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry.result
+
+    def put(
+        self,
+        key: ResultKey,
+        result: dict[str, Any],
+        data_source_ids: set[str] | frozenset[str],
+    ) -> None:
+        """Store a result; results larger than a quarter of the budget are skipped."""
+        size = _estimate_size(result)
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop_locked(key)
+            self._entries[key] = _CacheEntry(
+                result=result,
+                data_source_ids=frozenset(str(i) for i in data_source_ids),
+                size=size,
+                expires_at=time.monotonic() + self.ttl_seconds,
+            )
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop_locked(oldest)
+                self._evictions += 1
+
+    def invalidate(
+        self,
+        *,
+        tenant_id: object | None = None,
+        data_source_id: object | None = None,
+    ) -> int:
+        """Drop every entry matching all the given filters. Returns the number dropped."""
+        tenant = str(tenant_id) if tenant_id is not None else None
+        source = str(data_source_id) if data_source_id is not None else None
+        with self._lock:
+            doomed = [
+                key
+                for key, entry in self._entries.items()
+                if (tenant is None or key[0] == tenant)
+                and (source is None or source in entry.data_source_ids)
+            ]
+            for key in doomed:
+                self._drop_locked(key)
+            return len(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Return cache counters for monitoring."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+    def _drop_locked(self, key: ResultKey) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+
+query_result_cache = QueryResultCache(
+    max_bytes=settings.query_cache_max_mb * 1024 * 1024,
+    ttl_seconds=settings.query_cache_ttl_seconds,
+)
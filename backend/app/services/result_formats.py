@@ -0,0 +1,178 @@
+"""Result formats — columnar JSON and Arrow IPC encodings of query results.
+
+The default row-oriented JSON repeats every column name on every row and needs
+one Python dict per row. Clients that opt in can instead receive:
+
+- "columnar": {"columns": [...], "data": [[values of column 0], ...], ...}
+- "arrow": an Arrow IPC stream, taken directly from DuckDB's Arrow result.
+"""
+
+import datetime
+import decimal
+import io
+import json
+import time
+import uuid
+from typing import Callable, Iterable, Iterator
+
+import pyarrow as pa
+from fastapi.responses import JSONResponse, Response
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def json_safe(val: object) -> object:
+    """Convert non-JSON-serializable values to strings."""
+    if isinstance(val, (datetime.date, datetime.datetime)):
+        return val.isoformat()
+    if isinstance(val, decimal.Decimal):
+        return float(val)
+    if isinstance(val, bytes):
+        return val.hex()
+    if isinstance(val, uuid.UUID):
+        return str(val)
+    return val
+
+
+def resolve_format(requested: str | None, accept: str | None) -> str:
+    """Pick the response format from an explicit parameter or the Accept header."""
+    if requested:
+        return requested
+    if accept and ARROW_STREAM_MEDIA_TYPE in accept:
+        return "arrow"
+    return "json"
+
+
+def _needs_conversion(arrow_type: pa.DataType) -> bool:
+    """Whether values of this type are not JSON-native once converted to Python."""
+    return (
+        pa.types.is_temporal(arrow_type)
+        or pa.types.is_decimal(arrow_type)
+        or pa.types.is_binary(arrow_type)
+        or pa.types.is_large_binary(arrow_type)
+        or pa.types.is_fixed_size_binary(arrow_type)
+    )
+
+
+def table_to_columnar(table: pa.Table | pa.RecordBatch) -> list[list]:
+    """Convert an Arrow table to a list of column value lists, JSON-safe.
+
+    Only columns whose type needs it (dates, decimals, blobs) go through
+    json_safe; numeric and string columns are converted in bulk by Arrow.
+    """
+    data: list[list] = []
+    for column in table.columns:
+        values = column.to_pylist()
+        if _needs_conversion(column.type):
+            values = [json_safe(v) for v in values]
+        data.append(values)
+    return data
+
+
+def table_to_ipc(table: pa.Table) -> bytes:
+    """Serialize an Arrow table as an Arrow IPC stream."""
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def encode_table(result_format: str, table: pa.Table) -> dict:
+    """Encode an Arrow table for a non-default format.
+
+    Returns {"data": [...]} for columnar JSON or {"body": bytes} for Arrow IPC.
+    """
+    if result_format == "arrow":
+        return {"body": table_to_ipc(table)}
+    return {"data": table_to_columnar(table)}
+
+
+# X-* headers build_response() sets on Arrow responses, exposed to browsers through CORS
+ARROW_METADATA_HEADERS = [
+    "X-Row-Count",
+    "X-Execution-Time-Ms",
+    "X-Cache-Status",
+    "X-Run-Id",
+    "X-Total-Rows",
+    "X-Page",
+    "X-Page-Size",
+    "X-Total-Pages",
+    "X-Next-Cursor",
+    "X-Prev-Cursor",
+]
+
+
+def build_response(result_format: str, payload: dict) -> Response | dict:
+    """Turn an encoded payload into the HTTP response for its format.
+
+    Row-oriented JSON is returned as-is for the route's response_model. Columnar
+    JSON skips response_model validation (the payload is already JSON-safe).
+    Arrow IPC streams carry scalar metadata (row_count, cache_status, ...) as
+    X-* headers since the body is the stream itself.
+    """
+    if result_format == "json":
+        return payload
+    if result_format == "columnar":
+        return JSONResponse(content=payload)
+    headers = {
+        "X-" + key.replace("_", "-").title(): str(value)
+        for key, value in payload.items()
+        if key != "body" and isinstance(value, (str, int, float))
+    }
+    return Response(content=payload["body"], media_type=ARROW_STREAM_MEDIA_TYPE, headers=headers)
+
+
+def stream_ndjson(
+    columns: list[dict],
+    batches: Iterable[pa.RecordBatch],
+    on_close: Callable[[], None] | None = None,
+) -> Iterator[bytes]:
+    """Yield a query result as NDJSON, one line per record batch.
+
+    Lines are {"type": "columns", ...} first, then one {"type": "rows", "rows": [...]}
+    per batch, and a final {"type": "end", "row_count", "execution_time_ms"}.
+    `on_close` runs once the stream is exhausted, fails, or is abandoned.
+    """
+    start = time.monotonic()
+    names = [col["name"] for col in columns]
+    row_count = 0
+    try:
+        yield (json.dumps({"type": "columns", "columns": columns}) + "\n").encode()
+        for batch in batches:
+            rows = [dict(zip(names, values)) for values in zip(*table_to_columnar(batch))]
+            row_count += len(rows)
+            yield (json.dumps({"type": "rows", "rows": rows}, default=str) + "\n").encode()
+        yield (json.dumps({
+            "type": "end",
+            "row_count": row_count,
+            "execution_time_ms": round((time.monotonic() - start) * 1000, 2),
+        }) + "\n").encode()
+    finally:
+        if on_close:
+            on_close()
+
+
+def stream_arrow(
+    schema: pa.Schema,
+    batches: Iterable[pa.RecordBatch],
+    on_close: Callable[[], None] | None = None,
+) -> Iterator[bytes]:
+    """Yield a query result as an Arrow IPC stream, flushed after every record batch."""
+    sink = io.BytesIO()
+    try:
+        with pa.ipc.new_stream(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                yield _drain(sink)
+        yield _drain(sink)
+    finally:
+        if on_close:
+            on_close()
+
+
+def _drain(sink: io.BytesIO) -> bytes:
+    chunk = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return chunk
@@ -0,0 +1,504 @@
+"""Rollup service — pre-aggregated parquet files declared on the semantic layer.
+
+A semantic layer may declare rollups of a table node: group-by dimensions plus
+measure columns. Each rollup is materialized next to the source parquet as one
+row per combination of dimensions, holding the sum, count, min and max of every
+measure and the row count. Aggregate queries on the source table that only
+group and filter by those dimensions and aggregate those measures are rewritten
+(on the query's DuckDB parse tree, see sql_parser) to read the rollup instead.
+Rollups are written in the background (see RollupMaterializer); until a rollup's
+file exists, queries read the source table.
+
+Declared in definitions_json as:
+
+    "rollups": [{"name": "ventes_par_region", "source": "fact_ventes",
+                 "dimensions": ["region", "annee"], "measures": ["montant"]}]
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import duckdb
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.services.catalog_service import CatalogView, view_catalog, view_name_for
+from app.services.connection_pool import connection_pool
+from app.services.duckdb_resources import duckdb_resources
+from app.services.sql_parser import ParsedQuery, serialize_sql
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_VIEW_PREFIX = "__rollup_"
+# Bumped when the materialized columns change, so older rollup files are rebuilt
+_ROLLUP_FORMAT = 2
+
+# Aggregates answered from the stored partial aggregates, as DuckDB expressions.
+# `sum` is cast back to the type sum() has on the source column; counts of an
+# empty selection are 0, not the NULL sum() gives.
+_REWRITES = {
+    "sum": 'CAST(sum("sum__{col}") AS {sum_type})',
+    "min": 'min("min__{col}")',
+    "max": 'max("max__{col}")',
+    "count": 'COALESCE(CAST(sum("count__{col}") AS BIGINT), 0)',
+    "avg": 'CAST(sum("sum__{col}") AS DOUBLE) / sum("count__{col}")',
+}
+_COUNT_STAR_REWRITE = 'COALESCE(CAST(sum("count__star") AS BIGINT), 0)'
+_GROUPING_HANDLING = {"STANDARD_HANDLING", "FORCE_AGGREGATES"}
+
+_aggregate_functions: frozenset[str] | None = None
+
+
+def _aggregate_function_names(conn: duckdb.DuckDBPyConnection) -> frozenset[str]:
+    """Names of DuckDB's aggregate functions (other aggregates cannot use a rollup)."""
+    global _aggregate_functions
+    if _aggregate_functions is None:
+        rows = conn.execute(
+            "SELECT DISTINCT function_name FROM duckdb_functions() WHERE function_type = 'aggregate'"
+        ).fetchall()
+        _aggregate_functions = frozenset(name for (name,) in rows)
+    return _aggregate_functions
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+@dataclass(frozen=True)
+class RollupSpec:
+    """A rollup declared on the semantic layer."""
+    name: str
+    source: str  # view name of the table node it aggregates
+    dimensions: tuple[str, ...]
+    measures: tuple[str, ...]
+
+    @property
+    def view_name(self) -> str:
+        return f"{ROLLUP_VIEW_PREFIX}{self.name}"
+
+    def file_path(self, view: CatalogView) -> Path:
+        """Where this rollup of `view`'s current parquet file is materialized."""
+        spec = json.dumps([_ROLLUP_FORMAT, self.dimensions, self.measures, view.fingerprint])
+        digest = hashlib.sha256(spec.encode()).hexdigest()[:16]
+        return Path(view.parquet_path).parent / "rollups" / f"{self.name}-{digest}.parquet"
+
+
+def rollup_specs(definitions_json: dict) -> list[RollupSpec]:
+    """Parse the rollups declared in a semantic layer, skipping malformed entries."""
+    specs: list[RollupSpec] = []
+    for entry in definitions_json.get("rollups") or []:
+        if not isinstance(entry, dict):
+            continue
+        name, source = entry.get("name"), entry.get("source")
+        dimensions, measures = entry.get("dimensions") or [], entry.get("measures") or []
+        if (
+            not isinstance(name, str)
+            or not isinstance(source, str)
+            or not all(isinstance(col, str) for col in [*dimensions, *measures])
+            or not (dimensions or measures)
+        ):
+            logger.warning("Ignoring malformed rollup declaration: %s", entry)
+            continue
+        specs.append(RollupSpec(
+            name=view_name_for(name),
+            source=view_name_for(source),
+            dimensions=tuple(dimensions),
+            measures=tuple(measures),
+        ))
+    return specs
+
+
+class RollupMetrics:
+    """Process-wide rollup counters: rewrite hit rate and materializations."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._hits_by_rollup: dict[str, int] = {}
+        self._materialized = 0
+        self._materialize_errors = 0
+
+    def record_rewrite(self, rollup: str | None) -> None:
+        with self._lock:
+            if rollup is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._hits_by_rollup[rollup] = self._hits_by_rollup.get(rollup, 0) + 1
+
+    def record_materialization(self, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self._materialized += 1
+            else:
+                self._materialize_errors += 1
+
+    def hits_by_rollup(self) -> dict[str, int]:
+        """Return rewrite hits per rollup name.
+
+        Kept out of stats(): rollup names come from tenants' semantic layers, so
+        they must not become labels on the unauthenticated /metrics endpoint.
+        """
+        with self._lock:
+            return dict(self._hits_by_rollup)
+
+    def stats(self) -> dict:
+        """Return rollup counters for monitoring.
+
+        `hits` and `misses` count aggregate queries on a table that has rollups,
+        by whether one of them could answer the query.
+        """
+        with self._lock:
+            considered = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / considered, 4) if considered else 0.0,
+                "materialized": self._materialized,
+                "materialize_errors": self._materialize_errors,
+            }
+
+
+rollup_metrics = RollupMetrics()
+
+
+def materialize_rollup(conn: duckdb.DuckDBPyConnection, spec: RollupSpec, view: CatalogView) -> Path:
+    """Write the rollup of a source parquet file unless it is already up to date.
+
+    The file name includes the source fingerprint, so a re-uploaded source gets a
+    new rollup and older files of the same rollup are removed.
+    """
+    path = spec.file_path(view)
+    if path.exists():
+        return path
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    source = view.parquet_path.replace("'", "''")
+    sum_types = _sum_types(conn, f"read_parquet('{source}')", spec.measures)
+    columns = [_quote(dim) for dim in spec.dimensions]
+    for measure in spec.measures:
+        col = _quote(measure)
+        for agg in ("sum", "count", "min", "max"):
+            expr = f"{agg}({col})"
+            if agg == "sum" and sum_types[measure] == "HUGEINT":
+                # Parquet has no 128-bit integers and would store the sum as DOUBLE
+                expr = f"CAST({expr} AS DECIMAL(38,0))"
+            columns.append(f"{expr} AS {_quote(f'{agg}__{measure}')}")
+    columns.append('count(*) AS "count__star"')
+    group_by = f" GROUP BY {', '.join(_quote(dim) for dim in spec.dimensions)}" if spec.dimensions else ""
+
+    tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    tmp_str = str(tmp_path).replace("'", "''")
+    try:
+        conn.execute(
+            f"COPY (SELECT {', '.join(columns)} FROM read_parquet('{source}'){group_by}) "
+            f"TO '{tmp_str}' (FORMAT PARQUET)"
+        )
+        os.replace(tmp_path, path)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        rollup_metrics.record_materialization(ok=False)
+        raise
+    rollup_metrics.record_materialization(ok=True)
+
+    for old in path.parent.glob(f"{spec.name}-*.parquet"):
+        if old != path:
+            old.unlink(missing_ok=True)
+    return path
+
+
+def _sum_types(conn: duckdb.DuckDBPyConnection, relation: str, measures: tuple[str, ...]) -> dict[str, str]:
+    """The type sum() returns for each measure of `relation` (bound, not run)."""
+    if not measures:
+        return {}
+    sums = ", ".join(f"sum({_quote(measure)})" for measure in measures)
+    rows = conn.execute(f"DESCRIBE SELECT {sums} FROM {relation}").fetchall()
+    return {measure: row[1] for measure, row in zip(measures, rows)}
+
+
+class RollupMaterializer:
+    """Writes rollup files on a small background thread pool.
+
+    A full scan of the source per rollup is too slow for the request that saves
+    a semantic layer or builds a query context, so they only schedule the work.
+    A rollup already being written is not scheduled twice. Once it is written,
+    pooled query databases reading its source are dropped so that the next
+    context registers the rollup.
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rollup")
+        self._changed = threading.Condition()
+        self._pending: set[Path] = set()
+
+    def schedule(self, spec: RollupSpec, view: CatalogView) -> bool:
+        """Queue the materialization of `spec` on `view` unless it is written or queued."""
+        path = spec.file_path(view)
+        if path.exists():
+            return False
+        with self._changed:
+            if path in self._pending:
+                return False
+            self._pending.add(path)
+        self._executor.submit(self._run, spec, view, path)
+        return True
+
+    def _run(self, spec: RollupSpec, view: CatalogView, path: Path) -> None:
+        try:
+            with duckdb_resources.connection("ingestion") as conn:
+                materialize_rollup(conn, spec, view)
+        except Exception as e:
+            logger.warning("Rollup '%s' could not be materialized: %s", spec.name, e)
+        else:
+            connection_pool.invalidate(data_source_id=view.data_source_id)
+        finally:
+            with self._changed:
+                self._pending.discard(path)
+                self._changed.notify_all()
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        """Block until no materialization is queued or running. False on timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: not self._pending, timeout)
+
+    def stats(self) -> dict:
+        with self._changed:
+            return {"max_workers": self.max_workers, "pending": len(self._pending)}
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+rollup_materializer = RollupMaterializer(max_workers=settings.rollup_max_workers)
+
+
+def register_rollups(
+    conn: duckdb.DuckDBPyConnection,
+    definitions_json: dict,
+    views: tuple[CatalogView, ...] | list[CatalogView],
+) -> list[str]:
+    """Create a view for each of the layer's rollups that is already materialized.
+
+    The others are scheduled on rollup_materializer and skipped: queries keep
+    reading the source table until they are written. Returns the names of the
+    registered rollups.
+    """
+    by_name = {view.name: view for view in views}
+    registered: list[str] = []
+    for spec in rollup_specs(definitions_json):
+        view = by_name.get(spec.source)
+        if view is None:
+            continue
+        path = spec.file_path(view)
+        if not path.exists():
+            rollup_materializer.schedule(spec, view)
+            continue
+        path_str = str(path).replace("'", "''")
+        try:
+            conn.execute(
+                f"CREATE VIEW {_quote(spec.view_name)} AS SELECT * FROM read_parquet('{path_str}')"
+            )
+        except duckdb.Error as e:
+            logger.warning("Rollup '%s' unavailable: %s", spec.name, e)
+            continue
+        registered.append(spec.name)
+    return registered
+
+
+def refresh_rollups(definitions_json: dict, tenant_id: str | uuid.UUID, db: Session) -> list[str]:
+    """Schedule the materialization of a semantic layer's rollups ahead of its first query.
+
+    Sources that cannot be resolved yet (e.g. still ingesting) are skipped; their
+    rollups are scheduled when a query context is next built. Returns the names
+    of the rollups newly scheduled.
+    """
+    specs = rollup_specs(definitions_json)
+    if not specs:
+        return []
+    try:
+        catalog = view_catalog.resolve(definitions_json, tenant_id, db)
+    except ValueError as e:
+        logger.info("Rollups not materialized yet: %s", e)
+        return []
+
+    by_name = {view.name: view for view in catalog.views}
+    return [
+        spec.name
+        for spec in specs
+        if spec.source in by_name and rollup_materializer.schedule(spec, by_name[spec.source])
+    ]
+
+
+class _NoMatch(Exception):
+    """The query cannot be answered by this rollup."""
+
+
+class _ExpressionRewriter:
+    """Rewrites one SELECT node's expressions against a rollup's columns."""
+
+    def __init__(self, conn: duckdb.DuckDBPyConnection, spec: RollupSpec, aliases: set[str]) -> None:
+        self._conn = conn
+        self._spec = spec
+        self._dimensions = {dim.lower(): dim for dim in spec.dimensions}
+        self._measures = {measure.lower(): measure for measure in spec.measures}
+        self._sum_types: dict[str, str] | None = None
+        self._aliases = aliases
+        self._aggregate_functions = _aggregate_function_names(conn)
+        self.aggregates = 0
+
+    def rewrite(self, expr: object, allow_aliases: bool = False) -> object:
+        if isinstance(expr, list):
+            return [self.rewrite(item, allow_aliases) for item in expr]
+        if not isinstance(expr, dict):
+            return expr
+        if "class" not in expr:
+            return {key: self.rewrite(value, allow_aliases) for key, value in expr.items()}
+
+        cls = expr["class"]
+        if cls == "COLUMN_REF":
+            name = expr["column_names"][-1]
+            if name.lower() in self._dimensions:
+                return {**expr, "column_names": [self._dimensions[name.lower()]]}
+            if allow_aliases and len(expr["column_names"]) == 1 and name in self._aliases:
+                return expr
+            raise _NoMatch(f"column {name} is not a rollup dimension")
+        if cls in ("SUBQUERY", "WINDOW", "STAR", "LAMBDA", "PARAMETER"):
+            raise _NoMatch(f"{cls} expressions are not supported")
+        if cls == "FUNCTION" and (expr["function_name"] in _REWRITES or expr["function_name"] == "count_star"):
+            return self._rewrite_aggregate(expr)
+        if cls == "FUNCTION" and expr["function_name"] in self._aggregate_functions:
+            raise _NoMatch(f"aggregate {expr['function_name']}() cannot be computed from a rollup")
+        return {key: self.rewrite(value, allow_aliases) for key, value in expr.items()}
+
+    def _rewrite_aggregate(self, expr: dict) -> dict:
+        if expr.get("distinct") or expr.get("filter") or expr["order_bys"]["orders"]:
+            raise _NoMatch("DISTINCT, FILTER and ordered aggregates are not supported")
+        name = expr["function_name"]
+        if name == "count_star":
+            replacement = _COUNT_STAR_REWRITE
+        else:
+            children = expr["children"]
+            if len(children) != 1 or children[0].get("class") != "COLUMN_REF":
+                raise _NoMatch(f"{name}() must take a single column")
+            column = children[0]["column_names"][-1]
+            measure = self._measures.get(column.lower())
+            if measure is None:
+                raise _NoMatch(f"column {column} is not a rollup measure")
+            replacement = _REWRITES[name].format(
+                col=measure.replace('"', '""'),
+                sum_type=self._sum_type(measure) if name == "sum" else None,
+            )
+        self.aggregates += 1
+        node = serialize_sql(f"SELECT {replacement}")["statements"][0]["node"]
+        return {**node["select_list"][0], "alias": expr["alias"]}
+
+    def _sum_type(self, measure: str) -> str:
+        if self._sum_types is None:
+            try:
+                self._sum_types = _sum_types(self._conn, _quote(self._spec.source), self._spec.measures)
+            except duckdb.Error as e:
+                raise _NoMatch(f"measure types unavailable: {e}")
+        return self._sum_types[measure]
+
+
+def rewrite_for_rollups(
+    conn: duckdb.DuckDBPyConnection,
+    query: ParsedQuery,
+    rollups: list[RollupSpec],
+) -> tuple[ParsedQuery, str | None]:
+    """Rewrite an aggregate query on a rolled-up table to read the rollup instead.
+
+    Returns (query, rollup name), or the query unchanged and None when no rollup
+    can answer it. Records a hit or miss for aggregate queries on a table that
+    has rollups.
+    """
+    if not rollups or query.explain:
+        return query, None
+    node = query.node
+    from_table = node.get("from_table") or {}
+    if node.get("type") != "SELECT_NODE" or from_table.get("type") != "BASE_TABLE":
+        return query, None
+
+    table = from_table["table_name"].lower()
+    candidates = sorted(
+        (spec for spec in rollups if spec.source.lower() == table and not from_table["schema_name"]),
+        key=lambda spec: len(spec.dimensions),
+    )
+    is_aggregate = bool(node["group_expressions"]) or node["aggregate_handling"] == "FORCE_AGGREGATES"
+    if not candidates:
+        return query, None
+
+    for spec in candidates:
+        try:
+            rewritten, aggregates = _rewrite_node(conn, query.sql, node, spec)
+        except _NoMatch as e:
+            logger.debug("Rollup %s does not match: %s", spec.name, e)
+            continue
+        if not (is_aggregate or aggregates):
+            return query, None
+        rollup_metrics.record_rewrite(spec.name)
+        return query.replace_node(rewritten), spec.name
+
+    if is_aggregate or _has_aggregate(node["select_list"], _aggregate_function_names(conn)):
+        rollup_metrics.record_rewrite(None)
+    return query, None
+
+
+def _has_aggregate(expr: object, aggregates: frozenset[str]) -> bool:
+    if isinstance(expr, list):
+        return any(_has_aggregate(item, aggregates) for item in expr)
+    if not isinstance(expr, dict):
+        return False
+    if expr.get("class") == "FUNCTION" and expr["function_name"].lower() in aggregates:
+        return True
+    return any(_has_aggregate(value, aggregates) for value in expr.values())
+
+
+def _rewrite_node(
+    conn: duckdb.DuckDBPyConnection, sql: str, node: dict, spec: RollupSpec
+) -> tuple[dict, int]:
+    """Return the SELECT node reading `spec` instead of its source, and its aggregate count."""
+    if (
+        node["cte_map"]["map"]
+        or node.get("having")
+        or node.get("qualify")
+        or node.get("sample")
+        or node["from_table"].get("sample")
+        or node["aggregate_handling"] not in _GROUPING_HANDLING
+        or len(node["group_sets"]) > 1
+    ):
+        raise _NoMatch("HAVING, QUALIFY, SAMPLE, CTEs and grouping sets are not supported")
+
+    aliases = {item["alias"] for item in node["select_list"] if item.get("alias")}
+    rewriter = _ExpressionRewriter(conn, spec, aliases)
+    rewritten = dict(node)
+    rewritten["select_list"] = rewriter.rewrite(node["select_list"])
+    rewritten["where_clause"] = rewriter.rewrite(node["where_clause"])
+    rewritten["group_expressions"] = rewriter.rewrite(node["group_expressions"], allow_aliases=True)
+    rewritten["modifiers"] = rewriter.rewrite(node["modifiers"], allow_aliases=True)
+    rewritten["from_table"] = {
+        **node["from_table"],
+        "table_name": spec.view_name,
+        # Keep the source name as alias so qualified column references still resolve
+        "alias": node["from_table"]["alias"] or node["from_table"]["table_name"],
+    }
+
+    # Unaliased computed columns would be renamed by the rewrite: pin their original names
+    unnamed = [
+        i for i, item in enumerate(node["select_list"])
+        if not item.get("alias") and item.get("class") != "COLUMN_REF"
+    ]
+    if unnamed and rewriter.aggregates:
+        names = [row[0] for row in conn.execute(f"DESCRIBE {sql}").fetchall()]
+        for i in unnamed:
+            rewritten["select_list"][i] = {**rewritten["select_list"][i], "alias": names[i]}
+    return rewritten, rewriter.aggregates
@@ -0,0 +1,168 @@
+"""SQL parser — validates read-only queries on DuckDB's own parse tree.
+
+Every query sent to a semantic layer goes through parse_query(): DuckDB splits
+and classifies the statements, and json_serialize_sql returns the SELECT's
+tree. Only a single SELECT (optionally behind EXPLAIN) is accepted, so words
+like SET or CALL are fine inside identifiers and string literals while any
+write, DDL or configuration statement is rejected whatever its spelling.
+
+The resulting ParsedQuery carries that tree for the later stages: the row cap
+reads the outermost LIMIT from it (a LIMIT inside a subquery or CTE does not
+bound the result), rollup routing rewrites it, and fingerprint gives caches a
+key that ignores formatting.
+"""
+
+import copy
+import hashlib
+import json
+import re
+import threading
+from dataclasses import dataclass
+
+import duckdb
+
+# Leading whitespace and comments before the first keyword
+_LEADING_TRIVIA = re.compile(r"^(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*", re.DOTALL)
+_EXPLAIN_PREFIX = re.compile(r"^EXPLAIN(?:\s+ANALYZE)?\b", re.IGNORECASE)
+
+# SELECT-type statements may still be spelled SHOW, DESCRIBE, SUMMARIZE, PRAGMA...
+_QUERY_KEYWORDS = ("SELECT", "WITH", "EXPLAIN")
+
+# The parser needs no catalog; one private single-threaded connection serves every thread
+_parser_conn = duckdb.connect(config={"threads": 1})
+_parser_lock = threading.Lock()
+
+
+def _first_keyword(sql_text: str) -> str:
+    body = _LEADING_TRIVIA.sub("", sql_text, count=1)
+    match = re.match(r"[A-Za-z_]+", body)
+    return match.group(0).upper() if match else body[:1]
+
+
+def serialize_sql(sql_text: str) -> dict:
+    """Return json_serialize_sql's tree for a SELECT (with "error": true otherwise)."""
+    with _parser_lock:
+        row = _parser_conn.execute("SELECT json_serialize_sql(?::VARCHAR)", [sql_text]).fetchone()
+    return json.loads(row[0])
+
+
+def deserialize_sql(tree: dict) -> str:
+    """Turn a json_serialize_sql tree back into SQL text."""
+    with _parser_lock:
+        row = _parser_conn.execute("SELECT json_deserialize_sql(?::JSON)", [json.dumps(tree)]).fetchone()
+    return row[0]
+
+
+def _strip_locations(value: object) -> object:
+    if isinstance(value, list):
+        return [_strip_locations(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _strip_locations(item) for key, item in value.items() if key != "query_location"}
+    return value
+
+
+@dataclass(frozen=True)
+class ParsedQuery:
+    """A validated read-only query and its DuckDB parse tree."""
+
+    sql: str
+    tree: dict
+    explain: bool = False
+
+    @property
+    def node(self) -> dict:
+        """The outermost query node (SELECT_NODE, SET_OPERATION_NODE, ...)."""
+        return self.tree["statements"][0]["node"]
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the parse tree: equal for queries differing only in formatting."""
+        canonical = json.dumps(
+            {"explain": self.explain, "tree": _strip_locations(self.tree)}, sort_keys=True
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def replace_node(self, node: dict) -> "ParsedQuery":
+        """Return the query with its outermost node replaced, re-rendered as SQL."""
+        tree = copy.deepcopy(self.tree)
+        tree["statements"][0]["node"] = node
+        return ParsedQuery(sql=deserialize_sql(tree), tree=tree, explain=self.explain)
+
+    def outer_limit(self) -> int | None:
+        """The constant row count of the outermost LIMIT, or None if it has none or it is not constant."""
+        for modifier in self.node.get("modifiers", []):
+            if modifier["type"] != "LIMIT_MODIFIER":
+                continue
+            limit = modifier.get("limit") or {}
+            value = limit.get("value") or {}
+            if limit.get("class") == "CONSTANT" and not value.get("is_null") and isinstance(value.get("value"), int):
+                return value["value"]
+        return None
+
+    def with_limit(self, limit: int) -> str:
+        """Return SQL that never yields more than `limit` rows.
+
+        A query whose own outermost LIMIT is a constant within the cap runs as
+        written. One without any LIMIT gets an outer LIMIT appended; any other
+        (a larger, computed or percentage LIMIT) is wrapped in a capped subquery.
+        EXPLAIN output is a plan, not rows, and is left alone.
+        """
+        if self.explain:
+            return self.sql
+        own_limit = self.outer_limit()
+        if own_limit is not None and own_limit <= limit:
+            return self.sql
+        has_limit = any(
+            modifier["type"] in ("LIMIT_MODIFIER", "LIMIT_PERCENT_MODIFIER")
+            for modifier in self.node.get("modifiers", [])
+        )
+        if not has_limit:
+            # A trailing line comment would swallow a LIMIT on the same line
+            separator = "\n" if "--" in self.sql else " "
+            return f"{self.sql}{separator}LIMIT {limit}"
+        return f"SELECT * FROM (\n{self.sql}\n) AS capped_query LIMIT {limit}"
+
+
+def parse_query(sql_text: str) -> ParsedQuery:
+    """Parse a query and check that it is a single read-only SELECT.
+
+    Raises:
+        ValueError: If the SQL is empty, unparseable, holds several statements,
+            or is anything but a SELECT (or EXPLAIN of one).
+    """
+    stripped = sql_text.strip().rstrip(";").strip()
+    if not stripped:
+        raise ValueError("SQL query cannot be empty")
+
+    try:
+        with _parser_lock:
+            statements = _parser_conn.extract_statements(stripped)
+    except duckdb.Error as e:
+        raise ValueError(f"SQL syntax error: {str(e)}")
+    if not statements:
+        raise ValueError("SQL query cannot be empty")
+    if len(statements) > 1:
+        raise ValueError("Multiple SQL statements are not allowed")
+
+    statement_type = statements[0].type
+    if statement_type == duckdb.StatementType.EXPLAIN:
+        body = _LEADING_TRIVIA.sub("", stripped, count=1)
+        inner = parse_query(_EXPLAIN_PREFIX.sub("", body, count=1))
+        if inner.explain:
+            raise ValueError("Nested EXPLAIN is not allowed")
+        return ParsedQuery(sql=stripped, tree=inner.tree, explain=True)
+    if statement_type != duckdb.StatementType.SELECT:
+        raise ValueError(
+            f"Forbidden SQL operation: {_first_keyword(stripped)}. Only SELECT queries are allowed."
+        )
+
+    first_word = _first_keyword(stripped)
+    if first_word not in _QUERY_KEYWORDS and first_word != "(":
+        raise ValueError(
+            f"Query must start with SELECT, WITH, or EXPLAIN. Got: {first_word}"
+        )
+
+    tree = serialize_sql(stripped)
+    if tree.get("error"):
+        raise ValueError(f"SQL syntax error: {tree.get('error_message', 'unsupported query')}")
+    return ParsedQuery(sql=stripped, tree=tree)
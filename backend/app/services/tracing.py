@@ -0,0 +1,409 @@
+"""Tracing — per-request spans for the stages of an API call, and the Server-Timing header.
+
+TracingMiddleware opens a trace per HTTP request (continuing the caller's trace
+when a W3C `traceparent` header is sent). Code on the request path wraps its
+stages in `tracer.span(...)`: the JWT user lookup, the semantic layer and
+DataSource lookups, DuckDB view creation, queueing and execution, row
+conversion, the Claude call. TracedRoute adds the endpoint and its response
+model validation. Spans follow the caller into threadpools through
+contextvars; SemanticQueryBuilder copies the context onto scheduler workers.
+
+Every response gets a `Server-Timing` header with the duration of each stage,
+for the frontend to display. Finished traces go to the configured exporter:
+"console" logs a readable tree, "file" appends OTLP/JSON (one
+ExportTraceServiceRequest per line, which the OpenTelemetry Collector's
+otlpjsonfile receiver ingests), "none" keeps only the header.
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, Protocol
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "datapilot-api"
+# At most this many distinct stages in a Server-Timing header
+_MAX_SERVER_TIMING_ENTRIES = 32
+
+# OTLP enum values
+_KIND_INTERNAL = 1
+_KIND_SERVER = 2
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+@dataclass
+class Span:
+    """One timed stage. Times are time.monotonic() seconds; end is None while it runs."""
+    name: str
+    trace: "Trace"
+    span_id: str
+    parent_id: str | None
+    start: float
+    end: float | None = None
+    kind: int = _KIND_INTERNAL
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.monotonic()
+        return (end - self.start) * 1000
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.trace.unix_nano(self.start)),
+            "endTimeUnixNano": str(self.trace.unix_nano(self.end if self.end is not None else self.start)),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": _STATUS_ERROR, "message": self.error} if self.error else {"code": _STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class Trace:
+    """The spans of one request. Spans ending after the root has ended are dropped."""
+
+    def __init__(self, trace_id: str) -> None:
+        self.trace_id = trace_id
+        self.spans: list[Span] = []
+        self.finished = False
+        # When the endpoint returned, set by TracedRoute to time response validation
+        self.endpoint_end: float | None = None
+        self._lock = threading.Lock()
+        # Converts monotonic span times to wall-clock time for export
+        self._unix_offset_ns = time.time_ns() - time.monotonic_ns()
+
+    def unix_nano(self, monotonic: float) -> int:
+        return int(monotonic * 1e9) + self._unix_offset_ns
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            if not self.finished:
+                self.spans.append(span)
+
+    def finish(self) -> list[Span]:
+        with self._lock:
+            self.finished = True
+            return list(self.spans)
+
+    def server_timing(self, root: Span) -> str:
+        """Server-Timing header value: summed duration per stage, then the total so far."""
+        with self._lock:
+            spans = [span for span in self.spans if span is not root and span.end is not None]
+        durations: dict[str, float] = {}
+        for span in sorted(spans, key=lambda s: s.start):
+            if span.name in durations or len(durations) < _MAX_SERVER_TIMING_ENTRIES:
+                durations[span.name] = durations.get(span.name, 0.0) + span.duration_ms
+        entries = [f"{name};dur={ms:.2f}" for name, ms in durations.items()]
+        entries.append(f"total;dur={root.duration_ms:.2f}")
+        entries.append(f'trace;desc="{self.trace_id}"')
+        return ", ".join(entries)
+
+
+class SpanExporter(Protocol):
+    def export(self, spans: list[Span]) -> None:
+        ...
+
+
+class NoopExporter:
+    def export(self, spans: list[Span]) -> None:
+        pass
+
+
+class ConsoleExporter:
+    """Logs each trace as an indented tree of stage durations."""
+
+    def export(self, spans: list[Span]) -> None:
+        if not spans:
+            return
+        children: dict[str | None, list[Span]] = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+        ids = {span.span_id for span in spans}
+        roots = [span for span in spans if span.parent_id not in ids]
+        lines = [f"trace {spans[0].trace.trace_id}"]
+
+        def _walk(span: Span, depth: int) -> None:
+            status = f" ERROR {span.error}" if span.error else ""
+            lines.append(f"{'  ' * depth}{span.name} {span.duration_ms:.2f}ms{status}")
+            for child in sorted(children.get(span.span_id, []), key=lambda s: s.start):
+                _walk(child, depth + 1)
+
+        for root in sorted(roots, key=lambda s: s.start):
+            _walk(root, 1)
+        logger.info("\n".join(lines))
+
+
+class FileExporter:
+    """Appends each trace to a file as one line of OTLP/JSON."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: list[Span]) -> None:
+        if not spans:
+            return
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": "app.services.tracing"},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }],
+        }
+        line = json.dumps(request, default=str)
+        try:
+            with self._lock, open(self.path, "a") as f:
+                f.write(line + "\n")
+        except OSError:
+            logger.exception("Could not write trace to %s", self.path)
+
+
+def make_exporter(name: str, path: str) -> SpanExporter:
+    if name == "console":
+        return ConsoleExporter()
+    if name == "file":
+        return FileExporter(path)
+    if name == "none":
+        return NoopExporter()
+    raise ValueError(f"Unknown tracing exporter: {name}")
+
+
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(n_bytes: int) -> str:
+    return secrets.token_hex(n_bytes)
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str] | None:
+    """(trace id, parent span id) from a W3C traceparent header, or None if absent or malformed."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if set(parts[1]) == {"0"} or set(parts[2]) == {"0"}:
+        return None
+    return parts[1], parts[2]
+
+
+class Tracer:
+    """Creates spans in the current request's trace; a no-op outside of one."""
+
+    def __init__(self, exporter: SpanExporter, enabled: bool = True) -> None:
+        self.exporter = exporter
+        self.enabled = enabled
+
+    @staticmethod
+    def current_span() -> Span | None:
+        return _current_span.get()
+
+    @contextmanager
+    def start_trace(self, name: str, traceparent: str | None = None, **attributes: Any) -> Iterator[Span]:
+        """Open a trace with a server span as its root, and export it when the block ends."""
+        remote = parse_traceparent(traceparent)
+        trace = Trace(remote[0] if remote else _new_id(16))
+        root = Span(
+            name=name,
+            trace=trace,
+            span_id=_new_id(8),
+            parent_id=remote[1] if remote else None,
+            start=time.monotonic(),
+            kind=_KIND_SERVER,
+            attributes=dict(attributes),
+        )
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            root.end = time.monotonic()
+            trace.add(root)
+            spans = trace.finish()
+            try:
+                self.exporter.export(spans)
+            except Exception:
+                logger.exception("Trace export failed")
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span | None]:
+        """Time the block as a child of the current span. Usable as a decorator too."""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(
+            name=name,
+            trace=parent.trace,
+            span_id=_new_id(8),
+            parent_id=parent.span_id,
+            start=time.monotonic(),
+            attributes=dict(attributes),
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end = time.monotonic()
+            parent.trace.add(span)
+
+    def record_span(self, name: str, start: float, end: float, **attributes: Any) -> None:
+        """Add an already-timed stage (time.monotonic() bounds) under the current span."""
+        parent = _current_span.get()
+        if parent is None:
+            return
+        parent.trace.add(Span(
+            name=name,
+            trace=parent.trace,
+            span_id=_new_id(8),
+            parent_id=parent.span_id,
+            start=start,
+            end=end,
+            attributes=dict(attributes),
+        ))
+
+
+class TracingMiddleware:
+    """ASGI middleware running each HTTP request in a trace and adding Server-Timing.
+
+    The header is sent with the response start, so for streamed responses it
+    only covers the stages finished before the first chunk; the exported trace
+    has them all.
+    """
+
+    def __init__(self, app: Callable, tracer: "Tracer | None" = None) -> None:
+        self.app = app
+        self._tracer = tracer
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        active = self._tracer or tracer
+        if scope["type"] != "http" or not active.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope.get("headers", []):
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        method = scope["method"]
+        with active.start_trace(
+            f"{method} {scope['path']}", traceparent, **{"http.method": method, "http.target": scope["path"]}
+        ) as root:
+            async def _send(message: dict) -> None:
+                if message["type"] == "http.response.start":
+                    root.set_attribute("http.status_code", message["status"])
+                    if settings.tracing_server_timing:
+                        MutableHeaders(scope=message).append("Server-Timing", root.trace.server_timing(root))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, _send)
+            finally:
+                route = scope.get("route")
+                if route is not None and getattr(route, "path", None):
+                    root.name = f"{method} {route.path}"
+                    root.set_attribute("http.route", route.path)
+
+
+class TracedRoute(APIRoute):
+    """APIRoute timing the endpoint, and the response_model validation and rendering after it.
+
+    FastAPI validates and serializes the endpoint's return value inside the
+    route handler, so the "response" span runs from the end of the endpoint
+    span to the end of the handler.
+    """
+
+    def get_route_handler(self) -> Callable:
+        self.dependant.call = _traced_endpoint(self.dependant.call)
+        handler = super().get_route_handler()
+
+        @functools.wraps(handler)
+        async def _handler(request: Any) -> Any:
+            response = await handler(request)
+            root = tracer.current_span()
+            if root is not None and root.trace.endpoint_end is not None:
+                tracer.record_span("response", root.trace.endpoint_end, time.monotonic())
+            return response
+
+        return _handler
+
+
+def _traced_endpoint(call: Callable) -> Callable:
+    def _mark_end(span: Span | None) -> None:
+        if span is not None:
+            span.trace.endpoint_end = span.end
+
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def _async_endpoint(*args: Any, **kwargs: Any) -> Any:
+            with tracer.span("endpoint") as span:
+                result = await call(*args, **kwargs)
+            _mark_end(span)
+            return result
+
+        return _async_endpoint
+
+    @functools.wraps(call)
+    def _endpoint(*args: Any, **kwargs: Any) -> Any:
+        with tracer.span("endpoint") as span:
+            result = call(*args, **kwargs)
+        _mark_end(span)
+        return result
+
+    return _endpoint
+
+
+tracer = Tracer(
+    exporter=make_exporter(settings.tracing_exporter, settings.tracing_file),
+    enabled=settings.tracing_enabled,
+)
@@ -0,0 +1,176 @@
+"""Widget result cache — persists each widget's last result and the data sources it read.
+
+A stored result is keyed by a hash of the widget's SQL, row limit and semantic
+layer version, and stamped with the fingerprint of the parquet files its query
+reads. It is served while both still match, so dashboards open from the cache
+and only stale widgets are recomputed. Rows are also deleted eagerly when one of
+the recorded data sources is deleted or re-uploaded, or the widget's SQL changes.
+"""
+
+import hashlib
+import threading
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import duckdb
+from sqlalchemy.orm import Session
+
+from app.models.dashboard import Widget, WidgetResult, WidgetResultDependency
+from app.services.catalog_service import CatalogView, ResolvedCatalog, data_version_of
+
+
+@dataclass(frozen=True)
+class WidgetCacheKey:
+    """What a widget's cached result must match to be served."""
+    query_hash: str
+    data_version: str
+    data_source_ids: frozenset[str]
+
+
+def referenced_views(catalog: ResolvedCatalog, sql: str) -> tuple[CatalogView, ...]:
+    """Views of the catalog a query reads (all of them if it cannot be parsed)."""
+    try:
+        names = {name.lower() for name in duckdb.get_table_names(sql)}
+    except duckdb.Error:
+        return catalog.views
+    views = tuple(view for view in catalog.views if view.name.lower() in names)
+    return views or catalog.views
+
+
+class WidgetResultCache:
+    """Database-backed per-widget result cache, tenant-scoped."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def key_for(catalog: ResolvedCatalog, sql: str, limit: int) -> WidgetCacheKey:
+        views = referenced_views(catalog, sql)
+        query_hash = hashlib.sha256(f"{catalog.version}\n{limit}\n{sql}".encode()).hexdigest()
+        return WidgetCacheKey(
+            query_hash=query_hash,
+            data_version=data_version_of(views),
+            data_source_ids=frozenset(view.data_source_id for view in views),
+        )
+
+    def get_many(
+        self,
+        db: Session,
+        tenant_id: uuid.UUID,
+        keys: dict[uuid.UUID, WidgetCacheKey],
+    ) -> dict[uuid.UUID, WidgetResult]:
+        """Return the stored results of the given widgets that are still fresh."""
+        if not keys:
+            return {}
+        rows = (
+            db.query(WidgetResult)
+            .filter(
+                WidgetResult.widget_id.in_(keys),
+                WidgetResult.tenant_id == tenant_id,
+            )
+            .all()
+        )
+        fresh = {
+            row.widget_id: row
+            for row in rows
+            if row.query_hash == keys[row.widget_id].query_hash
+            and row.data_version == keys[row.widget_id].data_version
+        }
+        with self._lock:
+            self._hits += len(fresh)
+            self._misses += len(keys) - len(fresh)
+        return fresh
+
+    def put_many(
+        self,
+        db: Session,
+        tenant_id: uuid.UUID,
+        entries: list[tuple[uuid.UUID, WidgetCacheKey, dict]],
+    ) -> dict[uuid.UUID, WidgetResult]:
+        """Store (widget_id, key, result) entries, replacing older results. Commits."""
+        stored: dict[uuid.UUID, WidgetResult] = {}
+        now = datetime.now(timezone.utc)
+        for widget_id, key, result in entries:
+            row = db.get(WidgetResult, widget_id)
+            if row is None:
+                row = WidgetResult(widget_id=widget_id, tenant_id=tenant_id)
+                db.add(row)
+            row.query_hash = key.query_hash
+            row.data_version = key.data_version
+            row.result_json = result
+            row.computed_at = now
+            row.dependencies = [
+                WidgetResultDependency(widget_id=widget_id, data_source_id=uuid.UUID(source_id))
+                for source_id in sorted(key.data_source_ids)
+            ]
+            stored[widget_id] = row
+        if entries:
+            db.commit()
+        return stored
+
+    def invalidate_data_source(
+        self, db: Session, tenant_id: uuid.UUID, data_source_id: uuid.UUID
+    ) -> int:
+        """Delete every cached result that read a data source. Returns the number deleted."""
+        widget_ids = [
+            widget_id
+            for (widget_id,) in db.query(WidgetResult.widget_id)
+            .join(WidgetResultDependency, WidgetResultDependency.widget_id == WidgetResult.widget_id)
+            .filter(
+                WidgetResultDependency.data_source_id == data_source_id,
+                WidgetResult.tenant_id == tenant_id,
+            )
+        ]
+        return self._delete(db, widget_ids)
+
+    def invalidate_saved_query(
+        self, db: Session, tenant_id: uuid.UUID, saved_query_id: uuid.UUID
+    ) -> int:
+        """Delete the cached results of widgets showing a saved query."""
+        widget_ids = [
+            widget_id
+            for (widget_id,) in db.query(Widget.id).filter(
+                Widget.saved_query_id == saved_query_id,
+                Widget.tenant_id == tenant_id,
+            )
+        ]
+        return self._delete(db, widget_ids)
+
+    def invalidate_widget(self, db: Session, tenant_id: uuid.UUID, widget_id: uuid.UUID) -> int:
+        """Delete one widget's cached result (its query changed)."""
+        owned = (
+            db.query(WidgetResult.widget_id)
+            .filter(WidgetResult.widget_id == widget_id, WidgetResult.tenant_id == tenant_id)
+            .first()
+        )
+        return self._delete(db, [widget_id] if owned else [])
+
+    def stats(self) -> dict:
+        """Return cache counters for monitoring."""
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations,
+            }
+
+    def _delete(self, db: Session, widget_ids: list[uuid.UUID]) -> int:
+        if not widget_ids:
+            return 0
+        db.query(WidgetResultDependency).filter(
+            WidgetResultDependency.widget_id.in_(widget_ids)
+        ).delete()
+        deleted = db.query(WidgetResult).filter(
+            WidgetResult.widget_id.in_(widget_ids)
+        ).delete()
+        db.commit()
+        with self._lock:
+            self._invalidations += deleted
+        return deleted
+
+
+widget_result_cache = WidgetResultCache()
@@ -0,0 +1,9 @@
+"""End-to-end benchmarks over test-data and synthetic scale-ups of it.
+
+Run from backend/:
+
+    python -m benchmarks run --scale 1m --output results.json
+    python -m benchmarks compare baseline.json results.json
+
+See benchmarks/README.md.
+"""
@@ -0,0 +1,116 @@
+"""Command line: `python -m benchmarks run ...` and `python -m benchmarks compare ...`."""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from benchmarks.cases import GROUPS, run_benchmarks
+from benchmarks.datagen import generate, parse_scale
+from benchmarks.harness import RESULTS_VERSION, BenchEnvironment, run_metadata
+
+DEFAULT_DATA_DIR = Path(__file__).parent / ".data"
+
+
+def run(args: argparse.Namespace) -> int:
+    groups = tuple(args.only.split(",")) if args.only else GROUPS
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        print(f"Unknown groups: {', '.join(sorted(unknown))} (expected {', '.join(GROUPS)})", file=sys.stderr)
+        return 2
+
+    runs = []
+    for scale in args.scale.split(","):
+        rows = parse_scale(scale)
+        print(f"[{scale}] generating data in {args.data_dir}", file=sys.stderr)
+        csv_paths = generate(scale, args.data_dir)
+        with BenchEnvironment(args.work_dir) as env:
+            measurements = run_benchmarks(
+                env, csv_paths, groups, args.repeat, args.upload_repeat, args.llm_latency_ms
+            )
+        results = [measurement.to_dict() for measurement in measurements]
+        for result in results:
+            print(
+                f"[{scale}] {result['name']:<45} median {result['median_ms']:>11.2f} ms"
+                f"  p95 {result['p95_ms']:>11.2f} ms",
+                file=sys.stderr,
+            )
+        runs.append({
+            "metadata": run_metadata(scale, rows, args.repeat, args.llm_latency_ms),
+            "results": results,
+        })
+
+    output = json.dumps({"version": RESULTS_VERSION, "runs": runs}, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        Path(args.output).write_text(output + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    return 0
+
+
+def _medians(path: Path) -> dict[tuple[str, str], float]:
+    data = json.loads(path.read_text())
+    if data.get("version") != RESULTS_VERSION:
+        raise SystemExit(f"{path}: results version {data.get('version')}, expected {RESULTS_VERSION}")
+    return {
+        (run["metadata"]["scale"], result["name"]): result["median_ms"]
+        for run in data["runs"]
+        for result in run["results"]
+    }
+
+
+def compare(args: argparse.Namespace) -> int:
+    """Print the median change of every benchmark in both files; fail past the threshold."""
+    baseline, current = _medians(args.baseline), _medians(args.current)
+    regressions = 0
+    for key in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[key], current[key]
+        change = (after - before) / before if before else 0.0
+        regressed = change > args.threshold
+        regressions += regressed
+        print(
+            f"[{key[0]}] {key[1]:<45} {before:>11.2f} -> {after:>11.2f} ms  {change:>+8.1%}"
+            + ("  REGRESSION" if regressed else "")
+        )
+    for key in sorted(baseline.keys() ^ current.keys()):
+        print(f"[{key[0]}] {key[1]:<45} only in {'baseline' if key in baseline else 'current'}")
+    return 1 if regressions else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write JSON results")
+    run_parser.add_argument(
+        "--scale", default="1m",
+        help="Comma-separated fact_ventes sizes: base (test-data as is), 1m, 10m, 100m, 250k... (default: 1m)",
+    )
+    run_parser.add_argument("--only", help=f"Comma-separated groups to report ({', '.join(GROUPS)})")
+    run_parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark (default: 5)")
+    run_parser.add_argument("--upload-repeat", type=int, default=1, help="Timed runs per upload (default: 1)")
+    run_parser.add_argument(
+        "--llm-latency-ms", type=float, default=0.0, help="Delay of the stubbed Claude API (default: 0)"
+    )
+    run_parser.add_argument(
+        "--data-dir", type=Path, default=DEFAULT_DATA_DIR, help="Where generated CSVs are kept between runs"
+    )
+    run_parser.add_argument("--work-dir", type=Path, help="Uploads and database (default: a temporary directory)")
+    run_parser.add_argument("--output", "-o", default="-", help="Results file (default: stdout)")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="Compare the medians of two results files")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.10, help="Slowdown reported as a regression (default: 0.10)"
+    )
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
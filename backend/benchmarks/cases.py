@@ -0,0 +1,310 @@
+"""The benchmarks: ingestion, preview, semantic queries, dashboards and the HTTP endpoints.
+
+Each group is timed against the same four uploaded tables. Ingestion always
+runs, since every other group reads its data sources; its timings are only
+reported when the group is selected.
+"""
+
+from pathlib import Path
+
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+
+from app.core.dependencies import get_db
+from app.main import app
+from app.models.dashboard import Dashboard, SemanticLayer, Widget
+from app.models.data_source import DataSource
+from app.services.ai_service import AIService, get_ai_service
+from app.services.answer_cache import answer_cache
+from app.services.catalog_service import view_catalog
+from app.services.connection_pool import connection_pool
+from app.services.csv_service import create_pending_csv_source, delete_csv_files, get_csv_preview
+from app.services.dashboard_service import DashboardService
+from app.services.ingestion_queue import InlineIngestionBackend, IngestionQueue
+from app.services.query_service import SemanticQueryBuilder
+from app.services.result_cache import query_result_cache
+from benchmarks.datagen import TABLES
+from benchmarks.harness import BenchEnvironment, Measurement, StubLLM, measure
+
+GROUPS = ("ingestion", "preview", "query", "dashboard", "api")
+
+QUERY_LIMIT = 1000
+PREVIEW_PAGE_SIZE = 100
+
+# Typical BI queries over the star schema: the SQL the explorer, dashboards and AI produce
+BI_QUERIES = {
+    "revenue_by_month": (
+        "SELECT date_trunc('month', date_vente) AS mois, SUM(montant_net) AS ca "
+        "FROM fact_ventes GROUP BY 1 ORDER BY 1"
+    ),
+    "revenue_by_region_segment": (
+        "SELECT c.region, c.segment, SUM(f.montant_net) AS ca, COUNT(*) AS ventes "
+        "FROM fact_ventes f JOIN dim_clients c ON c.client_id = f.client_id "
+        "GROUP BY 1, 2 ORDER BY ca DESC"
+    ),
+    "top_products": (
+        "SELECT p.categorie, p.nom_produit, SUM(f.quantite) AS quantite, SUM(f.montant_net) AS ca "
+        "FROM fact_ventes f JOIN dim_produits p ON p.produit_id = f.produit_id "
+        "GROUP BY 1, 2 ORDER BY ca DESC LIMIT 10"
+    ),
+    "team_performance": (
+        "SELECT co.equipe, co.prenom || ' ' || co.nom AS commercial, "
+        "SUM(f.montant_net) AS ca, AVG(f.remise_pct) AS remise_moyenne "
+        "FROM fact_ventes f JOIN dim_commerciaux co ON co.commercial_id = f.commercial_id "
+        "GROUP BY 1, 2 ORDER BY ca DESC"
+    ),
+    "active_clients_by_month": (
+        "SELECT date_trunc('month', date_vente) AS mois, COUNT(DISTINCT client_id) AS clients "
+        "FROM fact_ventes GROUP BY 1 ORDER BY 1"
+    ),
+    "client_detail": "SELECT * FROM fact_ventes WHERE client_id = 7 ORDER BY date_vente DESC",
+    "raw_rows": "SELECT * FROM fact_ventes",
+}
+
+DASHBOARD_WIDGETS = (
+    ("revenue_by_month", "line"),
+    ("revenue_by_region_segment", "bar"),
+    ("top_products", "table"),
+    ("team_performance", "bar"),
+    ("active_clients_by_month", "line"),
+)
+
+# Questions the stubbed LLM answers, with the BI query it answers them with
+AI_QUESTIONS = {
+    "Quel est le chiffre d'affaires par mois ?": "revenue_by_month",
+    "Quels sont les 10 produits les plus vendus ?": "top_products",
+}
+
+_JOINS = (
+    ("fact_ventes", "client_id", "dim_clients", "client_id"),
+    ("fact_ventes", "produit_id", "dim_produits", "produit_id"),
+    ("fact_ventes", "commercial_id", "dim_commerciaux", "commercial_id"),
+)
+
+
+def run_benchmarks(
+    env: BenchEnvironment,
+    csv_paths: dict[str, Path],
+    groups: tuple[str, ...] = GROUPS,
+    repeat: int = 5,
+    upload_repeat: int = 1,
+    llm_latency_ms: float = 0.0,
+) -> list[Measurement]:
+    """Run the selected groups in order and return their measurements."""
+    results: list[Measurement] = []
+    sources, ingestion = _ingestion(env, csv_paths, upload_repeat)
+    if "ingestion" in groups:
+        results.extend(ingestion)
+
+    definitions = _definitions(sources)
+    env.db.add(SemanticLayer(
+        tenant_id=env.tenant_id, workspace_id=env.workspace.id, name="Ventes", definitions_json=definitions,
+    ))
+    env.db.commit()
+
+    if "preview" in groups:
+        results.extend(_preview(sources["fact_ventes"], repeat))
+    if "query" in groups:
+        results.extend(_query(env, definitions, repeat))
+    if "dashboard" in groups:
+        results.extend(_dashboard(env, repeat))
+    if "api" in groups:
+        results.extend(_api(env, repeat, llm_latency_ms))
+    return results
+
+
+def _upload(env: BenchEnvironment, queue: IngestionQueue, table: str, path: Path) -> DataSource:
+    """What /upload does: save the file as a pending source, then wait for its ingestion job."""
+    with open(path, "rb") as f:
+        data_source = create_pending_csv_source(
+            UploadFile(file=f, filename=f"{table}.csv"), table, env.tenant_id, env.db
+        )
+    return queue.ingest(data_source, env.db)
+
+
+def _ingestion(
+    env: BenchEnvironment, csv_paths: dict[str, Path], upload_repeat: int
+) -> tuple[dict[str, DataSource], list[Measurement]]:
+    # Jobs run in the calling thread, so the timings hold the conversion and none of the queueing
+    queue = IngestionQueue(InlineIngestionBackend(), session_factory=env.session_factory)
+    sources: dict[str, DataSource] = {}
+    results = []
+    for table in TABLES:
+        uploads: list[DataSource] = []
+
+        def _run(table: str = table, uploads: list[DataSource] = uploads) -> dict:
+            data_source = _upload(env, queue, table, csv_paths[table])
+            uploads.append(data_source)
+            return {"rows": data_source.schema_cache["row_count"], "bytes": csv_paths[table].stat().st_size}
+
+        measurement = measure(f"upload.{table}", "ingestion", _run, repeat=upload_repeat)
+        seconds = measurement.to_dict()["median_ms"] / 1000
+        measurement.info["mb_per_s"] = round(measurement.info["bytes"] / 1e6 / seconds, 2) if seconds else None
+        measurement.info["rows_per_s"] = round(measurement.info["rows"] / seconds) if seconds else None
+        results.append(measurement)
+
+        # Keep the first upload; the repeats only cost disk
+        sources[table] = uploads[0]
+        for extra in uploads[1:]:
+            delete_csv_files(extra)
+            env.db.delete(extra)
+        env.db.commit()
+    return sources, results
+
+
+def _definitions(sources: dict[str, DataSource]) -> dict:
+    """A semantic layer over the four tables, joined the way the model editor would."""
+    nodes = []
+    for table, data_source in sources.items():
+        nodes.append({
+            "id": table,
+            "type": "tableNode",
+            "data": {
+                "source_id": str(data_source.id),
+                "source_name": table,
+                "columns": [
+                    {"name": col["name"], "type": col["type"], "role": "dimension"}
+                    for col in data_source.schema_cache["columns"]
+                ],
+            },
+        })
+    edges = [
+        {
+            "id": f"{source}-{target}",
+            "source": source,
+            "target": target,
+            "data": {"join_type": "LEFT JOIN", "source_column": source_col, "target_column": target_col},
+        }
+        for source, source_col, target, target_col in _JOINS
+    ]
+    return {"nodes": nodes, "edges": edges}
+
+
+def _preview(fact: DataSource, repeat: int) -> list[Measurement]:
+    total_rows = fact.schema_cache["row_count"]
+    last_page = max(1, -(-total_rows // PREVIEW_PAGE_SIZE))
+    pages = {"first": 1, "middle": max(1, last_page // 2), "last": last_page}
+    results = []
+    for result_format in ("json", "arrow"):
+        for depth, page in pages.items():
+            def _run(page: int = page, result_format: str = result_format) -> dict:
+                preview = get_csv_preview(fact, page=page, page_size=PREVIEW_PAGE_SIZE, result_format=result_format)
+                return {"page": preview["page"], "total_pages": preview["total_pages"]}
+
+            results.append(measure(f"preview.{result_format}.{depth}", "preview", _run, repeat, warmup=1))
+    return results
+
+
+def _query(env: BenchEnvironment, definitions: dict, repeat: int) -> list[Measurement]:
+    def _setup(pool=None) -> dict:
+        builder = SemanticQueryBuilder(pool=pool)
+        try:
+            builder.setup_context(definitions, env.tenant_id, env.db, workspace_id=env.workspace.id)
+        finally:
+            builder.close()
+        return {}
+
+    def _cold_state() -> None:
+        view_catalog.clear()
+        connection_pool.clear()
+
+    results = [
+        measure("setup_context.cold", "query", _setup, repeat, before_each=_cold_state),
+        measure("setup_context.pooled", "query", lambda: _setup(connection_pool), repeat, warmup=1),
+    ]
+    with SemanticQueryBuilder(pool=connection_pool) as builder:
+        builder.setup_context(definitions, env.tenant_id, env.db, workspace_id=env.workspace.id)
+        for name, sql in BI_QUERIES.items():
+            def _run(sql: str = sql) -> dict:
+                return {"rows": builder.execute_query(sql, limit=QUERY_LIMIT)["row_count"]}
+
+            results.append(measure(f"execute_query.{name}", "query", _run, repeat, warmup=1))
+    return results
+
+
+def _dashboard(env: BenchEnvironment, repeat: int) -> list[Measurement]:
+    dashboard = Dashboard(tenant_id=env.tenant_id, workspace_id=env.workspace.id, name="Ventes")
+    env.db.add(dashboard)
+    env.db.flush()
+    env.db.add_all([
+        Widget(
+            tenant_id=env.tenant_id,
+            dashboard_id=dashboard.id,
+            type="chart",
+            title=name,
+            chart_type=chart_type,
+            query_json={"sql": BI_QUERIES[name], "limit": QUERY_LIMIT},
+        )
+        for name, chart_type in DASHBOARD_WIDGETS
+    ])
+    env.db.commit()
+    service = DashboardService(env.db, env.tenant_id)
+
+    def _render(refresh: bool) -> dict:
+        rendered = service.render(dashboard.id, refresh=refresh)
+        statuses = [widget["status"] for widget in rendered["widgets"]]
+        if statuses.count("ok") != len(statuses):
+            raise RuntimeError(f"Dashboard widgets failed: {rendered['widgets']}")
+        return {"widgets": len(statuses), "setup_time_ms": rendered["setup_time_ms"]}
+
+    return [
+        measure("dashboard_render.refresh", "dashboard", lambda: _render(True), repeat, warmup=1),
+        measure("dashboard_render.cached", "dashboard", lambda: _render(False), repeat, warmup=1),
+    ]
+
+
+def _api(env: BenchEnvironment, repeat: int, llm_latency_ms: float) -> list[Measurement]:
+    """The query and AI endpoints end to end: JWT lookup, semantic layer, execution, validation."""
+    llm = StubLLM({q: BI_QUERIES[name] for q, name in AI_QUESTIONS.items()}, latency_ms=llm_latency_ms)
+    ai_service = AIService()
+    ai_service._client = llm
+
+    def _get_db():
+        db = env.session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = _get_db
+    app.dependency_overrides[get_ai_service] = lambda: ai_service
+    headers = {"Authorization": f"Bearer {env.access_token()}"}
+    workspace_id = str(env.workspace.id)
+    results = []
+    try:
+        with TestClient(app) as client:
+            def _post(path: str, body: dict) -> dict:
+                resp = client.post(path, json=body, headers=headers)
+                if resp.status_code != 200:
+                    raise RuntimeError(f"{path} returned {resp.status_code}: {resp.text}")
+                data = resp.json()
+                return {"rows": data.get("row_count"), "cache_status": data.get("cache_status")}
+
+            for name in ("revenue_by_month", "raw_rows"):
+                body = {"sql_text": BI_QUERIES[name], "workspace_id": workspace_id, "limit": QUERY_LIMIT}
+                results.append(measure(
+                    f"http.queries_execute.{name}", "api",
+                    lambda body=body: _post("/api/v1/queries/execute", body),
+                    repeat, warmup=1, before_each=query_result_cache.clear,
+                ))
+            results.append(measure(
+                "http.queries_execute.result_cached", "api",
+                lambda: _post("/api/v1/queries/execute", {
+                    "sql_text": BI_QUERIES["revenue_by_month"], "workspace_id": workspace_id, "limit": QUERY_LIMIT,
+                }),
+                repeat, warmup=1,
+            ))
+
+            question = next(iter(AI_QUESTIONS))
+            body = {"question": question, "workspace_id": workspace_id}
+            results.append(measure(
+                "http.ai_query.llm", "api", lambda: _post("/api/v1/ai/query", body),
+                repeat, warmup=1, before_each=answer_cache.clear,
+            ))
+            results.append(measure(
+                "http.ai_query.answer_cached", "api", lambda: _post("/api/v1/ai/query", body), repeat, warmup=1,
+            ))
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        app.dependency_overrides.pop(get_ai_service, None)
+    return results
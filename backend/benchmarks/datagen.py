@@ -0,0 +1,143 @@
+"""Synthetic scale-ups of the test-data star schema.
+
+fact_ventes is generated with DuckDB at the requested row count: every column
+is derived from a hash of the row number, so a given scale always produces the
+same file. dim_clients grows with the fact table (one client per 100 sales, so
+joins and COUNT(DISTINCT client_id) stay realistic), while dim_produits and
+dim_commerciaux are the small reference tables from test-data, unchanged.
+"""
+
+import json
+import re
+import shutil
+from pathlib import Path
+
+import duckdb
+
+TEST_DATA_DIR = Path(__file__).resolve().parents[2] / "test-data"
+TABLES = ("fact_ventes", "dim_clients", "dim_produits", "dim_commerciaux")
+
+# Sales per client in the scaled-up dim_clients
+_SALES_PER_CLIENT = 100
+_SCALE_SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+
+def parse_scale(scale: str) -> int | None:
+    """Row count for a scale name: "1m", "10m", "250k", "5000", or None for "base" (test-data as is)."""
+    scale = scale.strip().lower()
+    if scale == "base":
+        return None
+    match = re.fullmatch(r"(\d+)([km]?)", scale)
+    if not match:
+        raise ValueError(f"Invalid scale '{scale}' (expected base, or a row count such as 1m, 250k, 5000)")
+    rows = int(match.group(1)) * _SCALE_SUFFIXES.get(match.group(2), 1)
+    if rows < 1:
+        raise ValueError("Scale must be at least one row")
+    return rows
+
+
+def _sql_path(path: Path) -> str:
+    return str(path).replace("'", "''")
+
+
+def generate(scale: str, data_dir: Path, seed_dir: Path = TEST_DATA_DIR) -> dict[str, Path]:
+    """Write the four CSVs for a scale under data_dir/<scale>/ and return their paths.
+
+    Files from an earlier run at the same scale are reused: generating 100M rows
+    takes minutes and several GB of disk.
+    """
+    out_dir = data_dir / scale
+    manifest_path = out_dir / "manifest.json"
+    paths = {table: out_dir / f"{table}.csv" for table in TABLES}
+    if manifest_path.exists() and all(path.exists() for path in paths.values()):
+        return paths
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rows = parse_scale(scale)
+    seeds = {table: seed_dir / f"{table}.csv" for table in TABLES}
+    if rows is None:
+        for table in TABLES:
+            shutil.copyfile(seeds[table], paths[table])
+    else:
+        conn = duckdb.connect()
+        try:
+            conn.execute(f"SET temp_directory = '{_sql_path(out_dir / 'tmp')}'")
+            _write_scaled(conn, seeds, paths, rows)
+        finally:
+            conn.close()
+        shutil.rmtree(out_dir / "tmp", ignore_errors=True)
+
+    manifest_path.write_text(json.dumps({
+        "scale": scale,
+        "rows": rows,
+        "files": {table: path.stat().st_size for table, path in paths.items()},
+    }, indent=2))
+    return paths
+
+
+def _write_scaled(
+    conn: duckdb.DuckDBPyConnection, seeds: dict[str, Path], paths: dict[str, Path], rows: int
+) -> None:
+    for table in ("dim_produits", "dim_commerciaux"):
+        shutil.copyfile(seeds[table], paths[table])
+
+    for table in ("dim_clients", "dim_produits", "dim_commerciaux"):
+        conn.execute(
+            f"CREATE TABLE seed_{table} AS "
+            f"SELECT *, row_number() OVER () - 1 AS k FROM read_csv_auto('{_sql_path(seeds[table])}')"
+        )
+    n_seed_clients = conn.execute("SELECT count(*) FROM seed_dim_clients").fetchone()[0]
+    n_products = conn.execute("SELECT count(*) FROM seed_dim_produits").fetchone()[0]
+    n_sellers = conn.execute("SELECT count(*) FROM seed_dim_commerciaux").fetchone()[0]
+    n_clients = max(n_seed_clients, rows // _SALES_PER_CLIENT)
+
+    # Clients past the seed ones copy a seed client, with a distinct name, email and signup date
+    conn.execute(f"""
+        COPY (
+            SELECT
+                i + 1 AS client_id,
+                CASE WHEN i < {n_seed_clients} THEN c.nom ELSE c.nom || ' ' || (i + 1) END AS nom,
+                CASE WHEN i < {n_seed_clients} THEN c.email ELSE (i + 1) || '.' || c.email END AS email,
+                c.ville,
+                c.region,
+                c.segment,
+                CASE WHEN i < {n_seed_clients} THEN c.date_inscription
+                     ELSE c.date_inscription + CAST(hash(i) % 365 AS INTEGER) END AS date_inscription
+            FROM range({n_clients}) t(i)
+            JOIN seed_dim_clients c ON c.k = i % {n_seed_clients}
+            ORDER BY i
+        ) TO '{_sql_path(paths["dim_clients"])}' (HEADER, DELIMITER ',')
+    """)
+
+    conn.execute(f"""
+        COPY (
+            WITH sales AS (
+                SELECT i, hash(i) AS h FROM range({rows}) t(i)
+            ),
+            priced AS (
+                SELECT
+                    s.i,
+                    s.h,
+                    p.produit_id,
+                    p.prix_unitaire,
+                    c.commercial_id,
+                    1 + CAST((s.h >> 24) % 10 AS INTEGER) AS quantite,
+                    [0, 0, 5, 10, 15][1 + CAST((s.h >> 32) % 5 AS INTEGER)] AS remise_pct
+                FROM sales s
+                JOIN seed_dim_produits p ON p.k = (s.h >> 8) % {n_products}
+                JOIN seed_dim_commerciaux c ON c.k = (s.h >> 16) % {n_sellers}
+            )
+            SELECT
+                i + 1 AS vente_id,
+                DATE '2024-01-01' + CAST((h >> 40) % 730 AS INTEGER) AS date_vente,
+                1 + CAST(h % {n_clients} AS BIGINT) AS client_id,
+                produit_id,
+                commercial_id,
+                quantite,
+                ROUND(quantite * prix_unitaire, 2) AS montant_ht,
+                remise_pct,
+                ROUND(quantite * prix_unitaire * (100 - remise_pct) / 100, 2) AS montant_net
+            FROM priced
+            ORDER BY i
+        ) TO '{_sql_path(paths["fact_ventes"])}' (HEADER, DELIMITER ',')
+    """)
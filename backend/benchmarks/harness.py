@@ -0,0 +1,212 @@
+"""Timing, result records and the isolated environment benchmarks run in."""
+
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable
+
+import duckdb
+import pyarrow
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.config import settings
+from app.core.security import create_access_token
+from app.database import Base
+from app.models.user import User
+from app.models.workspace import Workspace
+from app.services.answer_cache import answer_cache
+from app.services.catalog_service import view_catalog
+from app.services.connection_pool import connection_pool
+from app.services.query_history import query_history
+from app.services.result_cache import query_result_cache
+
+# Bumped when result fields change meaning, so old result files are not compared blindly
+RESULTS_VERSION = 1
+
+
+@dataclass
+class Measurement:
+    """Wall-clock samples of one benchmark, plus what the last run reported."""
+    name: str
+    group: str
+    samples_ms: list[float] = field(default_factory=list)
+    info: dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        ordered = sorted(self.samples_ms)
+        p95_index = min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))
+        return {
+            "name": self.name,
+            "group": self.group,
+            "runs": len(ordered),
+            "min_ms": round(ordered[0], 3),
+            "median_ms": round(statistics.median(ordered), 3),
+            "p95_ms": round(ordered[p95_index], 3),
+            "mean_ms": round(statistics.fmean(ordered), 3),
+            "max_ms": round(ordered[-1], 3),
+            "stdev_ms": round(statistics.stdev(ordered), 3) if len(ordered) > 1 else 0.0,
+            "info": self.info,
+        }
+
+
+def measure(
+    name: str,
+    group: str,
+    fn: Callable[[], dict | None],
+    repeat: int,
+    warmup: int = 0,
+    before_each: Callable[[], None] | None = None,
+) -> Measurement:
+    """Time `fn` `repeat` times after `warmup` untimed runs.
+
+    `before_each` runs untimed before every call (e.g. to clear a cache). The dict
+    `fn` returns on its last timed run is kept as the measurement's info.
+    """
+    measurement = Measurement(name=name, group=group)
+    for i in range(warmup + repeat):
+        if before_each is not None:
+            before_each()
+        start = time.perf_counter()
+        info = fn()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if i >= warmup:
+            measurement.samples_ms.append(elapsed_ms)
+            measurement.info = info or {}
+    return measurement
+
+
+def run_metadata(scale: str, rows: int | None, repeat: int, llm_latency_ms: float) -> dict:
+    """What the results depend on besides the code: machine, versions, commit."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "version": RESULTS_VERSION,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "scale": scale,
+        "fact_rows": rows,
+        "repeat": repeat,
+        "llm_latency_ms": llm_latency_ms,
+        "python": platform.python_version(),
+        "duckdb": duckdb.__version__,
+        "pyarrow": pyarrow.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+class StubLLM:
+    """Stands in for the AsyncAnthropic client: answers with canned SQL after a fixed delay.
+
+    A question gets the SQL of the first `answers` key it contains; the response
+    and its usage block have the shape AIService reads from the real client.
+    """
+
+    def __init__(self, answers: dict[str, str], latency_ms: float = 0.0) -> None:
+        self.answers = answers
+        self.latency_ms = latency_ms
+        self.calls = 0
+        messages = SimpleNamespace(create=self._create)
+        self.beta = SimpleNamespace(prompt_caching=SimpleNamespace(messages=messages))
+
+    async def _create(self, **kwargs: Any) -> SimpleNamespace:
+        self.calls += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        question = kwargs["messages"][0]["content"][-1]["text"]
+        sql = next((sql for q, sql in self.answers.items() if q in question), "SELECT 1")
+        text = json.dumps({"sql": sql, "explanation": "benchmark", "suggested_chart": "table"})
+        return SimpleNamespace(
+            content=[SimpleNamespace(text=text)],
+            usage=SimpleNamespace(
+                input_tokens=1500, output_tokens=80, cache_read_input_tokens=0, cache_creation_input_tokens=0,
+            ),
+        )
+
+
+class BenchEnvironment:
+    """A throwaway SQLite database, upload directory, tenant and user.
+
+    Uploads and query history go to a temporary directory instead of the
+    configured ones; the shared caches and pools are cleared on entry and exit
+    so one benchmark run cannot warm the next.
+    """
+
+    def __init__(self, work_dir: Path | None = None) -> None:
+        self._own_work_dir = work_dir is None
+        self.work_dir = Path(work_dir or tempfile.mkdtemp(prefix="datapilot-bench-"))
+        self.tenant_id = uuid.uuid4()
+        self._saved: dict[str, Any] = {}
+
+    def __enter__(self) -> "BenchEnvironment":
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.engine = create_engine(
+            f"sqlite:///{self.work_dir / 'bench.db'}", connect_args={"check_same_thread": False}
+        )
+        Base.metadata.create_all(bind=self.engine)
+        self.session_factory = sessionmaker(bind=self.engine)
+        self.db: Session = self.session_factory()
+
+        self._saved = {
+            "upload_dir": settings.upload_dir,
+            "max_upload_size_mb": settings.max_upload_size_mb,
+            "history_factory": query_history.session_factory,
+            "history_interval": query_history.flush_interval_seconds,
+        }
+        settings.upload_dir = str(self.work_dir / "uploads")
+        settings.max_upload_size_mb = sys.maxsize // (1024 * 1024)
+        query_history.session_factory = self.session_factory
+        query_history.flush_interval_seconds = 0
+        self._reset_shared_state()
+
+        self.user = User(
+            email=f"bench-{self.tenant_id}@datapilot.fr",
+            hashed_password="-",
+            tenant_id=self.tenant_id,
+        )
+        self.workspace = Workspace(tenant_id=self.tenant_id, name="Benchmark")
+        self.db.add_all([self.user, self.workspace])
+        self.db.commit()
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self._reset_shared_state()
+        settings.upload_dir = self._saved["upload_dir"]
+        settings.max_upload_size_mb = self._saved["max_upload_size_mb"]
+        query_history.session_factory = self._saved["history_factory"]
+        query_history.flush_interval_seconds = self._saved["history_interval"]
+        self.db.close()
+        self.engine.dispose()
+        if self._own_work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def access_token(self) -> str:
+        return create_access_token(
+            {"sub": str(self.user.id), "tenant_id": str(self.tenant_id), "role": self.user.role}
+        )
+
+    @staticmethod
+    def _reset_shared_state() -> None:
+        connection_pool.clear()
+        query_result_cache.clear()
+        answer_cache.clear()
+        view_catalog.clear()
+        query_history.clear()
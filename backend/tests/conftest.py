@@ -1,7 +1,11 @@
 """Shared test fixtures — in-memory SQLite database and FastAPI test client."""
 
+import json
+import os
+import tempfile
 import uuid
 
+import duckdb
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine, event
@@ -11,6 +15,9 @@ from sqlalchemy.pool import StaticPool
 from app.database import Base
 from app.core.dependencies import get_db
 from app.main import app
+from app.models.data_source import DataSource
+from app.services.query_history import query_history
+from app.services.ingestion_queue import InlineIngestionBackend, ingestion_queue
 
 SQLITE_URL = "sqlite:///:memory:"
 
@@ -38,6 +45,27 @@ def setup_db():
     Base.metadata.drop_all(bind=engine)
 
 
+@pytest.fixture(autouse=True)
+def query_history_db(monkeypatch):
+    """Write query history to the test database, only when flushed explicitly."""
+    monkeypatch.setattr(query_history, "session_factory", TestSession)
+    monkeypatch.setattr(query_history, "flush_interval_seconds", 0)
+    yield query_history
+    query_history.clear()
+
+
+@pytest.fixture(autouse=True)
+def ingestion_queue_db(monkeypatch):
+    """Run ingestion jobs synchronously against the test database.
+
+    Worker threads would share the single StaticPool connection with the request
+    session, so tests that need a real backend set one up themselves.
+    """
+    monkeypatch.setattr(ingestion_queue, "backend", InlineIngestionBackend())
+    monkeypatch.setattr(ingestion_queue, "session_factory", TestSession)
+    return ingestion_queue
+
+
 @pytest.fixture
 def db_session(setup_db):
     session = TestSession()
@@ -91,3 +119,86 @@ def auth_tokens(client, test_user_data, registered_user):
 def auth_header(auth_tokens):
     """Authorization header ready to use."""
     return {"Authorization": f"Bearer {auth_tokens['access_token']}"}
+
+
+@pytest.fixture
+def parquet_dir():
+    """Create a temporary directory with a test parquet file."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_content = "id,name,amount\n1,Alice,100.0\n2,Bob,200.0\n3,Charlie,150.0\n"
+        csv_path = os.path.join(tmpdir, "original.csv")
+        parquet_path = os.path.join(tmpdir, "processed.parquet")
+
+        with open(csv_path, "w") as f:
+            f.write(csv_content)
+
+        conn = duckdb.connect()
+        csv_str = csv_path.replace("'", "''")
+        pq_str = parquet_path.replace("'", "''")
+        conn.execute(
+            f"COPY (SELECT * FROM read_csv_auto('{csv_str}')) TO '{pq_str}' (FORMAT PARQUET)"
+        )
+        conn.close()
+
+        yield tmpdir
+
+
+@pytest.fixture
+def workspace_id(client, auth_header, db_session):
+    """Create a workspace and return its ID."""
+    resp = client.post(
+        "/api/v1/workspaces/",
+        json={"name": "Test Workspace"},
+        headers=auth_header,
+    )
+    assert resp.status_code == 201
+    return resp.json()["id"]
+
+
+@pytest.fixture
+def setup_semantic_layer(client, auth_header, db_session, workspace_id, parquet_dir):
+    """Create a data source + semantic layer pointing to test parquet."""
+    # Insert data source directly into DB
+    tenant_uuid = uuid.UUID(TENANT_ID)
+    ds_id = uuid.uuid4()
+    ds = DataSource(
+        id=ds_id,
+        tenant_id=tenant_uuid,
+        type="csv",
+        name="products",
+        connection_config_encrypted=json.dumps({"storage_path": parquet_dir}),
+        schema_cache={"columns": [], "row_count": 3},
+    )
+    db_session.add(ds)
+    db_session.commit()
+
+    definitions = {
+        "nodes": [
+            {
+                "id": "node-1",
+                "type": "tableNode",
+                "data": {
+                    "source_id": str(ds_id),
+                    "source_name": "products",
+                    "columns": [
+                        {"name": "id", "type": "BIGINT", "role": "dimension"},
+                        {"name": "name", "type": "VARCHAR", "role": "dimension"},
+                        {"name": "amount", "type": "DOUBLE", "role": "measure"},
+                    ],
+                },
+            }
+        ],
+        "edges": [],
+    }
+
+    resp = client.post(
+        "/api/v1/semantic-layers/",
+        json={
+            "workspace_id": workspace_id,
+            "name": "Test Layer",
+            "definitions_json": definitions,
+        },
+        headers=auth_header,
+    )
+    assert resp.status_code == 201
+    return {"workspace_id": workspace_id, "ds_id": str(ds_id)}
@@ -1,18 +1,36 @@
 """Tests for AIService and AI query endpoint."""
 
+import asyncio
 import json
+import threading
 import uuid
-from unittest.mock import MagicMock, patch
+from types import SimpleNamespace
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 import pytest
 
+from app.main import app
+from app.routers.ai import ai_query_stream
+from app.schemas.ai import AIQueryRequest
 from app.models.dashboard import SemanticLayer
 from app.models.workspace import Workspace
-from app.services.ai_service import AIService
+from app.services.ai_limiter import AIConcurrencyLimiter, AIOverloadedError
+from app.services.ai_service import AIService, JsonStringFieldStream, get_ai_service
+from app.services.query_registry import QueryCancelledError, query_registry
+from app.services.query_service import SemanticQueryBuilder
 
 TENANT_ID = "550e8400-e29b-41d4-a716-446655440000"
 
 
+@pytest.fixture
+def mock_ai_service(client):
+    """Replace the shared AIService dependency with a MagicMock."""
+    service = MagicMock()
+    app.dependency_overrides[get_ai_service] = lambda: service
+    yield service
+    app.dependency_overrides.pop(get_ai_service, None)
+
+
 # --- Unit tests for AIService ---
 
 
@@ -252,6 +270,140 @@ class TestEnsureClient:
                 svc._ensure_client()
 
 
+class TestGenerateSQLAsync:
+    """The Claude call goes through the async client inside a limiter slot."""
+
+    @pytest.mark.asyncio
+    async def test_uses_async_client(self):
+        svc = AIService()
+        response = MagicMock()
+        response.content = [MagicMock(text='{"sql": "SELECT 1", "explanation": "un"}')]
+        response.usage = MagicMock(
+            input_tokens=20, output_tokens=10,
+            cache_read_input_tokens=900, cache_creation_input_tokens=0,
+        )
+        svc._client = MagicMock()
+        create = svc._client.beta.prompt_caching.messages.create = AsyncMock(return_value=response)
+
+        result = await svc.generate_sql("combien ?", {"nodes": [], "edges": []}, tenant_id="t1")
+
+        assert result["sql"] == "SELECT 1"
+        create.assert_awaited_once()
+        assert svc.limiter.stats()["in_flight"] == 0
+        assert svc.stats()["cache_read_input_tokens"] == 900
+
+        # System prompt and schema context are cacheable; the question is not
+        kwargs = create.await_args.kwargs
+        assert kwargs["system"][0]["cache_control"] == {"type": "ephemeral"}
+        schema_block, question_block = kwargs["messages"][0]["content"]
+        assert "Schema de la base de donnees" in schema_block["text"]
+        assert schema_block["cache_control"] == {"type": "ephemeral"}
+        assert "combien ?" in question_block["text"]
+        assert "cache_control" not in question_block
+
+    @pytest.mark.asyncio
+    async def test_stream_sql_yields_sql_deltas(self):
+        svc = AIService()
+        raw = '{"sql": "SELECT \\"montant\\" FROM ventes", "explanation": "montants", "suggested_chart": "table"}'
+
+        async def fake_stream(schema_context, question_text, tenant_id):
+            for i in range(0, len(raw), 7):
+                yield raw[i:i + 7]
+
+        svc._complete_stream = fake_stream
+        events = [e async for e in svc.stream_sql("montants ?", {"nodes": [], "edges": []})]
+
+        deltas = [e["text"] for e in events if e["type"] == "sql_delta"]
+        assert len(deltas) > 1
+        assert "".join(deltas) == 'SELECT "montant" FROM ventes'
+        assert events[-1] == {
+            "type": "result",
+            "sql": 'SELECT "montant" FROM ventes',
+            "explanation": "montants",
+            "suggested_chart": "table",
+        }
+
+    def test_json_string_field_stream_waits_for_complete_escapes(self):
+        field = JsonStringFieldStream("sql")
+        assert field.feed('{"explanation": "x", "sq') == ""
+        assert field.feed('l": "a\\') == "a"
+        assert field.feed('nb\\u00') == "\nb"
+        assert field.feed('e9" , "x": "y"}') == "\u00e9"
+
+    def test_schema_prompt_memoized_per_layer_version(self):
+        svc = AIService()
+        definitions = {"nodes": [{"id": "n1", "data": {"source_name": "ventes"}}], "edges": []}
+        with patch.object(svc, "build_schema_prompt", wraps=svc.build_schema_prompt) as build:
+            first = svc.schema_prompt_for(definitions)
+            assert svc.schema_prompt_for(json.loads(json.dumps(definitions))) == first
+            assert build.call_count == 1
+
+            definitions["nodes"][0]["data"]["source_name"] = "clients"
+            assert "clients" in svc.schema_prompt_for(definitions)
+            assert build.call_count == 2
+
+    def test_shared_instance(self):
+        assert get_ai_service() is get_ai_service()
+
+
+class TestAIConcurrencyLimiter:
+    @pytest.mark.asyncio
+    async def test_global_limit_queues_then_runs(self):
+        limiter = AIConcurrencyLimiter(max_concurrency=1, max_per_tenant=5, max_queue=5, queue_timeout_seconds=5)
+        order = []
+
+        async def call(name):
+            async with limiter.slot("t1"):
+                order.append(f"{name}-start")
+                await asyncio.sleep(0.01)
+                order.append(f"{name}-end")
+
+        await asyncio.gather(call("a"), call("b"))
+        assert order == ["a-start", "a-end", "b-start", "b-end"]
+        assert limiter.stats()["peak_waiting"] == 1
+        assert limiter.stats()["acquired"] == 2
+
+    @pytest.mark.asyncio
+    async def test_busy_tenant_does_not_block_others(self):
+        limiter = AIConcurrencyLimiter(max_concurrency=2, max_per_tenant=1, max_queue=5, queue_timeout_seconds=5)
+        release = asyncio.Event()
+        started = []
+
+        async def call(tenant):
+            async with limiter.slot(tenant):
+                started.append(tenant)
+                await release.wait()
+
+        tasks = [asyncio.create_task(call(t)) for t in ("a", "a", "b")]
+        await asyncio.sleep(0.01)
+        assert sorted(started) == ["a", "b"]
+        assert limiter.stats()["waiting"] == 1
+        release.set()
+        await asyncio.gather(*tasks)
+        assert started == ["a", "b", "a"]
+
+    @pytest.mark.asyncio
+    async def test_rejects_when_queue_full(self):
+        limiter = AIConcurrencyLimiter(max_concurrency=1, max_per_tenant=1, max_queue=0, queue_timeout_seconds=5)
+        async with limiter.slot("t1"):
+            with pytest.raises(AIOverloadedError):
+                async with limiter.slot("t2"):
+                    pass
+        assert limiter.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_wait_timeout(self):
+        limiter = AIConcurrencyLimiter(max_concurrency=1, max_per_tenant=1, max_queue=5, queue_timeout_seconds=0.01)
+        async with limiter.slot("t1"):
+            with pytest.raises(AIOverloadedError):
+                async with limiter.slot("t2"):
+                    pass
+        stats = limiter.stats()
+        assert stats["timeouts"] == 1
+        assert stats["waiting"] == 0
+        assert stats["in_flight"] == 0
+
+
 # --- Endpoint integration tests ---
 
 
@@ -312,19 +464,17 @@ class TestAIQueryEndpoint:
         assert resp.status_code == 400
         assert "No semantic model" in resp.json()["detail"]
 
-    def test_missing_api_key_503(self, client, auth_header, db_session):
+    def test_missing_api_key_503(self, client, auth_header, db_session, mock_ai_service):
         workspace = self._setup_workspace_and_semantic_layer(db_session, TENANT_ID)
-        with patch("app.routers.ai.AIService") as MockService:
-            instance = MockService.return_value
-            instance._ensure_client.side_effect = RuntimeError("not configured")
-            resp = client.post(
-                "/api/v1/ai/query",
-                json={
-                    "question": "combien de ventes ?",
-                    "workspace_id": str(workspace.id),
-                },
-                headers=auth_header,
-            )
+        mock_ai_service._ensure_client.side_effect = RuntimeError("not configured")
+        resp = client.post(
+            "/api/v1/ai/query",
+            json={
+                "question": "combien de ventes ?",
+                "workspace_id": str(workspace.id),
+            },
+            headers=auth_header,
+        )
         assert resp.status_code == 503
         assert "not configured" in resp.json()["detail"]
 
@@ -373,15 +523,14 @@ class TestAIQueryEndpoint:
         assert "No semantic model" in resp.json()["detail"]
 
     @patch("app.routers.ai.SemanticQueryBuilder")
-    @patch("app.routers.ai.AIService")
     def test_full_flow_success(
-        self, MockAIService, MockBuilder, client, auth_header, db_session
+        self, MockBuilder, client, auth_header, db_session, mock_ai_service
     ):
         """Test happy path with mocked AI service and query builder."""
         workspace = self._setup_workspace_and_semantic_layer(db_session, TENANT_ID)
 
         # Mock AI service
-        ai_instance = MockAIService.return_value
+        ai_instance = mock_ai_service
         ai_instance._ensure_client.return_value = MagicMock()
         ai_instance.generate_sql = MagicMock(return_value={
             "sql": 'SELECT SUM(montant) AS total FROM "ventes"',
@@ -434,14 +583,13 @@ class TestAIQueryEndpoint:
         assert body["results"]["rows"][0]["total"] == 42000.0
 
     @patch("app.routers.ai.SemanticQueryBuilder")
-    @patch("app.routers.ai.AIService")
     def test_retry_on_first_failure(
-        self, MockAIService, MockBuilder, client, auth_header, db_session
+        self, MockBuilder, client, auth_header, db_session, mock_ai_service
     ):
         """Test that a failed first SQL attempt triggers a retry."""
         workspace = self._setup_workspace_and_semantic_layer(db_session, TENANT_ID)
 
-        ai_instance = MockAIService.return_value
+        ai_instance = mock_ai_service
         ai_instance._ensure_client.return_value = MagicMock()
 
         async def mock_generate_sql(**kwargs):
@@ -466,7 +614,7 @@ class TestAIQueryEndpoint:
         builder_instance = MockBuilder.return_value
         call_count = {"n": 0}
 
-        def mock_execute(sql_text, limit=1000):
+        def mock_execute(sql_text, limit=1000, run_id=None):
             call_count["n"] += 1
             if call_count["n"] == 1:
                 raise ValueError("Column bad_column not found")
@@ -491,3 +639,361 @@ class TestAIQueryEndpoint:
         assert resp.status_code == 200
         body = resp.json()
         assert body["explanation"] == "tentative 2 corrigee"
+
+    @patch("app.routers.ai.SemanticQueryBuilder")
+    def test_preflight_failure_retries_on_same_context(
+        self, MockBuilder, client, auth_header, db_session, mock_ai_service
+    ):
+        """SQL that fails to bind is retried without being executed or rebuilding the context."""
+        workspace = self._setup_workspace_and_semantic_layer(db_session, TENANT_ID)
+        mock_ai_service.generate_sql = AsyncMock(return_value={
+            "sql": "SELECT bad_column FROM ventes",
+            "explanation": "tentative 1",
+            "suggested_chart": "table",
+        })
+        mock_ai_service.generate_sql_with_retry = AsyncMock(return_value={
+            "sql": 'SELECT SUM(montant) FROM "ventes"',
+            "explanation": "tentative 2 corrigee",
+            "suggested_chart": "kpi",
+        })
+
+        builder_instance = MockBuilder.return_value
+        builder_instance.has_context = True
+
+        def mock_validate(sql_text):
+            if "bad_column" in sql_text:
+                raise ValueError("Query validation error: column bad_column not found")
+
+        builder_instance.validate.side_effect = mock_validate
+        builder_instance.execute_query.return_value = {
+            "columns": [{"name": "sum(montant)", "type": "DOUBLE"}],
+            "rows": [{"sum(montant)": 42000.0}],
+            "row_count": 1,
+            "execution_time_ms": 3.1,
+        }
+
+        resp = client.post(
+            "/api/v1/ai/query",
+            json={"question": "total des ventes", "workspace_id": str(workspace.id)},
+            headers=auth_header,
+        )
+        assert resp.status_code == 200
+        assert resp.json()["explanation"] == "tentative 2 corrigee"
+        assert builder_instance.setup_context.call_count == 1
+        builder_instance.execute_query.assert_called_once_with(
+            sql_text='SELECT SUM(montant) FROM "ventes"', limit=1000, run_id=ANY
+        )
+        builder_instance.close.assert_called_once()
+
+    @patch("app.routers.ai.SemanticQueryBuilder")
+    def test_repeated_question_served_from_answer_cache(
+        self, MockBuilder, client, auth_header, db_session, mock_ai_service
+    ):
+        """The second identical question reuses the validated SQL without calling Claude."""
+        workspace = self._setup_workspace_and_semantic_layer(db_session, TENANT_ID)
+        mock_ai_service.generate_sql = AsyncMock(return_value={
+            "sql": 'SELECT SUM(montant) AS total FROM "ventes"',
+            "explanation": "Somme des montants",
+            "suggested_chart": "kpi",
+        })
+        MockBuilder.return_value.execute_query.return_value = {
+            "columns": [{"name": "total", "type": "DOUBLE"}],
+            "rows": [{"total": 42000.0}],
+            "row_count": 1,
+            "execution_time_ms": 5.2,
+        }
+
+        statuses = []
+        for question in ("montant total des ventes", "Montant total des ventes ?"):
+            resp = client.post(
+                "/api/v1/ai/query",
+                json={"question": question, "workspace_id": str(workspace.id)},
+                headers=auth_header,
+            )
+            assert resp.status_code == 200
+            assert resp.json()["sql"] == 'SELECT SUM(montant) AS total FROM "ventes"'
+            statuses.append(resp.json()["cache_status"])
+
+        assert statuses == ["miss", "hit"]
+        assert mock_ai_service.generate_sql.await_count == 1
+
+    @patch("app.routers.ai.SemanticQueryBuilder")
+    def test_unavailable_data_source_does_not_retry(
+        self, MockBuilder, client, auth_header, db_session, mock_ai_service
+    ):
+        """A data source that cannot be read is a 400, without a Claude retry or losing the cached answer."""
+        workspace = self._setup_workspace_and_semantic_layer(db_session, TENANT_ID)
+        mock_ai_service.generate_sql = AsyncMock(return_value={
+            "sql": 'SELECT SUM(montant) AS total FROM "ventes"',
+            "explanation": "Somme des montants",
+            "suggested_chart": "kpi",
+        })
+        mock_ai_service.generate_sql_with_retry = AsyncMock()
+        MockBuilder.return_value.execute_query.return_value = {
+            "columns": [{"name": "total", "type": "DOUBLE"}],
+            "rows": [{"total": 42000.0}],
+            "row_count": 1,
+            "execution_time_ms": 5.2,
+        }
+        request = {"question": "montant total des ventes", "workspace_id": str(workspace.id)}
+        assert client.post("/api/v1/ai/query", json=request, headers=auth_header).status_code == 200
+
+        MockBuilder.return_value.setup_context.side_effect = ValueError(
+            "Data source 'ventes' is not ready (status: processing)"
+        )
+        resp = client.post("/api/v1/ai/query", json=request, headers=auth_header)
+        assert resp.status_code == 400
+        assert "not ready" in resp.json()["detail"]
+        mock_ai_service.generate_sql_with_retry.assert_not_awaited()
+
+        MockBuilder.return_value.setup_context.side_effect = None
+        resp = client.post("/api/v1/ai/query", json=request, headers=auth_header)
+        assert resp.json()["cache_status"] == "hit"
+        assert mock_ai_service.generate_sql.await_count == 1
+
+    @patch("app.routers.ai.SemanticQueryBuilder")
+    def test_failed_cached_sql_without_api_key_503(
+        self, MockBuilder, client, auth_header, db_session, mock_ai_service
+    ):
+        """A cached answer that no longer runs needs Claude for the retry: 503 if it is not configured."""
+        workspace = self._setup_workspace_and_semantic_layer(db_session, TENANT_ID)
+        mock_ai_service.generate_sql = AsyncMock(return_value={
+            "sql": 'SELECT SUM(montant) AS total FROM "ventes"',
+            "explanation": "Somme des montants",
+            "suggested_chart": "kpi",
+        })
+        mock_ai_service.generate_sql_with_retry = AsyncMock()
+        MockBuilder.return_value.execute_query.return_value = {
+            "columns": [{"name": "total", "type": "DOUBLE"}],
+            "rows": [{"total": 42000.0}],
+            "row_count": 1,
+            "execution_time_ms": 5.2,
+        }
+        request = {"question": "montant total des ventes", "workspace_id": str(workspace.id)}
+        assert client.post("/api/v1/ai/query", json=request, headers=auth_header).status_code == 200
+
+        mock_ai_service._ensure_client.side_effect = RuntimeError("not configured")
+        MockBuilder.return_value.validate.side_effect = ValueError("column montant not found")
+        resp = client.post("/api/v1/ai/query", json=request, headers=auth_header)
+        assert resp.status_code == 503
+        assert "not configured" in resp.json()["detail"]
+        mock_ai_service.generate_sql_with_retry.assert_not_awaited()
+        MockBuilder.return_value.close.assert_called()
+
+    @patch("app.routers.ai.SemanticQueryBuilder")
+    def test_cancelled_query_409(
+        self, MockBuilder, client, auth_header, db_session, mock_ai_service
+    ):
+        """A cancelled query is reported as such, without a retry."""
+        workspace = self._setup_workspace_and_semantic_layer(db_session, TENANT_ID)
+        mock_ai_service.generate_sql = AsyncMock(return_value={
+            "sql": 'SELECT SUM(montant) FROM "ventes"',
+            "explanation": "Somme",
+            "suggested_chart": "kpi",
+        })
+        mock_ai_service.generate_sql_with_retry = AsyncMock()
+        MockBuilder.return_value.execute_query.side_effect = QueryCancelledError("Query was cancelled")
+
+        resp = client.post(
+            "/api/v1/ai/query",
+            json={"question": "total des ventes", "workspace_id": str(workspace.id)},
+            headers=auth_header,
+        )
+        assert resp.status_code == 409
+        assert resp.json()["detail"] == "Query was cancelled"
+        mock_ai_service.generate_sql_with_retry.assert_not_awaited()
+        MockBuilder.return_value.close.assert_called()
+
+    @patch("app.routers.ai.SemanticQueryBuilder")
+    def test_client_disconnect_cancels_query(
+        self, MockBuilder, client, auth_header, db_session, mock_ai_service, monkeypatch
+    ):
+        workspace = self._setup_workspace_and_semantic_layer(db_session, TENANT_ID)
+        mock_ai_service.generate_sql = AsyncMock(return_value={
+            "sql": 'SELECT SUM(montant) FROM "ventes"',
+            "explanation": "Somme",
+            "suggested_chart": "kpi",
+        })
+
+        def long_query(sql_text, limit=1000, run_id=None):
+            interrupted = threading.Event()
+            run = query_registry.register(TENANT_ID, run_id, sql_text, interrupted.set)
+            try:
+                assert interrupted.wait(5), "query was not cancelled"
+            finally:
+                query_registry.unregister(run)
+            raise QueryCancelledError(f"Query {run_id} was cancelled")
+
+        async def gone(self):
+            return True
+
+        MockBuilder.return_value.execute_query = long_query
+        monkeypatch.setattr("starlette.requests.Request.is_disconnected", gone)
+        resp = client.post(
+            "/api/v1/ai/query",
+            json={"question": "total des ventes", "workspace_id": str(workspace.id)},
+            headers=auth_header,
+        )
+        assert resp.status_code == 409
+
+
+def _sse_events(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestAIQueryStreamEndpoint:
+    """Tests for POST /api/v1/ai/query/stream (Server-Sent Events)."""
+
+    @staticmethod
+    def _stream_sql(*answers):
+        """Fake AIService.stream_sql returning the given SQL strings, one per call."""
+        calls = []
+
+        async def stream_sql(**kwargs):
+            calls.append(kwargs)
+            sql = answers[len(calls) - 1]
+            for i in range(0, len(sql), 10):
+                yield {"type": "sql_delta", "text": sql[i:i + 10]}
+            yield {"type": "result", "sql": sql, "explanation": "explication", "suggested_chart": None}
+
+        return stream_sql, calls
+
+    def test_requires_auth(self, client):
+        resp = client.post(
+            "/api/v1/ai/query/stream",
+            json={"question": "total des ventes", "workspace_id": str(uuid.uuid4())},
+        )
+        assert resp.status_code in (401, 403)
+
+    def test_no_semantic_layer_400(self, client, auth_header, mock_ai_service):
+        resp = client.post(
+            "/api/v1/ai/query/stream",
+            json={"question": "total des ventes", "workspace_id": str(uuid.uuid4())},
+            headers=auth_header,
+        )
+        assert resp.status_code == 400
+
+    def test_streams_stages_in_order(self, client, auth_header, setup_semantic_layer, mock_ai_service):
+        sql = "SELECT name, amount FROM products ORDER BY id"
+        mock_ai_service.stream_sql, _ = self._stream_sql(sql)
+        mock_ai_service.suggest_chart_type.return_value = "bar"
+
+        resp = client.post(
+            "/api/v1/ai/query/stream",
+            json={"question": "montant par produit", "workspace_id": setup_semantic_layer["workspace_id"]},
+            headers=auth_header,
+        )
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        events = _sse_events(resp.text)
+        names = [name for name, _ in events]
+
+        assert names[0] == "sql_delta"
+        assert "".join(d["text"] for n, d in events if n == "sql_delta") == sql
+        assert [n for n in names if n != "sql_delta"] == [
+            "sql", "explanation", "validation", "rows", "stats", "chart", "done",
+        ]
+        data = dict(events)
+        assert data["sql"] == {"sql": sql, "cache_status": "miss"}
+        assert data["validation"] == {"valid": True}
+        assert [r["name"] for r in data["rows"]["rows"]] == ["Alice", "Bob", "Charlie"]
+        assert data["stats"]["row_count"] == 3
+        assert data["chart"] == {"suggested_chart": "bar"}
+
+    def test_validation_failure_streams_retry(
+        self, client, auth_header, setup_semantic_layer, mock_ai_service
+    ):
+        mock_ai_service.stream_sql, calls = self._stream_sql(
+            "SELECT no_such_column FROM products",
+            "SELECT SUM(amount) AS total FROM products",
+        )
+        mock_ai_service.suggest_chart_type.return_value = "kpi"
+
+        resp = client.post(
+            "/api/v1/ai/query/stream",
+            json={"question": "total des montants", "workspace_id": setup_semantic_layer["workspace_id"]},
+            headers=auth_header,
+        )
+        events = _sse_events(resp.text)
+        names = [name for name, _ in events if name != "sql_delta"]
+
+        assert names == [
+            "sql", "explanation", "validation", "retry",
+            "sql", "explanation", "validation", "rows", "stats", "chart", "done",
+        ]
+        validations = [d for n, d in events if n == "validation"]
+        assert validations[0]["valid"] is False
+        assert "Query validation error" in validations[0]["error"]
+        assert calls[1]["previous_sql"] == "SELECT no_such_column FROM products"
+        assert "Query validation error" in calls[1]["error_message"]
+        assert dict(events)["rows"]["rows"] == [{"total": 450.0}]
+
+    def test_failed_cached_sql_without_api_key_503(
+        self, client, auth_header, setup_semantic_layer, mock_ai_service, monkeypatch
+    ):
+        """A cached answer that no longer runs needs Claude for the retry: 503 if it is not configured."""
+        mock_ai_service.stream_sql, calls = self._stream_sql("SELECT SUM(amount) AS total FROM products")
+        mock_ai_service.suggest_chart_type.return_value = "kpi"
+        request = {"question": "total des montants", "workspace_id": setup_semantic_layer["workspace_id"]}
+        client.post("/api/v1/ai/query/stream", json=request, headers=auth_header)
+
+        def fail_validation(self, sql_text):
+            raise ValueError("Query validation error: column amount not found")
+
+        mock_ai_service._ensure_client.side_effect = RuntimeError("not configured")
+        monkeypatch.setattr(SemanticQueryBuilder, "validate", fail_validation)
+        resp = client.post("/api/v1/ai/query/stream", json=request, headers=auth_header)
+        events = _sse_events(resp.text)
+
+        assert [name for name, _ in events] == ["sql", "explanation", "validation", "retry", "error"]
+        assert dict(events)["sql"]["cache_status"] == "hit"
+        assert dict(events)["error"]["status_code"] == 503
+        assert "not configured" in dict(events)["error"]["detail"]
+        assert len(calls) == 1
+
+    def test_cancelled_query_streams_error(
+        self, client, auth_header, setup_semantic_layer, mock_ai_service, monkeypatch
+    ):
+        mock_ai_service.stream_sql, calls = self._stream_sql("SELECT name FROM products")
+
+        def cancelled(self, *args, **kwargs):
+            raise QueryCancelledError("Query was cancelled")
+
+        monkeypatch.setattr(SemanticQueryBuilder, "execute_stream", cancelled)
+        resp = client.post(
+            "/api/v1/ai/query/stream",
+            json={"question": "noms des produits", "workspace_id": setup_semantic_layer["workspace_id"]},
+            headers=auth_header,
+        )
+        events = _sse_events(resp.text)
+        assert [name for name, _ in events if name != "sql_delta"] == [
+            "sql", "explanation", "validation", "error",
+        ]
+        assert events[-1][1] == {"status_code": 409, "detail": "Query was cancelled"}
+        assert len(calls) == 1
+
+    def test_closed_stream_cancels_its_query(self, db_session, setup_semantic_layer, mock_ai_service):
+        mock_ai_service.stream_sql, _ = self._stream_sql("SELECT i FROM range(100000000) t(i)")
+        user = SimpleNamespace(tenant_id=uuid.UUID(TENANT_ID))
+        request = AIQueryRequest(question="tous les nombres", workspace_id=setup_semantic_layer["workspace_id"])
+
+        async def read_first_rows_then_leave() -> int:
+            response = await ai_query_stream(
+                request, db=db_session, current_user=user, ai_service=mock_ai_service
+            )
+            body = response.body_iterator
+            async for chunk in body:
+                if chunk.startswith("event: rows"):
+                    break
+            assert query_registry.stats()["running"] == 1
+            cancelled = query_registry.stats()["cancelled"]
+            await body.aclose()  # what the server does when the client disconnects
+            return cancelled
+
+        cancelled = asyncio.run(read_first_rows_then_leave())
+        assert query_registry.stats()["cancelled"] == cancelled + 1
+        assert query_registry.stats()["running"] == 0
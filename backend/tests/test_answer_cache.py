@@ -0,0 +1,74 @@
+"""Tests for the question -> SQL answer cache."""
+
+from app.services.answer_cache import AnswerCache, normalize_question
+
+
+def _cache(threshold=0.9):
+    return AnswerCache(max_entries_per_scope=10, ttl_seconds=60, similarity_threshold=threshold)
+
+
+SCOPE = AnswerCache.scope_key("tenant", "ws", "v1")
+
+
+class TestNormalizeQuestion:
+    def test_case_accents_and_punctuation(self):
+        assert normalize_question("  Ventes par Région ?! ") == "ventes par region"
+
+
+class TestAnswerCache:
+    def test_exact_hit_after_normalization(self):
+        cache = _cache()
+        cache.store(SCOPE, "CA par mois", "SELECT 1", "Chiffre d'affaires", "line")
+        answer, status = cache.lookup(SCOPE, "ca PAR mois ?")
+        assert status == "hit"
+        assert answer.sql == "SELECT 1"
+        assert answer.suggested_chart == "line"
+
+    def test_similar_phrasing_hits(self):
+        cache = _cache()
+        cache.store(SCOPE, "panier moyen par magasin", "SELECT 2", "", "bar")
+        answer, status = cache.lookup(SCOPE, "Quel est le panier moyen par magasin ?")
+        assert status == "similar"
+        assert answer.sql == "SELECT 2"
+
+    def test_different_meaning_misses(self):
+        cache = _cache()
+        cache.store(SCOPE, "nombre de clients actifs", "SELECT 3", "", "kpi")
+        cache.store(SCOPE, "CA par mois", "SELECT 4", "", "line")
+        assert cache.lookup(SCOPE, "nombre de clients inactifs") is None
+        assert cache.lookup(SCOPE, "CA par an") is None
+
+    def test_different_numbers_never_match(self):
+        cache = _cache(threshold=0.0)
+        cache.store(SCOPE, "top 10 clients", "SELECT ... LIMIT 10", "", "bar")
+        assert cache.lookup(SCOPE, "top 5 clients") is None
+
+    def test_similarity_tier_can_be_disabled(self):
+        cache = _cache(threshold=None)
+        cache.store(SCOPE, "panier moyen par magasin", "SELECT 2", "", "bar")
+        assert cache.lookup(SCOPE, "le panier moyen par magasin") is None
+
+    def test_scoped_by_layer_version_and_workspace(self):
+        cache = _cache()
+        cache.store(SCOPE, "CA par mois", "SELECT 1", "", "line")
+        assert cache.lookup(AnswerCache.scope_key("tenant", "ws", "v2"), "CA par mois") is None
+        assert cache.lookup(AnswerCache.scope_key("tenant", "ws2", "v1"), "CA par mois") is None
+        assert cache.lookup(AnswerCache.scope_key("other", "ws", "v1"), "CA par mois") is None
+
+    def test_invalidate_workspace(self):
+        cache = _cache()
+        cache.store(SCOPE, "CA par mois", "SELECT 1", "", "line")
+        assert cache.invalidate(tenant_id="tenant", workspace_id="ws") == 1
+        assert cache.lookup(SCOPE, "CA par mois") is None
+
+    def test_expired_entries_miss(self):
+        cache = AnswerCache(max_entries_per_scope=10, ttl_seconds=0, similarity_threshold=0.9)
+        cache.store(SCOPE, "CA par mois", "SELECT 1", "", "line")
+        assert cache.lookup(SCOPE, "CA par mois") is None
+
+    def test_oldest_entries_evicted(self):
+        cache = AnswerCache(max_entries_per_scope=2, ttl_seconds=60, similarity_threshold=None)
+        for i, question in enumerate(["ventes", "clients", "produits"]):
+            cache.store(SCOPE, question, f"SELECT {i}", "", None)
+        assert cache.lookup(SCOPE, "ventes") is None
+        assert cache.stats()["entries"] == 2
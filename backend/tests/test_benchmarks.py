@@ -0,0 +1,69 @@
+"""Smoke tests for the benchmark harness: every benchmark runs on test-data and small scale-ups."""
+
+import json
+
+import duckdb
+import pytest
+
+from benchmarks.__main__ import main
+from benchmarks.cases import GROUPS
+from benchmarks.datagen import TABLES, generate, parse_scale
+
+
+def test_parse_scale():
+    assert parse_scale("base") is None
+    assert parse_scale("1m") == 1_000_000
+    assert parse_scale("250K") == 250_000
+    assert parse_scale("5000") == 5000
+    with pytest.raises(ValueError):
+        parse_scale("1g")
+
+
+def test_generate_scales_the_star_schema(tmp_path):
+    paths = generate("5000", tmp_path)
+    conn = duckdb.connect()
+    count = lambda table: conn.execute(f"SELECT count(*) FROM read_csv_auto('{paths[table]}')").fetchone()[0]
+    assert count("fact_ventes") == 5000
+    assert count("dim_clients") == 50
+    # Every sale points at an existing client, product and salesperson
+    orphans = conn.execute(f"""
+        SELECT count(*) FROM read_csv_auto('{paths["fact_ventes"]}') f
+        LEFT JOIN read_csv_auto('{paths["dim_clients"]}') c USING (client_id)
+        LEFT JOIN read_csv_auto('{paths["dim_produits"]}') p USING (produit_id)
+        LEFT JOIN read_csv_auto('{paths["dim_commerciaux"]}') s USING (commercial_id)
+        WHERE c.nom IS NULL OR p.nom_produit IS NULL OR s.equipe IS NULL
+    """).fetchone()[0]
+    assert orphans == 0
+    # A second call reuses the files
+    mtime = paths["fact_ventes"].stat().st_mtime_ns
+    assert generate("5000", tmp_path)["fact_ventes"].stat().st_mtime_ns == mtime
+
+
+def test_run_and_compare(tmp_path, capsys):
+    output = tmp_path / "results.json"
+    args = ["run", "--scale", "base", "--repeat", "1", "--data-dir", str(tmp_path / "data"), "-o", str(output)]
+    assert main(args) == 0
+
+    data = json.loads(output.read_text())
+    (run,) = data["runs"]
+    assert run["metadata"]["scale"] == "base"
+    results = {result["name"]: result for result in run["results"]}
+    assert {result["group"] for result in results.values()} == set(GROUPS)
+    assert {f"upload.{table}" for table in TABLES} <= results.keys()
+    assert results["upload.fact_ventes"]["info"]["rows"] == 40
+    assert results["execute_query.top_products"]["info"]["rows"] == 10
+    assert results["dashboard_render.cached"]["info"]["widgets"] == 5
+    assert results["http.ai_query.llm"]["info"]["cache_status"] == "miss"
+    assert results["http.ai_query.answer_cached"]["info"]["cache_status"] == "hit"
+    assert all(result["median_ms"] > 0 for result in results.values())
+
+    # Same file on both sides: no regression
+    capsys.readouterr()
+    assert main(["compare", str(output), str(output)]) == 0
+    assert "execute_query.revenue_by_month" in capsys.readouterr().out
+
+    for result in run["results"]:
+        result["median_ms"] /= 2
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps(data))
+    assert main(["compare", str(baseline), str(output)]) == 1
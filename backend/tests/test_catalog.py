@@ -0,0 +1,116 @@
+"""Tests for the view catalog cache (batched DataSource resolution)."""
+
+import json
+import os
+import shutil
+import uuid
+
+import duckdb
+import pytest
+from sqlalchemy import event
+
+from app.models.data_source import DataSource
+from app.services.catalog_service import ViewCatalogCache
+from tests.conftest import TENANT_ID, engine
+
+
+@pytest.fixture
+def count_queries():
+    """Count SQL statements sent to the test database."""
+    statements: list[str] = []
+
+    def _before(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _before)
+    yield statements
+    event.remove(engine, "before_cursor_execute", _before)
+
+
+def _add_sources(db_session, storage_path: str, names: list[str]) -> dict:
+    nodes = []
+    for name in names:
+        ds_id = uuid.uuid4()
+        db_session.add(DataSource(
+            id=ds_id,
+            tenant_id=uuid.UUID(TENANT_ID),
+            type="csv",
+            name=name,
+            connection_config_encrypted=json.dumps({"storage_path": storage_path}),
+        ))
+        nodes.append({"id": f"n-{name}", "data": {"source_id": str(ds_id), "source_name": name}})
+    db_session.commit()
+    return {"nodes": nodes, "edges": []}
+
+
+class TestViewCatalogCache:
+    def test_resolves_all_nodes_in_one_query(self, db_session, parquet_dir, count_queries):
+        definitions = _add_sources(db_session, parquet_dir, ["ventes", "clients", "produits"])
+        count_queries.clear()
+
+        catalog = ViewCatalogCache().resolve(definitions, TENANT_ID, db_session)
+
+        assert [view.name for view in catalog.views] == ["ventes", "clients", "produits"]
+        assert len(count_queries) == 1
+
+    def test_memoizes_per_layer_version(self, db_session, parquet_dir, count_queries):
+        definitions = _add_sources(db_session, parquet_dir, ["ventes"])
+        cache = ViewCatalogCache()
+        first = cache.resolve(definitions, TENANT_ID, db_session)
+        count_queries.clear()
+
+        assert cache.resolve(definitions, TENANT_ID, db_session) is first
+        assert count_queries == []
+
+        changed = {**definitions, "edges": [{"source": "a", "target": "b"}]}
+        assert cache.resolve(changed, TENANT_ID, db_session) is not first
+
+    def test_invalidate_by_data_source(self, db_session, parquet_dir):
+        definitions = _add_sources(db_session, parquet_dir, ["ventes"])
+        cache = ViewCatalogCache()
+        first = cache.resolve(definitions, TENANT_ID, db_session)
+        ds_id = next(iter(first.data_source_ids))
+
+        assert cache.invalidate(data_source_id=uuid.uuid4()) == 0
+        assert cache.invalidate(data_source_id=ds_id) == 1
+        assert cache.resolve(definitions, TENANT_ID, db_session) is not first
+
+    def test_rewritten_parquet_resolves_again(self, db_session, parquet_dir):
+        definitions = _add_sources(db_session, parquet_dir, ["ventes"])
+        cache = ViewCatalogCache()
+        first = cache.resolve(definitions, TENANT_ID, db_session)
+        assert cache.resolve(definitions, TENANT_ID, db_session) is first
+
+        parquet_path = os.path.join(parquet_dir, "processed.parquet")
+        duckdb.connect().execute(f"COPY (SELECT 1 AS id) TO '{parquet_path}' (FORMAT PARQUET)")
+        second = cache.resolve(definitions, TENANT_ID, db_session)
+        assert second.data_version != first.data_version
+
+        os.remove(parquet_path)
+        with pytest.raises(ValueError, match="Parquet file not found"):
+            cache.resolve(definitions, TENANT_ID, db_session)
+
+    def test_sanitizes_view_names(self, db_session, parquet_dir):
+        definitions = _add_sources(db_session, parquet_dir, ["export-operations 2026"])
+        catalog = ViewCatalogCache().resolve(definitions, TENANT_ID, db_session)
+        assert catalog.views[0].name == "export_operations_2026"
+
+    def test_other_tenant_source_not_found(self, db_session, parquet_dir):
+        definitions = _add_sources(db_session, parquet_dir, ["ventes"])
+        with pytest.raises(ValueError, match="not found for this tenant"):
+            ViewCatalogCache().resolve(definitions, uuid.uuid4(), db_session)
+
+    def test_missing_parquet_file(self, db_session, parquet_dir, tmp_path):
+        storage = tmp_path / "gone"
+        storage.mkdir()
+        definitions = _add_sources(db_session, str(storage), ["ventes"])
+        shutil.rmtree(storage)
+        with pytest.raises(ValueError, match="Parquet file not found"):
+            ViewCatalogCache().resolve(definitions, TENANT_ID, db_session)
+
+    def test_source_still_ingesting(self, db_session, parquet_dir):
+        definitions = _add_sources(db_session, parquet_dir, ["ventes"])
+        db_session.query(DataSource).update({"status": "processing"})
+        db_session.commit()
+        with pytest.raises(ValueError, match=r"not ready \(status: processing\)"):
+            ViewCatalogCache().resolve(definitions, TENANT_ID, db_session)
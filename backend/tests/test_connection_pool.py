@@ -0,0 +1,157 @@
+"""Tests for the warm DuckDB connection pool and its use by SemanticQueryBuilder."""
+
+import json
+import uuid
+
+import duckdb
+import pytest
+
+from app.models.data_source import DataSource
+from app.services.connection_pool import DuckDBConnectionPool
+from app.services.query_service import SemanticQueryBuilder, semantic_layer_version
+
+TENANT_ID = "550e8400-e29b-41d4-a716-446655440000"
+
+
+def _factory(calls: list, source_id: str = "ds-1"):
+    def build():
+        calls.append(1)
+        conn = duckdb.connect()
+        conn.execute("CREATE VIEW t AS SELECT 42 AS answer")
+        return conn, ["t"], {source_id}
+    return build
+
+
+class TestDuckDBConnectionPool:
+    def test_reuses_warm_database(self):
+        pool = DuckDBConnectionPool(max_connections=4, idle_timeout_seconds=60)
+        calls: list = []
+        key = ("tenant", "ws", "v1")
+
+        first = pool.checkout(key, _factory(calls))
+        assert first.cursor.execute("SELECT answer FROM t").fetchone()[0] == 42
+        first.release()
+
+        second = pool.checkout(key, _factory(calls))
+        assert second.cursor.execute("SELECT answer FROM t").fetchone()[0] == 42
+        second.release()
+
+        assert len(calls) == 1
+        assert pool.stats()["hits"] == 1
+        assert pool.stats()["misses"] == 1
+
+    def test_new_version_builds_new_database(self):
+        pool = DuckDBConnectionPool(max_connections=4, idle_timeout_seconds=60)
+        calls: list = []
+        pool.checkout(("tenant", "ws", "v1"), _factory(calls)).release()
+        pool.checkout(("tenant", "ws", "v2"), _factory(calls)).release()
+        assert len(calls) == 2
+
+    def test_lru_eviction(self):
+        pool = DuckDBConnectionPool(max_connections=2, idle_timeout_seconds=60)
+        calls: list = []
+        for version in ("v1", "v2", "v3"):
+            pool.checkout(("tenant", "ws", version), _factory(calls)).release()
+        assert pool.stats()["size"] == 2
+        assert pool.stats()["evictions"] == 1
+
+        # v1 was the least recently used and must be rebuilt
+        pool.checkout(("tenant", "ws", "v1"), _factory(calls)).release()
+        assert len(calls) == 4
+
+    def test_idle_eviction(self):
+        pool = DuckDBConnectionPool(max_connections=4, idle_timeout_seconds=0)
+        calls: list = []
+        pool.checkout(("tenant", "ws", "v1"), _factory(calls)).release()
+        pool.checkout(("tenant", "ws", "v1"), _factory(calls)).release()
+        assert len(calls) == 2
+
+    def test_invalidate_by_data_source(self):
+        pool = DuckDBConnectionPool(max_connections=4, idle_timeout_seconds=60)
+        calls: list = []
+        pool.checkout(("tenant", "ws", "v1"), _factory(calls, "ds-1")).release()
+        pool.checkout(("tenant", "ws2", "v1"), _factory(calls, "ds-2")).release()
+
+        assert pool.invalidate(data_source_id="ds-1") == 1
+        assert pool.stats()["size"] == 1
+
+    def test_evicted_database_stays_open_while_leased(self):
+        pool = DuckDBConnectionPool(max_connections=4, idle_timeout_seconds=60)
+        lease = pool.checkout(("tenant", "ws", "v1"), _factory([]))
+        pool.clear()
+        # Still usable until released
+        assert lease.cursor.execute("SELECT answer FROM t").fetchone()[0] == 42
+        lease.release()
+        assert pool.stats()["size"] == 0
+
+    def test_duckdb_calls_run_outside_the_pool_lock(self, monkeypatch):
+        from app.services.connection_pool import duckdb_resources
+
+        pool = DuckDBConnectionPool(max_connections=1, idle_timeout_seconds=60)
+        calls: list = []
+
+        def record(name):
+            def call(conn, *args):
+                calls.append((name, pool._lock.locked()))
+            return call
+
+        monkeypatch.setattr(duckdb_resources, "set_active", record("set_active"))
+        monkeypatch.setattr(duckdb_resources, "close", record("close"))
+        pool.checkout(("tenant", "ws", "v1"), _factory([])).release()
+        lease = pool.checkout(("tenant", "ws", "v1"), _factory([]))
+        # Evicts v1 once it is released
+        pool.checkout(("tenant", "ws", "v2"), _factory([])).release()
+        lease.release()
+        pool.clear()
+
+        assert {name for name, _ in calls} == {"set_active", "close"}
+        assert not any(locked for _, locked in calls)
+
+
+class TestBuilderWithPool:
+    def test_builders_share_pooled_views(self, db_session, parquet_dir):
+        ds_id = uuid.uuid4()
+        db_session.add(DataSource(
+            id=ds_id,
+            tenant_id=uuid.UUID(TENANT_ID),
+            type="csv",
+            name="sales",
+            connection_config_encrypted=json.dumps({"storage_path": parquet_dir}),
+        ))
+        db_session.commit()
+        definitions = {
+            "nodes": [{"id": "n1", "data": {"source_id": str(ds_id), "source_name": "sales"}}],
+            "edges": [],
+        }
+        pool = DuckDBConnectionPool(max_connections=4, idle_timeout_seconds=60)
+        workspace_id = uuid.uuid4()
+
+        for _ in range(2):
+            with SemanticQueryBuilder(pool=pool) as builder:
+                views = builder.setup_context(definitions, TENANT_ID, db_session, workspace_id)
+                assert views == ["sales"]
+                result = builder.execute_query("SELECT COUNT(*) AS cnt FROM sales")
+                assert result["rows"][0]["cnt"] == 3
+
+        assert pool.stats() == {
+            "size": 1, "in_use": 0, "hits": 1, "misses": 1, "evictions": 0,
+        }
+
+    def test_failed_setup_is_not_pooled(self, db_session):
+        definitions = {
+            "nodes": [{"id": "n1", "data": {"source_id": str(uuid.uuid4()), "source_name": "x"}}],
+            "edges": [],
+        }
+        pool = DuckDBConnectionPool(max_connections=4, idle_timeout_seconds=60)
+        with pytest.raises(ValueError, match="not found"):
+            SemanticQueryBuilder(pool=pool).setup_context(
+                definitions, TENANT_ID, db_session, uuid.uuid4()
+            )
+        assert pool.stats()["size"] == 0
+
+    def test_version_changes_with_definitions(self):
+        a = {"nodes": [{"id": "n1"}], "edges": []}
+        b = {"edges": [], "nodes": [{"id": "n1"}]}
+        c = {"nodes": [{"id": "n2"}], "edges": []}
+        assert semantic_layer_version(a) == semantic_layer_version(b)
+        assert semantic_layer_version(a) != semantic_layer_version(c)
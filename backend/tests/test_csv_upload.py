@@ -7,8 +7,13 @@ import shutil
 import uuid
 from unittest.mock import patch
 
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
 
+from app.models.data_source import DataSource
+from app.services.csv_service import _ingest_csv, _read_parquet_rows
 from tests.conftest import TENANT_ID
 
 
@@ -90,6 +95,66 @@ class TestCSVUpload:
         assert "empty" in resp.json()["detail"].lower()
 
 
+class TestIngestCSV:
+    def test_schema_count_and_sample_from_parquet(self, tmp_path):
+        csv_path = tmp_path / "big.csv"
+        csv_path.write_text("id,day,price\n" + "".join(
+            f"{i},2026-01-{i % 28 + 1:02d},{i}.5\n" for i in range(250)
+        ))
+        info = _ingest_csv(csv_path, tmp_path / "out.parquet")
+
+        assert (tmp_path / "out.parquet").exists()
+        assert info["columns"] == [
+            {"name": "id", "type": "BIGINT"},
+            {"name": "day", "type": "DATE"},
+            {"name": "price", "type": "DOUBLE"},
+        ]
+        assert info["row_count"] == 250
+        assert len(info["sample_rows"]) == 100
+        assert info["sample_rows"][0] == {"id": 0, "day": "2026-01-01", "price": 0.5}
+
+    def test_header_only_csv(self, tmp_path):
+        csv_path = tmp_path / "header.csv"
+        csv_path.write_text("a,b\n")
+        info = _ingest_csv(csv_path, tmp_path / "out.parquet")
+        assert info["row_count"] == 0
+        assert info["sample_rows"] == []
+
+
+class TestReadParquetRows:
+    @pytest.fixture
+    def parquet_path(self, tmp_path):
+        path = tmp_path / "groups.parquet"
+        duckdb.connect().execute(
+            f"COPY (SELECT range AS id FROM range(250)) TO '{path}' (FORMAT PARQUET, ROW_GROUP_SIZE 100)"
+        )
+        return path
+
+    def test_page_inside_one_row_group(self, parquet_path):
+        assert _read_parquet_rows(parquet_path, 120, 5).column("id").to_pylist() == list(range(120, 125))
+
+    def test_page_spanning_row_groups(self, parquet_path):
+        assert _read_parquet_rows(parquet_path, 95, 10).column("id").to_pylist() == list(range(95, 105))
+
+    def test_last_partial_page_and_beyond(self, parquet_path):
+        assert _read_parquet_rows(parquet_path, 245, 10).column("id").to_pylist() == list(range(245, 250))
+        assert _read_parquet_rows(parquet_path, 250, 10).num_rows == 0
+
+    def test_closes_file(self, parquet_path, monkeypatch):
+        opened = []
+
+        class _TrackedParquetFile(pq.ParquetFile):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                opened.append(self)
+
+        monkeypatch.setattr(pq, "ParquetFile", _TrackedParquetFile)
+        _read_parquet_rows(parquet_path, 0, 10)
+        _read_parquet_rows(parquet_path, 250, 10)
+        assert len(opened) == 2
+        assert all(parquet_file.closed for parquet_file in opened)
+
+
 class TestDataSourcesList:
     def test_list_empty(self, client, auth_header):
         resp = client.get(f"{UPLOAD_PREFIX}/", headers=auth_header)
@@ -289,6 +354,74 @@ class TestDataSourcePreview:
         resp = client.get(f"{UPLOAD_PREFIX}/{ds_id}/preview", headers=other_header)
         assert resp.status_code == 404
 
+    def test_preview_metadata_from_schema_cache(self, client, auth_header, tmp_upload_dir, db_session):
+        """Row count and columns come from schema_cache, not from a parquet scan."""
+        ds_id = self._upload(client, auth_header, tmp_upload_dir)
+        ds = db_session.get(DataSource, uuid.UUID(ds_id))
+        ds.schema_cache = {**ds.schema_cache, "row_count": 1234}
+        db_session.commit()
+
+        data = client.get(f"{UPLOAD_PREFIX}/{ds_id}/preview", headers=auth_header).json()
+        assert data["total_rows"] == 1234
+        assert len(data["rows"]) == 3
+
+    def test_preview_metadata_from_parquet_footer(self, client, auth_header, tmp_upload_dir, db_session):
+        ds_id = self._upload(client, auth_header, tmp_upload_dir)
+        ds = db_session.get(DataSource, uuid.UUID(ds_id))
+        ds.schema_cache = None
+        db_session.commit()
+
+        data = client.get(f"{UPLOAD_PREFIX}/{ds_id}/preview", headers=auth_header).json()
+        assert data["total_rows"] == 3
+        assert [c["name"] for c in data["columns"]] == ["name", "age", "city"]
+
+    def test_preview_blob_and_uuid_columns(self, client, auth_header, tmp_upload_dir, db_session):
+        ds_id = self._upload(client, auth_header, tmp_upload_dir)
+        ds = db_session.get(DataSource, uuid.UUID(ds_id))
+        ds.schema_cache = None
+        db_session.commit()
+        parquet_path = tmp_upload_dir / TENANT_ID / ds_id / "processed.parquet"
+        duckdb.connect().execute(
+            "COPY (SELECT '\\xCA\\xFE'::BLOB AS payload, "
+            "'550e8400-e29b-41d4-a716-446655440000'::UUID AS ref) "
+            f"TO '{parquet_path}' (FORMAT PARQUET)"
+        )
+
+        resp = client.get(f"{UPLOAD_PREFIX}/{ds_id}/preview", headers=auth_header)
+        assert resp.status_code == 200
+        (row,) = resp.json()["rows"]
+        assert row["payload"] == "cafe"
+        assert isinstance(row["ref"], str)
+
+    def test_preview_cursor_navigation(self, client, auth_header, tmp_upload_dir):
+        ds_id = self._upload(client, auth_header, tmp_upload_dir)
+        url = f"{UPLOAD_PREFIX}/{ds_id}/preview"
+
+        first = client.get(f"{url}?page_size=2", headers=auth_header).json()
+        assert first["prev_cursor"] is None
+        second = client.get(
+            f"{url}?page_size=2&cursor={first['next_cursor']}", headers=auth_header
+        ).json()
+        assert second["page"] == 2
+        assert [r["name"] for r in second["rows"]] == ["Charlie"]
+        assert second["next_cursor"] is None
+
+        back = client.get(
+            f"{url}?page_size=2&cursor={second['prev_cursor']}", headers=auth_header
+        ).json()
+        assert back["rows"] == first["rows"]
+
+    def test_preview_invalid_cursor(self, client, auth_header, tmp_upload_dir):
+        ds_id = self._upload(client, auth_header, tmp_upload_dir)
+        other_id = self._upload(client, auth_header, tmp_upload_dir, name="Other")
+        other_cursor = client.get(
+            f"{UPLOAD_PREFIX}/{other_id}/preview?page_size=1", headers=auth_header
+        ).json()["next_cursor"]
+
+        for cursor in ("not-a-cursor", other_cursor):
+            resp = client.get(f"{UPLOAD_PREFIX}/{ds_id}/preview?cursor={cursor}", headers=auth_header)
+            assert resp.status_code == 400
+
     def test_preview_row_values(self, client, auth_header, tmp_upload_dir):
         """Row values match the CSV content."""
         ds_id = self._upload(client, auth_header, tmp_upload_dir)
@@ -302,6 +435,30 @@ class TestDataSourcePreview:
         assert "Bob" in names
         assert "Charlie" in names
 
+    def test_preview_columnar_format(self, client, auth_header, tmp_upload_dir):
+        ds_id = self._upload(client, auth_header, tmp_upload_dir)
+        resp = client.get(
+            f"{UPLOAD_PREFIX}/{ds_id}/preview?page=1&page_size=2&format=columnar",
+            headers=auth_header,
+        )
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["data"] == [["Alice", "Bob"], [30, 25], ["Paris", "Lyon"]]
+        assert data["total_rows"] == 3
+        assert data["total_pages"] == 2
+
+    def test_preview_arrow_format(self, client, auth_header, tmp_upload_dir):
+        ds_id = self._upload(client, auth_header, tmp_upload_dir)
+        resp = client.get(
+            f"{UPLOAD_PREFIX}/{ds_id}/preview",
+            headers={**auth_header, "Accept": "application/vnd.apache.arrow.stream"},
+        )
+        assert resp.status_code == 200
+        assert resp.headers["x-total-rows"] == "3"
+        table = pa.ipc.open_stream(resp.content).read_all()
+        assert table.column_names == ["name", "age", "city"]
+        assert table.num_rows == 3
+
 
 class TestMultiTenantIsolation:
     def test_cannot_access_other_tenant_source(self, client, auth_header, tmp_upload_dir, csv_file, db_session):
@@ -1,9 +1,13 @@
 """Tests for Dashboard and Widget CRUD endpoints."""
 
+import threading
 import uuid
 
 import pytest
 
+import app.services.query_service as query_service_module
+from app.services.query_scheduler import QueryScheduler
+
 TENANT_ID = "550e8400-e29b-41d4-a716-446655440000"
 OTHER_TENANT_ID = "660e8400-e29b-41d4-a716-446655440000"
 
@@ -368,3 +372,93 @@ class TestDashboardCascadeDelete:
             headers=auth_header,
         )
         assert resp.status_code == 404
+
+
+# --- Render ---
+
+
+class TestDashboardRender:
+    def _add_widget(self, client, auth_header, dashboard_id, title, **fields):
+        resp = client.post(
+            f"/api/v1/dashboards/{dashboard_id}/widgets",
+            json={"type": "chart", "title": title, "chart_type": "table", **fields},
+            headers=auth_header,
+        )
+        assert resp.status_code == 201
+        return resp.json()["id"]
+
+    def test_render_runs_all_widgets(self, client, auth_header, dashboard_id, setup_semantic_layer):
+        saved = client.post(
+            "/api/v1/queries/saved",
+            json={
+                "name": "Total",
+                "sql_text": "SELECT SUM(amount) AS total FROM products",
+                "workspace_id": setup_semantic_layer["workspace_id"],
+            },
+            headers=auth_header,
+        ).json()
+        by_sql = self._add_widget(
+            client, auth_header, dashboard_id, "Produits",
+            query_json={"sql": "SELECT name FROM products ORDER BY id", "limit": 2},
+        )
+        by_saved = self._add_widget(
+            client, auth_header, dashboard_id, "Total", saved_query_id=saved["id"]
+        )
+        broken = self._add_widget(
+            client, auth_header, dashboard_id, "Cassé",
+            query_json={"sql_text": "SELECT missing FROM products"},
+        )
+        text = self._add_widget(client, auth_header, dashboard_id, "Note", type="text")
+
+        resp = client.post(f"/api/v1/dashboards/{dashboard_id}/render", headers=auth_header)
+        assert resp.status_code == 200
+        body = resp.json()
+        assert body["dashboard_id"] == dashboard_id
+        assert body["total_time_ms"] >= body["setup_time_ms"] >= 0
+
+        results = {w["widget_id"]: w for w in body["widgets"]}
+        assert list(results) == [by_sql, by_saved, broken, text]
+        assert results[by_sql]["status"] == "ok"
+        assert results[by_sql]["rows"] == [{"name": "Alice"}, {"name": "Bob"}]
+        assert results[by_saved]["rows"] == [{"total": 450.0}]
+        assert results[broken]["status"] == "error"
+        assert "missing" in results[broken]["error"]
+        assert results[text]["status"] == "skipped"
+
+    def test_render_queues_widgets_on_the_scheduler(
+        self, monkeypatch, client, auth_header, dashboard_id, setup_semantic_layer
+    ):
+        scheduler = QueryScheduler(max_workers=1, max_per_tenant=1, max_queue=10)
+        monkeypatch.setattr(query_service_module, "query_scheduler", scheduler)
+        for i in range(4):
+            self._add_widget(
+                client, auth_header, dashboard_id, f"W{i}",
+                query_json={"sql": f"SELECT {i} AS n FROM products LIMIT 1"},
+            )
+        threads = threading.active_count()
+
+        resp = client.post(f"/api/v1/dashboards/{dashboard_id}/render", headers=auth_header)
+        assert resp.status_code == 200
+        assert [w["rows"] for w in resp.json()["widgets"]] == [[{"n": i}] for i in range(4)]
+        # One scheduler worker ran them in turn; rendering started no threads of its own
+        assert scheduler.stats()["completed"] == 4
+        assert threading.active_count() <= threads + 1
+
+    def test_render_without_queries_needs_no_semantic_layer(
+        self, client, auth_header, dashboard_id
+    ):
+        self._add_widget(client, auth_header, dashboard_id, "Note", type="text")
+        resp = client.post(f"/api/v1/dashboards/{dashboard_id}/render", headers=auth_header)
+        assert resp.status_code == 200
+        assert [w["status"] for w in resp.json()["widgets"]] == ["skipped"]
+
+    def test_render_missing_semantic_layer_404(self, client, auth_header, dashboard_id):
+        self._add_widget(
+            client, auth_header, dashboard_id, "Produits", query_json={"sql": "SELECT 1"}
+        )
+        resp = client.post(f"/api/v1/dashboards/{dashboard_id}/render", headers=auth_header)
+        assert resp.status_code == 404
+
+    def test_other_tenant_cannot_render(self, client, dashboard_id, other_auth_header):
+        resp = client.post(f"/api/v1/dashboards/{dashboard_id}/render", headers=other_auth_header)
+        assert resp.status_code == 404
@@ -0,0 +1,151 @@
+"""Tests for DuckDB connection classes and the shared memory budget."""
+
+import os
+
+import pytest
+
+import app.services.connection_pool as connection_pool_module
+from app.services.connection_pool import DuckDBConnectionPool
+from app.services.duckdb_resources import (
+    MIN_MEMORY_LIMIT_MB,
+    ConnectionProfile,
+    DuckDBResourceManager,
+)
+
+
+def _memory_limit_mb(conn) -> float:
+    value = conn.execute("SELECT current_setting('memory_limit')").fetchone()[0]
+    number, unit = value.split()
+    return float(number) * {"MiB": 1, "GiB": 1024}[unit] * 1.048576
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return DuckDBResourceManager(
+        profiles={
+            "query": ConnectionProfile(memory_limit_mb=1000, threads=2),
+            "preview": ConnectionProfile(memory_limit_mb=200, threads=1),
+        },
+        memory_budget_mb=1500,
+        idle_memory_limit_mb=100,
+        temp_directory=str(tmp_path / "spill"),
+    )
+
+
+class TestDuckDBResourceManager:
+    def test_applies_class_limits(self, manager, tmp_path):
+        with manager.connection("preview") as conn:
+            assert conn.execute("SELECT current_setting('threads')").fetchone()[0] == 1
+            assert _memory_limit_mb(conn) == pytest.approx(200, rel=0.01)
+            temp_directory = conn.execute("SELECT current_setting('temp_directory')").fetchone()[0]
+            assert temp_directory.startswith(str(tmp_path / "spill" / "preview-"))
+        assert manager.stats()["connections"] == 0
+
+    def test_budget_is_shared_in_proportion(self, manager):
+        first = manager.connect("query")
+        assert _memory_limit_mb(first) == pytest.approx(1000, rel=0.01)
+
+        second = manager.connect("query")
+        preview = manager.connect("preview")
+        # 2200 MB wanted from a 1500 MB budget: everyone gets 1500/2200 of its limit
+        assert _memory_limit_mb(first) == pytest.approx(681, rel=0.01)
+        assert _memory_limit_mb(second) == pytest.approx(681, rel=0.01)
+        assert _memory_limit_mb(preview) == pytest.approx(136, rel=0.01)
+        stats = manager.stats()
+        assert stats["connections"] == 3
+        assert stats["by_kind"] == {"query": 2, "preview": 1}
+        assert stats["allocated_mb"] <= 1500
+        assert stats["throttled"] >= 1
+
+        # Limits come back once load drops
+        manager.close(second)
+        manager.close(preview)
+        assert _memory_limit_mb(first) == pytest.approx(1000, rel=0.01)
+        manager.close(first)
+
+    def test_idle_databases_hold_a_floor(self, manager):
+        idle = manager.connect("query")
+        busy = manager.connect("query")
+        assert _memory_limit_mb(busy) == pytest.approx(750, rel=0.01)
+
+        manager.set_active(idle, False)
+        assert _memory_limit_mb(idle) == pytest.approx(100, rel=0.01)
+        assert _memory_limit_mb(busy) == pytest.approx(1000, rel=0.01)
+        assert manager.stats()["active"] == 1
+
+        manager.set_active(idle, True)
+        assert _memory_limit_mb(idle) == pytest.approx(750, rel=0.01)
+        manager.close(idle)
+        manager.close(busy)
+
+    def test_never_below_minimum(self, tmp_path):
+        manager = DuckDBResourceManager(
+            profiles={"query": ConnectionProfile(memory_limit_mb=1000, threads=1)},
+            memory_budget_mb=100,
+            idle_memory_limit_mb=50,
+            temp_directory=str(tmp_path),
+        )
+        conns = [manager.connect("query") for _ in range(4)]
+        assert all(_memory_limit_mb(c) == pytest.approx(MIN_MEMORY_LIMIT_MB, rel=0.01) for c in conns)
+        for conn in conns:
+            manager.close(conn)
+
+    def test_spills_instead_of_failing(self, manager, tmp_path):
+        with manager.connection("query") as conn:
+            conn.execute("SET memory_limit = '64MB'")
+            count = conn.execute(
+                "SELECT COUNT(*) FROM (SELECT md5(i::VARCHAR) AS h, COUNT(*) FROM range(2000000) t(i) GROUP BY h)"
+            ).fetchone()[0]
+            assert count == 2000000
+        # The spill directory goes away with the database
+        assert not any(name.startswith("query-") for name in os.listdir(tmp_path / "spill"))
+
+    def test_pool_marks_idle_databases(self, manager, monkeypatch):
+        monkeypatch.setattr(connection_pool_module, "duckdb_resources", manager)
+        pool = DuckDBConnectionPool(max_connections=4, idle_timeout_seconds=60)
+
+        def build():
+            return manager.connect("query"), [], set()
+
+        lease = pool.checkout(("tenant", "ws", "v1"), build)
+        assert manager.stats()["active"] == 1
+        lease.release()
+        assert manager.stats()["active"] == 0
+
+        pool.checkout(("tenant", "ws", "v1"), build).release()
+        pool.clear()
+        assert manager.stats()["connections"] == 0
+
+    def test_resizes_only_databases_whose_share_changed(self, manager):
+        first = manager.connect("query")
+        preview = manager.connect("preview")
+        # 1200 MB fits the budget: nobody else was touched
+        assert manager.stats()["resizes"] == 0
+
+        manager.set_active(preview, False)
+        manager.set_active(preview, True)
+        assert manager.stats()["resizes"] == 2
+        assert _memory_limit_mb(first) == pytest.approx(1000, rel=0.01)
+
+        # Crossing the budget resizes the others, but opening needs no SET of its own
+        second = manager.connect("query")
+        assert manager.stats()["resizes"] == 4
+        assert _memory_limit_mb(second) == pytest.approx(681, rel=0.01)
+        for conn in (first, preview, second):
+            manager.close(conn)
+
+    def test_resizes_outside_the_budget_lock(self, manager, monkeypatch):
+        first = manager.connect("query")
+        manager.connect("query")
+        held = []
+        real_cursor = first.cursor
+
+        class _Conn:
+            def cursor(self):
+                held.append(manager._lock.locked())
+                return real_cursor()
+
+        monkeypatch.setattr(next(s for s in manager._slots.values() if s.conn is first), "conn", _Conn())
+        manager.connect("preview")
+        assert held == [False]
+        assert _memory_limit_mb(first) == pytest.approx(681, rel=0.01)
@@ -0,0 +1,288 @@
+"""Tests for background CSV ingestion: queue backends, status tracking and endpoints."""
+
+import io
+import json
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+
+from app.models.data_source import DataSource
+from app.services.csv_service import ingest_csv_source
+from app.services.ingestion_queue import (
+    InlineIngestionBackend,
+    IngestionJob,
+    IngestionQueue,
+    LocalIngestionBackend,
+    ingestion_queue,
+)
+from tests.conftest import TENANT_ID, TestSession
+
+CSV_CONTENT = b"name,age\nAlice,30\nBob,25\n"
+UPLOAD_PREFIX = "/api/v1/data-sources"
+
+
+@pytest.fixture
+def tmp_upload_dir(tmp_path):
+    with patch("app.services.csv_service.settings") as mock_settings:
+        mock_settings.upload_dir = str(tmp_path)
+        mock_settings.max_upload_size_mb = 100
+        yield tmp_path
+
+
+class _DeferredBackend(InlineIngestionBackend):
+    """Holds jobs until run_all() so tests can observe the pending state."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, job, handler):
+        self.jobs.append((job, handler))
+
+    def run_all(self):
+        for job, handler in self.jobs:
+            handler(job)
+
+
+def _upload(client, auth_header, content=CSV_CONTENT):
+    return client.post(
+        f"{UPLOAD_PREFIX}/upload/async",
+        headers=auth_header,
+        files={"file": ("data.csv", io.BytesIO(content), "text/csv")},
+        data={"name": "Async"},
+    )
+
+
+class TestLocalIngestionBackend:
+    def test_runs_jobs_on_bounded_pool(self):
+        backend = LocalIngestionBackend(max_workers=2)
+        done = []
+        release = threading.Event()
+
+        def handler(job):
+            release.wait(5)
+            done.append(job.job_id)
+
+        for i in range(3):
+            backend.submit(IngestionJob(job_id=str(i), tenant_id="t"), handler)
+        stats = backend.stats()
+        assert stats["running"] + stats["queued"] == 3
+        assert stats["running"] <= 2
+
+        release.set()
+        backend.shutdown(wait=True)
+        assert sorted(done) == ["0", "1", "2"]
+        assert backend.stats()["completed"] == 3
+
+
+class TestAsyncUpload:
+    def test_returns_job_immediately(self, client, auth_header, tmp_upload_dir, monkeypatch, db_session):
+        backend = _DeferredBackend()
+        monkeypatch.setattr(ingestion_queue, "backend", backend)
+
+        resp = _upload(client, auth_header)
+        assert resp.status_code == 202
+        job = resp.json()
+        assert job["status"] == "pending"
+        assert job["progress"] == 0
+        assert job["job_id"] == job["data_source_id"]
+
+        # Not queryable until ingested
+        preview = client.get(f"{UPLOAD_PREFIX}/{job['data_source_id']}/preview", headers=auth_header)
+        assert preview.status_code == 409
+
+        backend.run_all()
+        db_session.expire_all()  # the test client shares one session across requests
+        status_resp = client.get(f"{UPLOAD_PREFIX}/{job['data_source_id']}/status", headers=auth_header)
+        assert status_resp.json()["status"] == "ready"
+        assert status_resp.json()["progress"] == 100
+
+    def test_ready_source_has_schema(self, client, auth_header, tmp_upload_dir, db_session):
+        ds_id = _upload(client, auth_header).json()["data_source_id"]
+        db_session.expire_all()  # the test client shares one session across requests
+        detail = client.get(f"{UPLOAD_PREFIX}/{ds_id}", headers=auth_header).json()
+        assert detail["status"] == "ready"
+        assert detail["schema_cache"]["row_count"] == 2
+        preview = client.get(f"{UPLOAD_PREFIX}/{ds_id}/preview", headers=auth_header)
+        assert preview.status_code == 200
+        assert (tmp_upload_dir / detail["tenant_id"] / ds_id / "processed.parquet").exists()
+
+    def test_invalid_csv_marks_failed(self, client, auth_header, tmp_upload_dir):
+        ds_id = _upload(client, auth_header, content=b"a,b\n1,2,3,4\n\"unterminated\n").json()["data_source_id"]
+        status_resp = client.get(f"{UPLOAD_PREFIX}/{ds_id}/status", headers=auth_header).json()
+        assert status_resp["status"] == "failed"
+        assert "Failed to parse CSV" in status_resp["error_message"]
+
+    def test_source_deleted_while_converting(self, client, auth_header, tmp_upload_dir, monkeypatch):
+        backend = _DeferredBackend()
+        monkeypatch.setattr(ingestion_queue, "backend", backend)
+        ds_id = _upload(client, auth_header).json()["data_source_id"]
+
+        def delete_then_convert(data_source, on_progress=None):
+            client.delete(f"{UPLOAD_PREFIX}/{ds_id}", headers=auth_header)
+            return {"row_count": 2, "columns": []}
+
+        monkeypatch.setattr("app.services.ingestion_queue.ingest_csv_source", delete_then_convert)
+        backend.run_all()  # the final update matches no row, and is only logged
+        assert client.get(f"{UPLOAD_PREFIX}/{ds_id}/status", headers=auth_header).status_code == 404
+
+    def test_status_stream(self, client, auth_header, tmp_upload_dir):
+        ds_id = _upload(client, auth_header).json()["data_source_id"]
+        resp = client.get(f"{UPLOAD_PREFIX}/{ds_id}/status/stream", headers=auth_header)
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        events = [
+            json.loads(line[len("data: "):])
+            for line in resp.text.splitlines()
+            if line.startswith("data: ")
+        ]
+        assert events[-1]["status"] == "ready"
+
+    def test_status_stream_follows_progress(self, client, auth_header, tmp_upload_dir, monkeypatch):
+        backend = _DeferredBackend()
+        monkeypatch.setattr(ingestion_queue, "backend", backend)
+        ds_id = _upload(client, auth_header).json()["data_source_id"]
+
+        worker = threading.Timer(0.2, backend.run_all)
+        worker.start()
+        resp = client.get(f"{UPLOAD_PREFIX}/{ds_id}/status/stream", headers=auth_header)
+        worker.join()
+        statuses = [
+            json.loads(line[len("data: "):])["status"]
+            for line in resp.text.splitlines()
+            if line.startswith("data: ")
+        ]
+        assert statuses[0] == "pending"
+        assert statuses[-1] == "ready"
+
+    def test_status_tenant_isolation(self, client, auth_header):
+        resp = client.get(
+            f"{UPLOAD_PREFIX}/00000000-0000-0000-0000-000000000000/status", headers=auth_header
+        )
+        assert resp.status_code == 404
+
+
+class TestWait:
+    def test_reads_status_outside_the_lock(self, client, auth_header, tmp_upload_dir, monkeypatch):
+        backend = _DeferredBackend()
+        monkeypatch.setattr(ingestion_queue, "backend", backend)
+        ds_id = _upload(client, auth_header).json()["data_source_id"]
+
+        held = []
+
+        def session_factory():
+            held.append(ingestion_queue._changed._is_owned())
+            return TestSession()
+
+        monkeypatch.setattr(ingestion_queue, "session_factory", session_factory)
+        worker = threading.Timer(0.2, backend.run_all)
+        worker.start()
+        ingestion_queue.wait(IngestionJob(job_id=ds_id, tenant_id=ds_id))
+        worker.join()
+        assert len(held) >= 2
+        assert not any(held)
+
+    def test_gives_up_after_timeout(self, client, auth_header, tmp_upload_dir, monkeypatch):
+        monkeypatch.setattr(ingestion_queue, "backend", _DeferredBackend())
+        ds_id = _upload(client, auth_header).json()["data_source_id"]
+        assert not ingestion_queue.wait(IngestionJob(job_id=ds_id, tenant_id=ds_id), timeout=0.1)
+
+
+class TestRecover:
+    def test_requeues_or_fails_interrupted_jobs(self, client, auth_header, tmp_upload_dir, monkeypatch, db_session):
+        backend = _DeferredBackend()
+        monkeypatch.setattr(ingestion_queue, "backend", backend)
+        on_disk = _upload(client, auth_header).json()["data_source_id"]
+        lost = _upload(client, auth_header).json()["data_source_id"]
+        # The restart dropped the queued jobs, and one upload's files with them
+        backend.jobs.clear()
+        (tmp_upload_dir / TENANT_ID / lost / "original.csv").unlink()
+
+        assert ingestion_queue.recover() == {"requeued": 1, "failed": 1}
+        assert [job.job_id for job, _ in backend.jobs] == [on_disk]
+        backend.run_all()
+
+        db_session.expire_all()
+        statuses = {
+            ds_id: client.get(f"{UPLOAD_PREFIX}/{ds_id}/status", headers=auth_header).json()
+            for ds_id in (on_disk, lost)
+        }
+        assert statuses[on_disk]["status"] == "ready"
+        assert statuses[lost]["status"] == "failed"
+        assert "interrupted" in statuses[lost]["error_message"]
+        assert ingestion_queue.recover() == {"requeued": 0, "failed": 0}
+
+    def test_sibling_workers_convert_a_recovered_job_once(self, client, auth_header, tmp_upload_dir, monkeypatch):
+        monkeypatch.setattr(ingestion_queue, "backend", _DeferredBackend())
+        ds_id = _upload(client, auth_header).json()["data_source_id"]
+        first, second = (IngestionQueue(_DeferredBackend(), TestSession) for _ in range(2))
+        assert first.recover() == second.recover() == {"requeued": 1, "failed": 0}
+        conversions = []
+
+        def ingest_while_sibling_runs(data_source, on_progress=None):
+            conversions.append(data_source.id)
+            if len(conversions) == 1:
+                second.backend.run_all()  # the sibling starts while the first is converting
+            return ingest_csv_source(data_source, on_progress=on_progress)
+
+        monkeypatch.setattr("app.services.ingestion_queue.ingest_csv_source", ingest_while_sibling_runs)
+        first.backend.run_all()
+        second.backend.run_all()
+        assert conversions == [uuid.UUID(ds_id)]
+        status_resp = client.get(f"{UPLOAD_PREFIX}/{ds_id}/status", headers=auth_header).json()
+        assert status_resp["status"] == "ready"
+
+    def test_leaves_jobs_of_live_workers(self, client, auth_header, tmp_upload_dir, monkeypatch, db_session):
+        monkeypatch.setattr(ingestion_queue, "backend", _DeferredBackend())
+        live = _upload(client, auth_header).json()["data_source_id"]
+        dead = _upload(client, auth_header).json()["data_source_id"]
+        now = datetime.now(timezone.utc)
+        for ds_id, heartbeat in ((live, now), (dead, now - timedelta(hours=1))):
+            data_source = db_session.get(DataSource, uuid.UUID(ds_id))
+            data_source.status = "processing"
+            data_source.ingestion_owner = "sibling"
+            data_source.ingestion_heartbeat_at = heartbeat
+        db_session.commit()
+
+        queue = IngestionQueue(_DeferredBackend(), TestSession)
+        assert queue.recover() == {"requeued": 1, "failed": 0}
+        assert [job.job_id for job, _ in queue.backend.jobs] == [dead]
+
+
+class TestSyncUpload:
+    def _upload(self, client, auth_header, content=CSV_CONTENT):
+        return client.post(
+            f"{UPLOAD_PREFIX}/upload",
+            headers=auth_header,
+            files={"file": ("data.csv", io.BytesIO(content), "text/csv")},
+            data={"name": "Sync"},
+        )
+
+    def test_waits_for_job_on_backend(self, client, auth_header, tmp_upload_dir, monkeypatch):
+        backend = LocalIngestionBackend(max_workers=1)
+        monkeypatch.setattr(ingestion_queue, "backend", backend)
+        try:
+            resp = self._upload(client, auth_header)
+        finally:
+            backend.shutdown()
+        assert resp.status_code == 201
+        assert resp.json()["status"] == "ready"
+        assert resp.json()["schema_cache"]["row_count"] == 2
+        assert backend.stats()["completed"] == 1
+
+    def test_lost_job_times_out(self, client, auth_header, tmp_upload_dir, monkeypatch):
+        monkeypatch.setattr(ingestion_queue, "backend", _DeferredBackend())
+        monkeypatch.setattr(ingestion_queue, "wait_timeout_seconds", 0.1)
+        resp = self._upload(client, auth_header)
+        assert resp.status_code == 504
+        sources = client.get(f"{UPLOAD_PREFIX}/", headers=auth_header).json()
+        assert [source["status"] for source in sources] == ["pending"]
+
+    def test_failed_job_removes_source(self, client, auth_header, tmp_upload_dir):
+        resp = self._upload(client, auth_header, content=b"a,b\n1,2,3,4\n\"unterminated\n")
+        assert resp.status_code == 422
+        assert "Failed to parse CSV" in resp.json()["detail"]
+        assert client.get(f"{UPLOAD_PREFIX}/", headers=auth_header).json() == []
+        assert not any(tmp_upload_dir.rglob("original.csv"))
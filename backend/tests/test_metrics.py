@@ -0,0 +1,139 @@
+"""Tests for the Prometheus metrics registry and the /metrics endpoint."""
+
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.services.ai_service import AIService
+from app.services.csv_service import _ingest_csv
+from app.services.metrics import CONTENT_TYPE, Histogram, MetricsRegistry, metrics, stats_families
+from app.services.rollup_service import rollup_metrics
+
+
+def _sample(text: str, name: str, **labels: str) -> float:
+    """Value of one sample in an exposition, 0 if absent."""
+    label_str = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    prefix = f"{name}{{{label_str}}} " if labels else f"{name} "
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+class TestRegistry:
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "Test latency", buckets=(0.1, 1.0), labelnames=("stage",))
+        for value in (0.05, 0.5, 0.7, 5.0):
+            histogram.observe(value, stage="execute")
+        text = "\n".join(histogram.collect().render())
+
+        assert "# TYPE test_seconds histogram" in text
+        assert _sample(text, "test_seconds_bucket", stage="execute", le="0.1") == 1
+        assert _sample(text, "test_seconds_bucket", stage="execute", le="1") == 3
+        assert _sample(text, "test_seconds_bucket", stage="execute", le="+Inf") == 4
+        assert _sample(text, "test_seconds_count", stage="execute") == 4
+        assert _sample(text, "test_seconds_sum", stage="execute") == pytest.approx(6.25)
+
+    def test_stats_families(self):
+        families = {
+            family.name: family
+            for family in stats_families("cache", {"entries": 3, "hits": 3, "misses": 1, "by_kind": {"query": 2}})
+        }
+        assert families["datapilot_cache_entries"].type == "gauge"
+        assert families["datapilot_cache_hits_total"].type == "counter"
+        assert families["datapilot_cache_by_kind"].samples == [("datapilot_cache_by_kind", {"kind": "query"}, 2)]
+        assert families["datapilot_cache_hit_ratio"].samples[0][2] == 0.75
+
+    def test_register_stats_replaces_component(self):
+        registry = MetricsRegistry()
+        registry.register_stats("pool", lambda: {"size": 1})
+        registry.register_stats("pool", lambda: {"size": 2})
+        text = registry.render()
+        assert _sample(text, "datapilot_pool_size") == 2
+        assert text.count("# TYPE datapilot_pool_size") == 1
+
+
+class TestMetricsEndpoint:
+    def test_exposition(self, client):
+        resp = client.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == CONTENT_TYPE
+        assert "datapilot_sqlalchemy_pool_" in resp.text
+        assert "datapilot_query_scheduler_submitted_total" in resp.text
+        assert "datapilot_query_cache_hit_ratio" in resp.text
+
+    def test_no_tenant_names_as_labels(self, client):
+        rollup_metrics.record_rewrite("tenant_authored_rollup")
+        text = client.get("/metrics").text
+        assert _sample(text, "datapilot_rollups_hits_total") >= 1
+        assert "tenant_authored_rollup" not in text
+        assert "rollup=" not in text
+
+    def test_query_requests_are_measured(self, client, auth_header, setup_semantic_layer):
+        before = metrics.render()
+        body = {"sql_text": "SELECT * FROM products", "workspace_id": setup_semantic_layer["workspace_id"]}
+        for _ in range(2):
+            assert client.post("/api/v1/queries/execute", json=body, headers=auth_header).status_code == 200
+        after = client.get("/metrics").text
+
+        def delta(name, **labels):
+            return _sample(after, name, **labels) - _sample(before, name, **labels)
+
+        assert delta(
+            "datapilot_http_request_duration_seconds_count", router="queries", method="POST", status="200"
+        ) == 2
+        assert delta("datapilot_query_duration_seconds_count", source="query", status="ok", cache_status="miss") == 1
+        assert delta("datapilot_query_duration_seconds_count", source="query", status="ok", cache_status="hit") == 1
+        assert delta("datapilot_query_stage_duration_seconds_count", stage="execute") == 1
+        assert delta("datapilot_query_result_rows_sum", source="query") == 6
+        assert delta("datapilot_duckdb_setup_duration_seconds_count", source="query") == 1
+
+    def test_unmatched_requests_share_a_label(self, client):
+        before = _sample(metrics.render(), "datapilot_http_request_duration_seconds_count",
+                         router="unmatched", method="GET", status="404")
+        assert client.get("/no-such-route/12345").status_code == 404
+        after = _sample(metrics.render(), "datapilot_http_request_duration_seconds_count",
+                        router="unmatched", method="GET", status="404")
+        assert after - before == 1
+
+
+class TestHotPathInstruments:
+    def test_ingestion_throughput(self, tmp_path):
+        csv_path = tmp_path / "data.csv"
+        csv_path.write_text("id,name\n" + "".join(f"{i},row{i}\n" for i in range(500)))
+        before = metrics.render()
+        _ingest_csv(csv_path, tmp_path / "data.parquet")
+        after = metrics.render()
+
+        assert _sample(after, "datapilot_ingestion_rows_total") - _sample(before, "datapilot_ingestion_rows_total") == 500
+        assert (
+            _sample(after, "datapilot_ingestion_bytes_total") - _sample(before, "datapilot_ingestion_bytes_total")
+            == csv_path.stat().st_size
+        )
+        assert (
+            _sample(after, "datapilot_ingestion_duration_seconds_count")
+            - _sample(before, "datapilot_ingestion_duration_seconds_count")
+        ) == 1
+
+    @pytest.mark.asyncio
+    async def test_ai_latency_by_outcome(self):
+        svc = AIService()
+        response = MagicMock()
+        response.content = [MagicMock(text='{"sql": "SELECT 1", "explanation": "un"}')]
+        response.usage = MagicMock(
+            input_tokens=20, output_tokens=10, cache_read_input_tokens=0, cache_creation_input_tokens=0,
+        )
+        svc._client = MagicMock()
+        create = svc._client.beta.prompt_caching.messages.create = AsyncMock(return_value=response)
+        before = metrics.render()
+
+        await svc.generate_sql("combien ?", {"nodes": [], "edges": []}, tenant_id="t1")
+        create.side_effect = RuntimeError("API down")
+        with pytest.raises(RuntimeError):
+            await svc.generate_sql("combien ?", {"nodes": [], "edges": []}, tenant_id="t1")
+        after = metrics.render()
+
+        for outcome in ("ok", "error"):
+            name = "datapilot_ai_request_duration_seconds_count"
+            labels = {"mode": "complete", "outcome": outcome}
+            assert _sample(after, name, **labels) - _sample(before, name, **labels) == 1
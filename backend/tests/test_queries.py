@@ -1,22 +1,28 @@
 """Tests for SemanticQueryBuilder, query execution endpoint, and SavedQuery CRUD."""
 
+import asyncio
+import datetime
+import decimal
 import json
-import os
-import tempfile
+import threading
+import time
 import uuid
 
-import duckdb
+import pyarrow as pa
 import pytest
 from fastapi.testclient import TestClient
 
 from app.models.data_source import DataSource
 from app.models.dashboard import SemanticLayer
 from app.models.workspace import Workspace
+from app.services.query_registry import QueryCancelledError, query_registry
 from app.services.query_service import (
     SemanticQueryBuilder,
     _ensure_limit,
     _sanitize_sql,
 )
+from app.services.sql_parser import parse_query
+from app.services.result_formats import table_to_columnar
 
 TENANT_ID = "550e8400-e29b-41d4-a716-446655440000"
 
@@ -77,6 +83,35 @@ class TestSanitizeSQL:
         result = _sanitize_sql("SELECT 1;")
         assert result == "SELECT 1"
 
+    def test_reject_multiple_statements(self):
+        with pytest.raises(ValueError, match="Multiple SQL statements"):
+            _sanitize_sql("SELECT 1; DROP TABLE sales")
+
+    def test_allows_keywords_in_identifiers_and_literals(self):
+        sql = "SELECT \"set\", \"call\" AS update_count, 'drop; delete' FROM sales"
+        assert _sanitize_sql(sql) == sql
+
+    def test_reject_set_and_call(self):
+        with pytest.raises(ValueError, match="Forbidden SQL operation: SET"):
+            _sanitize_sql("SET threads = 1")
+        with pytest.raises(ValueError, match="Forbidden SQL operation: CALL"):
+            _sanitize_sql("CALL pragma_version()")
+
+    def test_reject_explain_of_write(self):
+        with pytest.raises(ValueError, match="Forbidden SQL operation: DELETE"):
+            _sanitize_sql("EXPLAIN ANALYZE DELETE FROM sales")
+
+    def test_reject_syntax_error(self):
+        with pytest.raises(ValueError, match="SQL syntax error"):
+            _sanitize_sql("SELECT * FROM")
+
+    def test_parsed_query_fingerprint_ignores_formatting(self):
+        assert (
+            parse_query("select id\n  from sales -- all").fingerprint
+            == parse_query("SELECT id FROM sales;").fingerprint
+        )
+        assert parse_query("SELECT id FROM sales").fingerprint != parse_query("SELECT name FROM sales").fingerprint
+
 
 class TestEnsureLimit:
     def test_adds_limit_when_missing(self):
@@ -87,30 +122,24 @@ class TestEnsureLimit:
         result = _ensure_limit("SELECT * FROM sales LIMIT 50", 100)
         assert result == "SELECT * FROM sales LIMIT 50"
 
+    def test_inner_limit_does_not_count(self):
+        sql = "WITH recent AS (SELECT * FROM sales LIMIT 5) SELECT * FROM recent, sales"
+        assert _ensure_limit(sql, 100) == f"{sql} LIMIT 100"
+        sql = "SELECT * FROM (SELECT * FROM sales LIMIT 5) s"
+        assert _ensure_limit(sql, 100) == f"{sql} LIMIT 100"
 
-# --- Unit tests for SemanticQueryBuilder ---
+    def test_caps_larger_limit(self):
+        result = _ensure_limit("SELECT * FROM sales LIMIT 1000000", 100)
+        assert result.endswith(") AS capped_query LIMIT 100")
 
+    def test_trailing_comment(self):
+        assert _ensure_limit("SELECT * FROM sales -- all rows", 100) == "SELECT * FROM sales -- all rows\nLIMIT 100"
 
-@pytest.fixture
-def parquet_dir():
-    """Create a temporary directory with a test parquet file."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        csv_content = "id,name,amount\n1,Alice,100.0\n2,Bob,200.0\n3,Charlie,150.0\n"
-        csv_path = os.path.join(tmpdir, "original.csv")
-        parquet_path = os.path.join(tmpdir, "processed.parquet")
-
-        with open(csv_path, "w") as f:
-            f.write(csv_content)
-
-        conn = duckdb.connect()
-        csv_str = csv_path.replace("'", "''")
-        pq_str = parquet_path.replace("'", "''")
-        conn.execute(
-            f"COPY (SELECT * FROM read_csv_auto('{csv_str}')) TO '{pq_str}' (FORMAT PARQUET)"
-        )
-        conn.close()
+    def test_explain_is_not_capped(self):
+        assert _ensure_limit("EXPLAIN SELECT * FROM sales", 100) == "EXPLAIN SELECT * FROM sales"
 
-        yield tmpdir
+
+# --- Unit tests for SemanticQueryBuilder ---
 
 
 class TestSemanticQueryBuilder:
@@ -279,68 +308,45 @@ class TestSemanticQueryBuilder:
             assert result["row_count"] == 2
 
 
-# --- Integration tests for /api/v1/queries endpoints ---
+    def test_validate_binds_without_running(self, db_session, parquet_dir):
+        """Test that validate() rejects unknown columns and type errors up front."""
+        tenant_uuid = uuid.UUID(TENANT_ID)
+        ds_id = uuid.uuid4()
+        ds = DataSource(
+            id=ds_id,
+            tenant_id=tenant_uuid,
+            type="csv",
+            name="checked",
+            connection_config_encrypted=json.dumps({"storage_path": parquet_dir}),
+        )
+        db_session.add(ds)
+        db_session.commit()
 
+        definitions = {
+            "nodes": [{"id": "n1", "data": {"source_id": str(ds_id), "source_name": "checked", "columns": []}}],
+            "edges": [],
+        }
 
-@pytest.fixture
-def workspace_id(client, auth_header, db_session):
-    """Create a workspace and return its ID."""
-    resp = client.post(
-        "/api/v1/workspaces/",
-        json={"name": "Test Workspace"},
-        headers=auth_header,
-    )
-    assert resp.status_code == 201
-    return resp.json()["id"]
+        with SemanticQueryBuilder() as builder:
+            with pytest.raises(RuntimeError, match="No query context"):
+                builder.validate("SELECT 1")
+            builder.setup_context(definitions, TENANT_ID, db_session)
+            assert builder.has_context
 
+            builder.validate("SELECT name, SUM(amount) FROM checked GROUP BY name")
+            with pytest.raises(ValueError, match="Query validation error"):
+                builder.validate("SELECT no_such_column FROM checked")
+            with pytest.raises(ValueError, match="Query validation error"):
+                builder.validate("SELECT SUM(name) FROM checked")
+            with pytest.raises(ValueError, match="Forbidden SQL operation"):
+                builder.validate("DROP TABLE checked")
 
-@pytest.fixture
-def setup_semantic_layer(client, auth_header, db_session, workspace_id, parquet_dir):
-    """Create a data source + semantic layer pointing to test parquet."""
-    # Insert data source directly into DB
-    tenant_uuid = uuid.UUID(TENANT_ID)
-    ds_id = uuid.uuid4()
-    ds = DataSource(
-        id=ds_id,
-        tenant_id=tenant_uuid,
-        type="csv",
-        name="products",
-        connection_config_encrypted=json.dumps({"storage_path": parquet_dir}),
-        schema_cache={"columns": [], "row_count": 3},
-    )
-    db_session.add(ds)
-    db_session.commit()
+            # The context is still usable after a failed validation
+            result = builder.execute_query("SELECT COUNT(*) AS cnt FROM checked")
+            assert result["rows"][0]["cnt"] == 3
 
-    definitions = {
-        "nodes": [
-            {
-                "id": "node-1",
-                "type": "tableNode",
-                "data": {
-                    "source_id": str(ds_id),
-                    "source_name": "products",
-                    "columns": [
-                        {"name": "id", "type": "BIGINT", "role": "dimension"},
-                        {"name": "name", "type": "VARCHAR", "role": "dimension"},
-                        {"name": "amount", "type": "DOUBLE", "role": "measure"},
-                    ],
-                },
-            }
-        ],
-        "edges": [],
-    }
 
-    resp = client.post(
-        "/api/v1/semantic-layers/",
-        json={
-            "workspace_id": workspace_id,
-            "name": "Test Layer",
-            "definitions_json": definitions,
-        },
-        headers=auth_header,
-    )
-    assert resp.status_code == 201
-    return {"workspace_id": workspace_id, "ds_id": str(ds_id)}
+# --- Integration tests for /api/v1/queries endpoints ---
 
 
 class TestQueryExecuteEndpoint:
@@ -528,3 +534,283 @@ class TestSavedQueryCRUD:
             json={"name": "Test", "sql_text": "SELECT 1", "workspace_id": workspace_id},
         )
         assert resp.status_code == 403
+
+
+class TestQueryResultFormats:
+    def _execute(self, client, auth_header, workspace, headers=None, **extra):
+        return client.post(
+            "/api/v1/queries/execute",
+            json={"sql_text": "SELECT * FROM products ORDER BY id", "workspace_id": workspace, **extra},
+            headers={**auth_header, **(headers or {})},
+        )
+
+    def test_columnar_format(self, client, auth_header, setup_semantic_layer):
+        resp = self._execute(client, auth_header, setup_semantic_layer["workspace_id"], format="columnar")
+        assert resp.status_code == 200
+        body = resp.json()
+        assert [c["name"] for c in body["columns"]] == ["id", "name", "amount"]
+        assert body["data"][1] == ["Alice", "Bob", "Charlie"]
+        assert body["row_count"] == 3
+        assert "rows" not in body
+
+    def test_arrow_format(self, client, auth_header, setup_semantic_layer):
+        resp = self._execute(client, auth_header, setup_semantic_layer["workspace_id"], format="arrow")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/vnd.apache.arrow.stream"
+        assert resp.headers["x-row-count"] == "3"
+        table = pa.ipc.open_stream(resp.content).read_all()
+        assert table.column("name").to_pylist() == ["Alice", "Bob", "Charlie"]
+
+    def test_arrow_headers_exposed_to_browsers(self, client, auth_header, setup_semantic_layer):
+        resp = self._execute(
+            client, auth_header, setup_semantic_layer["workspace_id"],
+            format="arrow", headers={"Origin": "http://localhost:3000"},
+        )
+        exposed = {h.strip().lower() for h in resp.headers["access-control-expose-headers"].split(",")}
+        metadata = {h.lower() for h in resp.headers if h.startswith("x-")}
+        assert {"x-row-count", "x-execution-time-ms", "x-cache-status", "x-run-id"} <= metadata
+        assert metadata <= exposed
+
+    def test_arrow_via_accept_header(self, client, auth_header, setup_semantic_layer):
+        resp = self._execute(
+            client, auth_header, setup_semantic_layer["workspace_id"],
+            headers={"Accept": "application/vnd.apache.arrow.stream"},
+        )
+        assert resp.status_code == 200
+        assert pa.ipc.open_stream(resp.content).read_all().num_rows == 3
+
+    def test_formats_cached_separately(self, client, auth_header, setup_semantic_layer):
+        workspace = setup_semantic_layer["workspace_id"]
+        assert self._execute(client, auth_header, workspace).json()["cache_status"] == "miss"
+        columnar = self._execute(client, auth_header, workspace, format="columnar").json()
+        assert columnar["cache_status"] == "miss"
+        arrow = self._execute(client, auth_header, workspace, format="arrow")
+        assert arrow.headers["x-cache-status"] == "miss"
+        arrow = self._execute(client, auth_header, workspace, format="arrow")
+        assert arrow.headers["x-cache-status"] == "hit"
+
+
+class TestTableToColumnar:
+    def test_converts_non_json_types(self):
+        table = pa.table({
+            "d": pa.array([datetime.date(2026, 1, 31)]),
+            "amount": pa.array([decimal.Decimal("12.50")], type=pa.decimal128(10, 2)),
+            "n": pa.array([1]),
+        })
+        assert table_to_columnar(table) == [["2026-01-31"], [12.5], [1]]
+
+
+class TestQueryStreamEndpoint:
+    def _stream(self, client, auth_header, workspace, **extra):
+        return client.post(
+            "/api/v1/queries/execute/stream",
+            json={"sql_text": "SELECT * FROM products ORDER BY id", "workspace_id": workspace, **extra},
+            headers=auth_header,
+        )
+
+    def test_stream_ndjson(self, client, auth_header, setup_semantic_layer):
+        resp = self._stream(client, auth_header, setup_semantic_layer["workspace_id"])
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in resp.text.splitlines()]
+        assert lines[0]["type"] == "columns"
+        assert [c["name"] for c in lines[0]["columns"]] == ["id", "name", "amount"]
+        rows = [row for line in lines if line["type"] == "rows" for row in line["rows"]]
+        assert [r["name"] for r in rows] == ["Alice", "Bob", "Charlie"]
+        assert lines[-1]["type"] == "end"
+        assert lines[-1]["row_count"] == 3
+
+    def test_stream_arrow(self, client, auth_header, setup_semantic_layer):
+        resp = self._stream(client, auth_header, setup_semantic_layer["workspace_id"], format="arrow")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/vnd.apache.arrow.stream"
+        table = pa.ipc.open_stream(resp.content).read_all()
+        assert table.column("name").to_pylist() == ["Alice", "Bob", "Charlie"]
+
+    def test_stream_respects_limit(self, client, auth_header, setup_semantic_layer):
+        resp = self._stream(client, auth_header, setup_semantic_layer["workspace_id"], limit=2)
+        assert json.loads(resp.text.splitlines()[-1])["row_count"] == 2
+
+    def test_stream_forbidden_sql(self, client, auth_header, setup_semantic_layer):
+        resp = self._stream(
+            client, auth_header, setup_semantic_layer["workspace_id"], sql_text="DROP TABLE products",
+        )
+        assert resp.status_code == 400
+        assert "Forbidden" in resp.json()["detail"]
+
+
+# --- Cancellation ---
+
+LONG_SQL = "SELECT SUM(i) AS total FROM range(100000000000) t(i)"
+
+
+@pytest.fixture
+def sales_definitions(db_session, parquet_dir):
+    ds_id = uuid.uuid4()
+    db_session.add(DataSource(
+        id=ds_id,
+        tenant_id=uuid.UUID(TENANT_ID),
+        type="csv",
+        name="sales",
+        connection_config_encrypted=json.dumps({"storage_path": parquet_dir}),
+    ))
+    db_session.commit()
+    return {
+        "nodes": [{"id": "n1", "data": {"source_id": str(ds_id), "source_name": "sales", "columns": []}}],
+        "edges": [],
+    }
+
+
+def _wait_until_running(run_id: str, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not any(key[1] == run_id for key in query_registry._runs):
+        assert time.monotonic() < deadline, "query never started"
+        time.sleep(0.01)
+
+
+class TestQueryCancellation:
+    def test_cancel_running_query(self, db_session, sales_definitions):
+        builder = SemanticQueryBuilder()
+        builder.setup_context(sales_definitions, TENANT_ID, db_session)
+        outcome: dict = {}
+
+        def run():
+            try:
+                builder.execute_query(LONG_SQL, run_id="long-run")
+            except Exception as e:
+                outcome["error"] = e
+                outcome["at"] = time.monotonic()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        _wait_until_running("long-run")
+        time.sleep(0.1)
+        cancelled_at = time.monotonic()
+        assert query_registry.cancel(TENANT_ID, "long-run") is True
+        thread.join(5)
+
+        assert isinstance(outcome["error"], QueryCancelledError)
+        assert outcome["at"] - cancelled_at < 1
+        assert query_registry.cancel(TENANT_ID, "long-run") is False
+        # Closing does not wait for the interrupted query to unwind
+        start = time.monotonic()
+        builder.close()
+        assert time.monotonic() - start < 1
+
+    def test_cancel_is_tenant_scoped(self, db_session, sales_definitions):
+        builder = SemanticQueryBuilder()
+        builder.setup_context(sales_definitions, TENANT_ID, db_session)
+        errors: list = []
+
+        def run():
+            try:
+                builder.execute_query(LONG_SQL, run_id="mine")
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        _wait_until_running("mine")
+        assert query_registry.cancel(uuid.uuid4(), "mine") is False
+        assert query_registry.cancel(TENANT_ID, "mine") is True
+        thread.join(5)
+        builder.close()
+        assert [type(e) for e in errors] == [QueryCancelledError]
+
+    def test_duplicate_run_id_rejected(self, db_session, sales_definitions):
+        with SemanticQueryBuilder() as builder:
+            builder.setup_context(sales_definitions, TENANT_ID, db_session)
+            run = query_registry.register(TENANT_ID, "taken", "SELECT 1", lambda: None)
+            try:
+                with pytest.raises(ValueError, match="already running"):
+                    builder.execute_query("SELECT 1", run_id="taken")
+            finally:
+                query_registry.unregister(run)
+            assert builder.execute_query("SELECT 1 AS x", run_id="taken")["rows"] == [{"x": 1}]
+
+    def test_timeout_returns_without_waiting(self, db_session, sales_definitions):
+        builder = SemanticQueryBuilder()
+        builder.setup_context(sales_definitions, TENANT_ID, db_session)
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            builder.execute_query(LONG_SQL, timeout_seconds=0.3)
+        builder.close()
+        assert time.monotonic() - start < 1.5
+
+    def test_cancel_stream(self, db_session, sales_definitions):
+        with SemanticQueryBuilder() as builder:
+            builder.setup_context(sales_definitions, TENANT_ID, db_session)
+            stream = builder.execute_stream(
+                "SELECT i FROM range(1000000) t(i)", limit=1000000, batch_size=1000, run_id="stream-run"
+            )
+            assert stream["run_id"] == "stream-run"
+            batches = stream["batches"]
+            assert next(batches).num_rows == 1000
+            assert query_registry.cancel(TENANT_ID, "stream-run") is True
+            with pytest.raises(QueryCancelledError):
+                list(batches)
+        assert query_registry.cancel(TENANT_ID, "stream-run") is False
+
+    def test_abandoned_stream_is_unregistered(self, db_session, sales_definitions):
+        builder = SemanticQueryBuilder()
+        builder.setup_context(sales_definitions, TENANT_ID, db_session)
+        stream = builder.execute_stream("SELECT i FROM range(1000000) t(i)", batch_size=1000, run_id="gone")
+        next(stream["batches"])
+        builder.close()
+        assert query_registry.cancel(TENANT_ID, "gone") is False
+
+    def test_delete_endpoint(self, client, auth_header, setup_semantic_layer):
+        resp = client.delete("/api/v1/queries/unknown-run", headers=auth_header)
+        assert resp.status_code == 409
+
+        responses: dict = {}
+
+        def run():
+            responses["execute"] = client.post(
+                "/api/v1/queries/execute",
+                json={
+                    "sql_text": LONG_SQL,
+                    "workspace_id": setup_semantic_layer["workspace_id"],
+                    "run_id": "api-run",
+                },
+                headers=auth_header,
+            )
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        _wait_until_running("api-run")
+        resp = client.delete("/api/v1/queries/api-run", headers=auth_header)
+        assert resp.status_code == 204
+        thread.join(5)
+        assert responses["execute"].status_code == 409
+        assert "cancelled" in responses["execute"].json()["detail"]
+
+    def test_run_id_in_response(self, client, auth_header, setup_semantic_layer):
+        resp = client.post(
+            "/api/v1/queries/execute",
+            json={"sql_text": "SELECT 1 AS x", "workspace_id": setup_semantic_layer["workspace_id"], "run_id": "r-1"},
+            headers=auth_header,
+        )
+        assert resp.json()["run_id"] == "r-1"
+        resp = client.post(
+            "/api/v1/queries/execute",
+            json={"sql_text": "SELECT 2 AS x", "workspace_id": setup_semantic_layer["workspace_id"]},
+            headers=auth_header,
+        )
+        assert len(resp.json()["run_id"]) == 32
+
+    def test_client_disconnect_cancels_run(self):
+        cancelled: list = []
+
+        class _GoneRequest:
+            async def is_disconnected(self):
+                return True
+
+        run = query_registry.register(TENANT_ID, "left", "SELECT 1", lambda: cancelled.append(1))
+        try:
+            asyncio.run(asyncio.wait_for(
+                query_registry.cancel_on_disconnect(_GoneRequest(), TENANT_ID, "left"), 2
+            ))
+        finally:
+            query_registry.unregister(run)
+        assert cancelled == [1]
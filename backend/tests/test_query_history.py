@@ -0,0 +1,237 @@
+"""Tests for the query history recorder, slow-query profiles and the history endpoints."""
+
+import json
+import uuid
+
+import pytest
+
+from app.models.data_source import DataSource
+from app.models.query_history import QueryHistory
+from app.services.query_history import QueryExecution, QueryHistoryRecorder, estimate_json_bytes
+from app.services.query_service import SemanticQueryBuilder
+from tests.conftest import TENANT_ID, TestSession
+
+
+@pytest.fixture
+def definitions(db_session, parquet_dir):
+    ds_id = uuid.uuid4()
+    db_session.add(DataSource(
+        id=ds_id,
+        tenant_id=uuid.UUID(TENANT_ID),
+        type="csv",
+        name="sales",
+        connection_config_encrypted=json.dumps({"storage_path": parquet_dir}),
+    ))
+    db_session.commit()
+    return {
+        "nodes": [{"id": "n1", "data": {"source_id": str(ds_id), "source_name": "sales", "columns": []}}],
+        "edges": [],
+    }
+
+
+def _execution(sql: str = "SELECT 1", **fields) -> QueryExecution:
+    return QueryExecution(
+        tenant_id=fields.pop("tenant_id", TENANT_ID),
+        workspace_id=None,
+        source="query",
+        query_hash=fields.pop("query_hash", "h" * 64),
+        sql_text=sql,
+        **fields,
+    )
+
+
+class TestRecorder:
+    def test_builder_records_each_execution(self, db_session, definitions, query_history_db):
+        workspace_id = uuid.uuid4()
+        with SemanticQueryBuilder(source="dashboard") as builder:
+            builder.setup_context(definitions, TENANT_ID, db_session, workspace_id=workspace_id)
+            builder.execute_query("SELECT name, amount FROM sales ORDER BY id")
+            builder.execute_arrow("select name,   amount from sales order by id")
+        assert query_history_db.flush() == 2
+
+        first, second = db_session.query(QueryHistory).order_by(QueryHistory.executed_at).all()
+        assert first.tenant_id == uuid.UUID(TENANT_ID)
+        assert first.workspace_id == workspace_id
+        assert first.source == "dashboard"
+        assert (first.status, first.cache_status, first.row_count) == ("ok", "miss", 3)
+        assert first.sql_text == "SELECT name, amount FROM sales ORDER BY id"
+        # Formatting does not change the hash
+        assert first.query_hash == second.query_hash
+        assert first.result_bytes > 0 and second.result_bytes > 0
+        # Setup is charged to the first query only
+        assert first.setup_ms > 0
+        assert second.setup_ms == 0
+        assert first.total_ms == pytest.approx(
+            first.setup_ms + first.queue_ms + first.execute_ms + first.serialize_ms, abs=0.05
+        )
+        assert first.profile_json is None
+
+    def test_failed_and_timed_out_queries_recorded(self, db_session, definitions, query_history_db):
+        with SemanticQueryBuilder() as builder:
+            builder.setup_context(definitions, TENANT_ID, db_session)
+            with pytest.raises(ValueError):
+                builder.execute_query("SELECT missing_column FROM sales")
+            with pytest.raises(TimeoutError):
+                builder.execute_query("SELECT SUM(i) FROM range(100000000000) t(i)", timeout_seconds=0.2)
+            # Rejected by the parser: never executed, not recorded
+            with pytest.raises(ValueError):
+                builder.execute_query("DROP TABLE sales")
+        query_history_db.flush()
+
+        statuses = {row.status: row for row in db_session.query(QueryHistory).all()}
+        assert set(statuses) == {"error", "timeout"}
+        assert statuses["timeout"].execute_ms + statuses["timeout"].queue_ms >= 150
+        assert statuses["timeout"].row_count is None
+
+    def test_streams_recorded_when_they_end(self, db_session, definitions, query_history_db):
+        with SemanticQueryBuilder() as builder:
+            builder.setup_context(definitions, TENANT_ID, db_session)
+            stream = builder.execute_stream("SELECT * FROM sales", batch_size=1)
+            assert sum(batch.num_rows for batch in stream["batches"]) == 3
+            # Closed before it was drained
+            stream = builder.execute_stream("SELECT * FROM range(100000) t(i)", batch_size=10)
+            next(stream["batches"])
+        query_history_db.flush()
+
+        drained, closed = db_session.query(QueryHistory).order_by(QueryHistory.executed_at).all()
+        assert (drained.status, drained.row_count) == ("ok", 3)
+        assert drained.result_bytes > 0
+        assert drained.setup_ms > 0 and drained.execute_ms > 0
+        assert closed.status == "cancelled"
+        assert closed.row_count >= 10
+
+    def test_slow_queries_carry_profile(self, db_session, definitions, query_history_db, monkeypatch):
+        monkeypatch.setattr(query_history_db, "slow_threshold_ms", 1)
+        monkeypatch.setattr(query_history_db, "profile_slow", True)
+        with SemanticQueryBuilder() as builder:
+            builder.setup_context(definitions, TENANT_ID, db_session)
+            builder.execute_query("SELECT SUM(i) AS total FROM range(5000000) t(i)")
+        query_history_db.flush()
+
+        row = db_session.query(QueryHistory).one()
+        assert row.profile_json is not None
+        assert "children" in row.profile_json
+        assert query_history_db.stats()["profiled"] >= 1
+
+    def test_no_profiling_by_default(self, db_session, definitions, query_history_db, monkeypatch):
+        monkeypatch.setattr(query_history_db, "slow_threshold_ms", 1)
+        with SemanticQueryBuilder() as builder:
+            builder.setup_context(definitions, TENANT_ID, db_session)
+            assert builder._profile_path is None
+            builder.execute_query("SELECT SUM(i) AS total FROM range(5000000) t(i)")
+        query_history_db.flush()
+        assert db_session.query(QueryHistory).one().profile_json is None
+
+    def test_profiling_disabled_with_zero_threshold(self, db_session, definitions, query_history_db, monkeypatch):
+        monkeypatch.setattr(query_history_db, "slow_threshold_ms", 0)
+        monkeypatch.setattr(query_history_db, "profile_slow", True)
+        with SemanticQueryBuilder() as builder:
+            builder.setup_context(definitions, TENANT_ID, db_session)
+            assert builder._profile_path is None
+            builder.execute_query("SELECT SUM(i) AS total FROM range(5000000) t(i)")
+        query_history_db.flush()
+        assert db_session.query(QueryHistory).one().profile_json is None
+
+    def test_drops_oldest_past_max_pending(self):
+        recorder = QueryHistoryRecorder(TestSession, max_pending=2, flush_interval_seconds=0, slow_threshold_ms=0)
+        for sql in ("SELECT 1", "SELECT 2", "SELECT 3"):
+            recorder.record(_execution(sql))
+        stats = recorder.stats()
+        assert (stats["pending"], stats["recorded"], stats["dropped"]) == (2, 3, 1)
+        assert recorder.flush() == 2
+        with TestSession() as db:
+            assert sorted(row.sql_text for row in db.query(QueryHistory)) == ["SELECT 2", "SELECT 3"]
+
+    def test_failed_flush_is_counted(self):
+        def _broken_session():
+            raise RuntimeError("database down")
+
+        recorder = QueryHistoryRecorder(_broken_session, max_pending=10, flush_interval_seconds=0, slow_threshold_ms=0)
+        recorder.record(_execution())
+        assert recorder.flush() == 0
+        assert recorder.stats()["failed"] == 1
+        assert recorder.stats()["pending"] == 0
+
+    def test_disabled_recorder_ignores_executions(self):
+        recorder = QueryHistoryRecorder(
+            TestSession, max_pending=10, flush_interval_seconds=0, slow_threshold_ms=1000, enabled=False
+        )
+        recorder.record(_execution())
+        assert recorder.stats()["recorded"] == 0
+        assert recorder.profiling is False
+
+    def test_estimate_json_bytes(self):
+        rows = [{"name": "Alice", "amount": 100.0}] * 1000
+        exact = len(json.dumps(rows))
+        assert estimate_json_bytes(rows) == pytest.approx(exact, rel=0.05)
+        assert estimate_json_bytes([]) == 2
+
+
+class TestHistoryEndpoints:
+    def _execute(self, client, auth_header, workspace_id, sql):
+        resp = client.post(
+            "/api/v1/queries/execute",
+            json={"sql_text": sql, "workspace_id": workspace_id},
+            headers=auth_header,
+        )
+        assert resp.status_code == 200
+        return resp.json()
+
+    def test_top_frequent_and_slowest(self, client, auth_header, setup_semantic_layer, query_history_db):
+        workspace_id = setup_semantic_layer["workspace_id"]
+        self._execute(client, auth_header, workspace_id, "SELECT * FROM products")
+        # Same query again: served from the result cache, still counted
+        assert self._execute(client, auth_header, workspace_id, "SELECT * FROM products")["cache_status"] == "hit"
+        self._execute(client, auth_header, workspace_id, "select *   from products")
+        self._execute(client, auth_header, workspace_id, "SELECT SUM(i) AS total FROM range(3000000) t(i)")
+        # Another tenant's history is never listed
+        query_history_db.record(_execution(tenant_id=str(uuid.uuid4()), execute_ms=99999.0))
+
+        resp = client.get("/api/v1/queries/history/top?order=frequent", headers=auth_header)
+        assert resp.status_code == 200
+        top = resp.json()
+        assert len(top) == 2
+        assert top[0]["executions"] == 3
+        assert top[0]["cache_hits"] == 1
+        assert top[0]["avg_rows"] == 3
+        assert top[0]["avg_bytes"] > 0
+
+        resp = client.get(
+            f"/api/v1/queries/history/top?order=slowest&limit=1&workspace_id={workspace_id}",
+            headers=auth_header,
+        )
+        (slowest,) = resp.json()
+        assert "range(3000000)" in slowest["sql_text"]
+        assert slowest["executions"] == 1
+
+        resp = client.get("/api/v1/queries/history/top?since_hours=1", headers=auth_header)
+        assert len(resp.json()) == 2
+
+    def test_slow_log(self, client, auth_header, setup_semantic_layer, query_history_db, monkeypatch):
+        monkeypatch.setattr(query_history_db, "slow_threshold_ms", 1)
+        monkeypatch.setattr(query_history_db, "profile_slow", True)
+        workspace_id = setup_semantic_layer["workspace_id"]
+        self._execute(client, auth_header, workspace_id, "SELECT SUM(i) AS total FROM range(5000000) t(i)")
+
+        resp = client.get("/api/v1/queries/history/slow", headers=auth_header)
+        assert resp.status_code == 200
+        (entry,) = resp.json()
+        assert entry["status"] == "ok"
+        assert entry["workspace_id"] == workspace_id
+        assert entry["profile_json"]["children"]
+
+    def test_slow_log_without_profiles(self, client, auth_header, query_history_db, monkeypatch):
+        query_history_db.record(_execution("SELECT fast", execute_ms=5.0))
+        query_history_db.record(_execution("SELECT slow", execute_ms=5000.0))
+
+        resp = client.get("/api/v1/queries/history/slow", headers=auth_header)
+        assert resp.status_code == 200
+        (entry,) = resp.json()
+        assert entry["sql_text"] == "SELECT slow"
+        assert entry["profile_json"] is None
+
+        monkeypatch.setattr(query_history_db, "slow_threshold_ms", 0)
+        assert client.get("/api/v1/queries/history/slow", headers=auth_header).json() == []
+
+    def test_requires_auth(self, client):
+        assert client.get("/api/v1/queries/history/top").status_code in (401, 403)
@@ -0,0 +1,216 @@
+"""Tests for the query scheduler: quotas, fair queueing, admission control and timeouts."""
+
+import json
+import threading
+import time
+import uuid
+
+import pytest
+
+import app.services.query_service as query_service_module
+from app.models.data_source import DataSource
+from app.services.query_scheduler import QueryOverloadedError, QueryScheduler
+from app.services.query_service import SemanticQueryBuilder
+
+TENANT_ID = "550e8400-e29b-41d4-a716-446655440000"
+
+
+def _blocker(started: list, release: threading.Event, name: str, hold: float = 0.0):
+    def run():
+        started.append(name)
+        release.wait(5)
+        time.sleep(hold)
+        return name
+    return run
+
+
+class TestQueryScheduler:
+    def test_bounds_running_queries_per_tenant(self):
+        scheduler = QueryScheduler(max_workers=4, max_per_tenant=2, max_queue=10)
+        release = threading.Event()
+        started: list = []
+        futures = [scheduler.submit("a", _blocker(started, release, f"a{i}")) for i in range(3)]
+        other = scheduler.submit("b", _blocker(started, release, "b0"))
+        time.sleep(0.1)
+
+        stats = scheduler.stats()
+        assert stats["running"] == 3
+        assert stats["queued"] == 1
+        assert sorted(started) == ["a0", "a1", "b0"]
+
+        release.set()
+        assert [f.result(timeout=5) for f in futures] == ["a0", "a1", "a2"]
+        assert other.result(timeout=5) == "b0"
+        stats = scheduler.stats()
+        assert stats["completed"] == 4
+        assert stats["running"] == 0 and stats["queued"] == 0
+        assert stats["active_tenants"] == 0
+        assert stats["avg_run_ms"] > 0
+
+    def test_fair_queueing_across_tenants(self):
+        scheduler = QueryScheduler(max_workers=1, max_per_tenant=1, max_queue=10)
+        release = threading.Event()
+        order: list = []
+        first = scheduler.submit("heavy", _blocker(order, release, "heavy0", hold=0.2))
+        time.sleep(0.05)
+        # The heavy tenant queues a batch before the light tenant shows up
+        batch = [scheduler.submit("heavy", lambda i=i: order.append(f"heavy{i}")) for i in range(1, 4)]
+        light = scheduler.submit("light", lambda: order.append("light0"))
+
+        release.set()
+        for future in [first, *batch, light]:
+            future.result(timeout=5)
+        # The light tenant does not wait behind the whole batch
+        assert order.index("light0") == 1
+        assert scheduler.stats()["max_queue_ms"] > 0
+
+    def test_weights_favor_heavier_tenants(self):
+        scheduler = QueryScheduler(
+            max_workers=1, max_per_tenant=1, max_queue=20, tenant_weights={"gold": 4.0}
+        )
+        release = threading.Event()
+        order: list = []
+        first = scheduler.submit("other", _blocker(order, release, "start"))
+        time.sleep(0.05)
+
+        def work(name):
+            def run():
+                time.sleep(0.02)
+                order.append(name)
+            return run
+
+        futures = [scheduler.submit(tenant, work(tenant)) for _ in range(4) for tenant in ("gold", "basic")]
+        release.set()
+        for future in [first, *futures]:
+            future.result(timeout=5)
+        # Gold gets about four slots for each basic one
+        assert order[1:6].count("gold") >= 3
+
+    def test_rejects_when_queue_is_full(self):
+        scheduler = QueryScheduler(max_workers=1, max_per_tenant=1, max_queue=1)
+        release = threading.Event()
+        started: list = []
+        running = scheduler.submit("a", _blocker(started, release, "a0"))
+        queued = scheduler.submit("a", lambda: "a1")
+        with pytest.raises(QueryOverloadedError):
+            scheduler.submit("b", lambda: "b0")
+        assert scheduler.stats()["rejected"] == 1
+
+        release.set()
+        assert running.result(timeout=5) == "a0"
+        assert queued.result(timeout=5) == "a1"
+
+    def test_cancel_queued_query(self):
+        scheduler = QueryScheduler(max_workers=1, max_per_tenant=1, max_queue=10)
+        release = threading.Event()
+        started: list = []
+        running = scheduler.submit("a", _blocker(started, release, "a0"))
+        calls: list = []
+        queued = scheduler.submit("a", lambda: calls.append(1))
+
+        assert scheduler.cancel(queued) is True
+        assert queued.cancelled()
+        time.sleep(0.05)
+        assert scheduler.cancel(running) is False
+        release.set()
+        running.result(timeout=5)
+        assert calls == []
+        assert scheduler.stats()["cancelled"] == 1
+
+    def test_exceptions_reach_the_caller(self):
+        scheduler = QueryScheduler(max_workers=1, max_per_tenant=1, max_queue=10)
+
+        def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError, match="boom"):
+            scheduler.submit("a", fail).result(timeout=5)
+        assert scheduler.submit("a", lambda: 1).result(timeout=5) == 1
+
+
+@pytest.fixture
+def sales_definitions(db_session, parquet_dir):
+    """A semantic layer with one table node, `sales`, over the test parquet."""
+    ds_id = uuid.uuid4()
+    db_session.add(DataSource(
+        id=ds_id,
+        tenant_id=uuid.UUID(TENANT_ID),
+        type="csv",
+        name="sales",
+        connection_config_encrypted=json.dumps({"storage_path": parquet_dir}),
+    ))
+    db_session.commit()
+    return {
+        "nodes": [{"id": "n1", "data": {"source_id": str(ds_id), "source_name": "sales", "columns": []}}],
+        "edges": [],
+    }
+
+
+class TestBuilderScheduling:
+    def test_timeout_while_queued(self, monkeypatch, db_session, sales_definitions):
+        scheduler = QueryScheduler(max_workers=1, max_per_tenant=1, max_queue=10)
+        monkeypatch.setattr(query_service_module, "query_scheduler", scheduler)
+        definitions = sales_definitions
+
+        # The tenant's only slot is taken, so the query never starts
+        release = threading.Event()
+        scheduler.submit(TENANT_ID, lambda: release.wait(5))
+        try:
+            with SemanticQueryBuilder() as builder:
+                builder.setup_context(definitions, TENANT_ID, db_session)
+                with pytest.raises(TimeoutError):
+                    builder.execute_query("SELECT * FROM sales", timeout_seconds=0.2)
+                assert scheduler.stats()["cancelled"] == 1
+        finally:
+            release.set()
+
+    def test_stream_waits_for_the_tenant_quota(self, monkeypatch, db_session, sales_definitions):
+        scheduler = QueryScheduler(max_workers=2, max_per_tenant=1, max_queue=10)
+        monkeypatch.setattr(query_service_module, "query_scheduler", scheduler)
+        release = threading.Event()
+        scheduler.submit(TENANT_ID, lambda: release.wait(5))
+        try:
+            with SemanticQueryBuilder() as builder:
+                builder.setup_context(sales_definitions, TENANT_ID, db_session)
+                with pytest.raises(TimeoutError):
+                    builder.execute_stream("SELECT * FROM sales", timeout_seconds=0.2)
+                assert scheduler.stats()["cancelled"] == 1
+        finally:
+            release.set()
+
+    def test_open_streams_do_not_hold_workers(self, monkeypatch, db_session, sales_definitions):
+        scheduler = QueryScheduler(max_workers=1, max_per_tenant=1, max_queue=10)
+        monkeypatch.setattr(query_service_module, "query_scheduler", scheduler)
+        builders = []
+        try:
+            # More unread streams than workers: each one still starts
+            for _ in range(3):
+                builder = SemanticQueryBuilder()
+                builders.append(builder)
+                builder.setup_context(sales_definitions, TENANT_ID, db_session)
+                stream = builder.execute_stream(
+                    "SELECT i FROM range(1000000) t(i)", limit=1000000, batch_size=1000, timeout_seconds=2
+                )
+                assert next(stream["batches"]).num_rows == 1000
+            assert scheduler.stats()["running"] == 0
+
+            with SemanticQueryBuilder() as other:
+                other.setup_context(sales_definitions, TENANT_ID, db_session)
+                assert other.execute_query("SELECT * FROM sales", timeout_seconds=2)["row_count"] == 3
+        finally:
+            for builder in builders:
+                builder.close()
+
+    def test_overload_returns_503(self, monkeypatch, client, auth_header, setup_semantic_layer):
+        monkeypatch.setattr(
+            query_service_module,
+            "query_scheduler",
+            QueryScheduler(max_workers=1, max_per_tenant=1, max_queue=0),
+        )
+        resp = client.post(
+            "/api/v1/queries/execute",
+            json={"sql_text": "SELECT * FROM products", "workspace_id": setup_semantic_layer["workspace_id"]},
+            headers=auth_header,
+        )
+        assert resp.status_code == 503
+        assert resp.headers["retry-after"] == "2"
@@ -0,0 +1,120 @@
+"""Tests for the query result cache and its use by /api/v1/queries/execute."""
+
+import os
+import uuid
+
+import duckdb
+
+from app.services.cache_invalidation import invalidate_data_source
+from app.services.result_cache import QueryResultCache, normalize_sql
+
+TENANT_ID = "550e8400-e29b-41d4-a716-446655440000"
+
+
+def _result(rows: int = 1) -> dict:
+    return {
+        "columns": [{"name": "x", "type": "INTEGER"}],
+        "rows": [{"x": i} for i in range(rows)],
+        "row_count": rows,
+        "execution_time_ms": 1.0,
+    }
+
+
+class TestNormalizeSQL:
+    def test_collapses_whitespace_and_semicolon(self):
+        assert normalize_sql("  SELECT *\n  FROM   sales ;") == "SELECT * FROM sales"
+
+    def test_preserves_quoted_text(self):
+        sql = "SELECT 'a  b' AS \"my  col\"   FROM t"
+        assert normalize_sql(sql) == "SELECT 'a  b' AS \"my  col\" FROM t"
+
+    def test_escaped_quotes(self):
+        assert normalize_sql("SELECT  'it''s   ok'") == "SELECT 'it''s   ok'"
+
+
+class TestQueryResultCache:
+    def test_hit_and_miss(self):
+        cache = QueryResultCache(max_bytes=1024 * 1024, ttl_seconds=60)
+        key = cache.make_key(TENANT_ID, "SELECT 1", 100, "v1")
+        assert cache.get(key) is None
+        cache.put(key, _result(), {"ds-1"})
+        assert cache.get(cache.make_key(TENANT_ID, " SELECT  1; ", 100, "v1")) == _result()
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_key_includes_tenant_limit_and_data_version(self):
+        cache = QueryResultCache(max_bytes=1024 * 1024, ttl_seconds=60)
+        cache.put(cache.make_key(TENANT_ID, "SELECT 1", 100, "v1"), _result(), set())
+        assert cache.get(cache.make_key(str(uuid.uuid4()), "SELECT 1", 100, "v1")) is None
+        assert cache.get(cache.make_key(TENANT_ID, "SELECT 1", 50, "v1")) is None
+        assert cache.get(cache.make_key(TENANT_ID, "SELECT 1", 100, "v2")) is None
+
+    def test_ttl_expiry(self):
+        cache = QueryResultCache(max_bytes=1024 * 1024, ttl_seconds=0)
+        key = cache.make_key(TENANT_ID, "SELECT 1", 100, "v1")
+        cache.put(key, _result(), set())
+        assert cache.get(key) is None
+        assert cache.stats()["entries"] == 0
+
+    def test_size_bounded_lru_eviction(self):
+        cache = QueryResultCache(max_bytes=2000, ttl_seconds=60)
+        keys = [cache.make_key(TENANT_ID, f"SELECT {i}", 100, "v1") for i in range(5)]
+        for key in keys[:4]:
+            cache.put(key, _result(rows=5), set())  # 496 estimated bytes each
+        cache.get(keys[0])
+        cache.put(keys[4], _result(rows=5), set())
+        assert cache.get(keys[0]) is not None
+        assert cache.get(keys[1]) is None
+        assert cache.stats()["evictions"] == 1
+
+    def test_oversized_result_not_cached(self):
+        cache = QueryResultCache(max_bytes=1000, ttl_seconds=60)
+        key = cache.make_key(TENANT_ID, "SELECT 1", 100, "v1")
+        cache.put(key, _result(rows=100), set())
+        assert cache.get(key) is None
+
+    def test_invalidate_by_data_source(self):
+        cache = QueryResultCache(max_bytes=1024 * 1024, ttl_seconds=60)
+        cache.put(cache.make_key(TENANT_ID, "SELECT 1", 100, "v1"), _result(), {"ds-1"})
+        cache.put(cache.make_key(TENANT_ID, "SELECT 2", 100, "v1"), _result(), {"ds-2"})
+        assert cache.invalidate(tenant_id=TENANT_ID, data_source_id="ds-1") == 1
+        assert cache.stats()["entries"] == 1
+
+
+class TestExecuteEndpointCache:
+    def _execute(self, client, auth_header, workspace, sql="SELECT * FROM products ORDER BY id"):
+        resp = client.post(
+            "/api/v1/queries/execute",
+            json={"sql_text": sql, "workspace_id": workspace},
+            headers=auth_header,
+        )
+        assert resp.status_code == 200
+        return resp.json()
+
+    def test_repeated_query_hits_cache(self, client, auth_header, setup_semantic_layer):
+        workspace = setup_semantic_layer["workspace_id"]
+        first = self._execute(client, auth_header, workspace)
+        second = self._execute(client, auth_header, workspace, "SELECT *  FROM products\nORDER BY id;")
+        assert first["cache_status"] == "miss"
+        assert second["cache_status"] == "hit"
+        assert second["rows"] == first["rows"]
+
+    def test_data_source_invalidation(self, client, auth_header, setup_semantic_layer):
+        workspace = setup_semantic_layer["workspace_id"]
+        self._execute(client, auth_header, workspace)
+        invalidate_data_source(uuid.UUID(TENANT_ID), uuid.UUID(setup_semantic_layer["ds_id"]))
+        assert self._execute(client, auth_header, workspace)["cache_status"] == "miss"
+
+    def test_parquet_rewritten_elsewhere_misses(self, client, auth_header, setup_semantic_layer, parquet_dir):
+        """A source re-ingested without the invalidation hook (say, by another worker) is noticed."""
+        workspace = setup_semantic_layer["workspace_id"]
+        assert len(self._execute(client, auth_header, workspace)["rows"]) == 3
+
+        parquet_path = os.path.join(parquet_dir, "processed.parquet")
+        duckdb.connect().execute(
+            "COPY (SELECT 4 AS id, 'Dana' AS name, 50.0 AS amount) "
+            f"TO '{parquet_path}' (FORMAT PARQUET)"
+        )
+        result = self._execute(client, auth_header, workspace)
+        assert result["cache_status"] == "miss"
+        assert [row["name"] for row in result["rows"]] == ["Dana"]
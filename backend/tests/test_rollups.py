@@ -0,0 +1,228 @@
+"""Tests for semantic layer rollups: materialization, query rewriting and metrics."""
+
+import json
+import uuid
+from pathlib import Path
+
+import duckdb
+import pytest
+
+from app.models.data_source import DataSource
+from app.services.catalog_service import CatalogView
+from app.services.query_service import SemanticQueryBuilder
+from app.services.rollup_service import (
+    RollupMetrics,
+    materialize_rollup,
+    register_rollups,
+    rewrite_for_rollups,
+    rollup_materializer,
+    rollup_metrics,
+    rollup_specs,
+)
+from app.services.sql_parser import parse_query
+
+TENANT_ID = "550e8400-e29b-41d4-a716-446655440000"
+
+ROLLUP = {
+    "name": "ventes_par_region",
+    "source": "fact_ventes",
+    "dimensions": ["region", "annee"],
+    "measures": ["montant", "quantite"],
+}
+
+
+@pytest.fixture
+def fact_dir(tmp_path):
+    """A storage directory holding a small fact table as processed.parquet."""
+    parquet = tmp_path / "processed.parquet"
+    conn = duckdb.connect()
+    conn.execute(
+        "COPY (SELECT ['nord', 'sud', 'est'][(i % 3) + 1] AS region, 2023 + (i % 2) AS annee, "
+        "i * 1.5 AS montant, i AS quantite, 'client_' || i AS client FROM range(200) t(i)) "
+        f"TO '{parquet}' (FORMAT PARQUET)"
+    )
+    conn.close()
+    return tmp_path
+
+
+@pytest.fixture
+def rollup_conn(fact_dir):
+    """A DuckDB connection with the fact view and its rollup registered."""
+    conn = duckdb.connect()
+    parquet = str(fact_dir / "processed.parquet")
+    conn.execute(f"CREATE VIEW fact_ventes AS SELECT * FROM read_parquet('{parquet}')")
+    view = CatalogView(name="fact_ventes", data_source_id="ds", parquet_path=parquet, fingerprint="v1")
+    materialize_rollup(conn, rollup_specs({"rollups": [ROLLUP]})[0], view)
+    assert register_rollups(conn, {"rollups": [ROLLUP]}, [view]) == ["ventes_par_region"]
+    yield conn
+    conn.close()
+
+
+class TestRollupSpecs:
+    def test_parses_declarations(self):
+        specs = rollup_specs({"rollups": [ROLLUP]})
+        assert len(specs) == 1
+        assert specs[0].view_name == "__rollup_ventes_par_region"
+        assert specs[0].dimensions == ("region", "annee")
+
+    def test_skips_malformed(self):
+        assert rollup_specs({"rollups": [{"name": "x"}, "nope", {**ROLLUP, "measures": [1]}]}) == []
+        assert rollup_specs({"nodes": []}) == []
+
+
+class TestMaterialization:
+    def test_writes_one_file_per_source_version(self, fact_dir, rollup_conn):
+        files = list((fact_dir / "rollups").glob("*.parquet"))
+        assert len(files) == 1
+        rows = rollup_conn.execute(f"SELECT COUNT(*), SUM(count__star) FROM '{files[0]}'").fetchone()
+        assert rows == (6, 200)
+
+        # A new source fingerprint replaces the old file
+        view = CatalogView(
+            name="fact_ventes",
+            data_source_id="ds",
+            parquet_path=str(fact_dir / "processed.parquet"),
+            fingerprint="v2",
+        )
+        conn = duckdb.connect()
+        materialize_rollup(conn, rollup_specs({"rollups": [ROLLUP]})[0], view)
+        conn.close()
+        new_files = list((fact_dir / "rollups").glob("*.parquet"))
+        assert len(new_files) == 1 and new_files != files
+
+    def test_bad_rollup_is_skipped(self, fact_dir):
+        conn = duckdb.connect()
+        parquet = str(fact_dir / "processed.parquet")
+        view = CatalogView(name="fact_ventes", data_source_id="ds", parquet_path=parquet, fingerprint="v1")
+        bad = {**ROLLUP, "name": "bad", "measures": ["no_such_column"]}
+        assert register_rollups(conn, {"rollups": [bad]}, [view]) == []
+        assert rollup_materializer.wait_idle(timeout=30)
+        assert register_rollups(conn, {"rollups": [bad]}, [view]) == []
+        assert list((fact_dir / "rollups").glob("*.tmp")) == []
+        conn.close()
+
+    def test_registers_once_materialized_in_background(self, fact_dir):
+        conn = duckdb.connect()
+        parquet = str(fact_dir / "processed.parquet")
+        view = CatalogView(name="fact_ventes", data_source_id="ds", parquet_path=parquet, fingerprint="v1")
+        # Not written yet: scheduled, and queries keep reading the source table
+        assert register_rollups(conn, {"rollups": [ROLLUP]}, [view]) == []
+        assert rollup_materializer.wait_idle(timeout=30)
+        assert register_rollups(conn, {"rollups": [ROLLUP]}, [view]) == ["ventes_par_region"]
+        conn.close()
+
+
+class TestRewrite:
+    @pytest.mark.parametrize("sql", [
+        "SELECT region, SUM(montant) AS total, COUNT(*) AS n FROM fact_ventes GROUP BY region ORDER BY region",
+        "SELECT annee, AVG(quantite), MIN(montant), MAX(montant), COUNT(quantite) "
+        "FROM fact_ventes WHERE region IN ('nord', 'sud') GROUP BY annee ORDER BY annee",
+        "SELECT region, ROUND(SUM(montant), 1) FROM fact_ventes f GROUP BY ALL ORDER BY SUM(montant) DESC LIMIT 2",
+        "SELECT COUNT(*) FROM fact_ventes",
+        # No rollup row matches: counts are 0, not NULL
+        "SELECT COUNT(*), COUNT(quantite), SUM(quantite) FROM fact_ventes WHERE region = 'ouest'",
+        "SELECT SUM(quantite), SUM(montant), AVG(quantite), AVG(montant) FROM fact_ventes",
+    ])
+    def test_rewrites_matching_aggregates(self, rollup_conn, sql):
+        specs = rollup_specs({"rollups": [ROLLUP]})
+        rewritten, rollup = rewrite_for_rollups(rollup_conn, parse_query(sql), specs)
+        assert rollup == "ventes_par_region"
+        assert "__rollup_ventes_par_region" in rewritten.sql
+        # Same column names and exact types (description only gives coarse type codes)
+        columns = lambda q: [row[:2] for row in rollup_conn.execute(f"DESCRIBE {q}").fetchall()]
+        assert columns(rewritten.sql) == columns(sql)
+        assert rollup_conn.execute(rewritten.sql).fetchall() == rollup_conn.execute(sql).fetchall()
+
+    @pytest.mark.parametrize("sql", [
+        "SELECT region FROM fact_ventes",
+        "SELECT client, SUM(montant) FROM fact_ventes GROUP BY client",
+        "SELECT region, SUM(montant) FROM fact_ventes WHERE quantite > 10 GROUP BY region",
+        "SELECT COUNT(DISTINCT region) FROM fact_ventes",
+        "SELECT MEDIAN(montant) FROM fact_ventes",
+        "SELECT region, SUM(montant) FROM fact_ventes GROUP BY region HAVING SUM(montant) > 10",
+        "SELECT SUM(montant) FROM fact_ventes JOIN fact_ventes f2 USING (region)",
+    ])
+    def test_leaves_other_queries_alone(self, rollup_conn, sql):
+        specs = rollup_specs({"rollups": [ROLLUP]})
+        query = parse_query(sql)
+        assert rewrite_for_rollups(rollup_conn, query, specs) == (query, None)
+
+    def test_metrics_count_hits_and_misses(self, rollup_conn):
+        specs = rollup_specs({"rollups": [ROLLUP]})
+        before = rollup_metrics.stats()
+        rewrite_for_rollups(rollup_conn, parse_query("SELECT SUM(montant) FROM fact_ventes"), specs)
+        rewrite_for_rollups(rollup_conn, parse_query("SELECT MEDIAN(montant) FROM fact_ventes"), specs)
+        rewrite_for_rollups(rollup_conn, parse_query("SELECT region FROM fact_ventes"), specs)  # not an aggregate
+        after = rollup_metrics.stats()
+        assert after["hits"] - before["hits"] == 1
+        assert after["misses"] - before["misses"] == 1
+        assert rollup_metrics.hits_by_rollup()["ventes_par_region"] >= 1
+
+    def test_hit_rate(self):
+        metrics = RollupMetrics()
+        assert metrics.stats()["hit_rate"] == 0.0
+        metrics.record_rewrite("r")
+        metrics.record_rewrite(None)
+        metrics.record_rewrite("r")
+        assert metrics.stats()["hit_rate"] == pytest.approx(0.6667)
+
+
+class TestBuilderUsesRollups:
+    def test_aggregate_query_reads_rollup(self, db_session, fact_dir):
+        ds_id = uuid.uuid4()
+        db_session.add(DataSource(
+            id=ds_id,
+            tenant_id=uuid.UUID(TENANT_ID),
+            type="csv",
+            name="fact_ventes",
+            connection_config_encrypted=json.dumps({"storage_path": str(fact_dir)}),
+        ))
+        db_session.commit()
+        definitions = {
+            "nodes": [{"id": "n1", "data": {"source_id": str(ds_id), "source_name": "fact_ventes", "columns": []}}],
+            "edges": [],
+            "rollups": [ROLLUP],
+        }
+
+        sql = "SELECT region, SUM(quantite) AS total FROM fact_ventes GROUP BY region ORDER BY region"
+        before = rollup_metrics.stats()["hits"]
+        # Until the rollup is written, the query reads the source table
+        with SemanticQueryBuilder() as builder:
+            builder.setup_context(definitions, TENANT_ID, db_session)
+            fallback = builder.execute_query(sql)
+        assert rollup_metrics.stats()["hits"] == before
+        assert rollup_materializer.wait_idle(timeout=30)
+
+        with SemanticQueryBuilder() as builder:
+            assert builder.setup_context(definitions, TENANT_ID, db_session) == ["fact_ventes"]
+            result = builder.execute_query(sql)
+            detail = builder.execute_query("SELECT COUNT(*) AS n FROM fact_ventes WHERE quantite < 10")
+        assert [row["region"] for row in result["rows"]] == ["est", "nord", "sud"]
+        assert sum(row["total"] for row in result["rows"]) == sum(range(200))
+        assert detail["rows"] == [{"n": 10}]
+        assert result["rows"] == fallback["rows"]
+        assert rollup_metrics.stats()["hits"] == before + 1
+
+    def test_semantic_layer_save_materializes(self, client, auth_header, db_session, workspace_id, fact_dir):
+        ds_id = uuid.uuid4()
+        db_session.add(DataSource(
+            id=ds_id,
+            tenant_id=uuid.UUID(TENANT_ID),
+            type="csv",
+            name="fact_ventes",
+            connection_config_encrypted=json.dumps({"storage_path": str(fact_dir)}),
+        ))
+        db_session.commit()
+        definitions = {
+            "nodes": [{"id": "n1", "data": {"source_id": str(ds_id), "source_name": "fact_ventes", "columns": []}}],
+            "edges": [],
+            "rollups": [ROLLUP],
+        }
+        resp = client.post(
+            "/api/v1/semantic-layers/",
+            json={"workspace_id": workspace_id, "name": "Ventes", "definitions_json": definitions},
+            headers=auth_header,
+        )
+        assert resp.status_code == 201
+        assert rollup_materializer.wait_idle(timeout=30)
+        assert len(list(Path(fact_dir, "rollups").glob("ventes_par_region-*.parquet"))) == 1
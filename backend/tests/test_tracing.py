@@ -0,0 +1,142 @@
+"""Tests for request tracing: spans, OTLP export and the Server-Timing header."""
+
+import json
+import time
+
+from app.services.tracing import FileExporter, Tracer, parse_traceparent
+
+
+class _Collect:
+    def __init__(self):
+        self.traces = []
+
+    def export(self, spans):
+        self.traces.append(spans)
+
+
+def _stages(header: str) -> dict[str, str]:
+    """Server-Timing entries by name, with their parameters."""
+    entries = {}
+    for entry in header.split(", "):
+        name, _, params = entry.partition(";")
+        entries[name] = params
+    return entries
+
+
+class TestTracer:
+    def test_nested_spans(self):
+        exporter = _Collect()
+        tracer = Tracer(exporter)
+        with tracer.start_trace("GET /x") as root:
+            with tracer.span("outer", rows=3) as outer:
+                with tracer.span("inner") as inner:
+                    pass
+            now = time.monotonic()
+            tracer.record_span("queue", now - 0.01, now)
+
+        (spans,) = exporter.traces
+        by_name = {span.name: span for span in spans}
+        assert set(by_name) == {"GET /x", "outer", "inner", "queue"}
+        assert by_name["outer"].parent_id == root.span_id
+        assert by_name["inner"].parent_id == outer.span_id
+        assert by_name["queue"].parent_id == root.span_id
+        assert by_name["queue"].duration_ms > 9
+        assert outer.attributes == {"rows": 3}
+        assert {span.trace.trace_id for span in spans} == {root.trace.trace_id}
+        assert inner.end <= outer.end <= root.end
+
+    def test_noop_outside_a_trace(self):
+        exporter = _Collect()
+        tracer = Tracer(exporter)
+        with tracer.span("orphan") as span:
+            assert span is None
+        tracer.record_span("orphan", 0.0, 1.0)
+        assert exporter.traces == []
+
+    def test_decorator_and_errors(self):
+        exporter = _Collect()
+        tracer = Tracer(exporter)
+
+        @tracer.span("lookup")
+        def lookup():
+            raise KeyError("missing")
+
+        with tracer.start_trace("root"):
+            try:
+                lookup()
+            except KeyError:
+                pass
+        (spans,) = exporter.traces
+        assert spans[0].name == "lookup"
+        assert spans[0].error.startswith("KeyError")
+
+    def test_traceparent_is_continued(self):
+        parent = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+        assert parse_traceparent(parent) == ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7")
+        assert parse_traceparent("00-0000-00f067aa0ba902b7-01") is None
+        assert parse_traceparent("garbage") is None
+
+        tracer = Tracer(_Collect())
+        with tracer.start_trace("root", parent) as root:
+            pass
+        assert root.trace.trace_id == "4bf92f3577b34da6a3ce929d0e0e4736"
+        assert root.parent_id == "00f067aa0ba902b7"
+
+    def test_file_exporter_writes_otlp_json(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        tracer = Tracer(FileExporter(str(path)))
+        for _ in range(2):
+            with tracer.start_trace("POST /q", **{"http.method": "POST"}):
+                with tracer.span("duckdb.execute", rows=10):
+                    pass
+
+        lines = path.read_text().splitlines()
+        assert len(lines) == 2
+        request = json.loads(lines[0])
+        (resource_spans,) = request["resourceSpans"]
+        assert resource_spans["resource"]["attributes"][0]["value"] == {"stringValue": "datapilot-api"}
+        spans = {span["name"]: span for span in resource_spans["scopeSpans"][0]["spans"]}
+        child, root = spans["duckdb.execute"], spans["POST /q"]
+        assert child["parentSpanId"] == root["spanId"]
+        assert "parentSpanId" not in root
+        assert root["kind"] == 2
+        assert child["attributes"] == [{"key": "rows", "value": {"intValue": "10"}}]
+        assert int(child["endTimeUnixNano"]) >= int(child["startTimeUnixNano"]) > 1_600_000_000 * 10**9
+
+
+class TestServerTiming:
+    def _execute(self, client, auth_header, workspace_id, **headers):
+        return client.post(
+            "/api/v1/queries/execute",
+            json={"sql_text": "SELECT * FROM products ORDER BY id", "workspace_id": workspace_id},
+            headers={**auth_header, **headers},
+        )
+
+    def test_query_stages(self, client, auth_header, setup_semantic_layer):
+        resp = self._execute(client, auth_header, setup_semantic_layer["workspace_id"])
+        assert resp.status_code == 200
+
+        stages = _stages(resp.headers["server-timing"])
+        for stage in (
+            "auth", "semantic_layer", "data_sources", "duckdb.views", "duckdb.queue",
+            "duckdb.execute", "duckdb.fetch", "json_safe", "endpoint", "response", "total",
+        ):
+            assert stages[stage].startswith("dur="), stage
+        assert len(stages["trace"]) == len('desc=""') + 32
+
+    def test_cached_response_and_traceparent(self, client, auth_header, setup_semantic_layer):
+        workspace_id = setup_semantic_layer["workspace_id"]
+        assert self._execute(client, auth_header, workspace_id).status_code == 200
+
+        parent = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+        resp = self._execute(client, auth_header, workspace_id, traceparent=parent)
+        assert resp.status_code == 200
+        stages = _stages(resp.headers["server-timing"])
+        assert "duckdb.execute" not in stages
+        assert {"auth", "endpoint", "total"} <= stages.keys()
+        assert stages["trace"] == 'desc="4bf92f3577b34da6a3ce929d0e0e4736"'
+
+    def test_errors_carry_the_header(self, client):
+        resp = client.get("/api/v1/workspaces/", headers={"Authorization": "Bearer invalid"})
+        assert resp.status_code == 401
+        assert "auth;dur=" in resp.headers["server-timing"]
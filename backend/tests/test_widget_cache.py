@@ -0,0 +1,193 @@
+"""Tests for the persistent widget result cache and its use by dashboard rendering."""
+
+import json
+import uuid
+
+import pytest
+
+from app.models.dashboard import WidgetResult
+from app.models.data_source import DataSource
+from app.services.cache_invalidation import invalidate_data_source
+from app.services.catalog_service import CatalogView, ResolvedCatalog
+from app.services.widget_cache import WidgetResultCache, referenced_views
+
+TENANT_ID = "550e8400-e29b-41d4-a716-446655440000"
+
+
+def _catalog(sales_fingerprint: str = "f1", clients_fingerprint: str = "f2") -> ResolvedCatalog:
+    return ResolvedCatalog(
+        version="v1",
+        views=(
+            CatalogView(name="sales", data_source_id="ds-sales", parquet_path="/a", fingerprint=sales_fingerprint),
+            CatalogView(name="clients", data_source_id="ds-clients", parquet_path="/b", fingerprint=clients_fingerprint),
+        ),
+    )
+
+
+class TestWidgetCacheKey:
+    def test_depends_only_on_referenced_views(self):
+        catalog = _catalog()
+        assert [v.name for v in referenced_views(catalog, "SELECT * FROM Sales")] == ["sales"]
+        key = WidgetResultCache.key_for(catalog, "SELECT SUM(x) FROM sales", 100)
+        assert key.data_source_ids == {"ds-sales"}
+
+        # Re-uploading clients does not touch a widget reading only sales
+        assert WidgetResultCache.key_for(_catalog(clients_fingerprint="f3"), "SELECT SUM(x) FROM sales", 100) == key
+        assert WidgetResultCache.key_for(_catalog(sales_fingerprint="f9"), "SELECT SUM(x) FROM sales", 100) != key
+
+    def test_unparseable_sql_depends_on_every_view(self):
+        key = WidgetResultCache.key_for(_catalog(), "SELECT FROM WHERE", 100)
+        assert key.data_source_ids == {"ds-sales", "ds-clients"}
+
+    def test_sql_and_limit_change_query_hash(self):
+        key = WidgetResultCache.key_for(_catalog(), "SELECT 1 FROM sales", 100)
+        assert WidgetResultCache.key_for(_catalog(), "SELECT 2 FROM sales", 100).query_hash != key.query_hash
+        assert WidgetResultCache.key_for(_catalog(), "SELECT 1 FROM sales", 50).query_hash != key.query_hash
+
+
+@pytest.fixture
+def two_source_dashboard(client, auth_header, db_session, workspace_id, parquet_dir):
+    """A dashboard with one widget per data source of a two-source semantic layer."""
+    sources = {}
+    for name in ("products", "orders"):
+        ds = DataSource(
+            id=uuid.uuid4(),
+            tenant_id=uuid.UUID(TENANT_ID),
+            type="csv",
+            name=name,
+            connection_config_encrypted=json.dumps({"storage_path": parquet_dir}),
+        )
+        db_session.add(ds)
+        sources[name] = ds.id
+    db_session.commit()
+
+    definitions = {
+        "nodes": [
+            {"id": name, "data": {"source_id": str(ds_id), "source_name": name, "columns": []}}
+            for name, ds_id in sources.items()
+        ],
+        "edges": [],
+    }
+    resp = client.post(
+        "/api/v1/semantic-layers/",
+        json={"workspace_id": workspace_id, "name": "Layer", "definitions_json": definitions},
+        headers=auth_header,
+    )
+    assert resp.status_code == 201
+
+    dashboard_id = client.post(
+        "/api/v1/dashboards/",
+        json={"workspace_id": workspace_id, "name": "Cached"},
+        headers=auth_header,
+    ).json()["id"]
+    widgets = {}
+    for name in sources:
+        widgets[name] = client.post(
+            f"/api/v1/dashboards/{dashboard_id}/widgets",
+            json={
+                "type": "kpi",
+                "title": name,
+                "chart_type": "kpi",
+                "query_json": {"sql": f"SELECT COUNT(*) AS n FROM {name}"},
+            },
+            headers=auth_header,
+        ).json()["id"]
+    return {"dashboard_id": dashboard_id, "sources": sources, "widgets": widgets, "workspace_id": workspace_id}
+
+
+class TestDashboardRenderCache:
+    def _render(self, client, auth_header, dashboard_id, **params):
+        resp = client.post(f"/api/v1/dashboards/{dashboard_id}/render", params=params, headers=auth_header)
+        assert resp.status_code == 200
+        return {w["widget_id"]: w for w in resp.json()["widgets"]}
+
+    def test_second_render_served_from_cache(self, client, auth_header, two_source_dashboard):
+        dashboard_id = two_source_dashboard["dashboard_id"]
+        first = self._render(client, auth_header, dashboard_id)
+        second = self._render(client, auth_header, dashboard_id)
+
+        assert {w["cache_status"] for w in first.values()} == {"miss"}
+        assert {w["cache_status"] for w in second.values()} == {"hit"}
+        for widget_id, result in second.items():
+            assert result["rows"] == first[widget_id]["rows"] == [{"n": 3}]
+            assert result["computed_at"] is not None
+
+        refreshed = self._render(client, auth_header, dashboard_id, refresh="true")
+        assert {w["cache_status"] for w in refreshed.values()} == {"miss"}
+
+    def test_data_source_invalidation_is_precise(
+        self, client, auth_header, db_session, two_source_dashboard
+    ):
+        dashboard_id = two_source_dashboard["dashboard_id"]
+        widgets = two_source_dashboard["widgets"]
+        self._render(client, auth_header, dashboard_id)
+
+        invalidate_data_source(
+            uuid.UUID(TENANT_ID), two_source_dashboard["sources"]["products"], db_session
+        )
+        remaining = {str(row.widget_id) for row in db_session.query(WidgetResult).all()}
+        assert remaining == {widgets["orders"]}
+
+        results = self._render(client, auth_header, dashboard_id)
+        assert results[widgets["products"]]["cache_status"] == "miss"
+        assert results[widgets["orders"]]["cache_status"] == "hit"
+
+    def test_widget_sql_change_recomputes_only_that_widget(
+        self, client, auth_header, two_source_dashboard
+    ):
+        dashboard_id = two_source_dashboard["dashboard_id"]
+        widgets = two_source_dashboard["widgets"]
+        self._render(client, auth_header, dashboard_id)
+
+        resp = client.put(
+            f"/api/v1/dashboards/{dashboard_id}/widgets/{widgets['products']}",
+            json={"query_json": {"sql": "SELECT SUM(amount) AS n FROM products"}},
+            headers=auth_header,
+        )
+        assert resp.status_code == 200
+
+        results = self._render(client, auth_header, dashboard_id)
+        assert results[widgets["products"]]["cache_status"] == "miss"
+        assert results[widgets["products"]]["rows"] == [{"n": 450.0}]
+        assert results[widgets["orders"]]["cache_status"] == "hit"
+
+    def test_saved_query_sql_change_invalidates_widget(
+        self, client, auth_header, db_session, two_source_dashboard
+    ):
+        dashboard_id = two_source_dashboard["dashboard_id"]
+        saved = client.post(
+            "/api/v1/queries/saved",
+            json={
+                "name": "Total",
+                "sql_text": "SELECT SUM(amount) AS total FROM orders",
+                "workspace_id": two_source_dashboard["workspace_id"],
+            },
+            headers=auth_header,
+        ).json()
+        widget_id = client.post(
+            f"/api/v1/dashboards/{dashboard_id}/widgets",
+            json={"type": "kpi", "title": "Total", "chart_type": "kpi", "saved_query_id": saved["id"]},
+            headers=auth_header,
+        ).json()["id"]
+        assert self._render(client, auth_header, dashboard_id)[widget_id]["rows"] == [{"total": 450.0}]
+
+        client.put(
+            f"/api/v1/queries/saved/{saved['id']}",
+            json={"sql_text": "SELECT MAX(amount) AS total FROM orders"},
+            headers=auth_header,
+        )
+        assert db_session.get(WidgetResult, uuid.UUID(widget_id)) is None
+
+        result = self._render(client, auth_header, dashboard_id)[widget_id]
+        assert result["cache_status"] == "miss"
+        assert result["rows"] == [{"total": 200.0}]
+
+    def test_deleting_widget_deletes_its_result(self, client, auth_header, db_session, two_source_dashboard):
+        dashboard_id = two_source_dashboard["dashboard_id"]
+        widget_id = two_source_dashboard["widgets"]["orders"]
+        self._render(client, auth_header, dashboard_id)
+
+        resp = client.delete(f"/api/v1/dashboards/{dashboard_id}/widgets/{widget_id}", headers=auth_header)
+        assert resp.status_code == 204
+        db_session.expire_all()
+        assert db_session.get(WidgetResult, uuid.UUID(widget_id)) is None